@@ -0,0 +1,100 @@
+""" @package benchmarks.command_batch
+Compares the per-command latency of single command requests against batched command requests.
+
+This script starts a command resource on a local port (without TLS, the user ID is fixed instead of being read from
+the client certificate) and submits the same commands either one request at a time or in a single batch request for
+each of the batch modes. Each request is sent over a persistent (keep-alive) connection.
+
+Usage: python benchmarks/command_batch.py [commands_per_batch] [number_of_batches]
+"""
+
+# Import required modules
+import sys, time, json, logging
+from pkg_resources import Requirement, resource_filename
+from StringIO import StringIO
+from twisted.internet import reactor, defer
+from twisted.web.server import Site
+from twisted.web.client import Agent, HTTPConnectionPool, FileBodyProducer, readBody
+from twisted.web.http_headers import Headers
+from hwm.command import parser, connection
+from hwm.command.handlers import system
+from hwm.network.security import permissions
+
+class BenchmarkCommandResource(connection.CommandResource):
+  """ A command resource that executes every command as the benchmark's test user.
+  """
+
+  def _load_user_id(self, request):
+    return "1"
+
+class BenchmarkSessionCoordinator:
+  """ A session coordinator that doesn't have any active sessions (the benchmark user ignores session protections).
+  """
+
+  def load_user_sessions(self, user_id):
+    return []
+
+@defer.inlineCallbacks
+def post(agent, url, body):
+  """ POSTs the provided body to the command resource and returns the decoded response.
+  """
+
+  response = yield agent.request('POST', url, Headers({'Content-Type': ['application/json']}),
+                                 FileBodyProducer(StringIO(body)))
+  response_body = yield readBody(response)
+  defer.returnValue(json.loads(response_body))
+
+@defer.inlineCallbacks
+def run_benchmark(port, commands_per_batch, number_of_batches):
+  """ Runs the single command and batch benchmarks and prints the average latency per command.
+  """
+
+  pool = HTTPConnectionPool(reactor, persistent = True)
+  agent = Agent(reactor, pool = pool)
+  base_url = "http://127.0.0.1:%d/" % port
+  test_command = {'command': "station_time", 'destination': "system"}
+  total_commands = commands_per_batch*number_of_batches
+
+  # Warm up the connection and the user's permissions
+  yield post(agent, base_url, json.dumps(test_command))
+
+  # Single command requests
+  start_time = time.time()
+  for command_index in range(total_commands):
+    yield post(agent, base_url, json.dumps(test_command))
+  single_latency = (time.time()-start_time)/total_commands
+  print "%-26s %8.3f ms/command" % ("single:", single_latency*1000)
+
+  # Batch requests
+  batch_body = json.dumps([test_command]*commands_per_batch)
+  for batch_mode in parser.CommandParser.BATCH_MODES:
+    start_time = time.time()
+    for batch_index in range(number_of_batches):
+      batch_response = yield post(agent, base_url+"?mode="+batch_mode, batch_body)
+      assert batch_response['status'] == 'okay'
+    batch_latency = (time.time()-start_time)/total_commands
+    print "%-26s %8.3f ms/command (%.1fx)" % ("batch ("+batch_mode+"):", batch_latency*1000,
+                                              single_latency/batch_latency)
+
+  yield pool.closeCachedConnections()
+
+if __name__ == '__main__':
+  commands_per_batch = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+  number_of_batches = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+  logging.disable(logging.CRITICAL)
+
+  # Set up the command parser using the test permissions
+  source_data_directory = resource_filename(Requirement.parse("Mercury2HWM"), "hwm")
+  permission_manager = permissions.PermissionManager(source_data_directory+
+                                                     '/network/security/tests/data/test_permissions_valid.json', 3600)
+  command_parser = parser.CommandParser([system.SystemCommandHandler('system')], permission_manager)
+  command_parser.session_coordinator = BenchmarkSessionCoordinator()
+
+  listening_port = reactor.listenTCP(0, Site(BenchmarkCommandResource(command_parser)), interface = '127.0.0.1')
+  print "Commands: %d (%d batches of %d)" % (commands_per_batch*number_of_batches, number_of_batches,
+                                             commands_per_batch)
+
+  benchmark_deferred = run_benchmark(listening_port.getHost().port, commands_per_batch, number_of_batches)
+  benchmark_deferred.addErrback(lambda failure: failure.printTraceback())
+  benchmark_deferred.addBoth(lambda result: reactor.stop())
+  reactor.run()
@@ -0,0 +1,209 @@
+""" @package benchmarks.command_channel
+Compares the throughput and latency of the HTTP command resource against the WebSocket command channel.
+
+This script starts the command resource and the command channel on local ports (without TLS, the user ID is fixed
+instead of being read from the client certificate) and submits the same command through each of them:
+* HTTP: one command per request, sent sequentially over a persistent (keep-alive) connection.
+* WebSocket: tagged commands over a single connection, first one at a time and then with many commands in flight.
+
+Usage: python benchmarks/command_channel.py [number_of_commands] [commands_in_flight]
+"""
+
+# Import required modules
+import sys, time, json, struct, os, base64, logging
+from pkg_resources import Requirement, resource_filename
+from StringIO import StringIO
+from twisted.internet import reactor, defer
+from twisted.internet.protocol import Protocol, ClientFactory
+from twisted.web.server import Site
+from twisted.web.client import Agent, HTTPConnectionPool, FileBodyProducer, readBody
+from twisted.web.http_headers import Headers
+from txws import WebSocketFactory
+from hwm.command import parser, connection
+from hwm.command.handlers import system
+from hwm.network.security import permissions
+
+class BenchmarkCommandResource(connection.CommandResource):
+  """ A command resource that executes every command as the benchmark's test user.
+  """
+
+  def _load_user_id(self, request):
+    return "1"
+
+class BenchmarkCommandChannel(connection.CommandChannel):
+  """ A command channel that executes every command as the benchmark's test user.
+  """
+
+  def _load_user_id(self):
+    return "1"
+
+class BenchmarkCommandChannelFactory(connection.CommandChannelFactory):
+  protocol = BenchmarkCommandChannel
+
+class BenchmarkSessionCoordinator:
+  """ A session coordinator that doesn't have any active sessions (the benchmark user ignores session protections).
+  """
+
+  def load_user_sessions(self, user_id):
+    return []
+
+class WebSocketClient(Protocol):
+  """ A minimal WebSocket client that sends tagged commands and matches up their responses.
+  """
+
+  def __init__(self):
+    self.pending_commands = {}
+    self._buffer = ""
+    self._handshake_complete = False
+
+  def connectionMade(self):
+    websocket_key = base64.b64encode(os.urandom(16))
+    self.transport.write("GET / HTTP/1.1\r\nHost: 127.0.0.1\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"+
+                         "Sec-WebSocket-Key: "+websocket_key+"\r\nSec-WebSocket-Version: 13\r\n\r\n")
+
+  def dataReceived(self, data):
+    self._buffer += data
+    if not self._handshake_complete:
+      if "\r\n\r\n" not in self._buffer:
+        return
+      self._buffer = self._buffer.split("\r\n\r\n", 1)[1]
+      self._handshake_complete = True
+      self.factory.connected_deferred.callback(self)
+
+    # Parse the (unmasked) server frames
+    while len(self._buffer) >= 2:
+      payload_length = ord(self._buffer[1]) & 0x7f
+      header_length = 2
+      if payload_length == 126:
+        if len(self._buffer) < 4:
+          return
+        payload_length = struct.unpack("!H", self._buffer[2:4])[0]
+        header_length = 4
+      elif payload_length == 127:
+        if len(self._buffer) < 10:
+          return
+        payload_length = struct.unpack("!Q", self._buffer[2:10])[0]
+        header_length = 10
+      if len(self._buffer) < header_length+payload_length:
+        return
+
+      message = json.loads(self._buffer[header_length:header_length+payload_length])
+      self._buffer = self._buffer[header_length+payload_length:]
+      self.pending_commands.pop(message['tag']).callback(message['response'])
+
+  def send_command(self, tag, command):
+    """ Sends a tagged command and returns a deferred that will be fired with its response.
+    """
+
+    payload = json.dumps({'tag': tag, 'command': command})
+    mask = os.urandom(4)
+    masked_payload = "".join([chr(ord(character) ^ ord(mask[index % 4])) for index, character in enumerate(payload)])
+    if len(payload) < 126:
+      header = struct.pack("!BB", 0x81, 0x80 | len(payload))
+    else:
+      header = struct.pack("!BBH", 0x81, 0x80 | 126, len(payload))
+
+    self.pending_commands[tag] = defer.Deferred()
+    self.transport.write(header+mask+masked_payload)
+
+    return self.pending_commands[tag]
+
+class WebSocketClientFactory(ClientFactory):
+  protocol = WebSocketClient
+
+  def __init__(self):
+    self.connected_deferred = defer.Deferred()
+
+@defer.inlineCallbacks
+def post(agent, url, body):
+  """ POSTs the provided body to the command resource and returns the decoded response.
+  """
+
+  response = yield agent.request('POST', url, Headers({'Content-Type': ['application/json']}),
+                                 FileBodyProducer(StringIO(body)))
+  response_body = yield readBody(response)
+  defer.returnValue(json.loads(response_body))
+
+def print_results(title, latencies, total_time):
+  """ Prints the throughput and latency percentiles of a benchmark run.
+  """
+
+  latencies = sorted(latencies)
+  print "%-24s %8.0f commands/s   p50 %7.3f ms   p99 %7.3f ms" % (title, len(latencies)/total_time,
+                                                                   latencies[len(latencies)/2]*1000,
+                                                                   latencies[int(len(latencies)*0.99)]*1000)
+
+@defer.inlineCallbacks
+def run_benchmark(http_port, channel_port, number_of_commands, commands_in_flight):
+  """ Runs the HTTP and WebSocket benchmarks.
+  """
+
+  test_command = {'command': "station_time", 'destination': "system"}
+
+  # HTTP requests over a persistent connection
+  pool = HTTPConnectionPool(reactor, persistent = True)
+  agent = Agent(reactor, pool = pool)
+  http_url = "http://127.0.0.1:%d/" % http_port
+  yield post(agent, http_url, json.dumps(test_command))
+  latencies = []
+  start_time = time.time()
+  for command_index in range(number_of_commands):
+    command_start = time.time()
+    yield post(agent, http_url, json.dumps(test_command))
+    latencies.append(time.time()-command_start)
+  print_results("http (sequential):", latencies, time.time()-start_time)
+  yield pool.closeCachedConnections()
+
+  # WebSocket command channel
+  client = yield _connect_websocket(channel_port)
+  yield client.send_command("warmup", test_command)
+
+  for window_size in [1, commands_in_flight]:
+    latencies = []
+    command_tags = iter(range(number_of_commands))
+
+    @defer.inlineCallbacks
+    def send_commands():
+      for tag in command_tags:
+        command_start = time.time()
+        response = yield client.send_command(str(window_size)+"-"+str(tag), test_command)
+        assert response['status'] == 'okay'
+        latencies.append(time.time()-command_start)
+
+    start_time = time.time()
+    yield defer.DeferredList([send_commands() for worker in range(window_size)])
+    print_results("websocket (%d in flight):" % window_size, latencies, time.time()-start_time)
+
+  client.transport.loseConnection()
+
+def _connect_websocket(channel_port):
+  """ Connects a WebSocketClient to the command channel and returns a deferred fired once its handshake completes.
+  """
+
+  client_factory = WebSocketClientFactory()
+  reactor.connectTCP("127.0.0.1", channel_port, client_factory)
+
+  return client_factory.connected_deferred
+
+if __name__ == '__main__':
+  number_of_commands = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+  commands_in_flight = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+  logging.disable(logging.CRITICAL)
+
+  # Set up the command parser using the test permissions
+  source_data_directory = resource_filename(Requirement.parse("Mercury2HWM"), "hwm")
+  permission_manager = permissions.PermissionManager(source_data_directory+
+                                                     '/network/security/tests/data/test_permissions_valid.json', 3600)
+  command_parser = parser.CommandParser([system.SystemCommandHandler('system')], permission_manager)
+  command_parser.session_coordinator = BenchmarkSessionCoordinator()
+
+  http_port = reactor.listenTCP(0, Site(BenchmarkCommandResource(command_parser)), interface = '127.0.0.1')
+  channel_port = reactor.listenTCP(0, WebSocketFactory(BenchmarkCommandChannelFactory(command_parser)),
+                                   interface = '127.0.0.1')
+  print "Commands: %d" % number_of_commands
+
+  benchmark_deferred = run_benchmark(http_port.getHost().port, channel_port.getHost().port, number_of_commands,
+                                     commands_in_flight)
+  benchmark_deferred.addErrback(lambda failure: failure.printTraceback())
+  benchmark_deferred.addBoth(lambda result: reactor.stop())
+  reactor.run()
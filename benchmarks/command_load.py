@@ -0,0 +1,367 @@
+""" @package benchmarks.command_load
+Measures how many commands per second the command parser can sustain and how its latency degrades under load.
+
+This script builds a CommandParser with synthetic permissions (many users, each allowed to control the devices in one
+pipeline, written to a temporary local permissions file) and synthetic pipelines made up of Test_Driver devices (a radio
+and an antenna) and a Test_Virtual_Driver device (a tracker). The command handlers of the Test_Driver devices are
+replaced with handlers that take a configurable amount of time to respond, which simulates the round trip to the
+hardware.
+
+The benchmark replays a realistic mix of commands submitted by the users of every pipeline:
+* doppler: radio frequency retunes (set_rx_freq, coalesced)
+* antenna: antenna moves (move, coalesced)
+* ui: user interface reads (get_state, which is cached, and the system station_time command)
+
+Commands are first submitted open-loop at each of the requested rates, which shows how latency grows as the offered load
+approaches saturation. A closed-loop run, which keeps a fixed number of commands in flight, then measures the saturation
+throughput. Coalesced commands that are superseded by a newer command for the same device are counted separately (they
+aren't errors).
+
+If the saturation throughput falls below --min-throughput, or the p99 latency at --check-rate exceeds --max-p99-ms, the
+script reports a regression and exits with a non-zero status.
+
+Usage: python benchmarks/command_load.py [--users 64] [--pipelines 8] [--handler-latency-ms 2] [--rates 250,500,1000]
+                                         [--duration 5] [--mix doppler=0.5,antenna=0.2,ui=0.3] [--output results.json]
+"""
+
+# Import required modules
+import os, sys, time, json, random, logging, argparse, tempfile, atexit
+from twisted.internet import reactor, defer, task
+from twisted.python import failure
+from hwm.core.configuration import Configuration
+from hwm.command import parser
+from hwm.command.metadata import build_metadata_dict
+from hwm.command.handlers import system, handler
+from hwm.network.security import permissions
+from hwm.hardware.devices import manager as device_manager
+from hwm.hardware.pipelines import manager as pipeline_manager
+
+class LoadCommandHandler(handler.CommandHandler):
+  """ A device command handler that responds after a fixed delay, used in place of the Test_Driver command handler.
+  """
+
+  def __init__(self, command_handler_name, handler_latency):
+    super(LoadCommandHandler, self).__init__(command_handler_name)
+    self.handler_latency = handler_latency
+
+  def _respond(self, command_results):
+    if self.handler_latency <= 0:
+      return command_results
+
+    return task.deferLater(reactor, self.handler_latency, lambda: command_results)
+
+  def command_set_rx_freq(self, active_command):
+    return self._respond({'frequency': active_command.parameters['frequency']})
+
+  def settings_set_rx_freq(self):
+    return build_metadata_dict([{'type': "number", 'required': True, 'title': "frequency", 'minvalue': 0}],
+                               'set_rx_freq', self.name, requires_active_session = True, coalesce = True)
+
+  def command_move(self, active_command):
+    return self._respond({'azimuth': active_command.parameters['azimuth'],
+                          'elevation': active_command.parameters['elevation']})
+
+  def settings_move(self):
+    return build_metadata_dict([{'type': "number", 'required': True, 'title': "azimuth", 'minvalue': 0,
+                                 'maxvalue': 360},
+                                {'type': "number", 'required': True, 'title': "elevation", 'minvalue': 0,
+                                 'maxvalue': 210}],
+                               'move', self.name, requires_active_session = True, coalesce = True)
+
+  def command_get_state(self, active_command):
+    return self._respond({'azimuth': 180, 'elevation': 45})
+
+  def settings_get_state(self):
+    return build_metadata_dict([], 'get_state', self.name, requires_active_session = True, cache_ttl = 1)
+
+class SyntheticSession:
+  """ A session that gives its user access to one pipeline.
+  """
+
+  def __init__(self, session_id, user_id, active_pipeline):
+    self.id = session_id
+    self.user_id = user_id
+    self.active_pipeline = active_pipeline
+
+class SyntheticSessionCoordinator:
+  """ A session coordinator that has one active session for each benchmark user.
+  """
+
+  def __init__(self, user_sessions):
+    self.user_sessions = user_sessions
+
+  def load_user_sessions(self, user_id):
+    return self.user_sessions.get(user_id, [])
+
+class LoadGenerator:
+  """ Submits a mix of commands to the command parser and records their latencies.
+  """
+
+  def __init__(self, command_parser, user_pipelines, command_mix, random_seed = 1):
+    self.command_parser = command_parser
+    self.user_ids = sorted(user_pipelines.keys())
+    self.user_pipelines = user_pipelines
+    self.command_mix = command_mix
+    self.random = random.Random(random_seed)
+    self._next_user = 0
+    self.reset()
+
+  def reset(self):
+    self.latencies = []
+    self.errors = 0
+    self.superseded = 0
+    self.in_flight = 0
+    self.last_completion = None
+
+  def next_command(self):
+    """ Builds the next command in the mix, round-robining through the users.
+    """
+
+    user_id = self.user_ids[self._next_user % len(self.user_ids)]
+    self._next_user += 1
+    pipeline_id = self.user_pipelines[user_id]
+
+    command_type = self.random.random()
+    for command_kind, command_share in self.command_mix:
+      command_type -= command_share
+      if command_type < 0:
+        break
+
+    if command_kind == 'doppler':
+      return user_id, {'command': "set_rx_freq", 'destination': pipeline_id+"."+pipeline_id+"_radio",
+                       'parameters': {'frequency': 437500000 + self.random.randint(-10000, 10000)}}
+    elif command_kind == 'antenna':
+      return user_id, {'command': "move", 'destination': pipeline_id+"."+pipeline_id+"_antenna",
+                       'parameters': {'azimuth': self.random.randint(0, 360), 'elevation': self.random.randint(0, 90)}}
+    elif self.random.random() < 0.5:
+      return user_id, {'command': "get_state", 'destination': pipeline_id+"."+pipeline_id+"_antenna"}
+    else:
+      return user_id, {'command': "station_time", 'destination': "system"}
+
+  def submit(self):
+    """ Submits the next command and returns a deferred that fires (with None) once it finishes.
+    """
+
+    user_id, command_request = self.next_command()
+    submitted_at = time.time()
+    self.in_flight += 1
+    command_deferred = self.command_parser.parse_command(command_request, user_id = user_id)
+    command_deferred.addBoth(self._command_finished, submitted_at)
+
+    return command_deferred
+
+  def _command_finished(self, command_response, submitted_at):
+    self.in_flight -= 1
+    self.last_completion = time.time()
+    if isinstance(command_response, failure.Failure):
+      error_response = getattr(command_response.value, 'results', None)
+      if error_response is not None and error_response['response']['result'].get('superseded', False):
+        self.superseded += 1
+      else:
+        self.errors += 1
+      return None
+
+    self.latencies.append(self.last_completion - submitted_at)
+
+def summarize(load_generator, offered_rate, start_time):
+  """ Summarizes the results of a benchmark step.
+  """
+
+  latencies = sorted(load_generator.latencies)
+  completed = len(latencies) + load_generator.superseded + load_generator.errors
+  elapsed_time = max((load_generator.last_completion or start_time) - start_time, 1e-9)
+
+  return {
+    'offered_rate': offered_rate,
+    'throughput': completed / elapsed_time,
+    'completed': len(latencies),
+    'superseded': load_generator.superseded,
+    'errors': load_generator.errors,
+    'p50_ms': latencies[len(latencies)/2]*1000 if latencies else None,
+    'p99_ms': latencies[min(int(len(latencies)*0.99), len(latencies)-1)]*1000 if latencies else None
+  }
+
+@defer.inlineCallbacks
+def run_open_loop(load_generator, offered_rate, duration):
+  """ Submits commands at a fixed rate (regardless of how quickly they complete) for the specified duration.
+  """
+
+  load_generator.reset()
+  pending_commands = []
+  start_time = time.time()
+
+  def submit_due_commands():
+    elapsed_time = time.time() - start_time
+    if elapsed_time >= duration:
+      submit_loop.stop()
+      return
+    while len(pending_commands) < int(elapsed_time * offered_rate):
+      pending_commands.append(load_generator.submit())
+
+  submit_loop = task.LoopingCall(submit_due_commands)
+  yield submit_loop.start(0.005)
+  yield defer.DeferredList(pending_commands)
+
+  defer.returnValue(summarize(load_generator, offered_rate, start_time))
+
+@defer.inlineCallbacks
+def run_closed_loop(load_generator, commands_in_flight, duration):
+  """ Keeps a fixed number of commands in flight for the specified duration to measure the saturation throughput.
+  """
+
+  load_generator.reset()
+  start_time = time.time()
+
+  @defer.inlineCallbacks
+  def worker():
+    while time.time() - start_time < duration:
+      yield load_generator.submit()
+
+  yield defer.DeferredList([worker() for worker_index in range(commands_in_flight)])
+
+  defer.returnValue(summarize(load_generator, None, start_time))
+
+def build_command_parser(number_of_users, number_of_pipelines, handler_latency):
+  """ Builds the command parser, synthetic pipelines, permissions, and sessions used by the benchmark.
+
+  @return Returns a tuple containing the CommandParser and a dictionary mapping each user ID to its pipeline ID.
+  """
+
+  # Define the synthetic devices and pipelines
+  device_configuration = []
+  pipeline_configuration = []
+  for pipeline_index in range(number_of_pipelines):
+    pipeline_id = "pipeline_%d" % pipeline_index
+    device_configuration.append({'id': pipeline_id+"_radio", 'driver': "Test_Driver"})
+    device_configuration.append({'id': pipeline_id+"_antenna", 'driver': "Test_Driver"})
+    device_configuration.append({'id': pipeline_id+"_tracker", 'driver': "Test_Virtual_Driver"})
+    pipeline_configuration.append({'id': pipeline_id, 'mode': "transceive", 'hardware': [
+      {'device_id': pipeline_id+"_radio", 'pipeline_input': True, 'pipeline_output': True},
+      {'device_id': pipeline_id+"_antenna"},
+      {'device_id': pipeline_id+"_tracker"}
+    ]})
+  Configuration.verbose_startup = False
+  Configuration.options['devices'] = device_configuration
+  Configuration.options['pipelines'] = pipeline_configuration
+
+  # Generate the user permissions
+  user_pipelines = {}
+  permission_settings = []
+  for user_index in range(number_of_users):
+    user_id = "load_user_%d" % user_index
+    pipeline_id = "pipeline_%d" % (user_index % number_of_pipelines)
+    user_pipelines[user_id] = pipeline_id
+    permission_settings.append({'user_id': user_id, 'username': user_id, 'generated_at': int(time.time()),
+                                'ignore_session_protections': False, 'permitted_commands': [
+      {'command': "station_time", 'destination': "system"},
+      {'command': "set_rx_freq", 'destination': pipeline_id+"_radio", 'pipelines': [pipeline_id]},
+      {'command': "move", 'destination': pipeline_id+"_antenna", 'pipelines': [pipeline_id]},
+      {'command': "get_state", 'destination': pipeline_id+"_antenna", 'pipelines': [pipeline_id]}
+    ]})
+
+  permissions_file = tempfile.NamedTemporaryFile(suffix = ".json", delete = False)
+  json.dump(permission_settings, permissions_file)
+  permissions_file.close()
+  atexit.register(os.remove, permissions_file.name)
+
+  # Set up the command parser and the pipelines
+  command_parser = parser.CommandParser([system.SystemCommandHandler('system')],
+                                        permissions.PermissionManager(permissions_file.name, 3600))
+  devices = device_manager.DeviceManager(command_parser)
+  for device_id, device in devices.devices.items():
+    device._command_handler = LoadCommandHandler(device_id, handler_latency)
+  pipelines = pipeline_manager.PipelineManager(devices, command_parser)
+
+  # Give each user a session with their pipeline
+  command_parser.session_coordinator = SyntheticSessionCoordinator(dict(
+    (user_id, [SyntheticSession("session_"+user_id, user_id, pipelines.pipelines[pipeline_id])])
+    for user_id, pipeline_id in user_pipelines.items()))
+
+  return command_parser, user_pipelines
+
+@defer.inlineCallbacks
+def run_benchmark(arguments):
+  """ Runs the benchmark steps, prints the results, and checks the regression thresholds.
+
+  @return Returns a deferred that fires with True if the results are within the regression thresholds.
+  """
+
+  command_parser, user_pipelines = build_command_parser(arguments.users, arguments.pipelines,
+                                                        arguments.handler_latency_ms/1000.0)
+  command_mix = [(command_kind, float(command_share)) for command_kind, command_share in
+                 [mix_entry.split('=') for mix_entry in arguments.mix.split(',')]]
+  mix_total = sum(command_share for command_kind, command_share in command_mix)
+  command_mix = [(command_kind, command_share/mix_total) for command_kind, command_share in command_mix]
+  load_generator = LoadGenerator(command_parser, user_pipelines, command_mix)
+
+  # Load every user's permissions before measuring
+  yield defer.DeferredList([command_parser.permission_manager.get_user_permissions(user_id)
+                            for user_id in user_pipelines.keys()])
+
+  print "Users: %d  Pipelines: %d  Handler latency: %.1f ms  Mix: %s" % (arguments.users, arguments.pipelines,
+                                                                         arguments.handler_latency_ms, arguments.mix)
+  print "%-14s %12s %10s %10s %10s %10s" % ("offered (/s)", "achieved (/s)", "p50 (ms)", "p99 (ms)", "superseded",
+                                            "errors")
+  step_results = []
+  for offered_rate in [float(rate) for rate in arguments.rates.split(',')]:
+    step_result = yield run_open_loop(load_generator, offered_rate, arguments.duration)
+    step_results.append(step_result)
+    print "%-14.0f %12.0f %10.3f %10.3f %10d %10d" % (offered_rate, step_result['throughput'], step_result['p50_ms'],
+                                                      step_result['p99_ms'], step_result['superseded'],
+                                                      step_result['errors'])
+
+  saturation_result = yield run_closed_loop(load_generator, arguments.in_flight, arguments.duration)
+  print "%-14s %12.0f %10.3f %10.3f %10d %10d" % ("saturation", saturation_result['throughput'],
+                                                  saturation_result['p50_ms'], saturation_result['p99_ms'],
+                                                  saturation_result['superseded'], saturation_result['errors'])
+
+  if arguments.output:
+    with open(arguments.output, 'w') as output_file:
+      json.dump({'steps': step_results, 'saturation': saturation_result}, output_file, indent = 2)
+
+  # Check the regression thresholds
+  regressions = []
+  if saturation_result['throughput'] < arguments.min_throughput:
+    regressions.append("saturation throughput %.0f/s is below %.0f/s" % (saturation_result['throughput'],
+                                                                         arguments.min_throughput))
+  check_rate = arguments.check_rate if arguments.check_rate is not None else step_results[0]['offered_rate']
+  for step_result in step_results:
+    if step_result['offered_rate'] == check_rate and step_result['p99_ms'] > arguments.max_p99_ms:
+      regressions.append("p99 latency %.3f ms at %.0f/s exceeds %.3f ms" % (step_result['p99_ms'], check_rate,
+                                                                             arguments.max_p99_ms))
+  if sum(step_result['errors'] for step_result in step_results + [saturation_result]) > 0:
+    regressions.append("some commands failed")
+
+  for regression in regressions:
+    print "REGRESSION: "+regression
+
+  defer.returnValue(len(regressions) == 0)
+
+if __name__ == '__main__':
+  argument_parser = argparse.ArgumentParser(description = "Command parser load benchmark.")
+  argument_parser.add_argument('--users', type = int, default = 64)
+  argument_parser.add_argument('--pipelines', type = int, default = 8)
+  argument_parser.add_argument('--handler-latency-ms', type = float, default = 2.0)
+  argument_parser.add_argument('--rates', default = "250,500,1000,2000")
+  argument_parser.add_argument('--duration', type = float, default = 5.0, help = "Seconds per step.")
+  argument_parser.add_argument('--in-flight', type = int, default = 256,
+                               help = "Commands kept in flight during the saturation run.")
+  argument_parser.add_argument('--mix', default = "doppler=0.5,antenna=0.2,ui=0.3")
+  argument_parser.add_argument('--min-throughput', type = float, default = 500.0,
+                               help = "Fail if the saturation throughput (commands/s) is below this.")
+  argument_parser.add_argument('--max-p99-ms', type = float, default = 50.0,
+                               help = "Fail if the p99 latency at the check rate is above this.")
+  argument_parser.add_argument('--check-rate', type = float, default = None,
+                               help = "The offered rate that --max-p99-ms applies to (defaults to the first rate).")
+  argument_parser.add_argument('--output', default = None, help = "Write the results to this JSON file.")
+  parsed_arguments = argument_parser.parse_args()
+  logging.disable(logging.CRITICAL)
+
+  benchmark_results = []
+  benchmark_deferred = run_benchmark(parsed_arguments)
+  benchmark_deferred.addCallback(benchmark_results.append)
+  benchmark_deferred.addErrback(lambda benchmark_failure: benchmark_failure.printTraceback())
+  benchmark_deferred.addBoth(lambda result: reactor.stop())
+  reactor.run()
+
+  sys.exit(0 if benchmark_results and benchmark_results[0] else 1)
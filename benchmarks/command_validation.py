@@ -0,0 +1,89 @@
+""" @package benchmarks.command_validation
+Measures the throughput of the command validation pipeline.
+
+This script compares the original validation strategy (building a new Draft3Validator for every command and leaving
+parameter checks to the command handlers) against the compiled validators stored in the command routing table (see
+hwm.command.routing), using a mix of high frequency antenna controller and tracker commands.
+
+Usage: python benchmarks/command_validation.py [number_of_commands]
+"""
+
+# Import required modules
+import sys, time, json
+import jsonschema
+from hwm.command import command, routing
+from hwm.hardware.devices.drivers.mxl_antenna_controller import mxl_antenna_controller
+from hwm.hardware.devices.drivers.sgp4_tracker import sgp4_tracker
+
+class BenchmarkDriver:
+  """ A minimal stand-in for a Driver that only provides what the command handlers need to build their meta-data.
+  """
+
+  def __init__(self, device_id):
+    self.id = device_id
+
+def build_command_mix(number_of_commands):
+  """ Builds a list of raw (JSON encoded) commands that resembles the traffic generated during a tracking session.
+  """
+
+  tle_line_1 = "1 25544U 98067A   13172.53138889  .00008525  00000-0  15166-3 0  5836"
+  tle_line_2 = "2 25544  51.6483 130.1213 0010798  73.6596  66.9613 15.50514429835454"
+  command_templates = [
+    {'command': 'move', 'destination': 'test_pipeline.antenna', 'parameters': {'azimuth': 120, 'elevation': 42}},
+    {'command': 'move', 'destination': 'test_pipeline.antenna', 'parameters': {'azimuth': 121, 'elevation': 43}},
+    {'command': 'get_state', 'destination': 'test_pipeline.antenna'},
+    {'command': 'set_target_tle', 'destination': 'test_pipeline.tracker',
+     'parameters': {'line_1': tle_line_1, 'line_2': tle_line_2}}
+  ]
+
+  return [json.dumps(command_templates[index % len(command_templates)]) for index in range(number_of_commands)]
+
+def legacy_validation(raw_commands, handlers):
+  """ Validates the commands the way the command parser originally did: a new schema validator for every command.
+  """
+
+  for raw_command in raw_commands:
+    command_dict = json.loads(raw_command)
+    jsonschema.Draft3Validator(command.schema).validate(command_dict)
+
+def compiled_validation(raw_commands, handlers):
+  """ Validates the commands using the shared schema validator and the compiled parameter validators.
+  """
+
+  routing_table = routing.RoutingTable()
+  for device_id, command_handler in handlers.iteritems():
+    routing_table.add_command_handler(command_handler, 'test_pipeline.'+device_id, 'test_pipeline')
+
+  for raw_command in raw_commands:
+    active_command = command.Command(time.time(), raw_command, kernel_mode = True)
+    active_command.validate_command()
+    routing_table.get_route(active_command.full_destination, active_command.command).validate_parameters(active_command)
+
+def run_benchmark(benchmark_function, raw_commands, handlers, repeat = 3):
+  """ Runs the provided benchmark function several times and returns the best throughput (commands per second).
+  """
+
+  best_duration = None
+  for run in range(repeat):
+    start_time = time.time()
+    benchmark_function(raw_commands, handlers)
+    duration = time.time() - start_time
+    best_duration = duration if best_duration is None else min(best_duration, duration)
+
+  return len(raw_commands)/best_duration
+
+if __name__ == '__main__':
+  number_of_commands = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+  raw_commands = build_command_mix(number_of_commands)
+  handlers = {
+    'antenna': mxl_antenna_controller.AntennaControllerHandler(BenchmarkDriver('antenna')),
+    'tracker': sgp4_tracker.SGP4Handler(BenchmarkDriver('tracker'))
+  }
+
+  legacy_throughput = run_benchmark(legacy_validation, raw_commands, handlers)
+  compiled_throughput = run_benchmark(compiled_validation, raw_commands, handlers)
+
+  print "Commands validated:         %d" % number_of_commands
+  print "Legacy (schema only):       %.0f commands/s" % legacy_throughput
+  print "Compiled (schema + params): %.0f commands/s" % compiled_throughput
+  print "Speed up:                   %.2fx" % (compiled_throughput/legacy_throughput)
@@ -0,0 +1,93 @@
+""" @package benchmarks.schedule_index
+Measures how the cost of the session coordinator's schedule queries grows with the size of the reservation schedule.
+
+Every time the session coordinator runs, it asks the schedule manager for the active reservations and for the
+reservations that start within the permission prefetch horizon. This script builds schedules containing back-to-back
+reservations (a few of which overlap, like conflicting reservations do) and simulates the coordinator running once a
+second while the reservations start and end. For each schedule size it reports the average and p99 cost of a
+coordinator tick's schedule queries using:
+* a linear scan: the whole schedule is scanned on every query.
+* the reservation index: the schedule manager's time index (see hwm.sessions.schedule.ReservationIndex).
+
+Usage: python benchmarks/schedule_index.py [number_of_ticks]
+"""
+
+# Import required modules
+import sys, time
+from hwm.sessions import schedule
+
+PREFETCH_HORIZON = 600
+
+class LinearScanSchedule:
+  """ Answers the coordinator's schedule queries by scanning the whole schedule.
+  """
+
+  def __init__(self, reservations):
+    self.schedule = dict([(reservation['reservation_id'], reservation) for reservation in reservations])
+
+  def query(self, current_time):
+    active_reservations = []
+    upcoming_reservations = []
+    for reservation in self.schedule.itervalues():
+      if reservation['time_start'] < current_time and reservation['time_end'] > current_time:
+        active_reservations.append(reservation)
+      if reservation['time_start'] < current_time+PREFETCH_HORIZON and reservation['time_end'] > current_time:
+        upcoming_reservations.append(reservation)
+
+    return active_reservations, upcoming_reservations
+
+class IndexedSchedule:
+  """ Answers the coordinator's schedule queries using the schedule manager's reservation index.
+  """
+
+  def __init__(self, reservations):
+    self.reservation_index = schedule.ReservationIndex(reservations)
+
+  def query(self, current_time):
+    return (self.reservation_index.get_active_reservations(current_time),
+            self.reservation_index.get_upcoming_reservations(current_time, PREFETCH_HORIZON))
+
+def generate_reservations(number_of_reservations, start_time):
+  """ Generates a schedule of 5 minute reservations that start every 5 minutes (every tenth one overlaps the next).
+  """
+
+  reservations = []
+  for reservation_index in xrange(number_of_reservations):
+    time_start = start_time+reservation_index*300
+    reservations.append({'reservation_id': 'RES.'+str(reservation_index), 'user_id': str(reservation_index%50),
+                         'pipeline_id': 'test_pipeline', 'time_start': time_start,
+                         'time_end': time_start+(450 if reservation_index%10 == 0 else 300)})
+
+  return reservations
+
+def run_ticks(test_schedule, start_time, number_of_ticks):
+  """ Simulates the coordinator running once a second and returns the cost of each tick's queries.
+  """
+
+  tick_costs = []
+  for tick_index in xrange(number_of_ticks):
+    tick_start = time.time()
+    active_reservations, upcoming_reservations = test_schedule.query(start_time+tick_index)
+    tick_costs.append(time.time()-tick_start)
+    assert 1 <= len(active_reservations) <= 2 and len(upcoming_reservations) >= 2
+
+  return tick_costs
+
+def print_results(title, number_of_reservations, tick_costs):
+  """ Prints the average and p99 tick cost of a benchmark run.
+  """
+
+  tick_costs = sorted(tick_costs)
+  print "%-14s %7d reservations   avg %9.3f us   p99 %9.3f us" % (
+    title, number_of_reservations, sum(tick_costs)/len(tick_costs)*1e6, tick_costs[int(len(tick_costs)*0.99)]*1e6)
+
+if __name__ == '__main__':
+  number_of_ticks = int(sys.argv[1]) if len(sys.argv) > 1 else 3600
+  start_time = 1400000000
+  print "Ticks: %d" % number_of_ticks
+
+  for number_of_reservations in [1000, 10000, 100000]:
+    reservations = generate_reservations(number_of_reservations, start_time)
+    for title, schedule_class in [("linear scan:", LinearScanSchedule), ("indexed:", IndexedSchedule)]:
+      test_schedule = schedule_class(reservations)
+      print_results(title, number_of_reservations, run_ticks(test_schedule, start_time+0.5, number_of_ticks))
@@ -0,0 +1,99 @@
+""" @package benchmarks.schedule_sync
+Measures the cost of keeping a large reservation schedule synchronized with the user interface.
+
+This script serves a schedule from a local stand-in schedule server (see hwm.sessions.tests.utilities) and has a
+schedule manager update its copy of the schedule repeatedly. Before each update, a few reservations are changed, added,
+or deleted on the server (every tenth update is made without any changes). For each schedule size it reports the average
+number of response body bytes received and the average client processor time (excluding the time the stand-in server
+spent rendering responses) per update using:
+* full: the server doesn't support delta schedules, so the whole schedule is downloaded, parsed, and compared.
+* delta: the server responds with delta schedules (or '304 Not Modified' if nothing changed).
+
+Usage: python benchmarks/schedule_sync.py [number_of_updates]
+"""
+
+# Import required modules
+import sys, time, logging
+from twisted.internet import reactor, defer
+from hwm.core.configuration import Configuration
+from hwm.network import http_client
+from hwm.sessions import schedule
+from hwm.sessions.tests.utilities import StandInScheduleServer
+
+CHANGES_PER_UPDATE = 5
+
+def generate_reservation(reservation_index, start_time):
+  """ Generates a one hour reservation with a setup command, like the ones the user interface serves.
+  """
+
+  time_start = start_time+reservation_index*3600
+  return {'reservation_id': 'RES.'+str(reservation_index), 'user_id': str(reservation_index%50),
+          'username': 'user_'+str(reservation_index%50), 'pipeline_id': 'test_pipeline', 'time_start': time_start,
+          'time_end': time_start+3600, 'description': 'Benchmark reservation.',
+          'setup_commands': [{'command': 'station_time', 'destination': 'system'}]}
+
+def modify_schedule(schedule_server, update_index, number_of_reservations, start_time):
+  """ Moves a few of the server's reservations, adds a new one, and deletes one from the end of the schedule.
+  """
+
+  if update_index%10 == 9:
+    return
+
+  for change_index in range(CHANGES_PER_UPDATE):
+    reservation = generate_reservation((update_index*CHANGES_PER_UPDATE+change_index)%number_of_reservations,
+                                       start_time)
+    reservation['time_start'] += update_index+1
+    schedule_server.set_reservation(reservation)
+  schedule_server.set_reservation(generate_reservation(number_of_reservations+update_index, start_time))
+  schedule_server.delete_reservation('RES.'+str(number_of_reservations-update_index-1))
+
+@defer.inlineCallbacks
+def run_updates(number_of_reservations, supports_deltas, number_of_updates):
+  """ Synchronizes a schedule manager with a stand-in server and returns the average bytes and processor time per
+  update.
+  """
+
+  start_time = time.time()+3600
+  schedule_server = StandInScheduleServer(supports_deltas = supports_deltas)
+  for reservation_index in range(number_of_reservations):
+    schedule_server.set_reservation(generate_reservation(reservation_index, start_time))
+  schedule_server.start()
+  schedule_manager = schedule.ScheduleManager(schedule_server.url)
+  yield schedule_manager.update_schedule()
+
+  client = http_client.get_client()
+  bytes_received = client.get_stats()['bytes_received']
+  render_time = schedule_server.render_time
+  processor_time = time.clock()
+  for update_index in range(number_of_updates):
+    modify_schedule(schedule_server, update_index, number_of_reservations, start_time)
+    yield schedule_manager.update_schedule()
+  processor_time = time.clock()-processor_time-(schedule_server.render_time-render_time)
+  bytes_received = client.get_stats()['bytes_received']-bytes_received
+
+  assert schedule_manager.generated_at == schedule_server.generated_at
+  yield schedule_server.stop()
+
+  defer.returnValue((float(bytes_received)/number_of_updates, processor_time/number_of_updates))
+
+@defer.inlineCallbacks
+def run_benchmark(number_of_updates):
+  """ Runs the benchmark for each schedule size and synchronization mode.
+  """
+
+  for number_of_reservations in [1000, 10000, 50000]:
+    for title, supports_deltas in [("full:", False), ("delta:", True)]:
+      bytes_per_update, processor_time = yield run_updates(number_of_reservations, supports_deltas, number_of_updates)
+      print "%-7s %6d reservations   %12.0f bytes/update   %9.3f ms CPU/update" % (
+        title, number_of_reservations, bytes_per_update, processor_time*1000)
+
+if __name__ == '__main__':
+  number_of_updates = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+  logging.disable(logging.CRITICAL)
+  Configuration.options['schedule-update-timeout'] = 60
+  print "Updates: %d" % number_of_updates
+
+  benchmark_deferred = run_benchmark(number_of_updates)
+  benchmark_deferred.addErrback(lambda failure: failure.printTraceback())
+  benchmark_deferred.addBoth(lambda result: reactor.stop())
+  reactor.run()
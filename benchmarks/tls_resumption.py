@@ -0,0 +1,119 @@
+""" @package benchmarks.tls_resumption
+Measures how TLS session resumption affects the cost of short-lived command connections.
+
+This script generates a test CA along with server and client certificates, starts the command resource on a local TLS
+listener (using the same TLSContextFactory as the hardware manager's listeners), and submits the same command over a new
+connection each time (one HTTPS request per connection, like a client that doesn't keep its connections alive). It does
+this with:
+* no resumption: the session cache and session tickets are disabled, so every connection performs a full handshake.
+* session cache: the client resumes its previous session using the session ID cached by the server.
+* session tickets: the client resumes its previous session using a session ticket (the server cache is disabled).
+
+For each configuration it reports the handshakes (connections) per second, the command latency percentiles (measured
+from connecting to receiving the complete response), and the server's handshake statistics.
+
+Usage: python benchmarks/tls_resumption.py [number_of_connections]
+"""
+
+# Import required modules
+import sys, time, json, shutil, logging, tempfile
+from pkg_resources import Requirement, resource_filename
+from twisted.internet import reactor, defer, ssl, threads
+from twisted.web.server import Site
+from hwm.command import parser, connection
+from hwm.command.handlers import system
+from hwm.network.security import permissions, verification
+from hwm.network.tests.utilities import generate_tls_certificates, tls_client_request
+
+class BenchmarkCommandResource(connection.CommandResource):
+  """ A command resource that executes every command as the benchmark's test user.
+  """
+
+  def _load_user_id(self, request):
+    return "1"
+
+class BenchmarkSessionCoordinator:
+  """ A session coordinator that doesn't have any active sessions (the benchmark user ignores session protections).
+  """
+
+  def load_user_sessions(self, user_id):
+    return []
+
+def run_connections(port, certificate_files, number_of_connections, resume_sessions):
+  """ Submits a command over each of the specified number of new connections (blocks, run it in a thread).
+
+  @return Returns a tuple containing the latency of each command and the total run time.
+  """
+
+  command_body = json.dumps({'command': "station_time", 'destination': "system"})
+  command_request = ("POST / HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n"+
+                     "Content-Length: %d\r\nConnection: close\r\n\r\n%s") % (len(command_body), command_body)
+
+  # Warm up (and establish the first session)
+  response, session, session_resumed = tls_client_request(port, certificate_files, command_request)
+  assert '"okay"' in response
+
+  latencies = []
+  start_time = time.time()
+  for connection_index in range(number_of_connections):
+    command_start = time.time()
+    response, new_session, session_resumed = tls_client_request(port, certificate_files, command_request,
+                                                                session = session if resume_sessions else None)
+    latencies.append(time.time()-command_start)
+    assert '"okay"' in response
+    session = new_session
+
+  return latencies, time.time()-start_time
+
+def print_results(title, latencies, total_time, handshake_stats):
+  """ Prints the handshake rate, latency percentiles, and server handshake statistics of a benchmark run.
+  """
+
+  latencies = sorted(latencies)
+  print "%-18s %8.0f handshakes/s   p50 %7.3f ms   p99 %7.3f ms   full %5d   resumed %5d" % (
+    title, len(latencies)/total_time, latencies[len(latencies)/2]*1000, latencies[int(len(latencies)*0.99)]*1000,
+    handshake_stats['full_handshakes'], handshake_stats['resumed_handshakes'])
+
+@defer.inlineCallbacks
+def run_benchmark(command_parser, certificate_files, number_of_connections):
+  """ Runs the benchmark for each of the session resumption configurations.
+  """
+
+  ca_certificate = ssl.Certificate.loadPEM(open(certificate_files['ca_cert']).read())
+  server_certificate = ssl.PrivateCertificate.loadPEM(open(certificate_files['server_key']).read()+
+                                                      open(certificate_files['server_cert']).read())
+
+  for title, session_cache, session_tickets in [("no resumption:", False, False), ("session cache:", True, False),
+                                                ("session tickets:", False, True)]:
+    context_factory = verification.TLSContextFactory(server_certificate, ca_certificate, session_cache = session_cache,
+                                                     session_tickets = session_tickets)
+    listening_port = reactor.listenSSL(0, Site(BenchmarkCommandResource(command_parser)), context_factory,
+                                       interface = '127.0.0.1')
+
+    latencies, total_time = yield threads.deferToThread(run_connections, listening_port.getHost().port,
+                                                        certificate_files, number_of_connections,
+                                                        session_cache or session_tickets)
+    print_results(title, latencies, total_time, context_factory.get_stats())
+
+    yield listening_port.stopListening()
+
+if __name__ == '__main__':
+  number_of_connections = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+  logging.disable(logging.CRITICAL)
+
+  # Set up the command parser using the test permissions
+  source_data_directory = resource_filename(Requirement.parse("Mercury2HWM"), "hwm")
+  permission_manager = permissions.PermissionManager(source_data_directory+
+                                                     '/network/security/tests/data/test_permissions_valid.json', 3600)
+  command_parser = parser.CommandParser([system.SystemCommandHandler('system')], permission_manager)
+  command_parser.session_coordinator = BenchmarkSessionCoordinator()
+
+  certificate_directory = tempfile.mkdtemp()
+  certificate_files = generate_tls_certificates(certificate_directory)
+  print "Connections: %d" % number_of_connections
+
+  benchmark_deferred = run_benchmark(command_parser, certificate_files, number_of_connections)
+  benchmark_deferred.addErrback(lambda failure: failure.printTraceback())
+  benchmark_deferred.addBoth(lambda result: reactor.stop())
+  reactor.run()
+  shutil.rmtree(certificate_directory)
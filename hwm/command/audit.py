@@ -0,0 +1,359 @@
+""" @package hwm.command.audit
+Records an audit trail of every command executed by the hardware manager.
+
+This module contains a class that keeps a durable record of the commands executed by the command parser: who submitted
+each command, where it was sent, its parameters, how long each stage of its execution took, whether it succeeded, and
+the size of its result.
+
+Writing to disk from the reactor thread would slow down every command, so audit records are only serialized and placed
+on a bounded in-memory queue by the reactor thread. A writer thread collects the queued records into batches and appends
+each batch to the active audit file as a separate gzip member (so the files are append-only and can still be read with
+any gzip reader). Once the active file is large enough, it's archived under a name containing the time range of the
+records that it holds, which allows the query functions in this module to skip archives outside of the requested time
+range without opening them. If the queue fills up (e.g. because the disk is slow), new records are dropped and counted
+instead of blocking the reactor.
+"""
+
+# Import required modules
+import os, re, sys, time, json, zlib, logging, threading, Queue, argparse
+
+# The name of the audit file that records are currently being written to
+ACTIVE_FILE_NAME = "command_audit.log.gz"
+
+# Matches the names of archived audit files, which contain the time range of their records
+ARCHIVE_FILE_PATTERN = re.compile(r'^command_audit\.(\d+)-(\d+)(?:\.(\d+))?\.log\.gz$')
+
+class AuditLog:
+  """ Writes command audit records to rotating, compressed files using a background writer thread.
+  """
+
+  # Placed on the queue to stop the writer thread
+  _STOP = object()
+
+  def __init__(self, log_directory, max_queue_size = 10000, batch_size = 500, flush_interval = 1.0,
+               max_file_size = 16*1024*1024, max_archived_files = 50):
+    """ Sets up the audit log.
+
+    @note The writer thread isn't started until start() is called. Records submitted before then will be queued.
+
+    @param log_directory       The directory to write the audit files to. It will be created if it doesn't exist.
+    @param max_queue_size      The maximum number of records that may be waiting to be written. Once the queue is full,
+                               new records will be dropped (and counted).
+    @param batch_size          The maximum number of records to write at once.
+    @param flush_interval      The maximum amount of time (in seconds) that the writer thread will wait for more records
+                               before writing a partial batch.
+    @param max_file_size       The size (in bytes) that the active audit file may reach before it's archived.
+    @param max_archived_files  The maximum number of archived audit files to keep. Once this limit is reached, the
+                               oldest archives will be deleted.
+    """
+
+    self.log_directory = log_directory
+    self.batch_size = batch_size
+    self.flush_interval = flush_interval
+    self.max_file_size = max_file_size
+    self.max_archived_files = max_archived_files
+    self._queue = Queue.Queue(max_queue_size)
+    self._writer_thread = None
+    self._active_file_range = None
+
+    # Audit log statistics
+    self.records_dropped = 0
+    self.records_written = 0
+    self.batches_written = 0
+    self.write_errors = 0
+    self.files_archived = 0
+
+  def start(self):
+    """ Starts the writer thread.
+    """
+
+    if self._writer_thread is not None:
+      return
+
+    if not os.path.exists(self.log_directory):
+      os.makedirs(self.log_directory)
+
+    self._writer_thread = threading.Thread(target = self._write_records, name = "CommandAuditWriter")
+    self._writer_thread.daemon = True
+    self._writer_thread.start()
+
+  def stop(self, timeout = 5.0):
+    """ Writes any queued records and stops the writer thread. Called when the reactor shuts down.
+
+    @param timeout  The maximum amount of time (in seconds) to wait for the queued records to be written.
+    """
+
+    if self._writer_thread is None:
+      return
+
+    try:
+      self._queue.put(AuditLog._STOP, True, timeout)
+    except Queue.Full:
+      logging.error("The command audit log writer didn't stop in time, some records may have been lost.")
+      return
+
+    self._writer_thread.join(timeout)
+    self._writer_thread = None
+
+  def record(self, finished_command, command_response):
+    """ Queues an audit record for a finished command.
+
+    This method is called by the reactor thread and never blocks. If the queue is full, the record is dropped and
+    counted in the 'dropped' statistic.
+
+    @note The record is serialized here, on the reactor thread, so that the writer thread only ever sees immutable
+          strings. Otherwise the writer could read the command's parameters or result while they're being modified by
+          another command handler or job listener.
+
+    @param finished_command  The Command that just finished.
+    @param command_response  The response dictionary generated for the command (containing a 'response' field).
+    """
+
+    audit_record = {
+      'timestamp': time.time(),
+      'received_at': finished_command.time_received,
+      'user_id': finished_command.user_id,
+      'kernel_mode': finished_command.kernel_mode,
+      'destination': command_response['response'].get('destination', None),
+      'command': finished_command.command,
+      'parameters': finished_command.parameters,
+      'status': command_response['response']['status'],
+      'timing': finished_command.timing.stages if finished_command.timing is not None else None,
+      'result_size': len(json.dumps(command_response['response'].get('result', None)))
+    }
+
+    try:
+      self._queue.put_nowait((audit_record['timestamp'], json.dumps(audit_record, sort_keys = True)))
+    except Queue.Full:
+      self.records_dropped += 1
+
+  def get_stats(self):
+    """ Returns statistics about the audit log.
+
+    @return Returns a dictionary containing the number of records waiting to be written, the number of records that
+            were dropped because the queue was full, and the number of records, batches, and archives written.
+    """
+
+    return {
+      'queued': self._queue.qsize(),
+      'dropped': self.records_dropped,
+      'written': self.records_written,
+      'batches': self.batches_written,
+      'write_errors': self.write_errors,
+      'archived_files': self.files_archived
+    }
+
+  def _write_records(self):
+    """ Writes batches of queued records to the active audit file until the audit log is stopped.
+
+    @note This method runs in the writer thread.
+    """
+
+    # Archive any active file left over from a previous run, so that the time range of every archive is known
+    self._archive_active_file()
+
+    stopping = False
+    while not stopping:
+      # Wait for a record, then collect a batch
+      record_batch = [self._queue.get()]
+      batch_deadline = time.time() + self.flush_interval
+      while len(record_batch) < self.batch_size and record_batch[-1] is not AuditLog._STOP:
+        remaining_time = batch_deadline - time.time()
+        if remaining_time <= 0:
+          break
+        try:
+          record_batch.append(self._queue.get(True, remaining_time))
+        except Queue.Empty:
+          break
+
+      if record_batch[-1] is AuditLog._STOP:
+        record_batch.pop()
+        stopping = True
+
+      if record_batch:
+        self._write_batch(record_batch)
+
+  def _write_batch(self, record_batch):
+    """ Appends a batch of records to the active audit file as a single gzip member.
+
+    @note This method runs in the writer thread.
+
+    @param record_batch  A list of (timestamp, serialized audit record) tuples.
+    """
+
+    try:
+      # Compress the records
+      compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+      compressed_batch = compressor.compress("\n".join([record_line for timestamp, record_line in record_batch])+"\n")
+      compressed_batch += compressor.flush()
+
+      # Append the batch to the active file
+      with open(os.path.join(self.log_directory, ACTIVE_FILE_NAME), 'ab') as active_file:
+        active_file.write(compressed_batch)
+        active_file_size = active_file.tell()
+    except Exception as write_error:
+      self.write_errors += 1
+      logging.error("A batch of "+str(len(record_batch))+" command audit records could not be written: "+
+                    str(write_error))
+      return
+
+    self.records_written += len(record_batch)
+    self.batches_written += 1
+    batch_start = record_batch[0][0]
+    batch_end = record_batch[-1][0]
+    if self._active_file_range is None:
+      self._active_file_range = (batch_start, batch_end)
+    else:
+      self._active_file_range = (min(self._active_file_range[0], batch_start),
+                                 max(self._active_file_range[1], batch_end))
+
+    if active_file_size >= self.max_file_size:
+      self._archive_active_file()
+
+  def _archive_active_file(self):
+    """ Renames the active audit file so that its name contains the time range of its records, and deletes the oldest
+    archives if there are too many.
+
+    @note This method runs in the writer thread.
+    """
+
+    active_file_path = os.path.join(self.log_directory, ACTIVE_FILE_NAME)
+    if not os.path.exists(active_file_path):
+      return
+
+    try:
+      # Determine the time range of the file's records (scanning the file if it was left over from a previous run)
+      if self._active_file_range is None:
+        record_times = [audit_record['timestamp'] for audit_record in read_audit_file(active_file_path)]
+        if not record_times:
+          os.remove(active_file_path)
+          return
+        self._active_file_range = (min(record_times), max(record_times))
+
+      range_start, range_end = int(self._active_file_range[0]), int(self._active_file_range[1]) + 1
+      archive_name = "command_audit.%d-%d.log.gz" % (range_start, range_end)
+      archive_index = 0
+      while os.path.exists(os.path.join(self.log_directory, archive_name)):
+        archive_index += 1
+        archive_name = "command_audit.%d-%d.%d.log.gz" % (range_start, range_end, archive_index)
+      os.rename(active_file_path, os.path.join(self.log_directory, archive_name))
+      self._active_file_range = None
+      self.files_archived += 1
+
+      # Delete the oldest archives
+      archived_files = list_archived_files(self.log_directory)
+      for expired_archive in archived_files[:max(len(archived_files) - self.max_archived_files, 0)]:
+        os.remove(expired_archive[2])
+    except Exception as archive_error:
+      self.write_errors += 1
+      logging.error("The active command audit file could not be archived: "+str(archive_error))
+
+def list_archived_files(log_directory):
+  """ Lists the archived audit files in the specified directory.
+
+  @param log_directory  The audit log directory.
+  @return Returns a list of (start time, end time, path) tuples, sorted by start time, for each archived audit file.
+  """
+
+  archived_files = []
+  for file_name in os.listdir(log_directory):
+    name_match = ARCHIVE_FILE_PATTERN.match(file_name)
+    if name_match:
+      archived_files.append((int(name_match.group(1)), int(name_match.group(2)), int(name_match.group(3) or 0),
+                             os.path.join(log_directory, file_name)))
+  archived_files.sort()
+
+  return [(range_start, range_end, file_path) for range_start, range_end, archive_index, file_path in archived_files]
+
+def read_audit_file(file_path):
+  """ Reads the records stored in an audit file.
+
+  @note If the file ends with a partially written batch (e.g. because the hardware manager was stopped while writing
+        it), the incomplete records will be skipped.
+
+  @param file_path  The path to the audit file.
+  @return Returns a generator that yields each audit record dictionary in the file.
+  """
+
+  with open(file_path, 'rb') as audit_file:
+    compressed_data = audit_file.read()
+
+  # Decompress each gzip member (batch)
+  while compressed_data:
+    decompressor = zlib.decompressobj(31)
+    try:
+      batch_data = decompressor.decompress(compressed_data)
+    except zlib.error as read_error:
+      logging.error("The command audit file '"+file_path+"' is corrupt: "+str(read_error))
+      return
+    compressed_data = decompressor.unused_data
+
+    # Skip incomplete batches
+    if not compressed_data and not batch_data.endswith("\n"):
+      batch_data = batch_data[:batch_data.rfind("\n")+1]
+
+    for record_line in batch_data.splitlines():
+      yield json.loads(record_line)
+
+def query_audit_log(log_directory, start_time = None, end_time = None, user_id = None, destination = None,
+                    command_name = None):
+  """ Loads the audit records that match the specified filters.
+
+  Archived audit files whose time ranges don't overlap the requested time range are skipped without being opened.
+
+  @param log_directory  The audit log directory.
+  @param start_time     If set, only records for commands that finished at or after this time (UNIX timestamp) will be
+                        returned.
+  @param end_time       If set, only records for commands that finished before this time will be returned.
+  @param user_id        If set, only records for commands submitted by this user will be returned.
+  @param destination    If set, only records for commands sent to this (full) destination will be returned.
+  @param command_name   If set, only records for this command will be returned.
+  @return Returns a generator that yields each matching audit record dictionary (oldest files first).
+  """
+
+  audit_files = []
+  for range_start, range_end, file_path in list_archived_files(log_directory):
+    if (start_time is None or range_end >= start_time) and (end_time is None or range_start < end_time):
+      audit_files.append(file_path)
+  if os.path.exists(os.path.join(log_directory, ACTIVE_FILE_NAME)):
+    audit_files.append(os.path.join(log_directory, ACTIVE_FILE_NAME))
+
+  for file_path in audit_files:
+    for audit_record in read_audit_file(file_path):
+      if start_time is not None and audit_record['timestamp'] < start_time:
+        continue
+      if end_time is not None and audit_record['timestamp'] >= end_time:
+        continue
+      if user_id is not None and audit_record['user_id'] != user_id:
+        continue
+      if destination is not None and audit_record['destination'] != destination:
+        continue
+      if command_name is not None and audit_record['command'] != command_name:
+        continue
+
+      yield audit_record
+
+def query_tool(arguments = None):
+  """ Prints the audit records that match the filters given on the command line (one JSON record per line).
+
+  This is the entry point of the mercury2_audit script.
+
+  @param arguments  The command line arguments. If None, sys.argv will be used.
+  """
+
+  from hwm.core.configuration import Configuration
+
+  argument_parser = argparse.ArgumentParser(description = "Searches the Mercury2 hardware manager command audit log.")
+  argument_parser.add_argument('--directory', default = Configuration.log_directory+"audit/",
+                               help = "The audit log directory.")
+  argument_parser.add_argument('--start', type = float, help = "Only show commands that finished at or after this "+
+                               "time (UNIX timestamp).")
+  argument_parser.add_argument('--end', type = float, help = "Only show commands that finished before this time.")
+  argument_parser.add_argument('--user', help = "Only show commands submitted by this user ID.")
+  argument_parser.add_argument('--destination', help = "Only show commands sent to this destination.")
+  argument_parser.add_argument('--command', help = "Only show this command.")
+  parsed_arguments = argument_parser.parse_args(arguments)
+
+  for audit_record in query_audit_log(parsed_arguments.directory, parsed_arguments.start, parsed_arguments.end,
+                                      parsed_arguments.user, parsed_arguments.destination, parsed_arguments.command):
+    sys.stdout.write(json.dumps(audit_record, sort_keys = True)+"\n")
@@ -0,0 +1,152 @@
+""" @package hwm.command.cache
+Caches the results of read-only commands.
+
+This module contains a class that caches the results of commands that have been marked as cacheable in their meta-data
+(see the 'cache_ttl' argument of hwm.command.metadata.build_metadata_dict). Cached results are served until their TTL
+expires, and concurrent requests for the same command are collapsed into a single command execution (i.e. only one
+request per command and parameter set is ever passed to the command handler at a time).
+"""
+
+# Import required modules
+import time, json, copy, collections
+from twisted.internet import defer
+
+class CommandResultCache:
+  """ A least recently used cache for the results of read-only commands.
+
+  Results are keyed by the command's destination, name, and parameters. Only successful results are cached; if a command
+  fails, every request waiting on it will receive the failure and the next request will execute the command again.
+  """
+
+  def __init__(self, max_entries = 256):
+    """ Sets up the result cache.
+
+    @param max_entries  The maximum number of command results to cache. Once full, the least recently used results will
+                        be evicted.
+    """
+
+    self.max_entries = max_entries
+    self._results = collections.OrderedDict()
+    self._in_flight = {}
+
+    # Cache statistics
+    self._hits = 0
+    self._misses = 0
+    self._coalesced = 0
+    self._evictions = 0
+
+  def load(self, command_route, active_command, execute_command):
+    """ Loads the results of the specified command, executing it only if required.
+
+    @param command_route    The CommandRoute of the command. Its 'cache_ttl' attribute sets how long (in seconds) the
+                            command's results may be served from the cache.
+    @param active_command   The validated Command being executed.
+    @param execute_command  A function that executes the command and returns a deferred that will be fired with its
+                            results. Only called if the results aren't cached and the command isn't already running.
+    @return Returns a deferred that will be fired with the results of the command. Each caller receives its own copy of
+            the results.
+    """
+
+    cache_key = self._build_key(command_route, active_command)
+
+    # Check for a valid cached result
+    cached_result = self._results.get(cache_key, None)
+    if cached_result is not None:
+      command_results, expires_at = cached_result
+      if time.time() < expires_at:
+        del self._results[cache_key]
+        self._results[cache_key] = cached_result
+        self._hits += 1
+        return defer.succeed(copy.deepcopy(command_results))
+
+      del self._results[cache_key]
+
+    # Wait for the identical command that's already running, if there is one
+    waiting_deferreds = self._in_flight.get(cache_key, None)
+    if waiting_deferreds is not None:
+      self._coalesced += 1
+      result_deferred = defer.Deferred()
+      waiting_deferreds.append(result_deferred)
+      return result_deferred
+
+    # Execute the command
+    self._misses += 1
+    result_deferred = defer.Deferred()
+    self._in_flight[cache_key] = [result_deferred]
+    command_deferred = defer.maybeDeferred(execute_command)
+    command_deferred.addCallbacks(self._command_succeeded, self._command_failed,
+                                  callbackArgs = (cache_key, command_route.cache_ttl),
+                                  errbackArgs = (cache_key,))
+
+    return result_deferred
+
+  def invalidate(self, full_destination = None):
+    """ Removes cached results.
+
+    @param full_destination  If set, only the results of commands addressed to this destination will be removed.
+                             Otherwise, the entire cache will be cleared.
+    """
+
+    if full_destination is None:
+      self._results.clear()
+    else:
+      for cache_key in self._results.keys():
+        if cache_key[0] == full_destination:
+          del self._results[cache_key]
+
+  def get_stats(self):
+    """ Returns statistics about the result cache.
+
+    @return Returns a dictionary containing the number of cached results, the number of cache hits and misses, the
+            number of requests that were collapsed into an already running command, and the number of evicted results.
+    """
+
+    return {
+      'entries': len(self._results),
+      'in_flight': len(self._in_flight),
+      'hits': self._hits,
+      'misses': self._misses,
+      'coalesced': self._coalesced,
+      'evictions': self._evictions
+    }
+
+  def _command_succeeded(self, command_results, cache_key, cache_ttl):
+    """ Caches the results of a command and passes them to every request waiting on it.
+
+    @param command_results  The results returned by the command handler.
+    @param cache_key        The cache key of the command.
+    @param cache_ttl        How long (in seconds) the results may be served from the cache.
+    """
+
+    self._results[cache_key] = (command_results, time.time()+cache_ttl)
+    while len(self._results) > self.max_entries:
+      self._results.popitem(last = False)
+      self._evictions += 1
+
+    for waiting_deferred in self._in_flight.pop(cache_key):
+      waiting_deferred.callback(copy.deepcopy(command_results))
+
+  def _command_failed(self, failure, cache_key):
+    """ Passes a command failure to every request waiting on the command.
+
+    @param failure    A Failure describing the command error.
+    @param cache_key  The cache key of the command.
+    """
+
+    for waiting_deferred in self._in_flight.pop(cache_key):
+      waiting_deferred.errback(failure)
+
+  def _build_key(self, command_route, active_command):
+    """ Builds the cache key for a command.
+
+    @param command_route   The CommandRoute of the command.
+    @param active_command  The Command to build the key for.
+    @return Returns a tuple that identifies the command's destination, name, and parameters.
+    """
+
+    if active_command.parameters:
+      parameter_key = json.dumps(active_command.parameters, sort_keys = True)
+    else:
+      parameter_key = None
+
+    return (command_route.full_destination, command_route.command, parameter_key)
@@ -0,0 +1,99 @@
+""" @package hwm.command.catalog
+Maintains a versioned catalog of the meta-data for every available command.
+
+This module contains a class that assembles the meta-data of every command offered by the system and device command
+handlers into a catalog that can be sent to the user interface (which uses it to build its command forms). The catalog
+is built from the command parser's routing table (whose routes load each command's meta-data once), so it only has to
+be rebuilt when the routing table is rebuilt (i.e. when the loaded pipelines or devices change).
+
+The catalog is divided into sections: one for the system commands and one for each pipeline. Each section, and the
+catalog as a whole, is identified by a version string derived from its contents. Clients can pass the version of the
+catalog (or section) that they already have to skip downloading it again if it hasn't changed.
+"""
+
+# Import required modules
+import json, hashlib
+
+class MetadataCatalog:
+  """ A versioned catalog of command meta-data.
+  """
+
+  # The section containing the system command meta-data
+  SYSTEM_SECTION = 'system'
+
+  def __init__(self):
+    """ Sets up the empty catalog.
+    """
+
+    self._sections = {}
+    self.version = self._hash_contents({})
+
+  def build(self, routing_table):
+    """ Rebuilds the catalog from the provided routing table.
+
+    @note Commands that don't provide any meta-data aren't included in the catalog.
+
+    @param routing_table  The RoutingTable containing the routes of every available command.
+    @return Returns the new version of the catalog.
+    """
+
+    # Group the command meta-data by section and destination
+    section_commands = {}
+    for command_route in routing_table.routes():
+      if command_route.metadata is None:
+        continue
+
+      section_id = command_route.pipeline_id if command_route.device_command else self.SYSTEM_SECTION
+      destination_commands = section_commands.setdefault(section_id, {}).setdefault(command_route.full_destination, {})
+      destination_commands[command_route.command] = command_route.metadata
+
+    # Version each section, and then the catalog as a whole
+    self._sections = {}
+    section_versions = {}
+    for section_id, commands in section_commands.iteritems():
+      section_version = self._hash_contents(commands)
+      self._sections[section_id] = {'version': section_version, 'commands': commands}
+      section_versions[section_id] = section_version
+    self.version = self._hash_contents(section_versions)
+
+    return self.version
+
+  def get_catalog(self, section_id = None, client_version = None):
+    """ Loads the catalog, or one of its sections, if the client doesn't already have it.
+
+    @throw Throws CatalogSectionNotFound if the requested section doesn't exist.
+
+    @param section_id      The ID of the catalog section to load ('system' or a pipeline ID). If None, the entire
+                           catalog will be loaded.
+    @param client_version  The version of the catalog (or section) that the client already has, if any.
+    @return Returns a dictionary containing the current 'version' of the catalog (or section) and a 'modified' flag. If
+            the client's version doesn't match the current version, the catalog's sections (or the section's commands)
+            will be included in the 'sections' (or 'commands') field.
+    """
+
+    if section_id is None:
+      catalog_version = self.version
+      catalog_contents = ('sections', self._sections)
+    else:
+      if section_id not in self._sections:
+        raise CatalogSectionNotFound("The requested meta-data catalog section does not exist: "+str(section_id))
+
+      catalog_version = self._sections[section_id]['version']
+      catalog_contents = ('commands', self._sections[section_id]['commands'])
+
+    if client_version is not None and client_version == catalog_version:
+      return {'version': catalog_version, 'modified': False}
+
+    return {'version': catalog_version, 'modified': True, catalog_contents[0]: catalog_contents[1]}
+
+  def _hash_contents(self, contents):
+    """ Generates a version string for some catalog contents.
+
+    @param contents  The JSON serializable contents to version.
+    @return Returns a version string that only changes when the contents do.
+    """
+
+    return hashlib.sha1(json.dumps(contents, sort_keys = True)).hexdigest()
+
+class CatalogSectionNotFound(Exception):
+  pass
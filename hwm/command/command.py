@@ -32,6 +32,9 @@ schema = {
   }
 }
 
+# Compile the command schema validator once (it is shared by every Command instance)
+command_validator = jsonschema.Draft3Validator(schema)
+
 class Command:
   """ Used to represent user commands.
   
@@ -70,6 +73,9 @@ class Command:
     self.pipeline = None
     self.full_destination = None
     self.parameters = {}
+
+    # The stage timings of the command, recorded by the command parser (see hwm.command.stats)
+    self.timing = None
   
   def validate_command(self):
     """ Validates the submitted command and saves it in a usable form.
@@ -104,7 +110,6 @@ class Command:
       self.command_dict = self.command_raw
     
     # Validate the command schema
-    command_validator = jsonschema.Draft3Validator(schema)
     try:
       command_validator.validate(self.command_dict)
       self.valid = True
@@ -118,6 +123,19 @@ class Command:
     
     return defer.succeed(True)
   
+  def skip_validation(self):
+    """ Marks the command as valid without checking it against the command schema.
+
+    This method is used by commands that are generated by the hardware manager itself (see 
+    CommandParser.prepare_command), which are always constructed as dictionaries that conform to the command schema.
+    
+    @note This method sets the same convenience attributes as validate_command.
+    """
+
+    self.command_dict = self.command_raw
+    self.valid = True
+    self._populate_command_attributes()
+
   def build_command_response(self, success, command_results = {}):
     """ Constructs a dictionary to encapsulate the command results.
     
@@ -1,11 +1,14 @@
 """ @package hwm.command.connection
-Contains a resource for processing commands.
+Contains a resource and a protocol for processing commands.
 
-This module contains a Twisted resource for responding to station commands received over the network.
+This module contains a Twisted resource for responding to station commands received over the network (one command or 
+batch per HTTP request), as well as a protocol that accepts commands over a persistent WebSocket connection (the command
+channel).
 """
 
 # Import required modules
-import json
+import json, logging
+from twisted.internet.protocol import Protocol, Factory
 from twisted.web.resource import Resource
 from twisted.web.http import HTTPClient, HTTPFactory
 from twisted.web.server import NOT_DONE_YET
@@ -13,7 +16,11 @@ from twisted.web.server import NOT_DONE_YET
 class CommandResource(Resource):
   """ Handles commands received over the network.
   
-  This Resource handles commands received over the hardware manager's command connection.
+  This Resource handles commands received over the hardware manager's command connection. The request body can either
+  contain a single command or a JSON array of commands (a batch). Batches are executed in the mode specified by the
+  'mode' query argument (see CommandParser.parse_command_batch()), which defaults to sequential execution. Single 
+  commands can be executed in the background by setting the 'job' query argument to 'true', in which case the response
+  will contain the command's job ID instead of its results (see CommandParser.parse_command_job()).
   """
   
   # Set the resource attributes
@@ -39,16 +46,42 @@ class CommandResource(Resource):
     """
     
     # Store the user's ID from the SSL certificate
-    user_id = None
-    user_certificate = self.transport.getPeerCertificate()
-    if user_certificate:
-      user_id = user_certificate.get_subject().commonName.decode()
+    user_id = self._load_user_id(request)
     
-    # Pass the request body to the parser
-    response_deferred = self.command_parser.parse_command(request.content.read(), user_id=user_id)
+    # Check if the request contains a batch of commands
+    raw_command = request.content.read()
+    try:
+      parsed_command = json.loads(raw_command)
+    except ValueError:
+      # Let the parser generate the appropriate error response
+      parsed_command = raw_command
+
+    # Pass the command (or batch of commands) to the parser
+    if isinstance(parsed_command, list):
+      batch_mode = request.args.get('mode', [self.command_parser.BATCH_SEQUENTIAL])[0]
+      response_deferred = self.command_parser.parse_command_batch(parsed_command, user_id=user_id, mode=batch_mode)
+    elif request.args.get('job', ['false'])[0].lower() in ('true', '1'):
+      response_deferred = self.command_parser.parse_command_job(parsed_command, user_id=user_id)
+    elif isinstance(parsed_command, dict):
+      response_deferred = self.command_parser.parse_command(parsed_command, user_id=user_id)
+    else:
+      response_deferred = self.command_parser.parse_command(raw_command, user_id=user_id)
     response_deferred.addBoth(self._command_response_ready, request)
     
     return NOT_DONE_YET
+
+  def _load_user_id(self, request):
+    """ Loads the ID of the user that submitted the request from their SSL certificate.
+
+    @param request  The request object for the submitted command.
+    @return Returns the user's ID or None if the user didn't provide a certificate.
+    """
+
+    user_certificate = request.transport.getPeerCertificate()
+    if user_certificate:
+      return user_certificate.get_subject().commonName.decode()
+
+    return None
   
   def _command_response_ready(self, command_response, request):
     """ Writes the command response back to the originating request.
@@ -56,16 +89,16 @@ class CommandResource(Resource):
     This callback writes the response of a command back to the network via the request that generated it. It handles 
     both successful and failed command responses.
     
-    @param command_response  The results of the command. If the command was successful, this will be a dictionary
-                             containing the command response. If the command failed, this will be a Failure object
-                             containing the command response encapsulated in a CommandError exception.
+    @param command_response  The results of the command (or command batch). If the command was successful, this will 
+                             be a dictionary containing the command response. If the command failed, this will be a 
+                             Failure object containing the command response encapsulated in a CommandFailed exception.
     @param request           The original HTTP request for the connection.
     """
 
     # Extract the command response
     try:
-      # If the command failed, the response will be wrapped in a Failure (and in turn a CommandError) object
-      response_dict = command_response.value.response
+      # If the command failed, the response will be wrapped in a Failure (and in turn a CommandFailed) object
+      response_dict = command_response.value.results
     except AttributeError:
       # If the command was successful, command_response will just consist of a dictonary containing the response
       response_dict = command_response
@@ -75,3 +108,161 @@ class CommandResource(Resource):
     
     # Close the request
     request.finish()
+
+class CommandChannel(Protocol):
+  """ Handles commands received over a persistent command channel connection.
+
+  This Protocol accepts commands over a long-lived connection (typically a WebSocket, see txws), which avoids the cost of
+  setting up a new HTTPS request for every command. Each message sent by the client must be a JSON object containing a
+  client generated 'tag' and the 'command' to execute:
+
+    {"tag": 1, "command": {"command": "station_time", "destination": "system"}}
+
+  Messages may also set 'job' to true to execute the command in job mode (see CommandParser.parse_command_job()).
+
+  Many commands may be in flight on the same connection at once. Each response is sent as soon as its command finishes
+  (so responses may arrive out of order) and contains the tag of the command that it belongs to:
+
+    {"tag": 1, "response": {"status": "okay", "result": {"timestamp": 1234567890}, ...}}
+
+  @note The user's ID is loaded from the client's TLS certificate when the first message is received (by which point the
+        TLS handshake must have completed).
+  """
+
+  def __init__(self, command_parser, max_in_flight = 64):
+    """ Sets up the command channel protocol.
+
+    @param command_parser  A reference to the previously initialized command parser.
+    @param max_in_flight   The maximum number of commands that may be executing at once for the connection. Commands 
+                           received while this limit is reached will be rejected.
+    """
+
+    self.command_parser = command_parser
+    self.max_in_flight = max_in_flight
+    self.user_id = None
+    self.commands_in_flight = 0
+    self._user_id_loaded = False
+    self._connected = False
+
+  def connectionMade(self):
+    """ Marks the channel as connected.
+    """
+
+    self._connected = True
+
+  def connectionLost(self, reason = None):
+    """ Marks the channel as disconnected. The responses of any commands that are still running will be dropped.
+    """
+
+    self._connected = False
+
+  def dataReceived(self, data):
+    """ Executes a command message received from the client.
+
+    @param data  A single message from the client (txws passes each WebSocket message to this method separately).
+    """
+
+    # Load the user's ID from their certificate
+    if not self._user_id_loaded:
+      self.user_id = self._load_user_id()
+      self._user_id_loaded = True
+
+    # Parse the message
+    try:
+      message = json.loads(data)
+    except ValueError:
+      self._write_error(None, "The submitted message couldn't be parsed as a JSON string.")
+      return
+    if not isinstance(message, dict) or 'tag' not in message or 'command' not in message:
+      self._write_error(message.get('tag', None) if isinstance(message, dict) else None,
+                        "The submitted message must be an object containing a 'tag' and a 'command'.")
+      return
+
+    # Make sure the connection isn't overloaded
+    if self.commands_in_flight >= self.max_in_flight:
+      self._write_error(message['tag'], "Too many commands are already executing on this connection.")
+      return
+
+    # Execute the command
+    self.commands_in_flight += 1
+    if message.get('job', False):
+      response_deferred = self.command_parser.parse_command_job(message['command'], user_id = self.user_id)
+    else:
+      response_deferred = self.command_parser.parse_command(message['command'], user_id = self.user_id)
+    response_deferred.addBoth(self._command_response_ready, message['tag'])
+
+  def _load_user_id(self):
+    """ Loads the ID of the user from their TLS certificate.
+
+    @return Returns the user's ID or None if the user didn't provide a certificate.
+    """
+
+    user_certificate = self.transport.getPeerCertificate()
+    if user_certificate:
+      return user_certificate.get_subject().commonName.decode()
+
+    return None
+
+  def _command_response_ready(self, command_response, tag):
+    """ Writes a tagged command response back to the client.
+
+    @param command_response  The results of the command. Either a dictionary containing the command response or a 
+                             Failure wrapping a CommandFailed exception.
+    @param tag               The tag of the command's message.
+    """
+
+    self.commands_in_flight -= 1
+
+    # Extract the command response
+    try:
+      response_dict = command_response.value.results
+    except AttributeError:
+      response_dict = command_response
+
+    self._write_message({'tag': tag, 'response': response_dict['response']})
+
+  def _write_error(self, tag, error_message):
+    """ Writes an error response for a message that couldn't be executed.
+
+    @param tag            The tag of the message, or None if it couldn't be determined.
+    @param error_message  A message describing the error.
+    """
+
+    logging.error("A command channel message was rejected: "+error_message)
+    self._write_message({'tag': tag, 'response': {'status': 'error', 'result': {'error_message': error_message}}})
+
+  def _write_message(self, message):
+    """ Sends a message to the client, if it's still connected.
+
+    @param message  The message dictionary to send.
+    """
+
+    if self._connected:
+      self.transport.write(json.dumps(message))
+
+class CommandChannelFactory(Factory):
+  """ Constructs CommandChannel protocol instances for command channel connections.
+  """
+
+  # Setup some factory attributes
+  protocol = CommandChannel
+
+  def __init__(self, command_parser):
+    """ Sets up the command channel factory.
+
+    @param command_parser  A reference to the previously initialized command parser.
+    """
+
+    self.command_parser = command_parser
+
+  def buildProtocol(self, addr):
+    """ Constructs a new CommandChannel protocol.
+
+    @param addr  An object that implements twisted.internet.interfaces.IAddress.
+    @return Returns a new instance of the CommandChannel class representing a new command channel connection.
+    """
+
+    command_channel = self.protocol(self.command_parser)
+    command_channel.factory = self
+
+    return command_channel
@@ -5,14 +5,26 @@ Contains a class that handles various system commands received by the ground sta
 # Import required modules
 import time
 from hwm.command.metadata import *
-from hwm.command import command
+from hwm.command import command, catalog
 from hwm.command.handlers import handler
+from hwm.network import http_client
 
 class SystemCommandHandler(handler.CommandHandler):
   """ A command handler that responds to system commands.
   
   This class provides methods that handle various system level commands.
   """
+
+  def __init__(self, command_handler_name):
+    """ Sets up the system command handler.
+
+    @note The command_parser attribute is set by the CommandParser that the handler is registered with.
+
+    @param command_handler_name  The name of the command handler (the destination for this handler's commands).
+    """
+
+    super(SystemCommandHandler, self).__init__(command_handler_name)
+    self.command_parser = None
   
   def command_station_time(self, active_command):
     """ Returns the current ground station time.
@@ -34,4 +46,258 @@ class SystemCommandHandler(handler.CommandHandler):
     # The station_command does not take any parameters
     command_parameters = []
 
-    return build_metadata_dict(command_parameters, 'station_time', self.name, requires_active_session = False)
+    return build_metadata_dict(command_parameters, 'station_time', self.name, requires_active_session = False,
+                               cache_ttl = 0.5)
+
+  def command_command_stats(self, active_command):
+    """ Returns statistics about the commands executed by the hardware manager.
+
+    @note The statistics are returned in the response 'result' dictionary:
+          * commands - The per-stage latency histograms and error counts for each destination and command (see 
+                       hwm.command.stats.CommandStats.get_stats())
+          * queues - The statistics for each device command queue
+          * cache - The command result cache statistics
+          * internal_commands - Counters describing the execution of prepared (internal) commands
+          * jobs - The command job statistics
+          * scheduler - The command scheduler statistics (including how late scheduled commands were executed)
+          * audit - The command audit log statistics (None if the audit log is disabled)
+          * permissions - The permission manager statistics (including cache hits, misses, evictions, and refreshes)
+          * http - The shared HTTP client statistics (including how many connections were opened)
+          * tls - The TLS handshake statistics of the hardware manager's listeners (full and resumed handshakes), or
+                  None if they aren't available
+          * sessions - The session coordinator statistics (including how late sessions were started and stopped), or
+                       None if they aren't available
+
+    @throw Throws CommandError if the command handler isn't registered with a command parser.
+
+    @param active_command  The Command object associated with the executing command. If the 'reset' parameter is set,
+                           the command latency statistics will be cleared after they are returned.
+    @return Returns a dictionary containing the command statistics.
+    """
+
+    if self.command_parser is None:
+      raise command.CommandError("The command statistics are not available.")
+
+    command_statistics = {
+      'commands': self.command_parser.command_stats.get_stats(),
+      'queues': self.command_parser.command_queues.get_queue_stats(),
+      'cache': self.command_parser.result_cache.get_stats(),
+      'internal_commands': dict(self.command_parser.internal_command_counters),
+      'jobs': self.command_parser.command_jobs.get_stats(),
+      'scheduler': self.command_parser.command_scheduler.get_stats(),
+      'audit': self.command_parser.audit_log.get_stats() if self.command_parser.audit_log is not None else None,
+      'permissions': self.command_parser.permission_manager.get_stats(),
+      'http': http_client.get_client().get_stats(),
+      'tls': (self.command_parser.tls_context_factory.get_stats() 
+              if self.command_parser.tls_context_factory is not None else None),
+      'sessions': (self.command_parser.session_coordinator.get_stats()
+                   if self.command_parser.session_coordinator is not None else None)
+    }
+
+    if active_command.parameters is not None and active_command.parameters.get('reset', False):
+      self.command_parser.command_stats.reset()
+
+    return command_statistics
+
+  def settings_command_stats(self):
+    """ Returns a dictionary containing meta-data about the command_stats command.
+
+    @return Returns a standard dictionary containing meta-data about the command.
+    """
+
+    command_parameters = [
+      {
+        "type": "boolean",
+        "required": False,
+        "title": "reset",
+        "description": "Clear the command latency statistics after they are returned."
+      }
+    ]
+
+    return build_metadata_dict(command_parameters, 'command_stats', self.name, requires_active_session = False,
+                               dangerous = False)
+
+  def command_metadata_catalog(self, active_command):
+    """ Returns the meta-data catalog, which contains the meta-data for every command offered by the hardware manager.
+
+    If the client includes the version of the catalog (or catalog section) that it already has, and it matches the 
+    current version, the catalog contents will be omitted from the response.
+
+    @note The catalog is returned in the response 'result' dictionary (see MetadataCatalog.get_catalog()).
+
+    @throw Throws CommandError if the command handler isn't registered with a command parser or if the requested 
+           catalog section doesn't exist.
+
+    @param active_command  The Command object associated with the executing command. May contain the optional 'section'
+                           (the ID of a single pipeline, or 'system') and 'version' parameters.
+    @return Returns a dictionary containing the catalog's version and, if modified, its contents.
+    """
+
+    if self.command_parser is None:
+      raise command.CommandError("The command meta-data catalog is not available.")
+
+    command_parameters = active_command.parameters if active_command.parameters is not None else {}
+    try:
+      return self.command_parser.metadata_catalog.get_catalog(command_parameters.get('section', None),
+                                                              command_parameters.get('version', None))
+    except catalog.CatalogSectionNotFound as catalog_error:
+      raise command.CommandError(str(catalog_error), {'section': command_parameters.get('section', None)})
+
+  def settings_metadata_catalog(self):
+    """ Returns a dictionary containing meta-data about the metadata_catalog command.
+
+    @return Returns a standard dictionary containing meta-data about the command.
+    """
+
+    command_parameters = [
+      {
+        "type": "string",
+        "required": False,
+        "title": "section",
+        "description": "The ID of the pipeline (or 'system') to load the command meta-data for. If omitted, the meta-"+
+                       "data for every command will be loaded."
+      },
+      {
+        "type": "string",
+        "required": False,
+        "title": "version",
+        "description": "The version of the catalog (or section) that you already have."
+      }
+    ]
+
+    return build_metadata_dict(command_parameters, 'metadata_catalog', self.name, requires_active_session = False,
+                               dangerous = False)
+
+  def command_job_status(self, active_command):
+    """ Returns the status of a command job.
+
+    @note The job's status is returned in the response 'result' dictionary (see Job.get_status()). Once the job has 
+          finished, the job's command response will be available in the 'response' field. The results of scheduled 
+          commands can also be loaded by using their schedule IDs as job IDs.
+
+    @throw Throws CommandError if the command handler isn't registered with a command parser or if the job doesn't 
+           exist, has been discarded, or belongs to another user.
+
+    @param active_command  The Command object associated with the executing command. Contains the 'job_id' parameter.
+    @return Returns a dictionary containing the status of the job.
+    """
+
+    if self.command_parser is None:
+      raise command.CommandError("Command jobs are not available.")
+
+    job_id = active_command.parameters.get('job_id', None) if active_command.parameters is not None else None
+    requested_job = self.command_parser.command_jobs.get_job(job_id, active_command.user_id,
+                                                             ignore_owner = active_command.kernel_mode)
+    if requested_job is None:
+      requested_job = self.command_parser.command_scheduler.get_result(job_id, active_command.user_id,
+                                                                       ignore_owner = active_command.kernel_mode)
+    if requested_job is None:
+      raise command.CommandError("The specified job could not be found.", {'job_id': job_id})
+
+    return requested_job.get_status()
+
+  def settings_job_status(self):
+    """ Returns a dictionary containing meta-data about the job_status command.
+
+    @return Returns a standard dictionary containing meta-data about the command.
+    """
+
+    command_parameters = [
+      {
+        "type": "string",
+        "required": True,
+        "title": "job_id",
+        "description": "The ID of the job to check on."
+      }
+    ]
+
+    return build_metadata_dict(command_parameters, 'job_status', self.name, requires_active_session = False,
+                               dangerous = False)
+
+  def command_schedule_commands(self, active_command):
+    """ Schedules a group of commands to be executed at specific times (e.g. the points of an antenna trajectory).
+
+    Only commands whose meta-data marks them as 'schedulable' may be scheduled. All of the commands are validated and 
+    authorized before any of them are scheduled; if any of them are invalid, none of them will be scheduled. Commands 
+    that belong to a session will be cancelled if the session ends before they're executed.
+
+    @note The schedule IDs of the new commands are returned in the 'schedule_ids' field of the response 'result' 
+          dictionary, in the same order as the submitted commands. Once a scheduled command has been executed, its 
+          results can be loaded with the 'job_status' command using its schedule ID as the job ID.
+
+    @throw Throws CommandError if the command handler isn't registered with a command parser or if any of the commands
+           can't be scheduled.
+
+    @param active_command  The Command object associated with the executing command. Contains the 'commands' parameter, 
+                           a list of objects that each contain a 'command' and its 'execute_at' time (UNIX timestamp).
+    @return Returns a deferred that will be fired with a dictionary containing the schedule IDs of the commands.
+    """
+
+    if self.command_parser is None:
+      raise command.CommandError("The command scheduler is not available.")
+
+    # The command meta-data format can't describe lists, so the 'commands' parameter is validated by the parser
+    scheduled_commands = active_command.parameters.get('commands', None) if active_command.parameters is not None \
+                         else None
+    schedule_deferred = self.command_parser.schedule_commands(scheduled_commands, user_id = active_command.user_id,
+                                                              kernel_mode = active_command.kernel_mode)
+    schedule_deferred.addCallback(lambda schedule_ids: {'schedule_ids': schedule_ids})
+
+    return schedule_deferred
+
+  def settings_schedule_commands(self):
+    """ Returns a dictionary containing meta-data about the schedule_commands command.
+
+    @note The 'commands' parameter isn't included in the meta-data because its type (a list of commands) can't be 
+          described by the command meta-data format.
+
+    @return Returns a standard dictionary containing meta-data about the command.
+    """
+
+    command_parameters = []
+
+    return build_metadata_dict(command_parameters, 'schedule_commands', self.name, requires_active_session = False)
+
+  def command_cancel_scheduled_command(self, active_command):
+    """ Cancels a command that was scheduled with the 'schedule_commands' command.
+
+    @note The cancelled command is described in the response 'result' dictionary (see ScheduledCommand.get_status()).
+
+    @throw Throws CommandError if the command handler isn't registered with a command parser or if the scheduled command
+           doesn't exist, has already been executed, or belongs to another user.
+
+    @param active_command  The Command object associated with the executing command. Contains the 'schedule_id' 
+                           parameter.
+    @return Returns a dictionary describing the cancelled command.
+    """
+
+    if self.command_parser is None:
+      raise command.CommandError("The command scheduler is not available.")
+
+    schedule_id = active_command.parameters.get('schedule_id', None) if active_command.parameters is not None else None
+    scheduled_command = self.command_parser.command_scheduler.get_command(schedule_id, active_command.user_id,
+                                                                          ignore_owner = active_command.kernel_mode)
+    if scheduled_command is None:
+      raise command.CommandError("The specified scheduled command could not be found.", {'schedule_id': schedule_id})
+
+    self.command_parser.command_scheduler.cancel(schedule_id)
+
+    return scheduled_command.get_status()
+
+  def settings_cancel_scheduled_command(self):
+    """ Returns a dictionary containing meta-data about the cancel_scheduled_command command.
+
+    @return Returns a standard dictionary containing meta-data about the command.
+    """
+
+    command_parameters = [
+      {
+        "type": "string",
+        "required": True,
+        "title": "schedule_id",
+        "description": "The schedule ID of the command to cancel."
+      }
+    ]
+
+    return build_metadata_dict(command_parameters, 'cancel_scheduled_command', self.name,
+                               requires_active_session = False, dangerous = False)
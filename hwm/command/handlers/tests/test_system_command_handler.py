@@ -2,6 +2,7 @@
 import logging, time, json
 from pkg_resources import Requirement, resource_filename
 from twisted.trial import unittest
+from twisted.internet.defer import inlineCallbacks
 from mock import MagicMock
 from twisted.test import proto_helpers
 from hwm.core.configuration import *
@@ -60,3 +61,39 @@ class TestSystemCommandHandler(unittest.TestCase):
     test_deferred.addCallback(parsing_complete)
     
     return test_deferred
+
+  @inlineCallbacks
+  def test_command_stats(self):
+    """ Verifies that the command_stats command returns the latency statistics recorded by the command parser.
+    """
+
+    # Execute some commands
+    yield self.command_parser.parse_command({'command': "station_time", 'destination': "system"}, kernel_mode = True)
+    yield self.assertFailure(self.command_parser.parse_command({'command': "nonexistent", 'destination': "system"},
+                                                               kernel_mode = True), parser.CommandFailed)
+
+    # Load the statistics
+    stats_response = yield self.command_parser.parse_command({'command': "command_stats", 'destination': "system",
+                                                              'parameters': {'reset': True}}, kernel_mode = True)
+    command_stats = stats_response['response']['result']
+    station_time_stats = command_stats['commands']['destinations']['system']['station_time']
+    self.assertEqual(command_stats['commands']['completed'], 1)
+    self.assertEqual(command_stats['commands']['failed'], 1)
+    self.assertEqual(command_stats['commands']['rejected'], 1)
+    self.assertEqual(station_time_stats['count'], 1)
+    self.assertEqual(station_time_stats['errors'], 0)
+    for stage in ['validation', 'permissions', 'routing', 'parameters', 'execution', 'total']:
+      self.assertEqual(station_time_stats['stages'][stage]['count'], 1)
+    self.assertTrue('misses' in command_stats['cache'])
+    self.assertTrue('executed' in command_stats['internal_commands'])
+    self.assertTrue('connections_opened' in command_stats['http'])
+    self.assertEqual(command_stats['sessions']['active_sessions'], 0)
+    self.assertTrue('count' in command_stats['sessions']['start_lateness'])
+
+    # The statistics should have been reset (except for the command_stats command itself)
+    stats_response = yield self.command_parser.parse_command({'command': "command_stats", 'destination': "system"},
+                                                             kernel_mode = True)
+    command_stats = stats_response['response']['result']
+    self.assertEqual(command_stats['commands']['completed'], 1)
+    self.assertEqual(command_stats['commands']['destinations'].keys(), ['system'])
+    self.assertEqual(command_stats['commands']['destinations']['system'].keys(), ['command_stats'])
@@ -0,0 +1,193 @@
+""" @package hwm.command.jobs
+Tracks commands that are executed as background jobs.
+
+This module contains classes that keep track of commands submitted in job mode (see CommandParser.parse_command_job()).
+Instead of waiting for a long running command (e.g. an antenna calibration) to finish, the client immediately receives
+a job ID which it can use to poll for the command's results using the system 'job_status' command. The responses of
+finished jobs are kept in a bounded store, so clients must collect them in a timely manner.
+"""
+
+# Import required modules
+import time, uuid, logging, collections
+
+class JobManager:
+  """ Keeps track of running and finished command jobs.
+  """
+
+  def __init__(self, max_finished_jobs = 100):
+    """ Sets up the job manager.
+
+    @param max_finished_jobs  The maximum number of finished jobs to keep. Once this limit is reached, the oldest
+                              finished jobs will be discarded.
+    """
+
+    self.max_finished_jobs = max_finished_jobs
+    self._running_jobs = {}
+    self._finished_jobs = collections.OrderedDict()
+    self._job_listeners = []
+
+    # Job statistics
+    self.jobs_submitted = 0
+    self.jobs_discarded = 0
+
+  def submit(self, command_deferred, user_id = None, job_id = None):
+    """ Tracks the provided command as a job.
+
+    @param command_deferred  The deferred returned by CommandParser.parse_command() for the command.
+    @param user_id           The ID of the user that submitted the command. Only this user may check on the job.
+    @param job_id            The ID to give the job (e.g. the schedule ID of a scheduled command). If None, a random ID
+                             will be generated.
+    @return Returns the new Job.
+    """
+
+    new_job = Job(job_id if job_id is not None else uuid.uuid4().hex, user_id)
+    self._running_jobs[new_job.job_id] = new_job
+    self.jobs_submitted += 1
+    command_deferred.addCallbacks(self._job_finished, self._job_failed, callbackArgs = (new_job,),
+                                  errbackArgs = (new_job,))
+
+    return new_job
+
+  def get_job(self, job_id, user_id, ignore_owner = False):
+    """ Loads the specified job.
+
+    @param job_id        The ID of the job to load.
+    @param user_id       The ID of the user requesting the job.
+    @param ignore_owner  Whether or not to skip the job ownership check (e.g. for kernel mode commands).
+    @return Returns the Job or None if the job doesn't exist (or has been discarded) or belongs to another user.
+    """
+
+    requested_job = self._running_jobs.get(job_id, None)
+    if requested_job is None:
+      requested_job = self._finished_jobs.get(job_id, None)
+
+    if requested_job is None or (not ignore_owner and requested_job.user_id != user_id):
+      return None
+
+    return requested_job
+
+  def add_listener(self, job_listener):
+    """ Registers a function that will be called with each Job when it finishes.
+
+    @param job_listener  A callable that accepts a single Job argument.
+    """
+
+    self._job_listeners.append(job_listener)
+
+  def get_stats(self):
+    """ Returns statistics about the command jobs.
+
+    @return Returns a dictionary containing the number of running, finished (stored), submitted, and discarded jobs.
+    """
+
+    return {
+      'running': len(self._running_jobs),
+      'finished': len(self._finished_jobs),
+      'submitted': self.jobs_submitted,
+      'discarded': self.jobs_discarded
+    }
+
+  def _job_finished(self, command_response, finished_job):
+    """ Stores the response of a successful job.
+
+    @param command_response  The command response dictionary.
+    @param finished_job      The Job that finished.
+    """
+
+    finished_job.finish(True, command_response)
+    self._store_finished_job(finished_job)
+
+  def _job_failed(self, failure, failed_job):
+    """ Stores the response of a failed job.
+
+    @param failure     A Failure wrapping a CommandFailed exception.
+    @param failed_job  The Job that failed.
+    """
+
+    try:
+      command_response = failure.value.results
+    except AttributeError:
+      command_response = {'response': {'status': 'error', 'result': {'error_message': str(failure.value)}}}
+
+    failed_job.finish(False, command_response)
+    self._store_finished_job(failed_job)
+
+  def _store_finished_job(self, finished_job):
+    """ Moves a finished job into the bounded finished job store and notifies the job listeners.
+
+    @param finished_job  The Job that finished.
+    """
+
+    del self._running_jobs[finished_job.job_id]
+    self._finished_jobs[finished_job.job_id] = finished_job
+    while len(self._finished_jobs) > self.max_finished_jobs:
+      self._finished_jobs.popitem(last = False)
+      self.jobs_discarded += 1
+
+    for job_listener in self._job_listeners:
+      try:
+        job_listener(finished_job)
+      except Exception as listener_error:
+        logging.error("A command job listener failed for job '"+finished_job.job_id+"': "+str(listener_error))
+
+class Job:
+  """ Represents a command that is being executed in the background.
+  """
+
+  # Job states
+  RUNNING = 'running'
+  COMPLETED = 'completed'
+  FAILED = 'failed'
+
+  def __init__(self, job_id, user_id):
+    """ Sets up the job.
+
+    @param job_id   The job's unique ID.
+    @param user_id  The ID of the user that submitted the job.
+    """
+
+    self.job_id = job_id
+    self.user_id = user_id
+    self.status = Job.RUNNING
+    self.submitted_at = int(time.time())
+    self.completed_at = None
+    self.response = None
+
+  @property
+  def destination(self):
+    """ The full destination of the job's command, or None if the job hasn't finished or its command was invalid.
+    """
+
+    if self.response is None:
+      return None
+
+    return self.response.get('destination', None)
+
+  def finish(self, succeeded, command_response):
+    """ Records the results of the job.
+
+    @param succeeded         Whether or not the job's command was successful.
+    @param command_response  The response dictionary generated for the command (containing a 'response' field).
+    """
+
+    self.status = Job.COMPLETED if succeeded else Job.FAILED
+    self.completed_at = int(time.time())
+    self.response = command_response['response']
+
+  def get_status(self):
+    """ Returns the job's status.
+
+    @return Returns a dictionary containing the job's ID, its status, when it was submitted and completed, and (once
+            the job has finished) the command's response.
+    """
+
+    job_status = {
+      'job_id': self.job_id,
+      'status': self.status,
+      'submitted_at': self.submitted_at,
+      'completed_at': self.completed_at
+    }
+    if self.response is not None:
+      job_status['response'] = self.response
+
+    return job_status
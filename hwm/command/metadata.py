@@ -2,13 +2,15 @@
 This module contains functions used to build a command's meta-data dictionary. This dictionary defines how to reach a 
 specific command, what parameters it accepts, and whether or not it requires an active session to run.
 
-Periodically, a command's meta-data dictionary is loaded by the system state packager which then serializes it and sends
-it to the user interface. The user interface will use the metadata to build an appropriate form to allow the user to 
-easily execute the command.
+Each command's meta-data dictionary is loaded once, when the command parser builds its routing table, and is collected
+into a versioned catalog (see hwm.command.catalog) which the user interface loads using the system 'metadata_catalog'
+command. The user interface will use the metadata to build an appropriate form to allow the user to easily execute the 
+command.
 """
 
 def build_metadata_dict(command_parameters, command_id, command_handler_name, requires_active_session = True,
-                        dangerous = True, schedulable = False, use_as_initial_value = False):
+                        dangerous = True, schedulable = False, use_as_initial_value = False, priority = 'normal',
+                        coalesce = False, cache_ttl = None):
   """ Builds the command meta-data structure for a specific command.
   
   Command handlers use this function to build the command meta-data structures for the commands they service. For the 
@@ -63,6 +65,17 @@ def build_metadata_dict(command_parameters, command_id, command_handler_name, re
   @param use_as_initial_value     If set, the user interface will use this command when building the device or system's
                                   initial state configuration forms during the reservation process. This can be used, 
                                   for example, to set the initial frequency that a radio should be tunned to.
+  @param priority                 The priority class of the command, either 'normal' or 'high'. Device commands are 
+                                  executed one at a time by the device's command queue, and 'high' priority commands
+                                  (e.g. stop commands) are executed before any queued 'normal' priority commands.
+  @param coalesce                 If set, a newer instance of this command will replace an older instance that is still
+                                  waiting in the device's command queue. This should be used for commands that are 
+                                  superseded by newer versions of themselves (e.g. antenna movement commands).
+  @param cache_ttl                If set, the results of the command will be cached by the command parser for this many
+                                  seconds. Identical requests for the command (same destination and parameters) will be
+                                  served from the cache, and concurrent identical requests will be collapsed into a 
+                                  single command execution. This should only be used for read-only commands whose 
+                                  results don't depend on the user executing them (e.g. state queries).
   @return Returns a dictionary containing the command meta-data.
   """
   
@@ -90,6 +103,15 @@ def build_metadata_dict(command_parameters, command_id, command_handler_name, re
         if not isinstance(option, list) or len(option) != 2:
           raise InvalidCommandMetadata("One of the options specified for a 'select' parameter was malformed. Options need to be a 2 element list containing the option title and value.")
   
+  # Validate the command priority
+  if priority not in ['normal', 'high']:
+    raise InvalidCommandMetadata("Invalid command priority specified: "+str(priority))
+
+  # Validate the cache TTL
+  if cache_ttl is not None and (isinstance(cache_ttl, bool) or not isinstance(cache_ttl, (int, long, float)) or
+                                cache_ttl <= 0):
+    raise InvalidCommandMetadata("Invalid command cache TTL specified: "+str(cache_ttl))
+  
   # Store the meta-data values
   metadata['command_id'] = command_id
   metadata['destination'] = command_handler_name
@@ -98,6 +120,9 @@ def build_metadata_dict(command_parameters, command_id, command_handler_name, re
   metadata['dangerous'] = True if dangerous else False
   metadata['schedulable'] = True if schedulable else False
   metadata['use_as_initial_value'] = True if use_as_initial_value else False
+  metadata['priority'] = priority
+  metadata['coalesce'] = True if coalesce else False
+  metadata['cache_ttl'] = cache_ttl
   
   return metadata;
 
@@ -8,7 +8,7 @@ as they're received. Once a command has been executed, it returns the results of
 # Import required modules
 import time, logging
 from twisted.internet import defer, threads
-from hwm.command import command
+from hwm.command import command, routing, queues, cache, stats, catalog, jobs, scheduler
 from hwm.hardware.devices.drivers import driver
 from hwm.hardware.devices import manager as device_manager
 from hwm.hardware.pipelines import manager as pipeline_manager
@@ -18,6 +18,12 @@ class CommandParser:
   
   This class parses and performs validations on received commands, delegating them to the appropriate command handler.
   """
+
+  # Batch execution modes (see parse_command_batch())
+  BATCH_SEQUENTIAL = 'sequential'
+  BATCH_PARALLEL = 'parallel'
+  BATCH_STOP_ON_ERROR = 'stop_on_error'
+  BATCH_MODES = (BATCH_SEQUENTIAL, BATCH_PARALLEL, BATCH_STOP_ON_ERROR)
   
   def __init__(self, system_command_handlers, permission_manager):
     """ Sets up the command parser instance.
@@ -33,6 +39,10 @@ class CommandParser:
           coordinator needs this class so that it can pass it to newly created sessions for their setup commands.
     @note This class requires that a PipelineManager instance be initialized with an instance of this class before it 
           can parse device commands. This is required so that it can relay device commands to the specified device.
+    @note If the audit_log attribute is set to an AuditLog (see hwm.command.audit), an audit record will be written for 
+          every command that finishes.
+    @note The tls_context_factory attribute can be set to the TLSContextFactory used by the hardware manager's listeners
+          (see hwm.network.security.verification) so that its TLS handshake statistics can be reported.
     """
     
     # Set the class attributes
@@ -42,6 +52,29 @@ class CommandParser:
     self.permission_manager = permission_manager
     self.pipeline_manager = None
     self.session_coordinator = None
+    self.routing_table = routing.RoutingTable()
+    self.metadata_catalog = catalog.MetadataCatalog()
+    self.rebuild_routing_table()
+    self.command_queues = queues.CommandQueueManager()
+    self.result_cache = cache.CommandResultCache()
+    self.command_stats = stats.CommandStats()
+    self.command_jobs = jobs.JobManager()
+    self.command_jobs.add_listener(self._publish_job_status)
+    self.command_scheduler = scheduler.CommandScheduler(self)
+    self.audit_log = None
+    self.tls_context_factory = None
+
+    # Give the system command handlers access to the parser (used to report on the command system)
+    for command_handler in system_command_handlers:
+      command_handler.command_parser = self
+
+    # Counters describing the execution of prepared (internal) commands
+    self.internal_command_counters = {
+      'prepared': 0,
+      'executed': 0,
+      'fast_path': 0,
+      'full_checks': 0
+    }
 
   def system_command_handlers(self):
     """ Provides access to the loaded system command handlers.
@@ -51,14 +84,35 @@ class CommandParser:
 
     return self.system_handlers
 
+  def rebuild_routing_table(self):
+    """ Rebuilds the command routing table.
+
+    This method indexes every command offered by the system command handlers and by the command handlers of every device
+    in every loaded pipeline. It must be called whenever the set of loaded pipelines or devices changes (the 
+    PipelineManager calls it after it loads its pipelines) so that commands can be routed with a single lookup. The
+    command meta-data catalog is rebuilt from the new routing table at the same time.
+
+    @note Commands that aren't in the routing table will still be located by searching the pipelines and devices, and
+          will be added to the routing table once found.
+    
+    @return Returns the number of routes in the rebuilt routing table.
+    """
+
+    pipelines = self.pipeline_manager.pipelines if self.pipeline_manager is not None else None
+    route_count = self.routing_table.build(self.system_handlers, pipelines)
+    self.metadata_catalog.build(self.routing_table)
+
+    return route_count
+
   def parse_command(self, raw_command, user_id = None, kernel_mode = False):
     """ Processes all commands received by the ground station.
     
     When a raw command is passed to this function, it performs the following operations via a series of callbacks:
     * Constructs a new Command and validates it against that command's schema
-    * Verifies that the indicated command exists
+    * Verifies that the indicated command exists (using the routing table)
     * Checks that the user can execute the command
-    * Executes the command in a new thread
+    * Validates the command's parameters against the command meta-data
+    * Executes the command (device commands are executed one at a time by the device's command queue)
     * Returns a deferred that will be fired with the results of the command
     
     Some of these steps may be skipped depending on the type of command. For example, kernel level commands skip the 
@@ -88,6 +142,7 @@ class CommandParser:
     
     # Create the new command (currently there is only one command type to worry about)
     new_command = command.Command(time_command_received, raw_command, user_id=user_id, kernel_mode=kernel_mode)
+    new_command.timing = stats.CommandTiming()
     
     # Validate the command (format and schema)
     command_deferred = new_command.validate_command()
@@ -99,6 +154,340 @@ class CommandParser:
     
     return command_deferred
 
+  def parse_command_job(self, raw_command, user_id = None, kernel_mode = False):
+    """ Executes a command in the background (job mode).
+
+    This method executes the command using parse_command() but, instead of waiting for the command to finish, it 
+    immediately returns a response containing the command's job ID. The client can then use the job ID to poll for the
+    command's results using the system 'job_status' command. If the command is addressed to a device, its job status 
+    will also be written to the pipeline's telemetry stream (as the 'job_status' stream) once it finishes, as long as 
+    the job's user is using the pipeline.
+
+    @note Finished jobs are kept in a bounded store (see hwm.command.jobs.JobManager), so job results that aren't 
+          collected in a timely manner may be discarded.
+
+    @param raw_command  The raw command to execute (see parse_command()).
+    @param user_id      The ID of the user submitting the command. Only this user may check on the job.
+    @param kernel_mode  Whether or not the command should be run in kernel mode.
+    @return Returns a pre-fired deferred containing the job submission response. The job's status (see 
+            Job.get_status()) is stored in the 'result' field of the response.
+    """
+
+    # Local variables
+    time_job_received = int(time.time())
+
+    # Execute the command and track it as a job
+    command_deferred = self.parse_command(raw_command, user_id = user_id, kernel_mode = kernel_mode)
+    command_job = self.command_jobs.submit(command_deferred, user_id)
+
+    return defer.succeed({'response': {'received_at': time_job_received,
+                                       'completed_at': int(time.time()),
+                                       'status': 'okay',
+                                       'result': command_job.get_status()}})
+
+  @defer.inlineCallbacks
+  def schedule_commands(self, scheduled_commands, user_id = None, kernel_mode = False):
+    """ Validates a group of time-tagged commands and schedules them for execution.
+
+    Each command is validated, routed, and authorized (using the same permission and session checks as parse_command())
+    before any of them are scheduled; if any command is invalid, none of them will be scheduled. Only commands whose 
+    meta-data marks them as 'schedulable' may be scheduled. A command that requires an active session will be bound to 
+    the user's session for the command's pipeline, and will be cancelled if the session ends before it's executed.
+
+    @note The permission and session checks will be performed again when the commands are executed.
+    @note The results of each scheduled command are tracked as a command job whose job ID is the command's schedule ID 
+          (see the system 'job_status' command).
+
+    @throw Throws CommandError if any of the commands are invalid or can't be scheduled.
+
+    @param scheduled_commands  A list of dictionaries, each containing a 'command' (a command dictionary) and its 
+                               'execute_at' time (UNIX timestamp, may be fractional).
+    @param user_id             The ID of the user scheduling the commands.
+    @param kernel_mode         Whether or not the commands should be scheduled (and executed) in kernel mode.
+    @return Returns a deferred that will be fired with a list containing the schedule ID of each command.
+    """
+
+    if not isinstance(scheduled_commands, list) or len(scheduled_commands) == 0:
+      raise command.CommandError("The commands to schedule must be provided as a non-empty list.")
+
+    # Load the user's permissions once for the entire group
+    user_permissions = None
+    if not kernel_mode:
+      user_permissions = yield self.permission_manager.get_user_permissions(user_id)
+
+    # Validate every command before scheduling any of them
+    current_time = self.command_scheduler.seconds()
+    new_scheduled_commands = []
+    for command_index, scheduled_command in enumerate(scheduled_commands):
+      error_data = {'index': command_index}
+      if (not isinstance(scheduled_command, dict) or not isinstance(scheduled_command.get('command', None), dict) or
+          isinstance(scheduled_command.get('execute_at', None), bool) or
+          not isinstance(scheduled_command.get('execute_at', None), (int, long, float))):
+        raise command.CommandError("Each scheduled command must contain a 'command' object and an 'execute_at' time.",
+                                   error_data)
+      if scheduled_command['execute_at'] < current_time - 1:
+        raise command.CommandError("Commands can't be scheduled in the past.", error_data)
+
+      new_command = command.Command(int(current_time), scheduled_command['command'], user_id = user_id,
+                                    kernel_mode = kernel_mode)
+      try:
+        yield new_command.validate_command()
+        command_route = self._load_route(new_command)
+      except (command.CommandMalformed, command.CommandInvalidSchema, command.CommandError) as command_error:
+        raise command.CommandError("Scheduled command "+str(command_index)+" is invalid: "+str(command_error),
+                                   error_data)
+      error_data.update({'command': new_command.command, 'destination': new_command.full_destination})
+      if command_route.metadata is None or not command_route.metadata['schedulable']:
+        raise command.CommandError("The '"+new_command.command+"' command can't be scheduled.", error_data)
+
+      # Check the command's permissions, session requirements, and parameters
+      if not kernel_mode:
+        self._check_authorization(command_route, user_permissions, new_command)
+      command_route.validate_parameters(new_command)
+
+      new_scheduled_commands.append(scheduler.ScheduledCommand(scheduled_command['command'],
+                                                               scheduled_command['execute_at'], user_id, kernel_mode,
+                                                               self._load_command_session_id(command_route,
+                                                                                             new_command)))
+
+    try:
+      schedule_ids = self.command_scheduler.add(new_scheduled_commands)
+    except scheduler.SchedulerFull as scheduler_error:
+      raise command.CommandError(str(scheduler_error))
+
+    defer.returnValue(schedule_ids)
+
+  def _load_command_session_id(self, command_route, valid_command):
+    """ Determines which of the user's sessions a scheduled command should be bound to.
+
+    @param command_route  The CommandRoute of the command.
+    @param valid_command  The authorized Command (its active user sessions must have been loaded).
+    @return Returns the ID of the session that the command belongs to, or None if it doesn't require one.
+    """
+
+    if valid_command.kernel_mode:
+      return None
+
+    for user_session in valid_command.active_user_sessions:
+      if command_route.device_command and user_session.active_pipeline.id == valid_command.pipeline:
+        return user_session.id
+      elif not command_route.device_command and command_route.requires_active_session:
+        return user_session.id
+
+    return None
+
+  def parse_command_batch(self, raw_commands, user_id = None, kernel_mode = False, mode = BATCH_SEQUENTIAL):
+    """ Processes a batch of commands.
+
+    This method executes each of the provided commands using parse_command() and aggregates their responses into a
+    single batch response. The commands can be executed in one of the following modes:
+    * BATCH_SEQUENTIAL: Each command is executed after the previous command has completed, regardless of its outcome.
+    * BATCH_PARALLEL: All of the commands are submitted at once and may complete in any order.
+    * BATCH_STOP_ON_ERROR: Like BATCH_SEQUENTIAL, except that the remaining commands are skipped once a command fails.
+
+    @note The batch response contains the individual response of each command (as generated by 
+          Command.build_command_response) in the same order that the commands were submitted. The response of each 
+          command that was skipped (in BATCH_STOP_ON_ERROR mode) will be None.
+    @note The batch's status will be 'okay' if every command in the batch was successful and 'error' otherwise.
+
+    @param raw_commands  A list of raw commands. Each command may be in any format accepted by parse_command().
+    @param user_id       The ID of the user executing the commands.
+    @param kernel_mode   Indicates if the commands should be run in kernel mode.
+    @param mode          The batch execution mode.
+    @return Returns a deferred that will be fired with the batch response. If the batch itself is invalid (as opposed
+            to one of its commands), the deferred's errback chain will be fired with a CommandFailed exception.
+    """
+
+    # Local variables
+    time_batch_received = int(time.time())
+
+    # Validate the batch
+    if mode not in self.BATCH_MODES:
+      return defer.fail(self._batch_error("The requested batch mode '"+str(mode)+"' is invalid.", mode,
+                                          time_batch_received))
+    if not isinstance(raw_commands, list):
+      return defer.fail(self._batch_error("The submitted command batch must be a list of commands.", mode,
+                                          time_batch_received))
+
+    # Run the commands
+    if mode == self.BATCH_PARALLEL:
+      running_commands = [self.parse_command(raw_command, user_id = user_id, kernel_mode = kernel_mode)
+                          for raw_command in raw_commands]
+      batch_deferred = defer.DeferredList(running_commands, consumeErrors = True)
+      batch_deferred.addCallback(self._flatten_batch_results)
+    else:
+      batch_deferred = self._run_batch_sequentially(raw_commands, user_id, kernel_mode,
+                                                    mode == self.BATCH_STOP_ON_ERROR)
+
+    batch_deferred.addCallback(self._build_batch_response, mode, time_batch_received)
+
+    return batch_deferred
+
+  @defer.inlineCallbacks
+  def _run_batch_sequentially(self, raw_commands, user_id, kernel_mode, stop_on_error):
+    """ Executes a batch of commands one after the other.
+
+    @param raw_commands   A list of raw commands to execute.
+    @param user_id        The ID of the user executing the commands.
+    @param kernel_mode    Indicates if the commands should be run in kernel mode.
+    @param stop_on_error  Whether or not the remaining commands should be skipped once a command fails.
+    @return Returns a deferred that will be fired with a list containing the response of each command (or None for 
+            skipped commands).
+    """
+
+    command_responses = [None]*len(raw_commands)
+    for command_index, raw_command in enumerate(raw_commands):
+      try:
+        command_results = yield self.parse_command(raw_command, user_id = user_id, kernel_mode = kernel_mode)
+        command_responses[command_index] = command_results['response']
+      except CommandFailed as command_failure:
+        command_responses[command_index] = command_failure.results['response']
+
+        if stop_on_error:
+          break
+
+    defer.returnValue(command_responses)
+
+  def _flatten_batch_results(self, batch_results):
+    """ Extracts the response of each command from the results of a DeferredList of commands.
+
+    @param batch_results  The results of the DeferredList, a list of (success, result) tuples.
+    @return Returns a list containing the response of each command.
+    """
+
+    command_responses = []
+    for command_successful, command_result in batch_results:
+      if command_successful:
+        command_responses.append(command_result['response'])
+      else:
+        command_responses.append(command_result.value.results['response'])
+
+    return command_responses
+
+  def _build_batch_response(self, command_responses, mode, time_batch_received):
+    """ Builds the aggregated response for a batch of commands.
+
+    @param command_responses    A list containing the response of each command in the batch.
+    @param mode                 The mode the batch was executed in.
+    @param time_batch_received  The time (UNIX timestamp) when the batch was received.
+    @return Returns a dictionary containing the batch response.
+    """
+
+    batch_successful = True
+    for command_response in command_responses:
+      if command_response is None or command_response['status'] != 'okay':
+        batch_successful = False
+        break
+
+    return {
+      'response': {
+        'received_at': time_batch_received,
+        'completed_at': int(time.time()),
+        'status': 'okay' if batch_successful else 'error',
+        'mode': mode,
+        'responses': command_responses
+      }
+    }
+
+  def _batch_error(self, error_message, mode, time_batch_received):
+    """ Creates a CommandFailed exception describing an invalid command batch.
+
+    @param error_message        A string describing the error.
+    @param mode                 The requested batch mode.
+    @param time_batch_received  The time (UNIX timestamp) when the batch was received.
+    @return Returns a CommandFailed exception containing the batch error response.
+    """
+
+    logging.error("A command batch failed for the following reason: "+error_message)
+
+    error_response = self._build_batch_response([], mode, time_batch_received)
+    error_response['response']['status'] = 'error'
+    error_response['response']['result'] = {'error_message': error_message}
+
+    return CommandFailed(error_message, error_response)
+
+  def prepare_command(self, command_name, destination, user_id = None, kernel_mode = False):
+    """ Prepares a command that will be issued repeatedly by the hardware manager itself.
+
+    This method creates a PreparedCommand, which can be used by drivers to efficiently execute commands that they 
+    generate internally (such as the commands generated by a tracking loop). Prepared commands skip the parsing and 
+    schema validation steps performed by parse_command(), are routed once, and cache the results of their permission 
+    and session checks for as long as the user's permissions and sessions remain unchanged. The checks themselves are
+    identical to those performed by parse_command().
+
+    @note Prepared commands should be discarded by their driver at the end of each session.
+    
+    @param command_name  The name of the command.
+    @param destination   The full destination of the command (e.g. "pipeline_id.device_id").
+    @param user_id       The ID of the user that the command will be executed on behalf of.
+    @param kernel_mode   Indicates if the command should be run in kernel mode.
+    @return Returns a new PreparedCommand. 
+    """
+
+    self.internal_command_counters['prepared'] += 1
+
+    return PreparedCommand(self, command_name, destination, user_id, kernel_mode)
+
+  def _run_prepared_command(self, prepared_command, parameters):
+    """ Executes a prepared command with the specified parameters.
+
+    @param prepared_command  The PreparedCommand to execute.
+    @param parameters        A dictionary containing the command's parameters, or None if it doesn't have any.
+    @return Returns a deferred that will be fired with the results of the command (or a Failure wrapping a 
+            CommandFailed exception).
+    """
+
+    # Create the command without parsing or validating it
+    command_dict = {'command': prepared_command.command, 'destination': prepared_command.destination}
+    if parameters is not None:
+      command_dict['parameters'] = parameters
+    new_command = command.Command(int(time.time()), command_dict, user_id = prepared_command.user_id,
+                                  kernel_mode = prepared_command.kernel_mode)
+    new_command.timing = stats.CommandTiming()
+    new_command.skip_validation()
+    self.internal_command_counters['executed'] += 1
+
+    if prepared_command.kernel_mode:
+      command_deferred = defer.maybeDeferred(self._run_prepared_command_checked, None, prepared_command, new_command)
+    else:
+      command_deferred = self.permission_manager.get_user_permissions(prepared_command.user_id)
+      command_deferred.addCallback(self._run_prepared_command_checked, prepared_command, new_command)
+    command_deferred.addErrback(self._command_error, new_command)
+
+    return command_deferred
+
+  def _run_prepared_command_checked(self, user_permissions, prepared_command, valid_command):
+    """ Executes a prepared command after checking the user's permissions and sessions (if they've changed).
+
+    @throw May throw CommandError and other exceptions indicating that the command has failed.
+
+    @param user_permissions  The UserPermissions object containing the user's permissions, or None in kernel mode.
+    @param prepared_command  The PreparedCommand being executed.
+    @param valid_command     The Command object for the currently executing command.
+    @return Returns a deferred that will eventually be fired with the results of the command execution.
+    """
+
+    # Route the command
+    valid_command.timing.mark('permissions')
+    if prepared_command.route is None:
+      prepared_command.route = self._load_route(valid_command)
+    valid_command.timing.mark('routing')
+
+    if not valid_command.kernel_mode:
+      if prepared_command.is_authorized(user_permissions):
+        # Fast path, the user's permissions and sessions haven't changed since the command was last authorized
+        valid_command.active_user_sessions = prepared_command.authorized_sessions
+        self.internal_command_counters['fast_path'] += 1
+      else:
+        self._check_authorization(prepared_command.route, user_permissions, valid_command)
+        prepared_command.authorize(user_permissions, valid_command.active_user_sessions)
+        self.internal_command_counters['full_checks'] += 1
+    else:
+      self.internal_command_counters['fast_path'] += 1
+    valid_command.timing.mark('authorization')
+
+    return self._execute_command(prepared_command.route, valid_command)
+
   def _load_permissions(self, validation_results, valid_command):
     """ Loads the user's permissions, if required.
     
@@ -115,6 +504,8 @@ class CommandParser:
             the command is being run in kernel mode).
     """
     
+    valid_command.timing.mark('validation')
+
     # Check if the command is being run in kernel mode
     if valid_command.kernel_mode:
       # Return a pre-fired deferred
@@ -139,20 +530,143 @@ class CommandParser:
     @throw May throw CommandError and other exceptions indicating that the command has failed. A subsequent errback in 
            the main command deferred chain will automatically handle all command errors. 
     
-    @param user_permissions  A dictionary containing the user's permissions. If the command is being running in kernel
-                             mode, this will just be None.
+    @param user_permissions  The UserPermissions object containing the user's permissions. If the command is being 
+                             running in kernel mode, this will just be None.
     @param valid_command     The Command object for the currently executing command.
     @return Returns a deferred that will eventually be fired with the results of the command execution.
     """
     
     # Determine where to send the command
-    device_command = False
+    valid_command.timing.mark('permissions')
+    command_route = self._load_route(valid_command)
+    valid_command.timing.mark('routing')
+    
+    if not valid_command.kernel_mode:
+      self._check_authorization(command_route, user_permissions, valid_command)
+      valid_command.timing.mark('authorization')
+
+    return self._execute_command(command_route, valid_command)
+
+  def _load_route(self, valid_command):
+    """ Loads the route for the specified command from the routing table.
+
+    @throw Throws CommandError if the command's destination or the command itself can't be located.
+
+    @param valid_command  The Command object for the currently executing command.
+    @return Returns the CommandRoute for the command.
+    """
+
+    command_route = self.routing_table.get_route(valid_command.full_destination, valid_command.command)
+    if command_route is None:
+      command_route = self._locate_command(valid_command)
+
+    return command_route
+
+  def _check_authorization(self, command_route, user_permissions, valid_command):
+    """ Makes sure that the user is allowed to execute the specified command.
+
+    This method verifies that the user has permission to execute the command and that the command's session 
+    requirements are met. It also loads the user's active sessions into the command.
+
+    @throw Throws CommandError if the user isn't allowed to execute the command.
+
+    @param command_route     The CommandRoute for the command.
+    @param user_permissions  The UserPermissions object containing the user's permissions.
+    @param valid_command     The Command object for the currently executing command.
+    """
+
+    full_destination = valid_command.full_destination
+    pipeline = valid_command.pipeline
+
+    # Check the user's permissions
+    if not user_permissions.is_permitted(valid_command.command, valid_command.destination, pipeline):
+      raise command.CommandError("You do not have permission to execute that command on that device.",
+                                 {"command": valid_command.command, "destination": full_destination})
+
+    # Check the command's session requirements
+    active_user_sessions = self.session_coordinator.load_user_sessions(valid_command.user_id)
+    valid_command.active_user_sessions = active_user_sessions
+    if not user_permissions['ignore_session_protections']:
+      # Check the command's meta-data to see if it requires an active session
+      if command_route.requires_active_session:
+        if command_route.device_command:
+          # Device command, make sure one of the user's active sessions uses the specified pipeline
+          session_requirements_met = False
+          for user_session in active_user_sessions:
+            if user_session.active_pipeline.id == pipeline:
+              session_requirements_met = True
+              break
+          
+          if not session_requirements_met:
+            raise command.CommandError("You must have a currently active session for a pipeline that contains the "+
+                                       "destination device to use that command.",
+                                       {"command": valid_command.command, "destination": full_destination})
+        else:
+          # System command, make sure the user has at least one active session
+          if len(active_user_sessions) <= 0:
+            raise command.CommandError("You must have an active session to use that command.",
+                                       {"command": valid_command.command, "destination": full_destination})
+
+  def _execute_command(self, command_route, valid_command):
+    """ Validates the command's parameters and passes the command to its command handler.
+
+    @throw Throws CommandError if the command's parameters are invalid.
+
+    @param command_route  The CommandRoute for the command.
+    @param valid_command  The Command object for the currently executing command.
+    @return Returns a deferred that will eventually be fired with the results of the command execution.
+    """
+
+    # Validate the command parameters against the command's meta-data
+    command_route.validate_parameters(valid_command)
+    valid_command.timing.mark('parameters')
+
+    # Execute the command, cacheable commands may be served from the result cache
+    if command_route.cache_ttl is not None:
+      command_deferred = self.result_cache.load(command_route, valid_command,
+                                                lambda: self._dispatch_command(command_route, valid_command))
+    else:
+      command_deferred = self._dispatch_command(command_route, valid_command)
+    command_deferred.addCallback(self._command_complete, valid_command)
+    
+    return command_deferred
+
+  def _dispatch_command(self, command_route, valid_command):
+    """ Passes the command to its command handler.
+
+    @param command_route  The CommandRoute for the command.
+    @param valid_command  The Command object for the currently executing command.
+    @return Returns a deferred that will eventually be fired with the results returned by the command handler.
+    """
+
+    # Device commands are passed through their device's command queue
+    if command_route.device_command:
+      return self.command_queues.submit(command_route, valid_command)
+    else:
+      return defer.maybeDeferred(command_route.command_function, valid_command)
+  
+  def _locate_command(self, valid_command):
+    """ Searches the command handlers for the specified command.
+
+    This method is used to locate commands that aren't in the routing table, either because the command doesn't exist
+    (in which case it generates an appropriate error) or because its device was loaded after the routing table was
+    built. Commands that are found are added to the routing table.
+
+    @throw Throws CommandError if the command's destination or the command itself can't be located.
+
+    @param valid_command  The Command object for the currently executing command.
+    @return Returns the CommandRoute for the command.
+    """
+
     destination = valid_command.destination
     full_destination = valid_command.full_destination
     pipeline = valid_command.pipeline
     if destination in self.system_handlers:
       # System Command
+      device_command = False
       command_handler = self.system_handlers[destination]
+      route_destination = destination
+      route_pipeline = None
     elif pipeline is not None:
       # Device Command
       device_command = True
@@ -171,6 +685,9 @@ class CommandParser:
         command_handler = dest_device.get_command_handler()
       except driver.CommandHandlerNotDefined as e:
         raise command.CommandError(str(e), {"command": valid_command.command, "destination": full_destination})
+
+      route_destination = pipeline+"."+destination
+      route_pipeline = pipeline
     else:
       # Invalid Command
       raise command.CommandError("The received command was invalid because it specified an invalid command "+
@@ -184,61 +701,14 @@ class CommandParser:
       
       raise command.CommandError("The received command could not be located in the "+handler_string+" command handler.",
                                  {"command": valid_command.command, "destination": full_destination})
-    
-    if not valid_command.kernel_mode:
-      # Check the user's permissions
-      user_has_permission = False
-      for command_permission in user_permissions['permitted_commands']:
-        if (command_permission['command'] == valid_command.command and 
-            command_permission['destination'] == destination):
-          if 'pipelines' in command_permission:
-            if pipeline is not None and pipeline in command_permission['pipelines']:
-              user_has_permission = True
-          else:
-            user_has_permission = True
-      
-      if not user_has_permission:
-        raise command.CommandError("You do not have permission to execute that command on that device.",
-                                   {"command": valid_command.command, "destination": full_destination})
-
-      # Check the command's session requirements
-      active_user_sessions = self.session_coordinator.load_user_sessions(valid_command.user_id)
-      valid_command.active_user_sessions = active_user_sessions
-      if not user_permissions['ignore_session_protections']:
-        # Load the command meta-data to see if it requires an active session
-        try:
-          command_metadata = getattr(command_handler, 'settings_'+valid_command.command)
-          require_session = command_metadata()['requires_active_session']
-        except AttributeError:
-          # Command metadata not specified, default to True for safety
-          require_session = True
-        
-        if require_session:
-          if device_command:
-            # Device command, make sure one of the user's active sessions uses the specified pipeline
-            session_requirements_met = False
-            for user_session in active_user_sessions:
-              if user_session.active_pipeline.id == pipeline:
-                session_requirements_met = True
-                break
-            
-            if not session_requirements_met:
-              raise command.CommandError("You must have a currently active session for a pipeline that contains the "+
-                                         "destination device to use that command.",
-                                         {"command": valid_command.command, "destination": full_destination})
-          else:
-            # System command, make sure the user has at least one active session
-            if len(active_user_sessions) <= 0:
-              raise command.CommandError("You must have an active session to use that command.",
-                                         {"command": valid_command.command, "destination": full_destination})
-
-    # Execute the command in a new thread
-    command_function = getattr(command_handler, 'command_'+valid_command.command)
-    command_deferred = defer.maybeDeferred(command_function, valid_command)
-    command_deferred.addCallback(self._command_complete, valid_command)
-    
-    return command_deferred
-  
+
+    # Only cache routes that were addressed to their canonical destination
+    command_route = routing.CommandRoute(command_handler, valid_command.command, route_destination, route_pipeline)
+    if route_destination == full_destination:
+      self.routing_table.add_route(command_route)
+
+    return command_route
+
   def _command_complete(self, command_results, successful_command):
     """ Builds a complete response for the successful command.
     
@@ -254,6 +724,9 @@ class CommandParser:
     """
     
     command_response = successful_command.build_command_response(True, command_results)
+    self._record_command_stats(successful_command, True)
+    if self.audit_log is not None:
+      self.audit_log.record(successful_command, command_response)
     
     return command_response
   
@@ -285,6 +758,10 @@ class CommandParser:
     # Build the response dictionary
     error_response = failed_command.build_command_response(False, error_results)
 
+    self._record_command_stats(failed_command, False)
+    if self.audit_log is not None:
+      self.audit_log.record(failed_command, error_response)
+
     # Log the error
     if failed_command.command:
       logging.error("A command ("+failed_command.command+") failed for the following reason: "+str(failure.value))
@@ -294,6 +771,111 @@ class CommandParser:
     # Raise a CommandFailed describing the error
     raise CommandFailed(error_message['error_message'], error_response)
 
+  def _publish_job_status(self, finished_job):
+    """ Writes the status of a finished device command job to its pipeline's telemetry stream.
+
+    @note The job status will only be written if the pipeline's current session belongs to the job's user.
+
+    @param finished_job  The Job that just finished.
+    """
+
+    if finished_job.destination is None or self.pipeline_manager is None:
+      return
+
+    destination_parts = finished_job.destination.split('.')
+    if len(destination_parts) != 2:
+      return
+
+    job_pipeline = self.pipeline_manager.pipelines.get(destination_parts[0], None)
+    if job_pipeline is None or job_pipeline.current_session is None:
+      return
+
+    if job_pipeline.current_session.user_id == finished_job.user_id:
+      job_pipeline.write_telemetry(destination_parts[1], 'job_status', finished_job.completed_at,
+                                   finished_job.get_status())
+
+  def _record_command_stats(self, finished_command, succeeded):
+    """ Records the stage timings of a finished command in the command statistics.
+
+    @param finished_command  The Command that just finished.
+    @param succeeded         Whether or not the command was successful.
+    """
+
+    if finished_command.timing is None:
+      return
+
+    finished_command.timing.finish()
+    if 'routing' in finished_command.timing.stages:
+      self.command_stats.record(finished_command.full_destination, finished_command.command, finished_command.timing,
+                                succeeded)
+    else:
+      self.command_stats.record(None, None, finished_command.timing, succeeded)
+
+class PreparedCommand:
+  """ Represents a command that is repeatedly issued by the hardware manager itself.
+
+  Prepared commands are created by CommandParser.prepare_command() and are typically used by drivers to issue the
+  commands generated by their tracking loops. A prepared command remembers its route and the user permissions and 
+  sessions that were used the last time it was authorized. As long as the user's permissions haven't been reloaded and
+  the sessions are still running, the permission and session checks don't need to be repeated.
+  """
+
+  def __init__(self, command_parser, command_name, destination, user_id = None, kernel_mode = False):
+    """ Sets up the prepared command.
+
+    @param command_parser  The CommandParser that will execute the command.
+    @param command_name    The name of the command.
+    @param destination     The full destination of the command.
+    @param user_id         The ID of the user that the command will be executed on behalf of.
+    @param kernel_mode     Indicates if the command should be run in kernel mode.
+    """
+
+    self.command_parser = command_parser
+    self.command = command_name
+    self.destination = destination
+    self.user_id = user_id
+    self.kernel_mode = kernel_mode
+    self.route = None
+    self.authorized_permissions = None
+    self.authorized_sessions = []
+
+  def execute(self, parameters = None):
+    """ Executes the prepared command.
+
+    @param parameters  A dictionary containing the command's parameters, or None if it doesn't have any.
+    @return Returns a deferred that will be fired with the results of the command, just like 
+            CommandParser.parse_command().
+    """
+
+    return self.command_parser._run_prepared_command(self, parameters)
+
+  def authorize(self, user_permissions, user_sessions):
+    """ Records the user permissions and sessions that the command was successfully authorized with.
+
+    @param user_permissions  The UserPermissions object that the command was authorized with.
+    @param user_sessions     The user's active sessions at the time of authorization.
+    """
+
+    self.authorized_permissions = user_permissions
+    self.authorized_sessions = user_sessions
+
+  def is_authorized(self, user_permissions):
+    """ Checks if the command's previous authorization is still valid.
+
+    @param user_permissions  The user's current UserPermissions object.
+    @return Returns True if the user's permissions haven't been reloaded and none of the sessions that the command was 
+            authorized with have ended since the command was last authorized.
+    """
+
+    if self.authorized_permissions is None or user_permissions is not self.authorized_permissions:
+      return False
+
+    for user_session in self.authorized_sessions:
+      if user_session.active_pipeline is None:
+        return False
+
+    return True
+
 # High level command system exceptions
 class CommandFailed(Exception):
   """ Used to wrap command execution errors.
@@ -0,0 +1,225 @@
+""" @package hwm.command.queues
+Serializes the execution of device commands.
+
+This module contains classes that maintain a command queue for each device command handler. Device commands are
+executed one at a time, in the order that they were received, except that:
+* Commands with a 'high' priority (e.g. stop commands) are executed before any queued 'normal' priority commands.
+* Coalescing commands (e.g. move commands) replace any queued command of the same type that hasn't started yet.
+
+A command's priority and coalescing behavior are declared in its meta-data (see hwm.command.metadata).
+"""
+
+# Import required modules
+import time, collections
+from twisted.internet import defer
+from hwm.command import command
+
+class CommandQueueManager:
+  """ Maintains the command queues for every device command handler.
+  """
+
+  def __init__(self):
+    """ Sets up the command queue manager.
+    """
+
+    self._queues = {}
+
+  def submit(self, command_route, active_command):
+    """ Submits a command to the queue for its command handler.
+
+    @param command_route   The CommandRoute for the command.
+    @param active_command  The validated Command to execute.
+    @return Returns a deferred that will be fired with the results of the command once it has been executed. If the
+            command is superseded by a newer command before it runs, the deferred's errback chain will be fired with a
+            CommandError.
+    """
+
+    command_queue = self.get_queue(command_route)
+
+    return command_queue.submit(command_route, active_command)
+
+  def get_queue(self, command_route):
+    """ Loads (or creates) the command queue for the specified route's command handler.
+
+    @param command_route  The CommandRoute whose command handler's queue should be loaded.
+    @return Returns the DeviceCommandQueue for the command handler.
+    """
+
+    command_queue = self._queues.get(command_route.command_handler)
+    if command_queue is None:
+      command_queue = DeviceCommandQueue(command_route.full_destination)
+      self._queues[command_route.command_handler] = command_queue
+
+    return command_queue
+
+  def get_queue_stats(self):
+    """ Returns the statistics for every device command queue.
+
+    @return Returns a dictionary containing the statistics for each queue (see DeviceCommandQueue.get_stats()), keyed by
+            the destination of the queue's device.
+    """
+
+    queue_stats = {}
+    for command_queue in self._queues.itervalues():
+      queue_stats[command_queue.destination] = command_queue.get_stats()
+
+    return queue_stats
+
+class DeviceCommandQueue:
+  """ Executes the commands for a single device command handler one at a time.
+  """
+
+  def __init__(self, destination):
+    """ Sets up the command queue.
+
+    @param destination  The destination of the device that the queue belongs to. Used to identify the queue.
+    """
+
+    self.destination = destination
+    self._high_priority_commands = collections.deque()
+    self._normal_priority_commands = collections.deque()
+    self._running = False
+    self._draining = False
+    self._finished_immediately = False
+
+    # Queue statistics
+    self._commands_executed = 0
+    self._commands_coalesced = 0
+    self._max_depth = 0
+    self._total_wait_time = 0.0
+    self._max_wait_time = 0.0
+
+  @property
+  def depth(self):
+    """ The number of commands waiting to be executed.
+    """
+
+    return len(self._high_priority_commands) + len(self._normal_priority_commands)
+
+  def submit(self, command_route, active_command):
+    """ Adds a command to the queue and starts it if the queue is idle.
+
+    @param command_route   The CommandRoute for the command.
+    @param active_command  The validated Command to execute.
+    @return Returns a deferred that will be fired with the results of the command.
+    """
+
+    queued_command = QueuedCommand(command_route, active_command)
+
+    if command_route.priority == 'high':
+      self._high_priority_commands.append(queued_command)
+    elif not (command_route.coalesce and self._coalesce(queued_command)):
+      self._normal_priority_commands.append(queued_command)
+    self._max_depth = max(self._max_depth, self.depth)
+
+    if not self._running:
+      self._run_next_command()
+
+    return queued_command.deferred
+
+  def get_stats(self):
+    """ Returns statistics about the queue.
+
+    @return Returns a dictionary containing the queue's current and maximum depths, the number of commands that have
+            been executed and coalesced, and the average and maximum times (in seconds) that commands waited in the
+            queue before being executed.
+    """
+
+    return {
+      'depth': self.depth,
+      'max_depth': self._max_depth,
+      'running': self._running,
+      'commands_executed': self._commands_executed,
+      'commands_coalesced': self._commands_coalesced,
+      'average_wait_time': (self._total_wait_time/self._commands_executed) if self._commands_executed > 0 else 0.0,
+      'max_wait_time': self._max_wait_time
+    }
+
+  def _coalesce(self, queued_command):
+    """ Replaces a queued command of the same type with the provided command.
+
+    The newer command takes the place of the superseded command in the queue. The superseded command's deferred will be
+    fired with a CommandError.
+
+    @param queued_command  The QueuedCommand to coalesce.
+    @return Returns True if a queued command was replaced and False otherwise.
+    """
+
+    for queue_index, pending_command in enumerate(self._normal_priority_commands):
+      if pending_command.route.command == queued_command.route.command:
+        self._normal_priority_commands[queue_index] = queued_command
+        self._commands_coalesced += 1
+
+        superseded_command = pending_command.command
+        pending_command.deferred.errback(command.CommandError("The command was superseded by a newer '"+
+                                                              superseded_command.command+"' command before it was "+
+                                                              "executed.",
+                                                              {"command": superseded_command.command,
+                                                               "destination": superseded_command.full_destination,
+                                                               "superseded": True}))
+        return True
+
+    return False
+
+  def _run_next_command(self):
+    """ Executes the queued commands until the queue is empty or a command doesn't finish right away.
+
+    @note Commands that return their results directly (or in a deferred that has already fired) finish before their
+          command function returns. The queue is drained in a loop in that case, instead of having _command_finished()
+          start the next command, so that a long run of such commands doesn't recurse once per command.
+    """
+
+    self._draining = True
+    while True:
+      if self._high_priority_commands:
+        next_command = self._high_priority_commands.popleft()
+      elif self._normal_priority_commands:
+        next_command = self._normal_priority_commands.popleft()
+      else:
+        self._running = False
+        break
+
+      # Record the queue statistics
+      wait_time = time.time() - next_command.queued_at
+      self._commands_executed += 1
+      self._total_wait_time += wait_time
+      self._max_wait_time = max(self._max_wait_time, wait_time)
+
+      # Run the command
+      self._running = True
+      self._finished_immediately = False
+      command_deferred = defer.maybeDeferred(next_command.route.command_function, next_command.command)
+      command_deferred.addBoth(self._command_finished, next_command)
+      if not self._finished_immediately:
+        break
+    self._draining = False
+
+  def _command_finished(self, command_results, finished_command):
+    """ Passes the results of the command to its deferred and starts the next command.
+
+    @param command_results   The results of the command (or a Failure if the command failed).
+    @param finished_command  The QueuedCommand that finished.
+    """
+
+    finished_command.deferred.callback(command_results)
+    if self._draining:
+      # The command finished while _run_next_command() was starting it, which will start the next command itself
+      self._finished_immediately = True
+    else:
+      self._run_next_command()
+
+class QueuedCommand:
+  """ Represents a command waiting in a DeviceCommandQueue.
+  """
+
+  def __init__(self, command_route, active_command):
+    """ Sets up the queued command.
+
+    @param command_route   The CommandRoute for the command.
+    @param active_command  The Command to execute.
+    """
+
+    self.route = command_route
+    self.command = active_command
+    self.deferred = defer.Deferred()
+    self.queued_at = time.time()
@@ -0,0 +1,165 @@
+""" @package hwm.command.routing
+Maintains a routing table that maps command destinations to command handler methods.
+
+This module contains classes that index the commands offered by the system and device command handlers so that the
+command parser can locate the method (and meta-data) for a command with a single dictionary lookup, instead of walking
+the pipelines, devices, and command handlers every time a command is received.
+"""
+
+# Import required modules
+import logging
+from hwm.command import validation
+from hwm.hardware.devices.drivers import driver
+
+class RoutingTable:
+  """ Indexes the commands offered by a set of command handlers.
+
+  Routes are keyed by the command's full destination (e.g. "system" or "pipeline_id.device_id") and the command name.
+  The routing table is rebuilt by the command parser whenever the set of loaded pipelines and devices changes.
+  """
+
+  def __init__(self):
+    """ Sets up the routing table.
+    """
+
+    self._routes = {}
+
+  def build(self, system_handlers, pipelines):
+    """ Rebuilds the routing table from scratch.
+
+    @param system_handlers  A dictionary containing the system command handlers, keyed by their destination.
+    @param pipelines        A dictionary containing all of the loaded Pipeline objects, keyed by pipeline ID. May be
+                            None if the pipelines haven't been loaded yet.
+    @return Returns the number of routes in the rebuilt routing table.
+    """
+
+    self._routes = {}
+
+    # Index the system command handlers
+    for handler_name, command_handler in system_handlers.iteritems():
+      self.add_command_handler(command_handler, handler_name)
+
+    # Index the command handlers of every device in every pipeline
+    if pipelines is not None:
+      for pipeline_id, pipeline in pipelines.iteritems():
+        for device_id, device in pipeline.devices.iteritems():
+          try:
+            command_handler = device.get_command_handler()
+          except driver.CommandHandlerNotDefined:
+            continue
+
+          self.add_command_handler(command_handler, pipeline_id+"."+device_id, pipeline_id)
+
+    return len(self._routes)
+
+  def add_command_handler(self, command_handler, full_destination, pipeline_id = None):
+    """ Adds routes for every command offered by the specified command handler.
+
+    @param command_handler   The command handler (system or device) to index.
+    @param full_destination  The full destination that commands for this handler will be addressed to.
+    @param pipeline_id       The ID of the pipeline that contains the handler's device, or None for system handlers.
+    """
+
+    for attribute_name in dir(command_handler):
+      if attribute_name.startswith('command_'):
+        self.add_route(CommandRoute(command_handler, attribute_name[len('command_'):], full_destination, pipeline_id))
+
+  def add_route(self, command_route):
+    """ Adds (or replaces) a single route in the routing table.
+
+    @param command_route  The CommandRoute to add.
+    """
+
+    self._routes[(command_route.full_destination, command_route.command)] = command_route
+
+  def get_route(self, full_destination, command_name):
+    """ Looks up the route for the specified command.
+
+    @param full_destination  The command's full destination.
+    @param command_name      The name of the command.
+    @return Returns the matching CommandRoute or None if the command isn't in the routing table.
+    """
+
+    return self._routes.get((full_destination, command_name), None)
+
+  def routes(self):
+    """ Returns every route in the routing table.
+
+    @return Returns a list containing the CommandRoute for every indexed command.
+    """
+
+    return self._routes.values()
+
+  def __len__(self):
+    return len(self._routes)
+
+class CommandRoute:
+  """ Represents a single command offered by a command handler.
+
+  This class stores everything that the command parser needs to execute a command: the bound command method, the
+  command's meta-data (including its queue priority, coalescing, and caching behavior), and the compiled parameter
+  validator. The command's meta-data is loaded once, when the route is created.
+  """
+
+  def __init__(self, command_handler, command_name, full_destination, pipeline_id = None):
+    """ Sets up the command route.
+
+    @param command_handler   The command handler that offers the command.
+    @param command_name      The name of the command (without the "command_" prefix).
+    @param full_destination  The full destination that the command is addressed to.
+    @param pipeline_id       The ID of the pipeline containing the handler's device, or None for system commands.
+    """
+
+    self.command_handler = command_handler
+    self.command = command_name
+    self.full_destination = full_destination
+    self.pipeline_id = pipeline_id
+    self.device_command = pipeline_id is not None
+    self.command_function = getattr(command_handler, 'command_'+command_name)
+
+    # Load the command meta-data and compile the parameter validator
+    self.metadata = self._load_metadata()
+    if self.metadata is not None:
+      self.requires_active_session = self.metadata['requires_active_session']
+      self.priority = self.metadata.get('priority', 'normal')
+      self.coalesce = self.metadata.get('coalesce', False)
+      self.cache_ttl = self.metadata.get('cache_ttl', None)
+      self.parameter_validator = validation.ParameterValidator(self.metadata['parameters'])
+    else:
+      # Command metadata not specified, default to requiring a session for safety
+      self.requires_active_session = True
+      self.priority = 'normal'
+      self.coalesce = False
+      self.cache_ttl = None
+      self.parameter_validator = None
+
+  def validate_parameters(self, active_command):
+    """ Validates the parameters of the provided command against the command's meta-data.
+
+    @throw Raises CommandError if the command's parameters don't satisfy the command's meta-data restrictions.
+
+    @note Commands that don't specify any meta-data will not have their parameters validated. It is up to the command
+          handler to check the parameters of such commands.
+
+    @param active_command  The validated Command whose parameters should be checked.
+    """
+
+    if self.parameter_validator is not None:
+      self.parameter_validator.validate(active_command)
+
+  def _load_metadata(self):
+    """ Loads the command's meta-data from the command handler's "settings_" method.
+
+    @return Returns the command's meta-data dictionary or None if the command doesn't specify any usable meta-data.
+    """
+
+    settings_method = getattr(self.command_handler, 'settings_'+self.command, None)
+    if settings_method is None:
+      return None
+
+    try:
+      return settings_method()
+    except Exception as metadata_error:
+      logging.error("The meta-data for the '"+self.command+"' command offered by the '"+self.full_destination+
+                    "' command handler could not be loaded: "+str(metadata_error))
+      return None
@@ -0,0 +1,289 @@
+""" @package hwm.command.scheduler
+Executes commands at specified times.
+
+This module contains a class that executes time-tagged commands (e.g. the points of a pre-planned antenna trajectory) at
+their requested execution times. Only commands whose meta-data marks them as 'schedulable' may be scheduled (see
+CommandParser.schedule_commands(), which validates and authorizes commands before they're scheduled).
+
+Scheduled commands are stored in a heap ordered by execution time and are executed by a single reactor timer, which is
+always set for the earliest scheduled command. This keeps the cost of scheduling and executing commands logarithmic in
+the number of scheduled commands, even when thousands of commands are scheduled for a single pass. Commands that are
+bound to a session are cancelled automatically when the session ends.
+
+The results of executed commands are kept in the scheduler's own bounded job store, so that a long trajectory doesn't
+push the results of regular command jobs out of the command parser's job store (or publish a job status to the
+pipeline's telemetry stream for every point).
+"""
+
+# Import required modules
+import uuid, heapq, logging
+from hwm.core import stats
+from hwm.command import jobs
+
+class CommandScheduler:
+  """ Executes scheduled commands at their requested times.
+  """
+
+  def __init__(self, command_parser, clock = None, max_scheduled_commands = 100000, max_stored_results = 1000):
+    """ Sets up the command scheduler.
+
+    @param command_parser          The CommandParser that will execute the scheduled commands.
+    @param clock                   The object used to schedule the scheduler's timer (an IReactorTime provider). If
+                                   None, the reactor will be used.
+    @param max_scheduled_commands  The maximum number of commands that may be waiting to be executed at once.
+    @param max_stored_results      The maximum number of executed commands whose results will be kept. Once this limit
+                                   is reached, the oldest results will be discarded.
+    """
+
+    if clock is None:
+      from twisted.internet import reactor as clock
+
+    self.command_parser = command_parser
+    self.clock = clock
+    self.max_scheduled_commands = max_scheduled_commands
+    self._command_heap = []
+    self._scheduled_commands = {}
+    self._session_commands = {}
+    self._sequence = 0
+    self._timer = None
+    self.command_results = jobs.JobManager(max_finished_jobs = max_stored_results)
+
+    # Scheduler statistics
+    self.commands_scheduled = 0
+    self.commands_executed = 0
+    self.commands_cancelled = 0
+    self.firing_jitter = stats.LatencyHistogram()
+
+  @property
+  def pending(self):
+    """ The number of commands waiting to be executed.
+    """
+
+    return len(self._scheduled_commands)
+
+  def seconds(self):
+    """ Returns the scheduler's current time.
+
+    @return Returns the current time (UNIX timestamp) according to the scheduler's clock.
+    """
+
+    return self.clock.seconds()
+
+  def add(self, scheduled_commands):
+    """ Adds a group of validated commands to the schedule.
+
+    @throw Throws SchedulerFull if adding the commands would exceed the scheduler's limit. In this case, none of the
+           commands will be scheduled.
+
+    @param scheduled_commands  A list of ScheduledCommand objects to schedule.
+    @return Returns a list containing the schedule IDs of the new commands.
+    """
+
+    if self.pending + len(scheduled_commands) > self.max_scheduled_commands:
+      raise SchedulerFull("The command scheduler can't hold any more commands (limit: "+
+                          str(self.max_scheduled_commands)+").")
+
+    for scheduled_command in scheduled_commands:
+      self._sequence += 1
+      heapq.heappush(self._command_heap, (scheduled_command.execute_at, self._sequence, scheduled_command))
+      self._scheduled_commands[scheduled_command.schedule_id] = scheduled_command
+      if scheduled_command.session_id is not None:
+        self._session_commands.setdefault(scheduled_command.session_id, set()).add(scheduled_command.schedule_id)
+      self.commands_scheduled += 1
+
+    self._reset_timer()
+
+    return [scheduled_command.schedule_id for scheduled_command in scheduled_commands]
+
+  def get_command(self, schedule_id, user_id, ignore_owner = False):
+    """ Loads a scheduled command that hasn't been executed yet.
+
+    @param schedule_id   The schedule ID of the command.
+    @param user_id       The ID of the user requesting the command.
+    @param ignore_owner  Whether or not to skip the ownership check (e.g. for kernel mode commands).
+    @return Returns the ScheduledCommand, or None if it doesn't exist, has already been executed or cancelled, or
+            belongs to another user.
+    """
+
+    scheduled_command = self._scheduled_commands.get(schedule_id, None)
+    if scheduled_command is None or (not ignore_owner and scheduled_command.user_id != user_id):
+      return None
+
+    return scheduled_command
+
+  def get_result(self, schedule_id, user_id, ignore_owner = False):
+    """ Loads the results of a scheduled command that has been executed (or is being executed).
+
+    @param schedule_id   The schedule ID of the command.
+    @param user_id       The ID of the user requesting the results.
+    @param ignore_owner  Whether or not to skip the ownership check (e.g. for kernel mode commands).
+    @return Returns the command's Job (whose job ID is its schedule ID), or None if the command hasn't been executed, 
+            its results have been discarded, or it belongs to another user.
+    """
+
+    return self.command_results.get_job(schedule_id, user_id, ignore_owner = ignore_owner)
+
+  def cancel(self, schedule_id):
+    """ Cancels a scheduled command.
+
+    @param schedule_id  The schedule ID of the command to cancel.
+    @return Returns True if the command was cancelled and False if it doesn't exist or has already been executed.
+    """
+
+    scheduled_command = self._scheduled_commands.pop(schedule_id, None)
+    if scheduled_command is None:
+      return False
+
+    # The command is removed from the heap lazily, when it reaches the top (or the heap is compacted)
+    scheduled_command.cancelled = True
+    if scheduled_command.session_id is not None:
+      session_commands = self._session_commands.get(scheduled_command.session_id, None)
+      if session_commands is not None:
+        session_commands.discard(schedule_id)
+        if not session_commands:
+          del self._session_commands[scheduled_command.session_id]
+    self.commands_cancelled += 1
+
+    # Compact the heap if it's mostly made up of cancelled commands
+    if len(self._command_heap) > 64 and len(self._command_heap) > 2*self.pending:
+      self._command_heap = [heap_entry for heap_entry in self._command_heap if not heap_entry[2].cancelled]
+      heapq.heapify(self._command_heap)
+    self._reset_timer()
+
+    return True
+
+  def cancel_session_commands(self, session_id):
+    """ Cancels all of the commands bound to the specified session. Called when the session ends.
+
+    @param session_id  The ID of the session (reservation) that ended.
+    @return Returns the number of commands that were cancelled.
+    """
+
+    session_commands = list(self._session_commands.get(session_id, []))
+    for schedule_id in session_commands:
+      self.cancel(schedule_id)
+
+    if session_commands:
+      logging.info("Cancelled "+str(len(session_commands))+" scheduled commands after the '"+str(session_id)+
+                   "' session ended.")
+
+    return len(session_commands)
+
+  def get_stats(self):
+    """ Returns statistics about the command scheduler.
+
+    @return Returns a dictionary containing the number of pending, scheduled, executed, and cancelled commands, the 
+            statistics of the executed commands' result store (see JobManager.get_stats()), and statistics about how 
+            late (in milliseconds) commands were executed relative to their requested execution times (see 
+            LatencyHistogram.get_stats()).
+    """
+
+    return {
+      'pending': self.pending,
+      'scheduled': self.commands_scheduled,
+      'executed': self.commands_executed,
+      'cancelled': self.commands_cancelled,
+      'results': self.command_results.get_stats(),
+      'firing_jitter': self.firing_jitter.get_stats()
+    }
+
+  def _reset_timer(self):
+    """ Sets the scheduler's timer for the earliest scheduled command (or stops it if there aren't any).
+    """
+
+    # Drop cancelled commands from the top of the heap
+    while self._command_heap and self._command_heap[0][2].cancelled:
+      heapq.heappop(self._command_heap)
+
+    if not self._command_heap:
+      if self._timer is not None and self._timer.active():
+        self._timer.cancel()
+      self._timer = None
+      return
+
+    next_execution_time = self._command_heap[0][0]
+    timer_delay = max(next_execution_time - self.clock.seconds(), 0)
+    if self._timer is not None and self._timer.active():
+      if self._timer.getTime() != next_execution_time:
+        self._timer.reset(timer_delay)
+    else:
+      self._timer = self.clock.callLater(timer_delay, self._execute_due_commands)
+
+  def _execute_due_commands(self):
+    """ Executes every scheduled command whose execution time has arrived.
+    """
+
+    self._timer = None
+    current_time = self.clock.seconds()
+
+    while self._command_heap and self._command_heap[0][0] <= current_time:
+      execute_at, sequence, scheduled_command = heapq.heappop(self._command_heap)
+      if scheduled_command.cancelled:
+        continue
+
+      # Remove the command from the indexes and execute it
+      del self._scheduled_commands[scheduled_command.schedule_id]
+      if scheduled_command.session_id is not None:
+        session_commands = self._session_commands.get(scheduled_command.session_id, None)
+        if session_commands is not None:
+          session_commands.discard(scheduled_command.schedule_id)
+          if not session_commands:
+            del self._session_commands[scheduled_command.session_id]
+
+      self.firing_jitter.record(max(current_time - execute_at, 0.0))
+      self.commands_executed += 1
+      self._execute_command(scheduled_command)
+
+    self._reset_timer()
+
+  def _execute_command(self, scheduled_command):
+    """ Executes a scheduled command.
+
+    The command is executed using CommandParser.parse_command(), so its permission and session requirements are checked
+    again when it's executed. Its results are tracked as a job in the scheduler's result store (whose job ID is the 
+    command's schedule ID), so that they can be loaded using the system 'job_status' command.
+
+    @param scheduled_command  The ScheduledCommand to execute.
+    """
+
+    command_deferred = self.command_parser.parse_command(scheduled_command.command, user_id = scheduled_command.user_id,
+                                                         kernel_mode = scheduled_command.kernel_mode)
+    self.command_results.submit(command_deferred, scheduled_command.user_id, job_id = scheduled_command.schedule_id)
+
+class ScheduledCommand:
+  """ Represents a command waiting to be executed by the scheduler.
+  """
+
+  def __init__(self, command, execute_at, user_id = None, kernel_mode = False, session_id = None):
+    """ Sets up the scheduled command.
+
+    @param command      The command dictionary to execute.
+    @param execute_at   When the command should be executed (UNIX timestamp, may be fractional).
+    @param user_id      The ID of the user that scheduled the command.
+    @param kernel_mode  Whether or not the command should be executed in kernel mode.
+    @param session_id   The ID of the session (reservation) that the command belongs to, or None if the command isn't
+                        bound to a session. Commands bound to a session are cancelled when the session ends.
+    """
+
+    self.schedule_id = uuid.uuid4().hex
+    self.command = command
+    self.execute_at = execute_at
+    self.user_id = user_id
+    self.kernel_mode = kernel_mode
+    self.session_id = session_id
+    self.cancelled = False
+
+  def get_status(self):
+    """ Returns a dictionary describing the scheduled command.
+    """
+
+    return {
+      'schedule_id': self.schedule_id,
+      'execute_at': self.execute_at,
+      'command': self.command.get('command', None),
+      'destination': self.command.get('destination', None),
+      'session_id': self.session_id
+    }
+
+class SchedulerFull(Exception):
+  pass
@@ -0,0 +1,159 @@
+""" @package hwm.command.stats
+Records command latency statistics.
+
+This module contains classes that record how long each stage of a command's execution takes (e.g. schema validation,
+permission loading, routing, and execution by the command handler). The command parser records the stage timings of
+every command and aggregates them into per-destination, per-command latency histograms and error counts, which can be
+retrieved using the system 'command_stats' command.
+
+Recording a stage only requires a clock read and a dictionary update, and the histograms use a fixed set of buckets, so
+the statistics can be left on during normal operation.
+"""
+
+# Import required modules
+import time
+from hwm.core.stats import LatencyHistogram
+
+class CommandTiming:
+  """ Records the time spent in each stage of a single command's execution.
+
+  @note Python 2 doesn't provide a monotonic clock, so stage durations are clamped to zero in case the system clock is
+        stepped backwards while a command is executing.
+  """
+
+  def __init__(self):
+    """ Starts timing the command.
+    """
+
+    self.started_at = time.time()
+    self.stages = {}
+    self._last_mark = self.started_at
+
+  def mark(self, stage):
+    """ Records the end of a command execution stage.
+
+    The stage's duration is measured from the end of the previous stage (or the start of the command).
+
+    @param stage  The name of the stage that just finished.
+    """
+
+    current_time = time.time()
+    self.stages[stage] = max(current_time - self._last_mark, 0.0)
+    self._last_mark = current_time
+
+  def finish(self):
+    """ Records the end of the command's execution stage and its total duration.
+    """
+
+    self.mark('execution')
+    self.stages['total'] = max(self._last_mark - self.started_at, 0.0)
+
+class CommandStats:
+  """ Aggregates the stage timings and errors of every command executed by the command parser.
+  """
+
+  def __init__(self):
+    """ Sets up the command statistics.
+    """
+
+    self._command_stats = {}
+    self.commands_completed = 0
+    self.commands_failed = 0
+    self.commands_rejected = 0
+
+  def record(self, full_destination, command_name, command_timing, succeeded):
+    """ Records the results of a command.
+
+    @param full_destination  The full destination of the command, or None if the command couldn't be routed.
+    @param command_name      The name of the command, or None if the command couldn't be routed.
+    @param command_timing    The CommandTiming recorded for the command.
+    @param succeeded         Whether or not the command was successful.
+    """
+
+    if succeeded:
+      self.commands_completed += 1
+    else:
+      self.commands_failed += 1
+
+    # Commands that were rejected before they could be routed are only counted, to keep the statistics bounded
+    if full_destination is None or command_name is None:
+      self.commands_rejected += 1
+      return
+
+    stats_key = (full_destination, command_name)
+    latency_stats = self._command_stats.get(stats_key, None)
+    if latency_stats is None:
+      latency_stats = CommandLatencyStats()
+      self._command_stats[stats_key] = latency_stats
+    latency_stats.record(command_timing, succeeded)
+
+  def get_stats(self):
+    """ Returns the aggregated command statistics.
+
+    @return Returns a dictionary containing the overall command counts and a 'destinations' dictionary which contains
+            the statistics for each command (see CommandLatencyStats.get_stats()) keyed by destination and command name.
+    """
+
+    destination_stats = {}
+    for (full_destination, command_name), latency_stats in self._command_stats.iteritems():
+      destination_stats.setdefault(full_destination, {})[command_name] = latency_stats.get_stats()
+
+    return {
+      'completed': self.commands_completed,
+      'failed': self.commands_failed,
+      'rejected': self.commands_rejected,
+      'destinations': destination_stats
+    }
+
+  def reset(self):
+    """ Clears all of the recorded statistics.
+    """
+
+    self.__init__()
+
+class CommandLatencyStats:
+  """ Stores the latency histograms and error count for a single command.
+  """
+
+  def __init__(self):
+    """ Sets up the command's statistics.
+    """
+
+    self.count = 0
+    self.errors = 0
+    self.histograms = {}
+
+  def record(self, command_timing, succeeded):
+    """ Adds a command's stage timings to the histograms.
+
+    @param command_timing  The CommandTiming recorded for the command.
+    @param succeeded       Whether or not the command was successful.
+    """
+
+    self.count += 1
+    if not succeeded:
+      self.errors += 1
+
+    for stage, duration in command_timing.stages.iteritems():
+      histogram = self.histograms.get(stage, None)
+      if histogram is None:
+        histogram = LatencyHistogram()
+        self.histograms[stage] = histogram
+      histogram.record(duration)
+
+  def get_stats(self):
+    """ Returns the command's statistics.
+
+    @return Returns a dictionary containing the number of times the command was executed, the number of errors, and the
+            latency statistics for each stage (see LatencyHistogram.get_stats()).
+    """
+
+    stage_stats = {}
+    for stage, histogram in self.histograms.iteritems():
+      stage_stats[stage] = histogram.get_stats()
+
+    return {
+      'count': self.count,
+      'errors': self.errors,
+      'stages': stage_stats
+    }
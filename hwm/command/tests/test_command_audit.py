@@ -0,0 +1,151 @@
+# Import required modules
+import logging, os, json, zlib
+from pkg_resources import Requirement, resource_filename
+from twisted.trial import unittest
+from twisted.internet.defer import inlineCallbacks
+from mock import MagicMock, patch
+from hwm.command import audit, parser
+from hwm.command.handlers import system as command_handler
+from hwm.network.security import permissions
+
+class TestCommandAudit(unittest.TestCase):
+  """ This test suite verifies the functionality of the command audit log, which writes a record of every command to
+  rotating, compressed files from a background thread.
+  """
+
+  def setUp(self):
+    # Disable logging for most events
+    logging.disable(logging.CRITICAL)
+
+    self.log_directory = self.mktemp()
+    os.makedirs(self.log_directory)
+
+  def _test_record(self, timestamp, user_id = "4", command_name = "station_time"):
+    return (timestamp, json.dumps({'timestamp': timestamp, 'received_at': int(timestamp), 'user_id': user_id,
+                                   'kernel_mode': False, 'destination': "system", 'command': command_name,
+                                   'parameters': None, 'status': 'okay', 'timing': {'total': 0.001},
+                                   'result_size': 20}, sort_keys = True))
+
+  @inlineCallbacks
+  def test_parser_audit_records(self):
+    """ Verifies that the command parser writes an audit record for successful and failed commands.
+    """
+
+    source_data_directory = resource_filename(Requirement.parse("Mercury2HWM"), "hwm")
+    permission_manager = permissions.PermissionManager(source_data_directory+
+                                                       '/network/security/tests/data/test_permissions_valid.json', 3600)
+    command_parser = parser.CommandParser([command_handler.SystemCommandHandler('system')], permission_manager)
+    command_parser.session_coordinator = MagicMock()
+    command_parser.session_coordinator.load_user_sessions.return_value = []
+    command_parser.audit_log = audit.AuditLog(self.log_directory, flush_interval = 0.01)
+    command_parser.audit_log.start()
+
+    # Execute a successful and a failed command
+    yield command_parser.parse_command({'command': "station_time", 'destination': "system"}, user_id = "4")
+    test_deferred = command_parser.parse_command({'command': "nonexistent_command", 'destination': "system"},
+                                                 user_id = "4")
+    yield self.assertFailure(test_deferred, parser.CommandFailed)
+    command_parser.audit_log.stop()
+
+    # Check the records
+    audit_records = list(audit.query_audit_log(self.log_directory))
+    self.assertEqual(len(audit_records), 2)
+    self.assertEqual(audit_records[0]['user_id'], "4")
+    self.assertEqual(audit_records[0]['destination'], "system")
+    self.assertEqual(audit_records[0]['command'], "station_time")
+    self.assertEqual(audit_records[0]['status'], 'okay')
+    self.assertTrue(audit_records[0]['result_size'] > 0)
+    self.assertTrue('total' in audit_records[0]['timing'])
+    self.assertEqual(audit_records[1]['command'], "nonexistent_command")
+    self.assertEqual(audit_records[1]['status'], 'error')
+    self.assertEqual(command_parser.audit_log.get_stats()['written'], 2)
+
+  def test_queue_overflow(self):
+    """ Checks that records are dropped and counted, instead of blocking, once the queue is full.
+    """
+
+    audit_log = audit.AuditLog(self.log_directory, max_queue_size = 2)
+    test_command = MagicMock(time_received = 100, user_id = "4", kernel_mode = False, command = "test_command",
+                             parameters = None, timing = None)
+    for command_index in range(3):
+      audit_log.record(test_command, {'response': {'status': 'okay', 'result': {}}})
+
+    self.assertEqual(audit_log.get_stats()['queued'], 2)
+    self.assertEqual(audit_log.get_stats()['dropped'], 1)
+
+  def test_record_serialization(self):
+    """ Makes sure that records are serialized when they're submitted, so that the writer thread isn't affected by
+    later changes to the command's parameters or result.
+    """
+
+    audit_log = audit.AuditLog(self.log_directory)
+    test_command = MagicMock(time_received = 100, user_id = "4", kernel_mode = False, command = "test_command",
+                             parameters = {'value': 1}, timing = None)
+    test_result = {'items': [1, 2, 3]}
+    audit_log.record(test_command, {'response': {'status': 'okay', 'destination': "system", 'result': test_result}})
+    test_command.parameters['value'] = 2
+    test_result['items'].append(4)
+
+    audit_log._write_batch([audit_log._queue.get_nowait()])
+    audit_records = list(audit.query_audit_log(self.log_directory))
+    self.assertEqual(audit_records[0]['parameters'], {'value': 1})
+    self.assertEqual(audit_records[0]['result_size'], len(json.dumps({'items': [1, 2, 3]})))
+
+  def test_rotation_and_query(self):
+    """ Verifies that full audit files are archived with their time ranges and that queries only load the records in
+    the requested range.
+    """
+
+    audit_log = audit.AuditLog(self.log_directory, max_file_size = 1, max_archived_files = 3)
+    audit_log._write_batch([self._test_record(100.5), self._test_record(150.0, user_id = "1")])
+    audit_log._write_batch([self._test_record(200.0), self._test_record(250.0)])
+    audit_log._write_batch([self._test_record(300.0, command_name = "job_status")])
+
+    # Check the archive names
+    archived_files = audit.list_archived_files(self.log_directory)
+    self.assertEqual([(range_start, range_end) for range_start, range_end, file_path in archived_files],
+                     [(100, 151), (200, 251), (300, 301)])
+    self.assertFalse(os.path.exists(os.path.join(self.log_directory, audit.ACTIVE_FILE_NAME)))
+
+    # Query the records
+    self.assertEqual(len(list(audit.query_audit_log(self.log_directory))), 5)
+    self.assertEqual([audit_record['timestamp'] for audit_record in audit.query_audit_log(self.log_directory, 150, 300)],
+                     [150.0, 200.0, 250.0])
+    self.assertEqual(len(list(audit.query_audit_log(self.log_directory, user_id = "1"))), 1)
+    self.assertEqual(len(list(audit.query_audit_log(self.log_directory, command_name = "job_status"))), 1)
+
+    # Make sure archives outside of the time range aren't opened
+    with patch.object(audit, 'read_audit_file', wraps = audit.read_audit_file) as mock_read_audit_file:
+      self.assertEqual(len(list(audit.query_audit_log(self.log_directory, 200))), 3)
+      self.assertEqual([read_call[0][0] for read_call in mock_read_audit_file.call_args_list],
+                       [archived_files[1][2], archived_files[2][2]])
+
+    # The oldest archive should be deleted once there are too many
+    audit_log._write_batch([self._test_record(400.0)])
+    archived_files = audit.list_archived_files(self.log_directory)
+    self.assertEqual([range_start for range_start, range_end, file_path in archived_files], [200, 300, 400])
+    self.assertEqual(audit_log.get_stats()['archived_files'], 4)
+
+  def test_interrupted_writes(self):
+    """ Verifies that partially written batches are skipped and that an active file left over from a previous run is
+    archived when the audit log starts.
+    """
+
+    audit_log = audit.AuditLog(self.log_directory)
+    audit_log._write_batch([self._test_record(100.0), self._test_record(110.0)])
+    audit_log._write_batch([self._test_record(120.0)])
+
+    # Simulate a batch that was interrupted while being written
+    active_file_path = os.path.join(self.log_directory, audit.ACTIVE_FILE_NAME)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    partial_batch = compressor.compress('{"timestamp": 130.0}\n{"timestamp": 14') + compressor.flush()
+    with open(active_file_path, 'ab') as active_file:
+      active_file.write(partial_batch[:len(partial_batch)-4])
+    self.assertEqual([audit_record['timestamp'] for audit_record in audit.read_audit_file(active_file_path)],
+                     [100.0, 110.0, 120.0, 130.0])
+
+    # Start a new audit log, which should archive the existing file
+    audit_log = audit.AuditLog(self.log_directory)
+    audit_log._archive_active_file()
+    archived_files = audit.list_archived_files(self.log_directory)
+    self.assertEqual([(range_start, range_end) for range_start, range_end, file_path in archived_files], [(100, 131)])
@@ -0,0 +1,179 @@
+# Import required modules
+import logging
+from twisted.trial import unittest
+from twisted.internet import defer
+from mock import MagicMock, patch
+from hwm.command import cache, command, metadata
+
+class TestCommandResultCache(unittest.TestCase):
+  """ This test suite verifies the functionality of the command result cache, which caches the results of read-only
+  commands and collapses concurrent identical requests.
+  """
+
+  def setUp(self):
+    # Disable logging for most events
+    logging.disable(logging.CRITICAL)
+
+    # Keep track of the command executions
+    self.command_deferreds = []
+
+  def test_single_flight(self):
+    """ Verifies that concurrent identical requests are collapsed into a single command execution and that each request
+    receives its own copy of the results.
+    """
+
+    result_cache = cache.CommandResultCache()
+    test_route = self._create_route("get_state")
+
+    first_deferred = result_cache.load(test_route, self._create_command("get_state"), self._execute_command)
+    second_deferred = result_cache.load(test_route, self._create_command("get_state"), self._execute_command)
+    self.assertEqual(len(self.command_deferreds), 1)
+
+    # Finish the command, both requests should get the results
+    self.command_deferreds[0].callback({'azimuth': 10})
+    first_results = self.successResultOf(first_deferred)
+    second_results = self.successResultOf(second_deferred)
+    self.assertEqual(first_results, {'azimuth': 10})
+    self.assertEqual(second_results, {'azimuth': 10})
+    self.assertTrue(first_results is not second_results)
+
+    # The next request should be served from the cache
+    third_deferred = result_cache.load(test_route, self._create_command("get_state"), self._execute_command)
+    self.assertEqual(self.successResultOf(third_deferred), {'azimuth': 10})
+    self.assertEqual(len(self.command_deferreds), 1)
+
+    cache_stats = result_cache.get_stats()
+    self.assertEqual(cache_stats['hits'], 1)
+    self.assertEqual(cache_stats['misses'], 1)
+    self.assertEqual(cache_stats['coalesced'], 1)
+    self.assertEqual(cache_stats['in_flight'], 0)
+
+  def test_cache_keys(self):
+    """ Tests that commands with different parameters or destinations are cached separately.
+    """
+
+    result_cache = cache.CommandResultCache()
+    result_cache.load(self._create_route("get_state"), self._create_command("get_state", {'a': 1, 'b': 2}),
+                      self._execute_command)
+    result_cache.load(self._create_route("get_state"), self._create_command("get_state", {'b': 2, 'a': 1}),
+                      self._execute_command)
+    result_cache.load(self._create_route("get_state"), self._create_command("get_state", {'a': 2}),
+                      self._execute_command)
+    result_cache.load(self._create_route("get_state", "test_pipeline.other_device"),
+                      self._create_command("get_state", {'a': 1, 'b': 2}), self._execute_command)
+    self.assertEqual(len(self.command_deferreds), 3)
+
+  def test_failures_not_cached(self):
+    """ Verifies that command failures are passed to every waiting request but aren't cached.
+    """
+
+    result_cache = cache.CommandResultCache()
+    test_route = self._create_route("get_state")
+
+    first_deferred = result_cache.load(test_route, self._create_command("get_state"), self._execute_command)
+    second_deferred = result_cache.load(test_route, self._create_command("get_state"), self._execute_command)
+    self.command_deferreds[0].errback(command.CommandError("Controller offline."))
+    self.failureResultOf(first_deferred, command.CommandError)
+    self.failureResultOf(second_deferred, command.CommandError)
+
+    # The command should be executed again
+    result_cache.load(test_route, self._create_command("get_state"), self._execute_command)
+    self.assertEqual(len(self.command_deferreds), 2)
+    self.assertEqual(result_cache.get_stats()['entries'], 0)
+
+  def test_result_expiration(self):
+    """ Tests that cached results are only served until their TTL expires.
+    """
+
+    result_cache = cache.CommandResultCache()
+    test_route = self._create_route("get_state")
+
+    with patch('hwm.command.cache.time') as mock_time:
+      mock_time.time.return_value = 1000
+      result_cache.load(test_route, self._create_command("get_state"), self._execute_command)
+      self.command_deferreds[0].callback({'azimuth': 10})
+
+      # Still valid
+      mock_time.time.return_value = 1004.9
+      result_deferred = result_cache.load(test_route, self._create_command("get_state"), self._execute_command)
+      self.assertEqual(self.successResultOf(result_deferred), {'azimuth': 10})
+      self.assertEqual(len(self.command_deferreds), 1)
+
+      # Expired
+      mock_time.time.return_value = 1005
+      result_deferred = result_cache.load(test_route, self._create_command("get_state"), self._execute_command)
+      self.assertEqual(len(self.command_deferreds), 2)
+      self.command_deferreds[1].callback({'azimuth': 20})
+      self.assertEqual(self.successResultOf(result_deferred), {'azimuth': 20})
+
+  def test_lru_eviction(self):
+    """ Verifies that the least recently used results are evicted once the cache is full and that results can be
+    invalidated.
+    """
+
+    result_cache = cache.CommandResultCache(max_entries = 2)
+    for command_name in ["command_a", "command_b"]:
+      result_cache.load(self._create_route(command_name), self._create_command(command_name), self._execute_command)
+      self.command_deferreds[-1].callback(command_name)
+
+    # Use command_a so that command_b is the least recently used
+    result_cache.load(self._create_route("command_a"), self._create_command("command_a"), self._execute_command)
+    result_cache.load(self._create_route("command_c"), self._create_command("command_c"), self._execute_command)
+    self.command_deferreds[-1].callback("command_c")
+    self.assertEqual(result_cache.get_stats()['evictions'], 1)
+
+    result_cache.load(self._create_route("command_a"), self._create_command("command_a"), self._execute_command)
+    self.assertEqual(len(self.command_deferreds), 3)
+    result_cache.load(self._create_route("command_b"), self._create_command("command_b"), self._execute_command)
+    self.assertEqual(len(self.command_deferreds), 4)
+
+    # Invalidate the cache
+    self.command_deferreds[-1].callback("command_b")
+    result_cache.invalidate("test_pipeline.other_device")
+    self.assertEqual(result_cache.get_stats()['entries'], 2)
+    result_cache.invalidate("test_pipeline.test_device")
+    self.assertEqual(result_cache.get_stats()['entries'], 0)
+
+  def test_metadata_cache_ttl(self):
+    """ Checks that the command meta-data generation function validates command cache TTLs.
+    """
+
+    self.assertEqual(metadata.build_metadata_dict([], 'get_state', 'test_device', cache_ttl = 1)['cache_ttl'], 1)
+    self.assertEqual(metadata.build_metadata_dict([], 'move', 'test_device')['cache_ttl'], None)
+    self.assertRaises(metadata.InvalidCommandMetadata, metadata.build_metadata_dict, [], 'get_state', 'test_device',
+                      cache_ttl = 0)
+    self.assertRaises(metadata.InvalidCommandMetadata, metadata.build_metadata_dict, [], 'get_state', 'test_device',
+                      cache_ttl = "5")
+
+  def _execute_command(self):
+    """ Simulates the execution of a command, returning a deferred controlled by the test.
+    """
+
+    command_deferred = defer.Deferred()
+    self.command_deferreds.append(command_deferred)
+
+    return command_deferred
+
+  def _create_route(self, command_name, destination = "test_pipeline.test_device", cache_ttl = 5):
+    """ Creates a mock CommandRoute for a cacheable command.
+    """
+
+    command_route = MagicMock()
+    command_route.command = command_name
+    command_route.full_destination = destination
+    command_route.cache_ttl = cache_ttl
+
+    return command_route
+
+  def _create_command(self, command_name, parameters = None):
+    """ Creates a validated Command for the test device.
+    """
+
+    command_dict = {'command': command_name, 'destination': "test_pipeline.test_device"}
+    if parameters is not None:
+      command_dict['parameters'] = parameters
+
+    test_command = command.Command(0, command_dict, kernel_mode = True)
+    test_command.skip_validation()
+
+    return test_command
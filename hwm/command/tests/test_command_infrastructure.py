@@ -1,12 +1,14 @@
 # Import required modules
-import logging, time, json
+import logging, time, json, StringIO
 from pkg_resources import Requirement, resource_filename
 from twisted.trial import unittest
 from mock import MagicMock
 from twisted.test import proto_helpers
-from twisted.internet.defer import inlineCallbacks
+from twisted.web.test.requesthelper import DummyRequest
+from twisted.internet.defer import inlineCallbacks, Deferred
+from twisted.internet import task
 from hwm.core.configuration import *
-from hwm.command import parser, command, connection, metadata
+from hwm.command import parser, command, connection, metadata, catalog, scheduler
 from hwm.command.handlers import system as command_handler
 from hwm.command.tests import utilities
 from hwm.network.security import permissions
@@ -308,6 +310,118 @@ class TestCommandInfrastructure(unittest.TestCase):
     
     return test_deferred
 
+  @inlineCallbacks
+  def test_parser_invalid_parameters(self):
+    """ Tests that the command parser rejects commands whose parameters don't satisfy the restrictions in the command's
+    meta-data before the command is passed to its command handler.
+    """
+
+    invalid_commands = [
+      ({'command': "set_test_value", 'destination': "test"}, "required 'test_value'"),
+      ({'command': "set_test_value", 'destination': "test", 'parameters': {'test_value': "5"}}, "expected a number"),
+      ({'command': "set_test_value", 'destination': "test", 'parameters': {'test_value': 5.5}}, "expected an integer"),
+      ({'command': "set_test_value", 'destination': "test", 'parameters': {'test_value': 101}}, "less than or equal"),
+      ({'command': "set_test_value", 'destination': "test", 'parameters': {'test_value': 5, 'test_option': "option_c"}},
+       "not a valid option")
+    ]
+
+    for invalid_command, expected_error in invalid_commands:
+      try:
+        yield self.command_parser.parse_command(invalid_command, kernel_mode=True)
+        self.fail("A command with invalid parameters was executed.")
+      except parser.CommandFailed as command_failure:
+        response_dict = command_failure.results['response']
+        self.assertEqual(response_dict['status'], 'error')
+        self.assertTrue(expected_error in response_dict['result']['error_message'])
+        self.assertEqual(response_dict['result']['destination'], 'test')
+
+  @inlineCallbacks
+  def test_parser_valid_parameters(self):
+    """ Verifies that commands with valid parameters are executed normally and that parameters not described by the
+    command's meta-data are ignored by the parameter validator.
+    """
+
+    command_results = yield self.command_parser.parse_command({'command': "set_test_value",
+                                                               'destination': "test",
+                                                               'parameters': {'test_value': 42,
+                                                                              'test_option': "option_b",
+                                                                              'extra_parameter': True}},
+                                                              kernel_mode=True)
+    self.assertEqual(command_results['response']['status'], 'okay')
+    self.assertEqual(command_results['response']['result']['test_value'], 42)
+
+
+  @inlineCallbacks
+  def test_parser_routing_table(self):
+    """ Verifies that the routing table is built when the pipelines are loaded and that commands missing from the
+    routing table are located and added to it.
+    """
+
+    # Make sure the system and device commands were indexed when the pipelines were loaded
+    self.assertTrue(self.command_parser.routing_table.get_route('system', 'station_time') is not None)
+    device_route = self.command_parser.routing_table.get_route('test_pipeline.test_device', 'set_test_value')
+    self.assertTrue(device_route.device_command)
+    self.assertEqual(device_route.pipeline_id, 'test_pipeline')
+    self.assertEqual(device_route.requires_active_session, False)
+    self.assertTrue(self.command_parser.routing_table.get_route('test_pipeline.test_device', 'fake_command') is None)
+
+    # Clear the routing table and make sure commands are still located and routed
+    self.command_parser.routing_table.build({}, None)
+    self.assertEqual(len(self.command_parser.routing_table), 0)
+    command_results = yield self.command_parser.parse_command({'command': "set_test_value",
+                                                               'destination': "test_pipeline.test_device",
+                                                               'parameters': {'test_value': 7}},
+                                                              kernel_mode=True)
+    self.assertEqual(command_results['response']['result']['test_value'], 7)
+    self.assertTrue(self.command_parser.routing_table.get_route('test_pipeline.test_device', 'set_test_value')
+                    is not None)
+
+    # Rebuild the routing table
+    self.assertTrue(self.command_parser.rebuild_routing_table() > 1)
+
+  @inlineCallbacks
+  def test_parser_metadata_catalog(self):
+    """ Verifies that the command meta-data catalog is built with the routing table and that it can be conditionally 
+    loaded using the system 'metadata_catalog' command.
+    """
+
+    # Load the full catalog
+    catalog_response = yield self.command_parser.parse_command({'command': "metadata_catalog",
+                                                                'destination': "system"}, kernel_mode=True)
+    full_catalog = catalog_response['response']['result']
+    self.assertTrue(full_catalog['modified'])
+    self.assertEqual(full_catalog['version'], self.command_parser.metadata_catalog.version)
+    self.assertTrue('station_time' in full_catalog['sections']['system']['commands']['system'])
+    pipeline_section = full_catalog['sections']['test_pipeline']
+    self.assertEqual(pipeline_section['commands']['test_pipeline.test_device']['set_test_value']['command_id'],
+                     'set_test_value')
+
+    # Load the catalog again with the current version
+    catalog_response = yield self.command_parser.parse_command({'command': "metadata_catalog", 'destination': "system",
+                                                                'parameters': {'version': full_catalog['version']}},
+                                                               kernel_mode=True)
+    self.assertEqual(catalog_response['response']['result'], {'version': full_catalog['version'], 'modified': False})
+
+    # Load a single section
+    catalog_response = yield self.command_parser.parse_command({'command': "metadata_catalog", 'destination': "system",
+                                                                'parameters': {'section': "test_pipeline",
+                                                                               'version': "old_version"}},
+                                                               kernel_mode=True)
+    self.assertEqual(catalog_response['response']['result']['version'], pipeline_section['version'])
+    self.assertEqual(catalog_response['response']['result']['commands'], pipeline_section['commands'])
+    test_deferred = self.command_parser.parse_command({'command': "metadata_catalog", 'destination': "system",
+                                                       'parameters': {'section': "nonexistent_pipeline"}},
+                                                      kernel_mode=True)
+    yield self.assertFailure(test_deferred, parser.CommandFailed)
+
+    # Rebuilding the catalog shouldn't change its version unless the commands change
+    self.command_parser.rebuild_routing_table()
+    self.assertEqual(self.command_parser.metadata_catalog.version, full_catalog['version'])
+    self.command_parser.routing_table.build(self.command_parser.system_handlers, None)
+    self.command_parser.metadata_catalog.build(self.command_parser.routing_table)
+    self.assertNotEqual(self.command_parser.metadata_catalog.version, full_catalog['version'])
+    self.assertRaises(catalog.CatalogSectionNotFound, self.command_parser.metadata_catalog.get_catalog, 'test_pipeline')
+
   @inlineCallbacks
   def test_parser_destination_errors(self):
     """ Tests that the command parser can correctly handle invalid destinations.
@@ -449,6 +563,340 @@ class TestCommandInfrastructure(unittest.TestCase):
     
     return test_deferred
 
+  @inlineCallbacks
+  def test_parser_command_batch(self):
+    """ Verifies that the command parser can execute batches of commands in each of the batch modes and that it 
+    aggregates the individual command responses correctly.
+    """
+
+    test_batch = [
+      {'command': "station_time", 'destination': "system"},
+      {'command': "generate_error", 'destination': "test"},
+      {'command': "station_time", 'destination': "system"}
+    ]
+
+    # Run the batch sequentially and in parallel, every command should run
+    for batch_mode in [parser.CommandParser.BATCH_SEQUENTIAL, parser.CommandParser.BATCH_PARALLEL]:
+      batch_results = yield self.command_parser.parse_command_batch(test_batch, user_id="4", mode=batch_mode)
+      batch_response = batch_results['response']
+      self.assertEqual(batch_response['status'], 'error')
+      self.assertEqual(batch_response['mode'], batch_mode)
+      self.assertEqual([command_response['status'] for command_response in batch_response['responses']],
+                       ['okay', 'error', 'okay'])
+      self.assertTrue('timestamp' in batch_response['responses'][0]['result'])
+      self.assertEqual(batch_response['responses'][1]['result']['submitted_command'], 'generate_error')
+
+    # Make sure the batch stops after the failed command
+    batch_results = yield self.command_parser.parse_command_batch(test_batch, user_id="4",
+                                                                  mode=parser.CommandParser.BATCH_STOP_ON_ERROR)
+    batch_response = batch_results['response']
+    self.assertEqual(batch_response['status'], 'error')
+    self.assertEqual(batch_response['responses'][1]['status'], 'error')
+    self.assertEqual(batch_response['responses'][2], None)
+
+    # A batch of successful commands
+    batch_results = yield self.command_parser.parse_command_batch([test_batch[0], test_batch[2]], user_id="4")
+    self.assertEqual(batch_results['response']['status'], 'okay')
+    self.assertEqual(len(batch_results['response']['responses']), 2)
+
+  @inlineCallbacks
+  def test_parser_invalid_command_batch(self):
+    """ Checks that the command parser rejects command batches with an invalid mode or format.
+    """
+
+    invalid_batches = [
+      ([], "fake_mode", "batch mode"),
+      ({}, parser.CommandParser.BATCH_SEQUENTIAL, "must be a list")
+    ]
+
+    for invalid_batch, batch_mode, expected_error in invalid_batches:
+      try:
+        yield self.command_parser.parse_command_batch(invalid_batch, user_id="4", mode=batch_mode)
+        self.fail("An invalid command batch was executed.")
+      except parser.CommandFailed as batch_failure:
+        batch_response = batch_failure.results['response']
+        self.assertEqual(batch_response['status'], 'error')
+        self.assertTrue(expected_error in batch_response['result']['error_message'])
+
+  @inlineCallbacks
+  def test_resource_command_batch(self):
+    """ Tests that CommandResource passes batches of commands (JSON arrays) to the command parser and writes the batch
+    response back to the request.
+    """
+
+    # Create a mock request for a batch from user 4
+    test_request = DummyRequest([''])
+    test_request.method = 'POST'
+    test_request.args = {'mode': [parser.CommandParser.BATCH_STOP_ON_ERROR]}
+    test_request.content = StringIO.StringIO(json.dumps([{'command': "generate_error", 'destination': "test"},
+                                                         {'command': "station_time", 'destination': "system"}]))
+    test_request.transport = MagicMock()
+    test_request.transport.getPeerCertificate.return_value.get_subject.return_value.commonName = "4"
+    request_finished = test_request.notifyFinish()
+
+    command_resource = connection.CommandResource(self.command_parser)
+    command_resource.render_POST(test_request)
+    yield request_finished
+
+    batch_response = json.loads("".join(test_request.written))
+    self.assertEqual(batch_response['mode'], parser.CommandParser.BATCH_STOP_ON_ERROR)
+    self.assertEqual(batch_response['responses'][0]['status'], 'error')
+    self.assertEqual(batch_response['responses'][1], None)
+
+  @inlineCallbacks
+  def test_resource_command_job(self):
+    """ Tests that CommandResource executes commands in job mode when requested and that the results of the job can be
+    loaded using the system 'job_status' command.
+    """
+
+    # Create a mock request for a command job from user 4
+    test_request = DummyRequest([''])
+    test_request.method = 'POST'
+    test_request.args = {'job': ['true']}
+    test_request.content = StringIO.StringIO(json.dumps({'command': "station_time", 'destination': "system"}))
+    test_request.transport = MagicMock()
+    test_request.transport.getPeerCertificate.return_value.get_subject.return_value.commonName = "4"
+    request_finished = test_request.notifyFinish()
+    job_finished = Deferred()
+    self.command_parser.command_jobs.add_listener(job_finished.callback)
+
+    command_resource = connection.CommandResource(self.command_parser)
+    command_resource.render_POST(test_request)
+    yield request_finished
+
+    job_response = json.loads("".join(test_request.written))
+    self.assertEqual(job_response['status'], 'okay')
+    job_id = job_response['result']['job_id']
+    self.assertEqual(self.command_parser.command_jobs.get_job(job_id, "4").user_id, "4")
+
+    # Wait for the job to finish and load its results
+    finished_job = yield job_finished
+    self.assertEqual(finished_job.job_id, job_id)
+    status_response = yield self.command_parser.parse_command({'command': "job_status", 'destination': "system",
+                                                               'parameters': {'job_id': job_id}}, kernel_mode=True)
+    job_status = status_response['response']['result']
+    self.assertEqual(job_status['status'], 'completed')
+    self.assertTrue('timestamp' in job_status['response']['result'])
+
+    # Try to load a nonexistent job
+    test_deferred = self.command_parser.parse_command({'command': "job_status", 'destination': "system",
+                                                       'parameters': {'job_id': "nonexistent_job"}}, kernel_mode=True)
+    yield self.assertFailure(test_deferred, parser.CommandFailed)
+
+  @inlineCallbacks
+  def test_parser_job_telemetry(self):
+    """ Verifies that the statuses of finished device command jobs are written to the pipeline's telemetry stream if the
+    pipeline is being used by the job's user.
+    """
+
+    test_pipeline = self.pipeline_manager.pipelines['test_pipeline']
+    test_pipeline.current_session = MagicMock()
+    test_pipeline.current_session.user_id = None
+    test_pipeline.write_telemetry = MagicMock()
+
+    job_response = yield self.command_parser.parse_command_job({'command': "set_test_value",
+                                                                'destination': "test_pipeline.test_device",
+                                                                'parameters': {'test_value': 7}}, kernel_mode=True)
+    self.assertEqual(job_response['response']['result']['status'], 'completed')
+    self.assertEqual(test_pipeline.write_telemetry.call_args[0][0], 'test_device')
+    self.assertEqual(test_pipeline.write_telemetry.call_args[0][1], 'job_status')
+    self.assertEqual(test_pipeline.write_telemetry.call_args[0][3]['job_id'], job_response['response']['result']['job_id'])
+
+    # The job status shouldn't be written to other users' sessions
+    test_pipeline.write_telemetry.reset_mock()
+    test_pipeline.current_session.user_id = "1"
+    yield self.command_parser.parse_command_job({'command': "set_test_value", 'destination': "test_pipeline.test_device",
+                                                 'parameters': {'test_value': 7}}, kernel_mode=True)
+    self.assertFalse(test_pipeline.write_telemetry.called)
+
+  @inlineCallbacks
+  def test_parser_schedule_commands(self):
+    """ Verifies that schedulable commands can be scheduled with the system 'schedule_commands' command and that groups
+    containing invalid or non-schedulable commands are rejected.
+    """
+
+    test_clock = task.Clock()
+    test_clock.advance(1000)
+    self.command_parser.command_scheduler = scheduler.CommandScheduler(self.command_parser, clock = test_clock)
+
+    # Schedule some commands
+    schedule_response = yield self.command_parser.parse_command({'command': "schedule_commands", 'destination': "system",
+        'parameters': {'commands': [
+          {'execute_at': 1002, 'command': {'command': "schedulable_time", 'destination': "test"}},
+          {'execute_at': 1001, 'command': {'command': "schedulable_time", 'destination': "test"}}
+        ]}}, kernel_mode = True)
+    schedule_ids = schedule_response['response']['result']['schedule_ids']
+    self.assertEqual(len(schedule_ids), 2)
+    self.assertEqual(self.command_parser.command_scheduler.pending, 2)
+    test_clock.advance(2)
+    self.assertEqual(self.command_parser.command_scheduler.pending, 0)
+    job_response = yield self.command_parser.parse_command({'command': "job_status", 'destination': "system",
+                                                            'parameters': {'job_id': schedule_ids[0]}},
+                                                           kernel_mode = True)
+    self.assertEqual(job_response['response']['result']['status'], 'completed')
+    self.assertTrue('timestamp' in job_response['response']['result']['response']['result'])
+
+    # Cancel a scheduled command
+    schedule_ids = yield self.command_parser.schedule_commands([{'execute_at': 1010, 'command': {
+                                                                 'command': "schedulable_time", 'destination': "test"}}],
+                                                               kernel_mode = True)
+    cancel_response = yield self.command_parser.parse_command({'command': "cancel_scheduled_command",
+                                                               'destination': "system",
+                                                               'parameters': {'schedule_id': schedule_ids[0]}},
+                                                              kernel_mode = True)
+    self.assertEqual(cancel_response['response']['result']['schedule_id'], schedule_ids[0])
+    self.assertEqual(self.command_parser.command_scheduler.pending, 0)
+
+    # Groups containing invalid commands should be rejected entirely
+    invalid_groups = [
+      [],
+      [{'execute_at': 1020, 'command': {'command': "schedulable_time", 'destination': "test"}},
+       {'execute_at': 1020, 'command': {'command': "station_time", 'destination': "system"}}],
+      [{'execute_at': 1020, 'command': {'command': "schedulable_time", 'destination': "test"}},
+       {'execute_at': 900, 'command': {'command': "schedulable_time", 'destination': "test"}}],
+      [{'execute_at': "soon", 'command': {'command': "schedulable_time", 'destination': "test"}}],
+      [{'execute_at': 1020, 'command': {'command': "nonexistent_command", 'destination': "test"}}]
+    ]
+    for invalid_group in invalid_groups:
+      test_deferred = self.command_parser.schedule_commands(invalid_group, kernel_mode = True)
+      yield self.assertFailure(test_deferred, command.CommandError)
+    self.assertEqual(self.command_parser.command_scheduler.pending, 0)
+
+    # Users must have permission to execute the scheduled commands
+    test_deferred = self.command_parser.schedule_commands([{'execute_at': 1020, 'command': {
+                                                            'command': "schedulable_time", 'destination': "test"}}],
+                                                          user_id = "1")
+    yield self.assertFailure(test_deferred, command.CommandError)
+
+  @inlineCallbacks
+  def test_command_channel(self):
+    """ Tests that the command channel executes tagged commands and writes the tagged responses back to the client.
+    """
+
+    # Set up a command channel for user 4
+    command_channel = connection.CommandChannelFactory(self.command_parser).buildProtocol(None)
+    test_transport = proto_helpers.StringTransport()
+    test_transport.getPeerCertificate = MagicMock()
+    test_transport.getPeerCertificate.return_value.get_subject.return_value.commonName = "4"
+    command_channel.makeConnection(test_transport)
+
+    # Send a command and wait for its response
+    command_finished = Deferred()
+    original_response_ready = command_channel._command_response_ready
+    def response_ready(command_response, tag):
+      original_response_ready(command_response, tag)
+      command_finished.callback(tag)
+    command_channel._command_response_ready = response_ready
+    command_channel.dataReceived(json.dumps({'tag': "time_1", 'command': {'command': "station_time",
+                                                                          'destination': "system"}}))
+    yield command_finished
+
+    channel_response = json.loads(test_transport.value())
+    self.assertEqual(command_channel.user_id, "4")
+    self.assertEqual(channel_response['tag'], "time_1")
+    self.assertEqual(channel_response['response']['status'], 'okay')
+    self.assertTrue('timestamp' in channel_response['response']['result'])
+    self.assertEqual(command_channel.commands_in_flight, 0)
+
+    # Send some invalid messages
+    test_transport.clear()
+    command_channel.dataReceived("not json")
+    self.assertEqual(json.loads(test_transport.value())['tag'], None)
+    test_transport.clear()
+    command_channel.dataReceived(json.dumps({'tag': 5}))
+    self.assertEqual(json.loads(test_transport.value())['tag'], 5)
+    self.assertEqual(json.loads(test_transport.value())['response']['status'], 'error')
+
+  def test_command_channel_out_of_order(self):
+    """ Verifies that the command channel allows multiple commands to be in flight at once, writes their responses as
+    they finish, and rejects commands once too many are in flight.
+    """
+
+    # Set up a command channel with a mock parser
+    command_deferreds = []
+    def parse_command(raw_command, user_id = None):
+      command_deferreds.append(Deferred())
+      return command_deferreds[-1]
+    self.command_parser.parse_command = parse_command
+    command_channel = connection.CommandChannel(self.command_parser, max_in_flight = 2)
+    test_transport = proto_helpers.StringTransport()
+    test_transport.getPeerCertificate = MagicMock(return_value = None)
+    command_channel.makeConnection(test_transport)
+
+    # Send a few commands
+    for tag in [1, 2, 3]:
+      command_channel.dataReceived(json.dumps({'tag': tag, 'command': {'command': "station_time",
+                                                                       'destination': "system"}}))
+    self.assertEqual(len(command_deferreds), 2)
+    self.assertEqual(json.loads(test_transport.value())['tag'], 3)
+    self.assertEqual(command_channel.user_id, None)
+
+    # Finish the commands in reverse order
+    test_transport.clear()
+    command_deferreds[1].callback({'response': {'status': 'okay'}})
+    self.assertEqual(json.loads(test_transport.value())['tag'], 2)
+    test_transport.clear()
+    command_deferreds[0].errback(parser.CommandFailed("Test error.", {'response': {'status': 'error'}}))
+    self.assertEqual(json.loads(test_transport.value()), {'tag': 1, 'response': {'status': 'error'}})
+
+    # Responses for disconnected clients should be dropped
+    test_transport.clear()
+    command_channel.dataReceived(json.dumps({'tag': 4, 'command': {}}))
+    command_channel.connectionLost()
+    command_deferreds[2].callback({'response': {'status': 'okay'}})
+    self.assertEqual(test_transport.value(), "")
+    self.assertEqual(command_channel.commands_in_flight, 0)
+
+  @inlineCallbacks
+  def test_parser_prepared_command(self):
+    """ Verifies that prepared commands are subject to the same permission and session checks as parsed commands and
+    that the checks are only repeated once the user's permissions or sessions change.
+    """
+
+    # Update the mock session coordinator to return a valid session
+    test_session = MagicMock()
+    test_session.active_pipeline.id = "test_pipeline"
+    self.command_parser.session_coordinator.load_user_sessions = lambda user_id : [test_session]
+
+    # Execute a prepared command a few times
+    prepared_command = self.command_parser.prepare_command("requires_session", "test_pipeline.test_device", 
+                                                           user_id="4")
+    for execution_number in range(3):
+      command_results = yield prepared_command.execute()
+      self.assertEqual(command_results['response']['status'], 'okay')
+      self.assertEqual(command_results['response']['result']['some_results'], True)
+      self.assertEqual(command_results['response']['destination'], 'test_pipeline.test_device')
+    self.assertEqual(self.command_parser.internal_command_counters['executed'], 3)
+    self.assertEqual(self.command_parser.internal_command_counters['full_checks'], 1)
+    self.assertEqual(self.command_parser.internal_command_counters['fast_path'], 2)
+
+    # End the session, the prepared command should be rejected
+    test_session.active_pipeline = None
+    self.command_parser.session_coordinator.load_user_sessions = lambda user_id : []
+    try:
+      yield prepared_command.execute()
+      self.fail("A prepared command was executed without an active session.")
+    except parser.CommandFailed as command_failure:
+      self.assertTrue("active session" in command_failure.results['response']['result']['error_message'])
+
+    # Make sure commands that the user doesn't have permission to execute are rejected
+    prepared_command = self.command_parser.prepare_command("station_time", "system", user_id="5")
+    try:
+      yield prepared_command.execute()
+      self.fail("A prepared command was executed without permission.")
+    except parser.CommandFailed as command_failure:
+      self.assertTrue("not have permission" in command_failure.results['response']['result']['error_message'])
+
+    # Parameters should still be validated
+    prepared_command = self.command_parser.prepare_command("set_test_value", "test", kernel_mode=True)
+    command_results = yield prepared_command.execute({'test_value': 5})
+    self.assertEqual(command_results['response']['result']['test_value'], 5)
+    try:
+      yield prepared_command.execute({'test_value': 500})
+      self.fail("A prepared command was executed with invalid parameters.")
+    except parser.CommandFailed as command_failure:
+      self.assertTrue("test_value" in command_failure.results['response']['result']['error_message'])
+
   def test_command_active_user_sessions(self):
     """ Tests that the Command class can set and return a list of the associated user's active sessions.
     """
@@ -0,0 +1,92 @@
+# Import required modules
+import logging
+from twisted.trial import unittest
+from twisted.internet import defer
+from mock import MagicMock
+from hwm.command import jobs, parser
+
+class TestCommandJobs(unittest.TestCase):
+  """ This test suite verifies the functionality of the job manager, which tracks commands that are executed in the
+  background.
+  """
+
+  def setUp(self):
+    # Disable logging for most events
+    logging.disable(logging.CRITICAL)
+
+  def test_job_lifecycle(self):
+    """ Verifies that jobs are tracked while running and that their responses are stored once they finish.
+    """
+
+    job_manager = jobs.JobManager()
+    finished_jobs = []
+    job_manager.add_listener(finished_jobs.append)
+
+    # Submit a job
+    command_deferred = defer.Deferred()
+    test_job = job_manager.submit(command_deferred, "4")
+    job_status = job_manager.get_job(test_job.job_id, "4").get_status()
+    self.assertEqual(job_status['status'], jobs.Job.RUNNING)
+    self.assertTrue('response' not in job_status)
+    self.assertEqual(test_job.destination, None)
+
+    # Finish the job
+    command_deferred.callback({'response': {'status': 'okay', 'destination': "test_pipeline.test_device",
+                                            'result': {'azimuth': 10}}})
+    job_status = job_manager.get_job(test_job.job_id, "4").get_status()
+    self.assertEqual(job_status['status'], jobs.Job.COMPLETED)
+    self.assertEqual(job_status['response']['result']['azimuth'], 10)
+    self.assertEqual(test_job.destination, "test_pipeline.test_device")
+    self.assertEqual(finished_jobs, [test_job])
+    self.assertEqual(job_manager.get_stats(), {'running': 0, 'finished': 1, 'submitted': 1, 'discarded': 0})
+
+  def test_job_failures(self):
+    """ Tests that the responses of failed commands are stored with their jobs and that failing job listeners don't
+    affect the job.
+    """
+
+    job_manager = jobs.JobManager()
+    job_manager.add_listener(MagicMock(side_effect=Exception("Listener error.")))
+
+    # Fail a job with a CommandFailed
+    command_deferred = defer.Deferred()
+    test_job = job_manager.submit(command_deferred, "4")
+    command_deferred.errback(parser.CommandFailed("Test error.", {'response': {'status': 'error',
+                                                                                'result': {'error_message': "Test"}}}))
+    self.assertEqual(test_job.status, jobs.Job.FAILED)
+    self.assertEqual(test_job.response['result']['error_message'], "Test")
+
+    # Fail a job with an unexpected error
+    command_deferred = defer.Deferred()
+    test_job = job_manager.submit(command_deferred, "4")
+    command_deferred.errback(ValueError("Unexpected error."))
+    self.assertEqual(test_job.status, jobs.Job.FAILED)
+    self.assertEqual(test_job.response['status'], 'error')
+    self.assertEqual(job_manager.get_stats()['finished'], 2)
+
+  def test_job_access(self):
+    """ Checks that jobs can only be loaded by the users that submitted them (unless the ownership check is skipped).
+    """
+
+    job_manager = jobs.JobManager()
+    test_job = job_manager.submit(defer.Deferred(), "4")
+
+    self.assertEqual(job_manager.get_job(test_job.job_id, "4"), test_job)
+    self.assertEqual(job_manager.get_job(test_job.job_id, "1"), None)
+    self.assertEqual(job_manager.get_job(test_job.job_id, None), None)
+    self.assertEqual(job_manager.get_job(test_job.job_id, None, ignore_owner = True), test_job)
+    self.assertEqual(job_manager.get_job("nonexistent_job", "4"), None)
+
+  def test_bounded_job_store(self):
+    """ Verifies that the oldest finished jobs are discarded once the finished job store is full.
+    """
+
+    job_manager = jobs.JobManager(max_finished_jobs = 2)
+    test_jobs = []
+    for job_index in range(3):
+      test_jobs.append(job_manager.submit(defer.succeed({'response': {'status': 'okay'}}), "4"))
+
+    self.assertEqual(job_manager.get_job(test_jobs[0].job_id, "4"), None)
+    self.assertEqual(job_manager.get_job(test_jobs[2].job_id, "4"), test_jobs[2])
+    self.assertEqual(job_manager.get_stats()['discarded'], 1)
+    self.assertEqual(job_manager.get_stats()['finished'], 2)
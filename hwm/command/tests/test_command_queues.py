@@ -0,0 +1,182 @@
+# Import required modules
+import logging, sys
+from twisted.trial import unittest
+from twisted.internet import defer
+from mock import MagicMock
+from hwm.command import queues, command, metadata
+
+class TestCommandQueues(unittest.TestCase):
+  """ This test suite verifies the functionality of the device command queues, which serialize the execution of device
+  commands.
+  """
+
+  def setUp(self):
+    # Disable logging for most events
+    logging.disable(logging.CRITICAL)
+
+    # Keep track of the commands that are executed and their deferreds
+    self.executed_commands = []
+    self.executed_parameters = []
+    self.command_deferreds = []
+
+  def test_serialized_execution(self):
+    """ Verifies that commands submitted to a device's queue are executed one at a time, in order.
+    """
+
+    command_queue = queues.DeviceCommandQueue("test_pipeline.test_device")
+    first_route = self._create_route("calibrate")
+    second_route = self._create_route("park")
+
+    first_deferred = command_queue.submit(first_route, self._create_command("calibrate"))
+    second_deferred = command_queue.submit(second_route, self._create_command("park"))
+
+    # Only the first command should be running
+    self.assertEqual(self.executed_commands, ["calibrate"])
+    self.assertEqual(command_queue.depth, 1)
+
+    # Finish the first command, the second should start
+    self.command_deferreds[0].callback({'result': 1})
+    self.assertEqual(self.executed_commands, ["calibrate", "park"])
+    self.assertEqual(command_queue.depth, 0)
+    self.assertEqual(self.successResultOf(first_deferred), {'result': 1})
+
+    # Errors should be passed back to the command's deferred
+    self.command_deferreds[1].errback(command.CommandError("Test error."))
+    self.failureResultOf(second_deferred, command.CommandError)
+
+    # Check the queue statistics
+    queue_stats = command_queue.get_stats()
+    self.assertEqual(queue_stats['depth'], 0)
+    self.assertEqual(queue_stats['max_depth'], 1)
+    self.assertEqual(queue_stats['running'], False)
+    self.assertEqual(queue_stats['commands_executed'], 2)
+    self.assertTrue(queue_stats['max_wait_time'] >= queue_stats['average_wait_time'])
+
+  def test_command_coalescing(self):
+    """ Tests that a newer coalescing command replaces an older instance of the same command that is still queued.
+    """
+
+    command_queue = queues.DeviceCommandQueue("test_pipeline.test_device")
+    command_queue.submit(self._create_route("calibrate"), self._create_command("calibrate"))
+
+    # Queue up a few move commands while the calibration is running
+    move_route = self._create_route("move", coalesce = True)
+    park_route = self._create_route("park")
+    first_move_deferred = command_queue.submit(move_route, self._create_command("move", {'azimuth': 1}))
+    park_deferred = command_queue.submit(park_route, self._create_command("park"))
+    second_move_deferred = command_queue.submit(move_route, self._create_command("move", {'azimuth': 2}))
+    self.assertEqual(command_queue.depth, 2)
+
+    # The first move should have been superseded
+    superseded_failure = self.failureResultOf(first_move_deferred, command.CommandError)
+    self.assertTrue(superseded_failure.value.error_parameters['superseded'])
+
+    # The second move should have taken the first move's place in the queue
+    self.command_deferreds[0].callback(None)
+    self.assertEqual(self.executed_commands, ["calibrate", "move"])
+    self.assertEqual(self.executed_parameters[-1]['azimuth'], 2)
+    self.command_deferreds[1].callback(None)
+    self.assertEqual(self.executed_commands, ["calibrate", "move", "park"])
+    self.command_deferreds[2].callback(None)
+    self.successResultOf(second_move_deferred)
+    self.successResultOf(park_deferred)
+    self.assertEqual(command_queue.get_stats()['commands_coalesced'], 1)
+
+  def test_command_priority(self):
+    """ Verifies that high priority commands are executed before any queued normal priority commands.
+    """
+
+    command_queue = queues.DeviceCommandQueue("test_pipeline.test_device")
+    command_queue.submit(self._create_route("calibrate"), self._create_command("calibrate"))
+    command_queue.submit(self._create_route("park"), self._create_command("park"))
+    command_queue.submit(self._create_route("move"), self._create_command("move"))
+    command_queue.submit(self._create_route("stop", priority = 'high'), self._create_command("stop"))
+
+    for command_deferred_index in range(3):
+      self.command_deferreds[command_deferred_index].callback(None)
+    self.assertEqual(self.executed_commands, ["calibrate", "stop", "park", "move"])
+
+  def test_immediate_commands(self):
+    """ Makes sure that a long run of queued commands that finish immediately is executed without recursing once per
+    command.
+    """
+
+    command_queue = queues.DeviceCommandQueue("test_pipeline.test_device")
+    command_queue.submit(self._create_route("calibrate"), self._create_command("calibrate"))
+
+    # Queue up more commands than the recursion limit allows, each of which returns its results directly
+    station_time_route = self._create_route("station_time")
+    station_time_route.command_function = lambda active_command: {'timestamp': 0}
+    command_deferreds = []
+    for command_index in range(sys.getrecursionlimit()):
+      command_deferreds.append(command_queue.submit(station_time_route, self._create_command("station_time")))
+
+    self.command_deferreds[0].callback(None)
+    for command_deferred in command_deferreds:
+      self.assertEqual(self.successResultOf(command_deferred), {'timestamp': 0})
+    self.assertEqual(command_queue.get_stats()['running'], False)
+    self.assertEqual(command_queue.get_stats()['commands_executed'], sys.getrecursionlimit()+1)
+
+    # The queue should still wait for commands that don't finish right away
+    command_queue.submit(self._create_route("park"), self._create_command("park"))
+    self.assertEqual(command_queue.get_stats()['running'], True)
+
+  def test_queue_manager(self):
+    """ Tests that the queue manager maintains a separate queue for each command handler.
+    """
+
+    queue_manager = queues.CommandQueueManager()
+    first_handler_route = self._create_route("move", destination = "test_pipeline.device_1")
+    second_handler_route = self._create_route("move", destination = "test_pipeline.device_2")
+
+    # The commands should run at the same time because they're for different devices
+    queue_manager.submit(first_handler_route, self._create_command("move"))
+    queue_manager.submit(second_handler_route, self._create_command("move"))
+    self.assertEqual(len(self.executed_commands), 2)
+
+    queue_stats = queue_manager.get_queue_stats()
+    self.assertEqual(queue_stats["test_pipeline.device_1"]['commands_executed'], 1)
+    self.assertEqual(queue_stats["test_pipeline.device_2"]['commands_executed'], 1)
+
+  def test_metadata_priority(self):
+    """ Checks that the command meta-data generation function validates command priorities.
+    """
+
+    test_metadata = metadata.build_metadata_dict([], 'stop', 'test_device', priority = 'high', coalesce = True)
+    self.assertEqual(test_metadata['priority'], 'high')
+    self.assertEqual(test_metadata['coalesce'], True)
+    self.assertEqual(metadata.build_metadata_dict([], 'move', 'test_device')['priority'], 'normal')
+    self.assertRaises(metadata.InvalidCommandMetadata, metadata.build_metadata_dict, [], 'stop', 'test_device',
+                      priority = 'urgent')
+
+  def _create_route(self, command_name, priority = 'normal', coalesce = False, destination = None):
+    """ Creates a mock CommandRoute whose command returns a deferred controlled by the test.
+    """
+
+    def command_function(active_command):
+      self.executed_commands.append(active_command.command)
+      self.executed_parameters.append(active_command.parameters)
+      command_deferred = defer.Deferred()
+      self.command_deferreds.append(command_deferred)
+
+      return command_deferred
+
+    command_route = MagicMock()
+    command_route.command = command_name
+    command_route.priority = priority
+    command_route.coalesce = coalesce
+    command_route.command_function = command_function
+    command_route.full_destination = destination
+    command_route.command_handler = destination
+
+    return command_route
+
+  def _create_command(self, command_name, parameters = None):
+    """ Creates a validated Command for the test device.
+    """
+
+    test_command = command.Command(0, {'command': command_name, 'destination': "test_pipeline.test_device",
+                                       'parameters': parameters if parameters is not None else {}}, kernel_mode = True)
+    test_command.skip_validation()
+
+    return test_command
@@ -0,0 +1,142 @@
+# Import required modules
+import logging
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from mock import MagicMock
+from hwm.command import scheduler, jobs
+
+class TestCommandScheduler(unittest.TestCase):
+  """ This test suite verifies the functionality of the command scheduler, which executes time-tagged commands at their
+  requested times.
+  """
+
+  def setUp(self):
+    # Disable logging for most events
+    logging.disable(logging.CRITICAL)
+
+    # Create a scheduler that uses a fake clock and a mock command parser
+    self.clock = task.Clock()
+    self.clock.advance(1000)
+    self.executed_commands = []
+    self.command_parser = MagicMock()
+    def parse_command(command_request, user_id = None, kernel_mode = False):
+      self.executed_commands.append(command_request['command'])
+      return defer.succeed({'response': {'status': 'okay', 'result': {'executed': command_request['command']}}})
+    self.command_parser.parse_command = parse_command
+    self.command_scheduler = scheduler.CommandScheduler(self.command_parser, clock = self.clock)
+
+  def _scheduled_command(self, command_name, execute_at, session_id = None):
+    return scheduler.ScheduledCommand({'command': command_name, 'destination': "system"}, execute_at, "4",
+                                      session_id = session_id)
+
+  def test_execution_order(self):
+    """ Verifies that scheduled commands are executed in order at their requested times using a single timer and that
+    their results are stored in the scheduler's own result store.
+    """
+
+    schedule_ids = self.command_scheduler.add([self._scheduled_command("third", 1003),
+                                               self._scheduled_command("first", 1001),
+                                               self._scheduled_command("second", 1002),
+                                               self._scheduled_command("also_first", 1001)])
+    self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+    self.assertEqual(self.clock.getDelayedCalls()[0].getTime(), 1001)
+
+    # Run the schedule
+    self.clock.advance(1)
+    self.assertEqual(self.executed_commands, ["first", "also_first"])
+    self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+    self.clock.advance(2)
+    self.assertEqual(self.executed_commands, ["first", "also_first", "second", "third"])
+    self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    # Make sure the results are available from the scheduler (and not the command parser's job store)
+    finished_job = self.command_scheduler.get_result(schedule_ids[0], "4")
+    self.assertEqual(finished_job.status, jobs.Job.COMPLETED)
+    self.assertEqual(finished_job.response['result']['executed'], "third")
+    self.assertEqual(self.command_scheduler.get_result(schedule_ids[0], "1"), None)
+    self.assertFalse(self.command_parser.command_jobs.submit.called)
+    self.assertEqual(self.command_scheduler.get_command(schedule_ids[0], "4"), None)
+
+    # Adding an earlier command should move the timer forward
+    self.command_scheduler.add([self._scheduled_command("later", 1010)])
+    self.command_scheduler.add([self._scheduled_command("sooner", 1005)])
+    self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+    self.assertEqual(self.clock.getDelayedCalls()[0].getTime(), 1005)
+
+    # Check the statistics
+    scheduler_stats = self.command_scheduler.get_stats()
+    self.assertEqual(scheduler_stats['pending'], 2)
+    self.assertEqual(scheduler_stats['scheduled'], 6)
+    self.assertEqual(scheduler_stats['executed'], 4)
+    self.assertEqual(scheduler_stats['results']['finished'], 4)
+    self.assertEqual(scheduler_stats['firing_jitter']['count'], 4)
+
+  def test_firing_jitter(self):
+    """ Checks that the scheduler records how late commands are executed and that past-due commands run immediately.
+    """
+
+    self.command_scheduler.add([self._scheduled_command("late", 1000.5), self._scheduled_command("overdue", 990)])
+    self.assertEqual(self.clock.getDelayedCalls()[0].getTime(), 1000)
+    self.clock.advance(0)
+    self.assertEqual(self.executed_commands, ["overdue"])
+
+    # Fire the timer late
+    self.clock.advance(0.75)
+    self.assertEqual(self.executed_commands, ["overdue", "late"])
+    jitter_stats = self.command_scheduler.get_stats()['firing_jitter']
+    self.assertEqual(jitter_stats['count'], 2)
+    self.assertAlmostEqual(jitter_stats['max_ms'], 10000, places = 3)
+
+  def test_cancellation(self):
+    """ Verifies that scheduled commands can be cancelled individually and by session.
+    """
+
+    schedule_ids = self.command_scheduler.add([self._scheduled_command("first", 1001),
+                                               self._scheduled_command("session_1", 1002, "session_1"),
+                                               self._scheduled_command("session_2", 1003, "session_2"),
+                                               self._scheduled_command("session_1_again", 1004, "session_1")])
+
+    # Check ownership
+    self.assertEqual(self.command_scheduler.get_command(schedule_ids[0], "1"), None)
+    self.assertEqual(self.command_scheduler.get_command(schedule_ids[0], "1", ignore_owner = True).command['command'],
+                     "first")
+
+    # Cancel the first command, which should move the timer
+    self.assertTrue(self.command_scheduler.cancel(schedule_ids[0]))
+    self.assertFalse(self.command_scheduler.cancel(schedule_ids[0]))
+    self.assertEqual(self.clock.getDelayedCalls()[0].getTime(), 1002)
+
+    # End a session
+    self.assertEqual(self.command_scheduler.cancel_session_commands("session_1"), 2)
+    self.assertEqual(self.command_scheduler.cancel_session_commands("session_1"), 0)
+    self.assertEqual(self.clock.getDelayedCalls()[0].getTime(), 1003)
+    self.clock.advance(10)
+    self.assertEqual(self.executed_commands, ["session_2"])
+    self.assertEqual(self.command_scheduler.get_stats()['cancelled'], 3)
+
+    # Cancelling every command should stop the timer
+    schedule_ids = self.command_scheduler.add([self._scheduled_command("cancelled", 1020)])
+    self.command_scheduler.cancel(schedule_ids[0])
+    self.assertEqual(self.clock.getDelayedCalls(), [])
+
+  def test_cancelled_heap_compaction(self):
+    """ Makes sure that cancelled commands don't accumulate in the scheduler's heap.
+    """
+
+    schedule_ids = self.command_scheduler.add([self._scheduled_command("test", 2000+command_index)
+                                               for command_index in range(200)])
+    for schedule_id in reversed(schedule_ids[1:]):
+      self.command_scheduler.cancel(schedule_id)
+
+    self.assertEqual(self.command_scheduler.pending, 1)
+    self.assertTrue(len(self.command_scheduler._command_heap) <= 64)
+
+  def test_scheduler_limit(self):
+    """ Verifies that the scheduler rejects groups of commands that would exceed its limit.
+    """
+
+    self.command_scheduler.max_scheduled_commands = 2
+    self.command_scheduler.add([self._scheduled_command("first", 1001)])
+    self.assertRaises(scheduler.SchedulerFull, self.command_scheduler.add,
+                      [self._scheduled_command("second", 1002), self._scheduled_command("third", 1003)])
+    self.assertEqual(self.command_scheduler.pending, 1)
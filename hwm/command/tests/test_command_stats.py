@@ -0,0 +1,64 @@
+# Import required modules
+import logging
+from twisted.trial import unittest
+from mock import patch
+from hwm.command import stats
+
+class TestCommandStats(unittest.TestCase):
+  """ This test suite verifies the functionality of the command latency statistics.
+  """
+
+  def setUp(self):
+    # Disable logging for most events
+    logging.disable(logging.CRITICAL)
+
+  def test_command_timing(self):
+    """ Verifies that command stage timings are measured from the end of the previous stage.
+    """
+
+    with patch('hwm.command.stats.time') as mock_time:
+      mock_time.time.return_value = 100.0
+      command_timing = stats.CommandTiming()
+      mock_time.time.return_value = 100.5
+      command_timing.mark('validation')
+      mock_time.time.return_value = 101.5
+      command_timing.mark('routing')
+
+      # Clock stepped backwards
+      mock_time.time.return_value = 90.0
+      command_timing.finish()
+
+    self.assertEqual(command_timing.stages['validation'], 0.5)
+    self.assertEqual(command_timing.stages['routing'], 1.0)
+    self.assertEqual(command_timing.stages['execution'], 0)
+    self.assertEqual(command_timing.stages['total'], 0)
+
+  def test_aggregated_stats(self):
+    """ Checks that the command statistics are aggregated by destination and command, and that unrouted commands are
+    only counted.
+    """
+
+    command_stats = stats.CommandStats()
+    command_timing = stats.CommandTiming()
+    command_timing.mark('routing')
+    command_timing.finish()
+
+    command_stats.record("test_pipeline.test_device", "move", command_timing, True)
+    command_stats.record("test_pipeline.test_device", "move", command_timing, False)
+    command_stats.record("system", "station_time", command_timing, True)
+    command_stats.record(None, None, command_timing, False)
+
+    aggregated_stats = command_stats.get_stats()
+    self.assertEqual(aggregated_stats['completed'], 2)
+    self.assertEqual(aggregated_stats['failed'], 2)
+    self.assertEqual(aggregated_stats['rejected'], 1)
+    move_stats = aggregated_stats['destinations']['test_pipeline.test_device']['move']
+    self.assertEqual(move_stats['count'], 2)
+    self.assertEqual(move_stats['errors'], 1)
+    self.assertEqual(sorted(move_stats['stages'].keys()), ['execution', 'routing', 'total'])
+    self.assertEqual(aggregated_stats['destinations']['system']['station_time']['count'], 1)
+
+    # Reset the statistics
+    command_stats.reset()
+    self.assertEqual(command_stats.get_stats()['completed'], 0)
+    self.assertEqual(command_stats.get_stats()['destinations'], {})
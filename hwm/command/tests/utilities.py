@@ -3,6 +3,7 @@
 
 # Import required modules
 import time
+from mock import MagicMock
 from hwm.command.metadata import *
 from hwm.command import command
 from hwm.command.handlers import handler
@@ -62,4 +63,83 @@ class TestCommandHandler(handler.CommandHandler):
     @return Returns a standard dictionary containing meta-data about the command.
     """
 
-    return build_metadata_dict([], 'requires_session', self.name, requires_active_session = True)
\ No newline at end of file
+    return build_metadata_dict([], 'requires_session', self.name, requires_active_session = True)
+
+  def command_set_test_value(self, active_command):
+    """ A test command that accepts some parameters which are validated using the command's meta-data.
+
+    @param active_command  The command object associated with the executing command.
+    """
+
+    return {'test_value': active_command.parameters['test_value']}
+
+  def settings_set_test_value(self):
+    """ Returns a dictionary containing meta-data about the set_test_value command.
+
+    @return Returns a standard dictionary containing meta-data about the command.
+    """
+
+    command_parameters = [
+      {
+        "type": "number",
+        "integer": True,
+        "minvalue": 0,
+        "maxvalue": 100,
+        "required": True,
+        "title": "test_value"
+      },
+      {
+        "type": "select",
+        "options": [
+          ['Option A', 'option_a'],
+          ['Option B', 'option_b']
+        ],
+        "required": False,
+        "title": "test_option"
+      }
+    ]
+
+    return build_metadata_dict(command_parameters, 'set_test_value', self.name, requires_active_session = False)
+
+  def command_schedulable_time(self, active_command):
+    """ A test command that may be scheduled using the command scheduler.
+
+    @param active_command  The command object associated with the executing command.
+    """
+
+    return {'timestamp': int(time.time())}
+
+  def settings_schedulable_time(self):
+    """ Returns a dictionary containing meta-data about the schedulable_time command.
+
+    @return Returns a standard dictionary containing meta-data about the command.
+    """
+
+    return build_metadata_dict([], 'schedulable_time', self.name, requires_active_session = False, schedulable = True)
+
+def mock_prepare_command(mock_parse_command):
+  """ Creates a mock of CommandParser.prepare_command() for testing drivers that use prepared commands.
+
+  The prepared commands created by the returned function pass their commands (as command dictionaries) to the provided
+  parse_command() mock when they're executed. This allows driver tests to inspect the commands that drivers issue using 
+  prepared commands the same way that they inspect commands passed to CommandParser.parse_command().
+
+  @param mock_parse_command  A mock of CommandParser.parse_command().
+  @return Returns a mock of CommandParser.prepare_command().
+  """
+
+  def prepare_command(command_name, destination, user_id = None, kernel_mode = False):
+    def execute(parameters = None):
+      command_request = {'command': command_name, 'destination': destination}
+      if parameters is not None:
+        command_request['parameters'] = parameters
+
+      return mock_parse_command(command_request, user_id = user_id, kernel_mode = kernel_mode)
+
+    prepared_command = MagicMock()
+    prepared_command.user_id = user_id
+    prepared_command.execute = execute
+
+    return prepared_command
+
+  return prepare_command
@@ -0,0 +1,145 @@
+""" @package hwm.command.validation
+Compiles and applies command parameter validators.
+
+This module contains a class that compiles the parameter restrictions advertised by a command handler's "settings_"
+meta-data methods (see hwm.command.metadata.build_metadata_dict) into a validator. The validators are compiled once, when
+the command's route is added to the command parser's routing table (see hwm.command.routing), and are then used to
+reject commands with invalid parameters before they are passed to their command handler.
+"""
+
+# Import required modules
+from hwm.command import command
+
+class ParameterValidator:
+  """ Validates the parameters of a single command.
+
+  This class compiles the parameter list from a command's meta-data dictionary into a list of parameter checks that can
+  quickly be run against submitted commands. Each parameter is identified in the command's 'parameters' dictionary by
+  its title.
+
+  @note Parameters that are submitted with a command but that aren't defined in the command's meta-data are ignored.
+  """
+
+  def __init__(self, command_parameters):
+    """ Compiles the parameter validator.
+
+    @param command_parameters  The 'parameters' array from the command's meta-data dictionary (as generated by
+                               build_metadata_dict).
+    """
+
+    self._parameter_checks = []
+    for parameter in command_parameters:
+      self._parameter_checks.append((parameter['title'],
+                                     parameter.get('required', False),
+                                     self._compile_parameter(parameter)))
+
+  def validate(self, active_command):
+    """ Validates the provided command's parameters.
+
+    @throw Raises CommandError if one of the command's parameters is missing or invalid.
+
+    @param active_command  The Command whose parameters should be validated.
+    """
+
+    command_parameters = active_command.parameters if active_command.parameters is not None else {}
+
+    for parameter_title, parameter_required, parameter_check in self._parameter_checks:
+      if parameter_title not in command_parameters:
+        if parameter_required:
+          raise command.CommandError("The required '"+parameter_title+"' parameter was not included in the submitted "+
+                                     "command.", {"command": active_command.command,
+                                                  "destination": active_command.full_destination,
+                                                  "parameter": parameter_title})
+        continue
+
+      error_message = parameter_check(command_parameters[parameter_title])
+      if error_message is not None:
+        raise command.CommandError("The '"+parameter_title+"' parameter was invalid: "+error_message,
+                                   {"command": active_command.command,
+                                    "destination": active_command.full_destination,
+                                    "parameter": parameter_title})
+
+  def _compile_parameter(self, parameter):
+    """ Compiles a check function for the provided parameter definition.
+
+    @param parameter  A single parameter definition from a command's meta-data.
+    @return Returns a function that accepts a parameter value and returns an error message if the value is invalid or
+            None if it is valid.
+    """
+
+    if parameter['type'] == 'string':
+      return self._compile_string(parameter.get('minlength'), parameter.get('maxlength'))
+    elif parameter['type'] == 'number':
+      return self._compile_number(parameter.get('minvalue'), parameter.get('maxvalue'), parameter.get('integer', False))
+    elif parameter['type'] == 'boolean':
+      return self._compile_boolean()
+    elif parameter['type'] == 'select':
+      return self._compile_select(parameter['options'], parameter.get('multiselect', False))
+
+    # Unrecognized types are rejected by build_metadata_dict, accept anything just in case
+    return lambda value: None
+
+  def _compile_string(self, min_length, max_length):
+    """ Compiles a check function for 'string' parameters.
+    """
+
+    def check_string(value):
+      if not isinstance(value, basestring):
+        return "expected a string."
+      if min_length is not None and len(value) < min_length:
+        return "must be at least "+str(min_length)+" characters long."
+      if max_length is not None and len(value) > max_length:
+        return "must be at most "+str(max_length)+" characters long."
+
+      return None
+
+    return check_string
+
+  def _compile_number(self, min_value, max_value, integer):
+    """ Compiles a check function for 'number' parameters.
+    """
+
+    def check_number(value):
+      if isinstance(value, bool) or not isinstance(value, (int, long, float)):
+        return "expected a number."
+      if integer and not (isinstance(value, (int, long)) or value.is_integer()):
+        return "expected an integer."
+      if min_value is not None and value < min_value:
+        return "must be greater than or equal to "+str(min_value)+"."
+      if max_value is not None and value > max_value:
+        return "must be less than or equal to "+str(max_value)+"."
+
+      return None
+
+    return check_number
+
+  def _compile_boolean(self):
+    """ Compiles a check function for 'boolean' parameters.
+    """
+
+    def check_boolean(value):
+      if not isinstance(value, bool):
+        return "expected a boolean."
+
+      return None
+
+    return check_boolean
+
+  def _compile_select(self, options, multiselect):
+    """ Compiles a check function for 'select' parameters.
+    """
+
+    option_values = frozenset([option[1] for option in options])
+
+    def check_select(value):
+      selected_values = value if (multiselect and isinstance(value, list)) else [value]
+      for selected_value in selected_values:
+        try:
+          if selected_value not in option_values:
+            return "'"+unicode(selected_value)+"' is not a valid option."
+        except TypeError:
+          return "contained an unhashable option."
+
+      return None
+
+    return check_select
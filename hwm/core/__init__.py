@@ -1,3 +1,4 @@
 __all__ = ["configuration",
            "errors", 
-           "initialization"]
+           "initialization",
+           "stats"]
@@ -206,6 +206,25 @@ class Config:
           "minimum": 1,
           "default": 45502
         },
+        "command-channel-port": {
+          "type": "integer",
+          "minimum": 1,
+          "default": 45503
+        },
+        "audit-log-enabled": {
+          "type": "boolean",
+          "default": True
+        },
+        "audit-log-queue-size": {
+          "type": "integer",
+          "minimum": 1,
+          "default": 10000
+        },
+        "audit-log-max-files": {
+          "type": "integer",
+          "minimum": 1,
+          "default": 50
+        },
         "mercury2-ui-location": {
           "type": "string",
           "required": True
@@ -222,6 +241,34 @@ class Config:
           "type": "string",
           "default": self.config_directory + "ssl/ca-cert.pem"
         },
+        "tls-session-cache-enabled": {
+          "type": "boolean",
+          "default": True
+        },
+        "tls-session-cache-size": {
+          "type": "integer",
+          "minimum": 1,
+          "default": 1024
+        },
+        "tls-session-lifetime": {
+          "type": "integer",
+          "minimum": 1,
+          "default": 3600
+        },
+        "tls-session-tickets": {
+          "type": "boolean",
+          "default": False
+        },
+        "session-waiting-room-period": {
+          "type": "integer",
+          "minimum": 0,
+          "default": 120
+        },
+        "session-coordinator-sweep-period": {
+          "type": "integer",
+          "minimum": 1,
+          "default": 60
+        },
         "schedule-update-period": {
           "type": "integer",
           "default": 30
@@ -249,6 +296,26 @@ class Config:
           "maximum": 60,
           "default": 10
         },
+        "permissions-cache-max-users": {
+          "type": "integer",
+          "minimum": 1,
+          "default": 1000
+        },
+        "permissions-cache-max-size": {
+          "type": "integer",
+          "minimum": 1,
+          "default": 4194304
+        },
+        "permissions-refresh-ahead": {
+          "type": "integer",
+          "minimum": 0,
+          "default": 10
+        },
+        "permissions-prefetch-horizon": {
+          "type": "integer",
+          "minimum": 0,
+          "default": 600
+        },
         "permissions-location-local": {
           "type": "string",
           "default": self.config_directory + "permissions/offline_permissions.json"
@@ -9,7 +9,6 @@ up the application state and starting the reactor loop.
 import logging, sys, shutil, os
 from OpenSSL import SSL
 from twisted.internet import reactor, ssl
-from twisted.internet.task import LoopingCall
 from twisted.web.server import Site
 from txws import WebSocketFactory
 from pkg_resources import Requirement, resource_filename
@@ -20,10 +19,11 @@ from hwm.core.configuration import Configuration
 from hwm.sessions import coordinator, schedule as schedule
 from hwm.hardware.devices import manager as devices
 from hwm.hardware.pipelines import manager as pipelines
-from hwm.command import parser as command_parser_mod, connection as command_connection
+from hwm.command import parser as command_parser_mod, connection as command_connection, audit
 from hwm.command.handlers import system as system_command_handler
 from hwm.network.security import verification, permissions
 from hwm.network.protocols import data, telemetry
+from hwm.network import http_client
 
 def initialize():
   """ Initializes the Mercury2 Hardware Manager.
@@ -69,9 +69,8 @@ def initialize():
   # Initialize the required network listeners
   _setup_network_listeners(command_parser, session_coordinator);
   
-  # Set up the session coordinator looping call
-  coordination_loop = LoopingCall(session_coordinator.coordinate)
-  coordination_loop.start(1)
+  # Start the session coordinator, which sets its own timers based on the schedule
+  session_coordinator.start()
   
   # Start the reactor
   if Configuration.verbose_startup:
@@ -162,12 +161,27 @@ def _setup_command_system():
   system_command_handlers = []
   system_command_handlers.append(system_command_handler.SystemCommandHandler('system'))
   if Configuration.get('offline-mode'):
-    permission_manager = permissions.PermissionManager(Configuration.get('permissions-location-local'),
-                                                       Configuration.get('permissions-update-period'))
+    permissions_location = Configuration.get('permissions-location-local')
   else:
-    permission_manager = permissions.PermissionManager(Configuration.get('permissions-location-network'),
-                                                       Configuration.get('permissions-update-period'))
+    permissions_location = Configuration.get('permissions-location-network')
+  permission_manager = permissions.PermissionManager(permissions_location,
+                                                     Configuration.get('permissions-update-period'),
+                                                     max_cached_users = Configuration.get('permissions-cache-max-users'),
+                                                     max_cache_size = Configuration.get('permissions-cache-max-size'),
+                                                     refresh_ahead = Configuration.get('permissions-refresh-ahead'))
   command_parser = command_parser_mod.CommandParser(system_command_handlers, permission_manager)
+
+  # Set up the command audit log, which writes its records from a separate thread
+  if Configuration.get('audit-log-enabled'):
+    command_parser.audit_log = audit.AuditLog(Configuration.log_directory+"audit/",
+                                              max_queue_size = Configuration.get('audit-log-queue-size'),
+                                              max_archived_files = Configuration.get('audit-log-max-files'))
+    command_parser.audit_log.start()
+    reactor.addSystemEventTrigger('before', 'shutdown', command_parser.audit_log.stop)
+    logging.info("Startup: Started the command audit log.")
+
+  # Close the shared HTTP client's pooled connections when the hardware manager stops
+  reactor.addSystemEventTrigger('before', 'shutdown', http_client.get_client().close)
   
   return command_parser
 
@@ -185,12 +199,17 @@ def _setup_network_listeners(command_parser, session_coordinator):
     
   # Create a TLS context factory for the various listeners
   tls_context_factory = verification.create_tls_context_factory()
+  command_parser.tls_context_factory = tls_context_factory
   
-  # Setup the command listener
+  # Setup the command listeners (HTTP requests and the WebSocket command channel)
   command_factory = Site(command_connection.CommandResource(command_parser))
   reactor.listenSSL(Configuration.get('command-port'),
                     command_factory,
                     tls_context_factory)
+  command_channel_factory = command_connection.CommandChannelFactory(command_parser)
+  reactor.listenSSL(Configuration.get('command-channel-port'),
+                    WebSocketFactory(command_channel_factory),
+                    tls_context_factory)
 
   # Setup the pipeline data & telemetry stream listeners
   pipeline_data_factory = data.PipelineDataFactory(session_coordinator)
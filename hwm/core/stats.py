@@ -0,0 +1,84 @@
+""" @package hwm.core.stats
+Records latency statistics.
+
+This module contains a fixed bucket latency histogram that is shared by the components that keep timing statistics
+(e.g. the command parser's per-command latencies, the HTTP client's request latencies, and the session coordinator's
+session start and end lateness).
+"""
+
+# Import required modules
+import bisect
+
+# The upper bounds (in seconds) of the latency histogram buckets, the last bucket catches everything else
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+class LatencyHistogram:
+  """ A fixed bucket latency histogram.
+  """
+
+  def __init__(self):
+    """ Sets up the histogram.
+    """
+
+    self.buckets = [0]*(len(LATENCY_BUCKETS)+1)
+    self.count = 0
+    self.total = 0.0
+    self.max = 0.0
+
+  def record(self, duration):
+    """ Adds a duration to the histogram.
+
+    @param duration  The duration to record (in seconds).
+    """
+
+    self.buckets[bisect.bisect_left(LATENCY_BUCKETS, duration)] += 1
+    self.count += 1
+    self.total += duration
+    if duration > self.max:
+      self.max = duration
+
+  def percentile(self, percentile):
+    """ Estimates a percentile from the histogram.
+
+    @param percentile  The percentile to estimate (0-100).
+    @return Returns the upper bound (in seconds) of the bucket containing the percentile, or the maximum recorded
+            duration if it falls in the last bucket or is smaller than the bucket's upper bound. Returns 0 if the
+            histogram is empty.
+    """
+
+    if self.count == 0:
+      return 0.0
+
+    target_count = self.count*percentile/100.0
+    cumulative_count = 0
+    for bucket_index, bucket_count in enumerate(self.buckets):
+      cumulative_count += bucket_count
+      if cumulative_count >= target_count and bucket_count > 0:
+        if bucket_index < len(LATENCY_BUCKETS):
+          return min(LATENCY_BUCKETS[bucket_index], self.max)
+        break
+
+    return self.max
+
+  def get_stats(self):
+    """ Returns the histogram's statistics.
+
+    @return Returns a dictionary containing the number of recorded durations, their mean, maximum, and estimated 50th
+            and 99th percentiles (all in milliseconds), and the histogram's bucket counts (keyed by the bucket's upper
+            bound in milliseconds, or 'inf' for the last bucket).
+    """
+
+    bucket_counts = {}
+    for bucket_index, bucket_count in enumerate(self.buckets):
+      if bucket_count > 0:
+        bucket_label = str(LATENCY_BUCKETS[bucket_index]*1000) if bucket_index < len(LATENCY_BUCKETS) else 'inf'
+        bucket_counts[bucket_label] = bucket_count
+
+    return {
+      'count': self.count,
+      'mean_ms': (self.total/self.count)*1000 if self.count > 0 else 0.0,
+      'max_ms': self.max*1000,
+      'p50_ms': self.percentile(50)*1000,
+      'p99_ms': self.percentile(99)*1000,
+      'buckets': bucket_counts
+    }
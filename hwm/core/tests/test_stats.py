@@ -0,0 +1,29 @@
+# Import required modules
+from twisted.trial import unittest
+from hwm.core import stats
+
+class TestStats(unittest.TestCase):
+  """ This test suite verifies the functionality of the shared latency histogram.
+  """
+
+  def test_latency_histogram(self):
+    """ Tests that the latency histograms estimate percentiles using their buckets.
+    """
+
+    latency_histogram = stats.LatencyHistogram()
+    self.assertEqual(latency_histogram.get_stats()['p99_ms'], 0)
+
+    for duration_index in range(98):
+      latency_histogram.record(0.0008)
+    latency_histogram.record(0.07)
+    latency_histogram.record(20.0)
+
+    histogram_stats = latency_histogram.get_stats()
+    self.assertEqual(histogram_stats['count'], 100)
+    self.assertAlmostEqual(histogram_stats['p50_ms'], 1.0)
+    self.assertAlmostEqual(histogram_stats['p99_ms'], 100.0)
+    self.assertAlmostEqual(histogram_stats['max_ms'], 20000.0)
+    self.assertAlmostEqual(histogram_stats['mean_ms'], (98*0.0008+0.07+20.0)*10)
+    self.assertEqual(histogram_stats['buckets']['1.0'], 98)
+    self.assertEqual(histogram_stats['buckets']['inf'], 1)
+    self.assertAlmostEqual(latency_histogram.percentile(100)*1000, 20000.0)
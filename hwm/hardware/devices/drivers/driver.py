@@ -37,6 +37,7 @@ class Driver(object):
     # Private attributes
     self._use_count = 0
     self._locked = False
+    self._prepared_commands = {}
 
   def write_telemetry(self, stream, telemetry_datum, binary=False, **extra_headers):
     """ Writes device telemetry data back to the device's registered pipelines.
@@ -243,6 +244,31 @@ class Driver(object):
 
     self._use_count = 0 if (self._use_count-1 < 0) else (self._use_count-1) 
 
+  def _load_prepared_command(self, command_name, session_pipeline):
+    """ Loads a prepared command that the driver can use to send commands to its own command handler.
+
+    This method returns a PreparedCommand (see CommandParser.prepare_command()) for the specified command, addressed to
+    this device in the specified pipeline and executed on behalf of the user of the pipeline's current session. Drivers
+    should use prepared commands for commands that they generate frequently during a session (e.g. in a tracking loop)
+    because they skip the parsing and validation steps performed by CommandParser.parse_command().
+
+    @note Prepared commands are cached per command and pipeline. A new prepared command will be created if the user of
+          the pipeline's current session changes.
+    
+    @param command_name      The name of the command.
+    @param session_pipeline  The Pipeline being used by the session that the command will be executed for.
+    @return Returns the PreparedCommand.
+    """
+
+    user_id = session_pipeline.current_session.user_id
+    prepared_command = self._prepared_commands.get((command_name, session_pipeline.id))
+    if prepared_command is None or prepared_command.user_id != user_id:
+      prepared_command = self._command_parser.prepare_command(command_name, session_pipeline.id+"."+self.id, 
+                                                              user_id = user_id)
+      self._prepared_commands[(command_name, session_pipeline.id)] = prepared_command
+
+    return prepared_command
+
   def _register_services(self, pipeline):
     """ Allows the driver to register any services that it may provide with its pipelines.
     
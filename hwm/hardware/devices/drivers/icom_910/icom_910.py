@@ -11,6 +11,7 @@ from hwm.core.configuration import *
 from hwm.hardware.pipelines import pipeline
 from hwm.hardware.devices.drivers import driver
 from hwm.command import command
+from hwm.command.metadata import *
 from hwm.command.handlers import handler
 
 class ICOM_910(driver.HardwareDriver):
@@ -141,31 +142,15 @@ class ICOM_910(driver.HardwareDriver):
 
       # Send the command to update the downlink frequency
       new_downlink_freq = target_position['doppler_multiplier'] * self._radio_state['set_rx_freq']
-      command_request = {
-        'command': "set_rx_freq",
-        'destination': self._session_pipeline.id+"."+self.id,
-        'parameters': {
-          'frequency': new_downlink_freq
-        }
-      }
-      command_deferred = self._command_parser.parse_command(command_request, 
-                                                            user_id = self._session_pipeline.current_session.user_id)
-      results = yield command_deferred
+      rx_freq_command = self._load_prepared_command("set_rx_freq", self._session_pipeline)
+      results = yield rx_freq_command.execute({'rx_freq': new_downlink_freq})
 
       # Send the command to update the uplink frequency
       if results['response']['status'] is not 'error':
         downlink_freq_set = True
       new_uplink_freq = target_position['doppler_multiplier'] * self._radio_state['set_tx_freq']
-      command_request = {
-        'command': "set_tx_freq",
-        'destination': self._session_pipeline.id+"."+self.id,
-        'parameters': {
-          'frequency': new_uplink_freq
-        }
-      }
-      command_deferred = self._command_parser.parse_command(command_request, 
-                                                            user_id = self._session_pipeline.current_session.user_id)
-      results = yield command_deferred
+      tx_freq_command = self._load_prepared_command("set_tx_freq", self._session_pipeline)
+      results = yield tx_freq_command.execute({'tx_freq': new_uplink_freq})
 
       # Verify the results
       if results['response']['status'] is not 'error':
@@ -310,13 +295,14 @@ class ICOM910Handler(handler.DeviceCommandHandler):
       {
         "type": "number",
         "required": True,
-        "title": "rx_frequency",
+        "title": "rx_freq",
         "description": "The Icom 910's downlink frequency (in Mhz).",
         "integer": False
       }
     ]
 
-    return build_metadata_dict(command_parameters, 'set_rx_freq', self.name, requires_active_session = True)
+    return build_metadata_dict(command_parameters, 'set_rx_freq', self.name, requires_active_session = True,
+                               coalesce = True)
 
   def command_set_tx_freq(self, active_command):
     """ Sets the uplink frequency for the radio.
@@ -371,13 +357,14 @@ class ICOM910Handler(handler.DeviceCommandHandler):
       {
         "type": "number",
         "required": True,
-        "title": "tx_frequency",
+        "title": "tx_freq",
         "description": "The Icom 910's uplink frequency (in Mhz).",
         "integer": False
       }
     ]
 
-    return build_metadata_dict(command_parameters, 'set_tx_freq', self.name, requires_active_session = True)
+    return build_metadata_dict(command_parameters, 'set_tx_freq', self.name, requires_active_session = True,
+                               coalesce = True)
 
 class ICOM910Error(Exception):
   pass
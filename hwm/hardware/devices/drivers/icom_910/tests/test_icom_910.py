@@ -8,6 +8,7 @@ from twisted.internet import defer
 from twisted.internet.defer import inlineCallbacks
 from hwm.core.configuration import *
 from hwm.command import command
+from hwm.command.tests import utilities
 from hwm.hardware.pipelines import pipeline
 from hwm.hardware.devices.drivers.icom_910 import icom_910
 
@@ -153,15 +154,15 @@ class TestIcom910(unittest.TestCase):
 
     def mock_parse_command(command_request, **keywords):
       if command_request['command'] == "set_rx_freq":
-        self.assertEqual(command_request['parameters']['frequency'], 5)
+        self.assertEqual(command_request['parameters']['rx_freq'], 5)
       elif command_request['command'] == "set_tx_freq":
-        self.assertEqual(command_request['parameters']['frequency'], 25)
+        self.assertEqual(command_request['parameters']['tx_freq'], 25)
 
       return defer.succeed({'response':{'status':'okay'}})
 
     # Create a test Icom driver
     test_cp = MagicMock()
-    test_cp.parse_command = mock_parse_command
+    test_cp.prepare_command = utilities.mock_prepare_command(mock_parse_command)
     test_device = icom_910.ICOM_910(self.standard_icom_config, test_cp)
     test_device._session_pipeline = test_pipeline
     test_device._radio_state['set_rx_freq'] = 20
@@ -196,7 +197,7 @@ class TestIcom910(unittest.TestCase):
 
     # Create a test Icom driver
     test_cp = MagicMock()
-    test_cp.parse_command = mock_parse_command
+    test_cp.prepare_command = utilities.mock_prepare_command(mock_parse_command)
     test_device = icom_910.ICOM_910(self.standard_icom_config, test_cp)
     test_device._session_pipeline = test_pipeline
     test_device._radio_state['set_downlink_freq'] = 20
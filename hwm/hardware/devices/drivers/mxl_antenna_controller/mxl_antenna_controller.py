@@ -4,13 +4,15 @@ This module contains the driver and command handler for the MXL Antenna Controll
 
 # Import required modules
 import logging, time, json
-import urllib, urllib2
-from twisted.internet import task, defer, threads
+import urllib
+from twisted.internet import task, defer
 from twisted.internet.defer import inlineCallbacks
 from hwm.hardware.devices.drivers import driver
 from hwm.hardware.pipelines import pipeline
 from hwm.command import command
+from hwm.command.metadata import *
 from hwm.command.handlers import handler
+from hwm.network import http_client
 
 class MXL_Antenna_Controller(driver.HardwareDriver):
   """ A driver for the custom MXL antenna controller.
@@ -122,16 +124,11 @@ class MXL_Antenna_Controller(driver.HardwareDriver):
     target_elevation = 0 if target_position['elevation']<0 else int(target_position['elevation'])
 
     # Move the antenna
-    command_request = {
-      'command': "move",
-      'destination': self._session_pipeline.id+"."+self.id,
-      'parameters': {
-        'azimuth': int(target_position['azimuth']),
-        'elevation': target_elevation
-      }
-    }
-    command_deferred = self._command_parser.parse_command(command_request, 
-                                                          user_id = self._session_pipeline.current_session.user_id)
+    move_command = self._load_prepared_command("move", self._session_pipeline)
+    command_deferred = move_command.execute({
+      'azimuth': int(target_position['azimuth']),
+      'elevation': target_elevation
+    })
 
     return command_deferred
 
@@ -147,13 +144,8 @@ class MXL_Antenna_Controller(driver.HardwareDriver):
     """
 
     # Query the antenna controller for it's current orientation
-    command_request = {
-      'command': "get_state",
-      'destination': self._session_pipeline.id+"."+self.id
-    }
-    command_deferred = self._command_parser.parse_command(command_request, 
-                                                          user_id = self._session_pipeline.current_session.user_id)
-    result = yield command_deferred
+    state_command = self._load_prepared_command("get_state", self._session_pipeline)
+    result = yield state_command.execute()
 
     # Process the results
     if result['response']['status'] == "okay":
@@ -235,7 +227,8 @@ class AntennaControllerHandler(handler.DeviceCommandHandler):
     # Define a schema for parameters
     command_parameters = [
       {
-        "type": "integer",
+        "type": "number",
+        "integer": True,
         "minvalue": 0,
         "maxvalue": 360,
         "required": True,
@@ -243,7 +236,8 @@ class AntennaControllerHandler(handler.DeviceCommandHandler):
         "description": "The desired azimuth."
       },
       {
-        "type": "integer",
+        "type": "number",
+        "integer": True,
         "minvalue": 0,
         "maxvalue": 210,
         "required": True,
@@ -253,7 +247,7 @@ class AntennaControllerHandler(handler.DeviceCommandHandler):
     ]
 
     return build_metadata_dict(command_parameters, 'move', self.name, requires_active_session = True,
-                               schedulable = True)
+                               schedulable = True, coalesce = True)
 
   @inlineCallbacks
   def command_park(self, active_command):
@@ -423,7 +417,7 @@ class AntennaControllerHandler(handler.DeviceCommandHandler):
     @return Returns a dictionary containing meta-data about the command.
     """
 
-    return build_metadata_dict([], 'get_state', self.name, requires_active_session = True)
+    return build_metadata_dict([], 'get_state', self.name, requires_active_session = True, cache_ttl = 1)
 
   @inlineCallbacks
   def command_stop(self, active_command):
@@ -455,7 +449,7 @@ class AntennaControllerHandler(handler.DeviceCommandHandler):
     @return Returns a dictionary containing meta-data about the command.
     """
 
-    return build_metadata_dict([], 'stop', self.name, requires_active_session = True)
+    return build_metadata_dict([], 'stop', self.name, requires_active_session = True, priority = 'high')
 
   @inlineCallbacks
   def command_stop_emergency(self, active_command):
@@ -489,7 +483,8 @@ class AntennaControllerHandler(handler.DeviceCommandHandler):
     @return Returns a dictionary containing meta-data about the command.
     """
 
-    return build_metadata_dict([], 'stop_emergency', self.name, requires_active_session = True, dangerous = True)
+    return build_metadata_dict([], 'stop_emergency', self.name, requires_active_session = True, dangerous = True,
+                               priority = 'high')
 
   def _build_request(self, command, parameters = None):
     """ Constructs a request dictionary for the antenna controller API.
@@ -534,19 +529,19 @@ class AntennaControllerHandler(handler.DeviceCommandHandler):
     """ Asynchronously sends commands to the antenna controller.
 
     This method is used by _send_commands() to send commands to the antenna controller API in a non-blocking fashion.
+    The requests are made using the shared HTTP client, so the connection to the antenna controller is kept open between
+    commands.
 
     @param encoded_request  The encoded request JSON ready for transmission.
     @return Returns a deferred that will be fired with the request response.
     """
 
     # Query the antenna controller API
-    ac_request = urllib2.Request(self.driver.controller_api_endpoint, encoded_request)
-    ac_opener = urllib2.build_opener()
-    ac_deferred = threads.deferToThread(ac_opener.open, ac_request, None, self.driver.controller_api_timeout)
-    ac_response = yield ac_deferred
+    ac_response = yield http_client.get_client().post(self.driver.controller_api_endpoint, encoded_request,
+                                                      timeout = self.driver.controller_api_timeout)
 
     # Parse and return response
-    parsed_response = json.load(ac_response)
+    parsed_response = json.loads(ac_response.body)
     defer.returnValue(parsed_response)
 
   def _handle_query_error(self, failure):
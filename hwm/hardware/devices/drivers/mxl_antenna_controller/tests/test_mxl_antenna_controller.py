@@ -1,15 +1,16 @@
 # Import required modules
-import logging, time, urllib2, urlparse, json
+import logging, time, json
 from twisted.trial import unittest
 from twisted.internet import defer
 from twisted.internet.defer import inlineCallbacks
 from mock import MagicMock
 from pkg_resources import Requirement, resource_filename
-from StringIO import StringIO
 from hwm.core.configuration import *
 from hwm.command import command
+from hwm.command.tests import utilities
 from hwm.hardware.devices.drivers.mxl_antenna_controller import mxl_antenna_controller
 from hwm.hardware.pipelines import pipeline
+from hwm.network.tests.utilities import StandInHTTPServer
 
 class TestMXLAntennaControllerDriver(unittest.TestCase):
   """ This test suite verifies the functionality of the custom MXL antenna controller driver.
@@ -153,7 +154,7 @@ class TestMXLAntennaControllerDriver(unittest.TestCase):
 
     # Create a test device
     test_cp = MagicMock()
-    test_cp.parse_command = mock_parse_command
+    test_cp.prepare_command = utilities.mock_prepare_command(mock_parse_command)
     test_device = mxl_antenna_controller.MXL_Antenna_Controller(self.standard_device_configuration, test_cp)
     test_device._session_pipeline = test_pipeline
 
@@ -206,7 +207,7 @@ class TestMXLAntennaControllerDriver(unittest.TestCase):
 
     # Create a test device
     test_cp = MagicMock()
-    test_cp.parse_command = mock_parse_command
+    test_cp.prepare_command = utilities.mock_prepare_command(mock_parse_command)
     test_device = mxl_antenna_controller.MXL_Antenna_Controller(self.standard_device_configuration, test_cp)
     test_device._session_pipeline = test_pipeline
 
@@ -244,7 +245,7 @@ class TestMXLAntennaControllerDriver(unittest.TestCase):
 
     # Create a test device
     test_cp = MagicMock()
-    test_cp.parse_command = mock_parse_command
+    test_cp.prepare_command = utilities.mock_prepare_command(mock_parse_command)
     test_device = mxl_antenna_controller.MXL_Antenna_Controller(self.standard_device_configuration, test_cp)
     test_device._session_pipeline = test_pipeline
 
@@ -270,28 +271,30 @@ class TestMXLAntennaControllerHandler(unittest.TestCase):
     self.source_data_directory = resource_filename(Requirement.parse("Mercury2HWM"),"hwm")
     self.config.read_configuration(self.source_data_directory+'/core/tests/data/test_config_basic.yml')
 
-    # Backup a urllib2 method that gets monkey-patched so that it can be restored between tests
-    self.old_build_opener = urllib2.build_opener
+    # Start a local server to stand in for the antenna controller API
+    self.controller_server = StandInHTTPServer()
+    self.controller_server.start()
 
     # Setup a test driver and command handler
     self.test_driver = MagicMock()
     self.test_driver._controller_state = {}
     self.test_handler = mxl_antenna_controller.AntennaControllerHandler(self.test_driver)
-    self.test_driver.controller_api_endpoint = "http://actest.local"
+    self.test_driver.controller_api_endpoint = self.controller_server.url+"api"
+    self.test_driver.controller_api_timeout = 2
     
     # Disable logging for most events
     logging.disable(logging.CRITICAL)
   
   def tearDown(self):
-    # Restore urllib2 functions
-    urllib2.build_opener = self.old_build_opener
-
     # Reset the recorded configuration values
     self._reset_config_entries()
     
     # Reset the configuration reference
     self.config = None
 
+    # Stop the stand-in antenna controller
+    return self.controller_server.stop()
+
   def test_build_request(self):
     """ Tests the _build_request method, which is responsible for building individual requests for the antenna
     controller API. """
@@ -312,19 +315,15 @@ class TestMXLAntennaControllerHandler(unittest.TestCase):
     correctly packages commands and returns the response. """
 
     def mock_request_handler(request):
-      form_params = urlparse.parse_qs(request.get_data())
-      request_json = json.loads(form_params['request'][0])
+      request_json = json.loads(request.args['request'][0])
       
       # Make sure the request arrived in the correct format
+      self.assertEqual(request.method, "POST")
       self.assertEqual(request_json[0]['command'], "TC")
       self.assertEqual(request_json[0]['arguments']['param1'], "waffles")
       self.assertEqual(request_json[1]['command'], "TC2")
 
-      response = urllib2.addinfourl(StringIO("{\"status\":\"okay\",\"responses\":[{\"timestamp\":1384814185,\"command\":\"move\"}]}"), "mock headers", request.get_full_url())
-      response.code = 200
-      response.msg = "OK"
-  
-      return response
+      return "{\"status\":\"okay\",\"responses\":[{\"timestamp\":1384814185,\"command\":\"move\"}]}"
 
     # Build and submit some mock commands
     self._set_mock_request_builder(mock_request_handler)
@@ -343,7 +342,8 @@ class TestMXLAntennaControllerHandler(unittest.TestCase):
     """ Tests that the _send_commands() method can correctly handle connection errors if they arise. """
 
     def mock_request_handler(request):
-      raise TypeError("Test error yo.")
+      # Drop the connection without responding
+      return None
 
     # Build and submit some mock commands
     self._set_mock_request_builder(mock_request_handler)
@@ -360,11 +360,7 @@ class TestMXLAntennaControllerHandler(unittest.TestCase):
     """ Tests that the _send_commands() method can correctly handle malformed responses. """
 
     def mock_request_handler(request):
-      response = urllib2.addinfourl(StringIO("{\"invalid_json\":True}"), "mock headers", request.get_full_url())
-      response.code = 200
-      response.msg = "OK"
-  
-      return response
+      return "{\"invalid_json\":True}"
 
     # Build and submit some mock commands
     self._set_mock_request_builder(mock_request_handler)
@@ -542,77 +538,41 @@ class TestMXLAntennaControllerHandler(unittest.TestCase):
     self.config.user_options = {}
 
   def _set_mock_request_builder(self, mock_request_handler):
-    """ This method modifies the global urllib2 module to return a handler that we constructed that uses a custom 
-    request handler to simulate network events.
+    """ Sets the function that the stand-in antenna controller API will use to respond to requests.
     """
 
-    urllib2.build_opener = self.old_build_opener
-    test_build_opener = urllib2.build_opener(MockAntennaControllerHandler)
-    urllib2.build_opener = lambda : test_build_opener
-    for temp_handler in test_build_opener.handlers:
-      if isinstance(temp_handler, MockAntennaControllerHandler):
-        temp_handler.mock_request_builder = mock_request_handler
-        break
-
-    return test_build_opener
-
-class MockAntennaControllerHandler(urllib2.HTTPHandler):
-  """ A mock HTTP handler for simulating antenna controller API queries. """
-  
-  def http_open(self, req):
-    return self.mock_request_builder(req)
+    self.controller_server.response_handler = mock_request_handler
 
 def mock_ac_success(request):
-  """ A mock urllib2 request handler that returns a simulated successful antenna controller API response for a single
-  move command.
+  """ A mock request handler that returns a simulated successful antenna controller API response for a single move
+  command.
   """
 
-  response = urllib2.addinfourl(StringIO("{\"status\":\"okay\",\"responses\":[{\"timestamp\":1384814185,\"command\":\"move\"}]}"), "mock headers", request.get_full_url())
-  response.code = 200
-  response.msg = "OK"
-  
-  return response
+  return "{\"status\":\"okay\",\"responses\":[{\"timestamp\":1384814185,\"command\":\"move\"}]}"
 
 def mock_ac_success_multiple(request):
-  """ A mock urllib2 request handler that returns a simulated successful antenna controller API response for sequential
-  move and park commands.
+  """ A mock request handler that returns a simulated successful antenna controller API response for sequential move 
+  and park commands.
   """
 
-  response = urllib2.addinfourl(StringIO("{\"status\":\"okay\",\"responses\":[{\"timestamp\":1384814185,\"command\":\"move\"},{\"timestamp\":1384814185,\"command\":\"park\"}]}"), "mock headers", request.get_full_url())
-  response.code = 200
-  response.msg = "OK"
-  
-  return response
+  return "{\"status\":\"okay\",\"responses\":[{\"timestamp\":1384814185,\"command\":\"move\"},{\"timestamp\":1384814185,\"command\":\"park\"}]}"
 
 def mock_ac_failure(request):
-  """ A mock urllib2 request handler that returns a simulated failed antenna controller API response for a single 
-  command.
+  """ A mock request handler that returns a simulated failed antenna controller API response for a single command.
   """
 
-  response = urllib2.addinfourl(StringIO("{\"status\":\"error\",\"message\":\"waffles\",\"responses\": []}"), "mock headers", request.get_full_url())
-  response.code = 200
-  response.msg = "OK"
-  
-  return response
+  return "{\"status\":\"error\",\"message\":\"waffles\",\"responses\": []}"
 
 def mock_ac_failure_multiple(request):
-  """ A mock urllib2 request handler that returns a simulated failed antenna controller API response for sequential
-  move and park commands.
+  """ A mock request handler that returns a simulated failed antenna controller API response for sequential move and
+  park commands.
   """
 
-  response = urllib2.addinfourl(StringIO("{\"status\":\"error\",\"message\":\"waffles\",\"responses\":[{\"timestamp\":1384814185,\"command\":\"move\"}]}"), "mock headers", request.get_full_url())
-  response.code = 200
-  response.msg = "OK"
-  
-  return response
+  return "{\"status\":\"error\",\"message\":\"waffles\",\"responses\":[{\"timestamp\":1384814185,\"command\":\"move\"}]}"
 
 def mock_ac_state(request):
-  """ A mock urllib2 request handler that returns a simulated successful antenna controller API response for a single
-  state command.
+  """ A mock request handler that returns a simulated successful antenna controller API response for a single state
+  command.
   """
 
-  response = urllib2.addinfourl(StringIO("{\"status\":\"okay\",\"responses\":[{\"timestamp\":1384814185,\"command\":\"state\",\"azimuth\":42.0,\"elevation\":42.0}]}"), "mock headers", request.get_full_url())
-  response.code = 200
-  response.msg = "OK"
-  
-  return response
+  return "{\"status\":\"okay\",\"responses\":[{\"timestamp\":1384814185,\"command\":\"state\",\"azimuth\":42.0,\"elevation\":42.0}]}"
@@ -5,14 +5,14 @@ the APRS.fi network and position information downlinked directly from the balloo
 
 # Import required modules
 import time, json, logging
-import urllib2
 from math import *
-from twisted.internet import task, defer, reactor, threads
+from twisted.internet import task, defer, reactor
 from hwm.core.configuration import Configuration
 from hwm.hardware.devices.drivers import driver, service
 from hwm.command.handlers import handler
 from hwm.command.metadata import *
 from hwm.command import command
+from hwm.network import http_client
 
 class MXL_Balloon_Tracker(driver.VirtualDriver):
   """ A general purpose tracker for MXL Balloon missions.
@@ -202,7 +202,7 @@ class Direct_Downlink_APRS_Service(service.Service):
     # Query APRS.fi if needed
     if self.callsign is not None:
       if self._balloon_position['timestamp'] is None or (int(time.time()) - self._balloon_position['timestamp']) >= self.aprs_fallback_timeout:
-        tracking_update_deferred = threads.deferToThread(self._query_aprs_api)
+        tracking_update_deferred = self._query_aprs_api()
         tracking_update_deferred.addErrback(self._handle_aprs_error)
         tracking_update_deferred.addCallback(self._update_targeting_info)
 
@@ -228,23 +228,44 @@ class Direct_Downlink_APRS_Service(service.Service):
   def _query_aprs_api(self):
     """ Queries the APRS.fi API for the target's last known location.
     
-    @note This method is blocking and should be called using threads.deferToThread().
+    @note The API is queried asynchronously using the shared HTTP client.
 
-    @return Returns a dictionary containing the target's last known location from APRS.fi.
+    @return Returns a deferred that will be fired with a dictionary containing the target's last known location from 
+            APRS.fi, or with an APRSAPIError if the query fails.
     """
     
     # Query APRS.fi for the balloon's location
     try:
-      aprs_request = urllib2.Request(self._aprs_api_endpoint)
-      aprs_opener = urllib2.build_opener()
-      aprs_response = aprs_opener.open(aprs_request, None, self.aprs_update_timeout)
+      query_deferred = http_client.get_client().get(self._aprs_api_endpoint, timeout = self.aprs_update_timeout)
     except Exception as e:
-      # Error downloading the file
-      raise APRSAPIError('There was an error querying the APRS.fi API.')
+      query_deferred = defer.fail()
+    query_deferred.addCallbacks(self._parse_aprs_response, self._aprs_query_failed)
+
+    return query_deferred
+
+  def _aprs_query_failed(self, failure):
+    """ Translates errors that occur while querying the APRS.fi API into APRSAPIError exceptions.
+
+    @throw Throws APRSAPIError.
+
+    @param failure  A Failure object encapsulating the error.
+    """
+
+    # Error downloading the file
+    raise APRSAPIError('There was an error querying the APRS.fi API.')
+
+  def _parse_aprs_response(self, aprs_response):
+    """ Parses an APRS.fi API response.
+
+    @throw Throws APRSAPIError if the response can't be parsed or indicates that the query failed.
+
+    @param aprs_response  The HTTPResponse from the APRS.fi API.
+    @return Returns a dictionary containing the target's last known location from APRS.fi.
+    """
     
     # Parse the APRS response
     try:
-      parsed_response = json.load(aprs_response)
+      parsed_response = json.loads(aprs_response.body)
     except ValueError as e:
       # Error parsing the response
       raise APRSAPIError('There was an error parsing the JSON response from the APRS.fi API.')
@@ -539,7 +560,7 @@ class BalloonHandler(handler.DeviceCommandHandler):
       {
         "type": "string",
         "minlength": 1,
-        "maxlength": 1,
+        "maxlength": 9,
         "required": True,
         "title": "callsign",
         "description": "The APRS callsign to be tracked."
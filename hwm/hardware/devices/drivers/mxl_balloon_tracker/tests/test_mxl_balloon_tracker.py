@@ -1,13 +1,13 @@
 # Import required modules
-import logging, time, urllib2
+import logging, time
 from twisted.trial import unittest
 from twisted.internet.defer import inlineCallbacks
 from mock import MagicMock
 from pkg_resources import Requirement, resource_filename
-from StringIO import StringIO
 from hwm.core.configuration import *
 from hwm.command import command
 from hwm.hardware.devices.drivers.mxl_balloon_tracker import mxl_balloon_tracker
+from hwm.network.tests.utilities import StandInHTTPServer
 
 class TestMXLBalloonTrackerDriver(unittest.TestCase):
   """ This test suite verifies the functionality of the MXL Balloon Tracker virtual driver.
@@ -21,16 +21,10 @@ class TestMXLBalloonTrackerDriver(unittest.TestCase):
     self.config.read_configuration(self.source_data_directory+'/core/tests/data/test_config_basic.yml')
     self.standard_device_config = {'id': "test_device", 'update_interval': 2, 'aprs_fallback_timeout': 10, 'aprs_update_timeout': 4, 'api_key': None} 
 
-    # Backup a urllib2 method that gets monkey-patched so that it can be restored between tests
-    self.old_build_opener = urllib2.build_opener
-    
     # Disable logging for most events
     logging.disable(logging.CRITICAL)
   
   def tearDown(self):
-    # Restore urllib2 functions
-    urllib2.build_opener = self.old_build_opener
-
     # Reset the recorded configuration values
     self._reset_config_entries()
     
@@ -87,16 +81,10 @@ class TestBalloonHandler(unittest.TestCase):
     self.source_data_directory = resource_filename(Requirement.parse("Mercury2HWM"),"hwm")
     self.config.read_configuration(self.source_data_directory+'/core/tests/data/test_config_basic.yml')
 
-    # Backup a urllib2 method that gets monkey-patched so that it can be restored between tests
-    self.old_build_opener = urllib2.build_opener
-    
     # Disable logging for most events
     logging.disable(logging.CRITICAL)
   
   def tearDown(self):
-    # Restore urllib2 functions
-    urllib2.build_opener = self.old_build_opener
-
     # Reset the recorded configuration values
     self._reset_config_entries()
     
@@ -177,22 +165,23 @@ class TestAPRSTrackingService(unittest.TestCase):
     self.config.read_configuration(self.source_data_directory+'/core/tests/data/test_config_basic.yml')
     self.standard_device_config = {'id': "test_device", 'update_interval': 2, 'aprs_fallback_timeout': 10, 'aprs_update_timeout': 4, 'api_key': None} 
 
-    # Backup a urllib2 method that gets monkey-patched so that it can be restored between tests
-    self.old_build_opener = urllib2.build_opener
+    # Start a local server to stand in for the APRS.fi API
+    self.aprs_server = StandInHTTPServer()
+    self.aprs_server.start()
     
     # Disable logging for most events
     logging.disable(logging.CRITICAL)
   
   def tearDown(self):
-    # Restore urllib2 functions
-    urllib2.build_opener = self.old_build_opener
-
     # Reset the recorded configuration values
     self._reset_config_entries()
     
     # Reset the configuration reference
     self.config = None
 
+    # Stop the stand-in APRS.fi API
+    return self.aprs_server.stop()
+
   def test_service_initialization(self):
     """ Tests that the tracking service correctly initializes its state when constructed.
     """
@@ -228,6 +217,7 @@ class TestAPRSTrackingService(unittest.TestCase):
     self.assertEqual(balloon_position['azimuth'], 20)
     self.assertEqual(balloon_position['elevation'], 30)
 
+  @inlineCallbacks
   def test_aprs_query(self):
     """ Tests that the APRS query method can successfully query the APRS API for the balloon's position and parse the 
     response.
@@ -237,38 +227,40 @@ class TestAPRSTrackingService(unittest.TestCase):
           dependencies.
     """
 
-    # Create a test service instance and mock some urllib2 methods
+    # Create a test service instance that uses the stand-in APRS.fi API
     test_service = mxl_balloon_tracker.Direct_Downlink_APRS_Service('direct_downlink_aprs_service', 'tracker', self.standard_device_config)
-    test_service._aprs_api_endpoint = "http://aprstest.local"
+    test_service._aprs_api_endpoint = self.aprs_server.url+"api/get"
     self.set_mock_request_builder(mock_aprs_success)
 
     # Query the APRS API with a successful request and make sure it correctly parses the response
-    test_location = test_service._query_aprs_api()
+    test_location = yield test_service._query_aprs_api()
     self.assertEqual(test_location['timestamp'], 1384119682)
     self.assertEqual(test_location['longitude'], -83.944942)
     self.assertEqual(test_location['latitude'], 42.003933)
     self.assertEqual(test_location['altitude'], 12000)
 
+  @inlineCallbacks
   def test_aprs_query_errors(self):
     """ Verifies that the APRS query method can correctly handle several probable errors.
     """
 
-    # Create a test service instance and mock some urllib2 methods
+    # Create a test service instance with an invalid API endpoint
     test_service = mxl_balloon_tracker.Direct_Downlink_APRS_Service('direct_downlink_aprs_service', 'tracker', self.standard_device_config)
     test_service._aprs_api_endpoint = "aprstest.local"
 
-    # Test that the service correctly responds to urllib2 errors
-    self.assertRaises(mxl_balloon_tracker.APRSAPIError, test_service._query_aprs_api)
+    # Test that the service correctly responds to request errors
+    yield self.assertFailure(test_service._query_aprs_api(), mxl_balloon_tracker.APRSAPIError)
+    test_service._aprs_api_endpoint = self.aprs_server.url+"api/get"
+    self.aprs_server.respond_with("Server error.", code = 500)
+    yield self.assertFailure(test_service._query_aprs_api(), mxl_balloon_tracker.APRSAPIError)
 
     # Test with a malformed APRS response
-    test_service._aprs_api_endpoint = "http://aprstest.local"
     self.set_mock_request_builder(mock_aprs_malformed)
-    self.assertRaises(mxl_balloon_tracker.APRSAPIError, test_service._query_aprs_api)
+    yield self.assertFailure(test_service._query_aprs_api(), mxl_balloon_tracker.APRSAPIError)
 
     # Test with a failed APRS response
-    test_service._aprs_api_endpoint = "http://aprstest.local"
     self.set_mock_request_builder(mock_aprs_failed)
-    self.assertRaises(mxl_balloon_tracker.APRSAPIError, test_service._query_aprs_api)
+    yield self.assertFailure(test_service._query_aprs_api(), mxl_balloon_tracker.APRSAPIError)
 
   def test_calculate_targeting_info_failed(self):
     """ Tests that the APRS tracking service correctly handles errors that may occur when calculating balloon targeting 
@@ -329,7 +321,7 @@ class TestAPRSTrackingService(unittest.TestCase):
 
     # Verify results and set the APRS callsign + mock the API to return a failed response
     self.assertEqual(result, None)
-    test_service._aprs_api_endpoint = "http://aprstest.local"
+    test_service._aprs_api_endpoint = self.aprs_server.url+"api/get"
     self.set_mock_request_builder(mock_aprs_failed)
     test_service.callsign = "test_callsign"
     test_deferred = test_service._track_target()
@@ -354,7 +346,7 @@ class TestAPRSTrackingService(unittest.TestCase):
 
     # Set the APRS callsign, add an existing expired balloon position, and mock the API to return a failed response
     test_service._balloon_position['timestamp'] = 1384119680
-    test_service._aprs_api_endpoint = "http://aprstest.local"
+    test_service._aprs_api_endpoint = self.aprs_server.url+"api/get"
     self.set_mock_request_builder(mock_aprs_success)
     test_service.callsign = "test_callsign"
     test_deferred = test_service._track_target()
@@ -419,7 +411,7 @@ class TestAPRSTrackingService(unittest.TestCase):
     # Mock the position service with a function that will generate an error and check that it reverted to APRS
     test_service._live_craft_position_service = MagicMock()
     test_service._live_craft_position_service.get_position = mock_get_position_error
-    test_service._aprs_api_endpoint = "http://aprstest.local"
+    test_service._aprs_api_endpoint = self.aprs_server.url+"api/get"
     test_service.callsign = "test_callsign"
     self.set_mock_request_builder(mock_aprs_success)
     test_deferred = test_service._track_target()
@@ -504,57 +496,30 @@ class TestAPRSTrackingService(unittest.TestCase):
     return test_deferred
 
   def set_mock_request_builder(self, mock_request_handler):
-    """ This method modifies the global urllib2 module to return a handler that we constructed that uses a custom 
-    request handler.
+    """ Sets the function that the stand-in APRS.fi API will use to respond to requests.
     """
 
-    urllib2.build_opener = self.old_build_opener
-    test_build_opener = urllib2.build_opener(MockAPRSHandler)
-    urllib2.build_opener = lambda : test_build_opener
-    for temp_handler in test_build_opener.handlers:
-      if isinstance(temp_handler, MockAPRSHandler):
-        temp_handler.mock_request_builder = mock_request_handler
-        break
-
-    return test_build_opener
+    self.aprs_server.response_handler = mock_request_handler
 
   def _reset_config_entries(self):
     # Reset the recorded configuration entries
     self.config.options = {}
     self.config.user_options = {}
 
-class MockAPRSHandler(urllib2.HTTPHandler):
-  """ A mock HTTP handler for simulating APRS.fi API queries. """
-
-  def http_open(self, req):
-    return self.mock_request_builder(req)
-
 def mock_aprs_success(request):
-  """ A mock urllib2 request handler that returns a simulated successful APRS.fi API response.
+  """ A mock request handler that returns a simulated successful APRS.fi API response.
   """
 
-  response = urllib2.addinfourl(StringIO("{\"command\":\"get\",\"result\":\"ok\",\"what\":\"loc\",\"found\":1,\"entries\": [{\"time\":\"1384119682\",\"lat\":\"42.003933\",\"lng\":\"-83.944942\",\"altitude\":\"12000\"}]}"), "mock headers", request.get_full_url())
-  response.code = 200
-  response.msg = "OK"
-  
-  return response
+  return "{\"command\":\"get\",\"result\":\"ok\",\"what\":\"loc\",\"found\":1,\"entries\": [{\"time\":\"1384119682\",\"lat\":\"42.003933\",\"lng\":\"-83.944942\",\"altitude\":\"12000\"}]}"
 
 def mock_aprs_malformed(request):
-  """ A mock urllib2 request handler that returns a malformed APRS.fi response.
+  """ A mock request handler that returns a malformed APRS.fi response.
   """
 
-  response = urllib2.addinfourl(StringIO("{\"test_response\":false,\"invalid\":True}"), "mock headers", request.get_full_url())
-  response.code = 200
-  response.msg = "OK"
-  
-  return response
+  return "{\"test_response\":false,\"invalid\":True}"
 
 def mock_aprs_failed(request):
-  """ A mock urllib2 request handler that returns a simulated failed APRS.fi API response.
+  """ A mock request handler that returns a simulated failed APRS.fi API response.
   """
 
-  response = urllib2.addinfourl(StringIO("{\"command\":\"get\",\"result\":\"fail\",\"description\":\"Test error description.\"}"), "mock headers", request.get_full_url())
-  response.code = 200
-  response.msg = "OK"
-  
-  return response
+  return "{\"command\":\"get\",\"result\":\"fail\",\"description\":\"Test error description.\"}"
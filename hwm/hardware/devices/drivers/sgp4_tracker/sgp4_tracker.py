@@ -11,6 +11,7 @@ from twisted.internet import task, defer
 from hwm.core.configuration import *
 from hwm.hardware.devices.drivers import driver, service
 from hwm.command import command
+from hwm.command.metadata import *
 from hwm.command.handlers import handler
 
 class SGP4TrackerDriver(driver.VirtualDriver):
@@ -332,18 +333,18 @@ class SGP4Handler(handler.DeviceCommandHandler):
     command_parameters = [
       {
         "type": "string",
-        "minlength": 80,
-        "maxlength": 80,
+        "minlength": 69,
+        "maxlength": 69,
         "required": True,
-        "title": "TLE_line_1",
+        "title": "line_1",
         "description": "The first line of the target's TLE."
       },
       {
         "type": "string",
-        "minlength": 80,
-        "maxlength": 80,
+        "minlength": 69,
+        "maxlength": 69,
         "required": True,
-        "title": "TLE_line_2",
+        "title": "line_2",
         "description": "The second line of the target's TLE."
       },
     ]
@@ -58,6 +58,31 @@ class TestBaseDriver(unittest.TestCase):
     test_driver._command_handler = test_command_handler
     self.assertTrue(test_driver.get_command_handler() is test_command_handler)
 
+  def test_loading_prepared_commands(self):
+    """ Tests that the Driver class caches the prepared commands that it uses for each pipeline and creates new ones
+    when the pipeline's session user changes.
+    """
+
+    # Load a device to test with
+    test_driver = self.device_manager.get_device_driver("test_device")
+    test_driver._command_parser.prepare_command = lambda command_name, destination, user_id: MagicMock(
+      command = command_name, destination = destination, user_id = user_id)
+    test_pipeline = MagicMock()
+    test_pipeline.id = "test_pipeline"
+    test_pipeline.current_session.user_id = "1"
+
+    # Load a prepared command and make sure it gets cached
+    prepared_command = test_driver._load_prepared_command("test_command", test_pipeline)
+    self.assertEqual(prepared_command.destination, "test_pipeline.test_device")
+    self.assertEqual(prepared_command.user_id, "1")
+    self.assertTrue(test_driver._load_prepared_command("test_command", test_pipeline) is prepared_command)
+
+    # Change the session user
+    test_pipeline.current_session.user_id = "2"
+    new_prepared_command = test_driver._load_prepared_command("test_command", test_pipeline)
+    self.assertTrue(new_prepared_command is not prepared_command)
+    self.assertEqual(new_prepared_command.user_id, "2")
+
   def test_writing_device_output(self):
     """ Tests that the Driver class can pass its output to its registered pipelines. The default implementation of the 
     Driver.write_output() method only writes to active pipelines that specify this device as its output device.
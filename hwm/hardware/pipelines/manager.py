@@ -94,6 +94,9 @@ class PipelineManager:
     for pipeline_config in pipeline_settings:
       temp_pipeline = pipeline.Pipeline(pipeline_config, self.device_manager, self.command_parser)
       self.pipelines[temp_pipeline.id] = temp_pipeline
+
+    # Index the commands offered by the newly loaded devices
+    self.command_parser.rebuild_routing_table()
   
   def _validate_pipeline_schema(self, pipeline_configuration):
     """ Validates the provided pipeline configuration.
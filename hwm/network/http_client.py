@@ -0,0 +1,378 @@
+""" @package hwm.network.http_client
+A shared, non-blocking HTTP client.
+
+This module contains the HTTP client used by the hardware manager to query remote web APIs (e.g. the mercury2 user
+interface's schedule and permission resources, antenna controller APIs, and APRS.fi). Requests are made asynchronously
+by the reactor instead of in threads, and connections are kept alive and reused from a pool (one per host), so that
+periodic requests to the same API don't have to open a new TCP connection (and perform a new TLS handshake) every time.
+
+Each request can specify its own timeout. Requests can also be made conditional, in which case the client remembers the
+response's ETag and Last-Modified headers and sends them with the next request for the same URL. If the server responds
+with '304 Not Modified', the previously downloaded body is returned instead.
+
+Most callers should use the shared client returned by get_client().
+"""
+
+# Import required modules
+import time, collections
+from StringIO import StringIO
+from zope.interface import implementer
+from twisted.internet import defer
+from twisted.internet.interfaces import IStreamClientEndpoint
+from twisted.internet.endpoints import TCP4ClientEndpoint, SSL4ClientEndpoint
+from twisted.python import failure
+from twisted.web.client import (Agent, RedirectAgent, HTTPConnectionPool, BrowserLikePolicyForHTTPS, FileBodyProducer,
+                                readBody)
+from twisted.web.error import SchemeNotSupported
+from twisted.web.http_headers import Headers
+from twisted.web.iweb import IAgentEndpointFactory
+from hwm.core import stats
+
+# The User-Agent sent with every request
+USER_AGENT = "Mercury2-HWM"
+
+# The shared HTTP client
+_shared_client = None
+
+def get_client():
+  """ Returns the hardware manager's shared HTTP client.
+
+  @return Returns the shared HTTPClient, which is created the first time this function is called.
+  """
+
+  global _shared_client
+
+  if _shared_client is None:
+    _shared_client = HTTPClient()
+
+  return _shared_client
+
+class HTTPClient:
+  """ Makes asynchronous HTTP requests using a pool of persistent connections.
+  """
+
+  def __init__(self, reactor = None, max_connections_per_host = 4, idle_connection_timeout = 120, default_timeout = 10,
+               max_cached_responses = 128):
+    """ Sets up the HTTP client.
+
+    @param reactor                   The reactor to use. If None, the global reactor will be used.
+    @param max_connections_per_host  The maximum number of idle connections to keep open for each host.
+    @param idle_connection_timeout   How long (in seconds) idle connections will be kept open.
+    @param default_timeout           The timeout (in seconds) used for requests that don't specify their own.
+    @param max_cached_responses      The maximum number of responses that will be kept for conditional requests. Once
+                                     this limit is reached, the least recently used responses will be discarded.
+    """
+
+    if reactor is None:
+      from twisted.internet import reactor
+
+    self.reactor = reactor
+    self.default_timeout = default_timeout
+    self.max_cached_responses = max_cached_responses
+    self._pool = HTTPConnectionPool(reactor, persistent = True)
+    self._pool.maxPersistentPerHost = max_connections_per_host
+    self._pool.cachedConnectionTimeout = idle_connection_timeout
+    self._endpoint_factory = _CountingEndpointFactory(reactor)
+    self._agent = RedirectAgent(Agent.usingEndpointFactory(reactor, self._endpoint_factory, pool = self._pool))
+    self._cached_responses = collections.OrderedDict()
+    self._in_flight = 0
+
+    # Client statistics
+    self.requests_started = 0
+    self.requests_failed = 0
+    self.requests_timed_out = 0
+    self.responses_not_modified = 0
+    self.bytes_received = 0
+    self.request_latency = stats.LatencyHistogram()
+
+  def get(self, url, timeout = None, conditional = False, headers = None):
+    """ Makes a GET request.
+
+    @param url          The URL to request.
+    @param timeout      The request's timeout in seconds (see request()).
+    @param conditional  Whether or not to make the request conditional (see request()).
+    @param headers      A dictionary containing any additional request headers.
+    @return Returns a deferred that will be fired with the HTTPResponse (see request()).
+    """
+
+    return self.request(url, headers = headers, timeout = timeout, conditional = conditional)
+
+  def post(self, url, body, content_type = "application/x-www-form-urlencoded", timeout = None):
+    """ Makes a POST request.
+
+    @param url           The URL to post to.
+    @param body          A string containing the request body.
+    @param content_type  The content type of the request body.
+    @param timeout       The request's timeout in seconds (see request()).
+    @return Returns a deferred that will be fired with the HTTPResponse (see request()).
+    """
+
+    return self.request(url, method = 'POST', body = body, headers = {'Content-Type': content_type},
+                        timeout = timeout)
+
+  def request(self, url, method = 'GET', body = None, headers = None, timeout = None, conditional = False):
+    """ Makes an HTTP request.
+
+    @note Redirects are followed automatically.
+
+    @param url          The URL to request.
+    @param method       The HTTP method to use.
+    @param body         A string containing the request body, or None if the request doesn't have one.
+    @param headers      A dictionary containing any additional request headers.
+    @param timeout      How long (in seconds) to wait for the complete response. If None, the client's default timeout
+                        will be used.
+    @param conditional  Whether or not to make the request conditional. If True, the validators (ETag and Last-Modified
+                        headers) of the last successful response from the URL will be sent with the request and, if
+                        the server responds with '304 Not Modified', the body of that response will be returned.
+    @return Returns a deferred that will be fired with an HTTPResponse. If the request fails, the deferred will be fired
+            with an HTTPRequestTimeout (if the request timed out), an HTTPStatusError (if the server responded with an
+            error), or an HTTPRequestError (for all other errors).
+    """
+
+    url = str(url)
+    request_headers = Headers({'User-Agent': [USER_AGENT]})
+    if headers is not None:
+      for header_name, header_value in headers.items():
+        request_headers.setRawHeaders(header_name, [header_value])
+
+    # Add the validators of the last response
+    cached_response = self._cached_responses.get(url, None) if conditional else None
+    if cached_response is not None:
+      if cached_response.get_header('ETag') is not None:
+        request_headers.setRawHeaders('If-None-Match', [cached_response.get_header('ETag')])
+      if cached_response.get_header('Last-Modified') is not None:
+        request_headers.setRawHeaders('If-Modified-Since', [cached_response.get_header('Last-Modified')])
+
+    # Make the request
+    started_at = time.time()
+    self.requests_started += 1
+    self._in_flight += 1
+    body_producer = FileBodyProducer(StringIO(body)) if body is not None else None
+    request_deferred = defer.maybeDeferred(self._agent.request, method, url, request_headers, body_producer)
+    request_deferred.addCallback(self._read_response, url, cached_response, conditional)
+    request_deferred.addTimeout(timeout if timeout is not None else self.default_timeout, self.reactor,
+                                onTimeoutCancel = lambda cancelled_results, timeout: self._request_timed_out(url))
+    request_deferred.addBoth(self._request_finished, url, started_at)
+
+    return request_deferred
+
+  def get_stats(self):
+    """ Returns statistics about the HTTP client.
+
+    @return Returns a dictionary containing the number of requests made, in progress, failed, and timed out, the number
+            of conditional requests answered with '304 Not Modified', the number of connections opened (requests that
+            didn't open a connection reused a pooled one), the number of body bytes received, and the request latency
+            statistics (see LatencyHistogram.get_stats()).
+    """
+
+    return {
+      'requests': self.requests_started,
+      'in_flight': self._in_flight,
+      'failed': self.requests_failed,
+      'timed_out': self.requests_timed_out,
+      'not_modified': self.responses_not_modified,
+      'connections_opened': self._endpoint_factory.connections_opened,
+      'bytes_received': self.bytes_received,
+      'latency': self.request_latency.get_stats()
+    }
+
+  def close(self):
+    """ Closes the client's idle connections.
+
+    @return Returns a deferred that will be fired once the connections have been closed.
+    """
+
+    return self._pool.closeCachedConnections()
+
+  def _read_response(self, response, url, cached_response, conditional):
+    """ Reads the body of a response.
+
+    @param response         The twisted.web IResponse provider for the request.
+    @param url              The requested URL.
+    @param cached_response  The HTTPResponse whose validators were sent with the request, or None.
+    @param conditional      Whether or not the request was conditional.
+    @return Returns a deferred that will be fired with the HTTPResponse.
+    """
+
+    body_deferred = readBody(response)
+    body_deferred.addCallback(self._response_received, response, url, cached_response, conditional)
+
+    return body_deferred
+
+  def _response_received(self, body, response, url, cached_response, conditional):
+    """ Builds the HTTPResponse for a complete response.
+
+    @throw Throws HTTPStatusError if the server responded with an error (or a '304 Not Modified' response to a request
+           that wasn't conditional).
+
+    @param body             The response body.
+    @param response         The twisted.web IResponse provider for the request.
+    @param url              The requested URL.
+    @param cached_response  The HTTPResponse whose validators were sent with the request, or None.
+    @param conditional      Whether or not the request was conditional.
+    @return Returns the HTTPResponse.
+    """
+
+    self.bytes_received += len(body)
+
+    # Reuse the cached body if it hasn't changed
+    if response.code == 304 and cached_response is not None:
+      self.responses_not_modified += 1
+      del self._cached_responses[url]
+      self._cached_responses[url] = cached_response
+
+      return HTTPResponse(url, response.code, response.headers, cached_response.body, not_modified = True)
+
+    if response.code < 200 or response.code >= 300:
+      raise HTTPStatusError(response.code, "The server responded to the request for '"+url+"' with status "+
+                            str(response.code)+".")
+
+    http_response = HTTPResponse(url, response.code, response.headers, body)
+
+    # Save the response's validators for the next conditional request
+    if conditional:
+      self._cached_responses.pop(url, None)
+      if http_response.get_header('ETag') is not None or http_response.get_header('Last-Modified') is not None:
+        self._cached_responses[url] = http_response
+        while len(self._cached_responses) > self.max_cached_responses:
+          self._cached_responses.popitem(last = False)
+
+    return http_response
+
+  def _request_timed_out(self, url):
+    """ Called (instead of the cancelled request's callbacks) when a request times out.
+
+    @param url  The requested URL.
+    @return Returns a Failure wrapping an HTTPRequestTimeout.
+    """
+
+    self.requests_timed_out += 1
+
+    return failure.Failure(HTTPRequestTimeout("The request for '"+url+"' timed out."))
+
+  def _request_finished(self, request_results, url, started_at):
+    """ Records the results of a request and translates any errors into HTTPRequestError exceptions.
+
+    @param request_results  The HTTPResponse or a Failure.
+    @param url              The requested URL.
+    @param started_at       When the request was made.
+    @return Returns the HTTPResponse, or a Failure wrapping an HTTPRequestError.
+    """
+
+    self._in_flight -= 1
+    self.request_latency.record(max(time.time()-started_at, 0.0))
+
+    if not isinstance(request_results, failure.Failure):
+      return request_results
+
+    self.requests_failed += 1
+    if request_results.check(HTTPRequestError):
+      return request_results
+    else:
+      raise HTTPRequestError("The request for '"+url+"' failed: "+request_results.getErrorMessage())
+
+class HTTPResponse:
+  """ Represents a complete HTTP response.
+  """
+
+  def __init__(self, url, code, headers, body, not_modified = False):
+    """ Sets up the response.
+
+    @param url           The requested URL.
+    @param code          The response's status code.
+    @param headers       The response headers (a twisted.web Headers object).
+    @param body          A string containing the response body.
+    @param not_modified  Whether or not the response was a '304 Not Modified' response to a conditional request, in
+                         which case body will contain the body of the previous response.
+    """
+
+    self.url = url
+    self.code = code
+    self.headers = headers
+    self.body = body
+    self.not_modified = not_modified
+
+  def get_header(self, header_name):
+    """ Returns the value of a response header.
+
+    @param header_name  The name of the header.
+    @return Returns the header's (last) value, or None if the response doesn't include it.
+    """
+
+    header_values = self.headers.getRawHeaders(header_name)
+
+    return header_values[-1] if header_values else None
+
+@implementer(IAgentEndpointFactory)
+class _CountingEndpointFactory(object):
+  """ Creates the endpoints that the client's agent connects to (TCP for HTTP and TLS for HTTPS, like the default agent
+  endpoints) and counts the connections opened through them.
+
+  @note The connection pool only connects an endpoint when it doesn't have an idle connection to the host, so every
+        connection counted here is a new one.
+  """
+
+  def __init__(self, reactor):
+    """ Sets up the endpoint factory.
+
+    @param reactor  The reactor that the endpoints will use.
+    """
+
+    self.reactor = reactor
+    self.tls_policy = BrowserLikePolicyForHTTPS()
+    self.connections_opened = 0
+
+  def endpointForURI(self, uri):
+    """ Creates an endpoint for the specified URI.
+
+    @throw Throws SchemeNotSupported if the URI's scheme isn't 'http' or 'https'.
+
+    @param uri  The twisted.web URI being requested.
+    @return Returns a _CountingEndpoint wrapping the endpoint for the URI's host.
+    """
+
+    if uri.scheme == 'http':
+      endpoint = TCP4ClientEndpoint(self.reactor, uri.host, uri.port)
+    elif uri.scheme == 'https':
+      endpoint = SSL4ClientEndpoint(self.reactor, uri.host, uri.port,
+                                    self.tls_policy.creatorForNetloc(uri.host, uri.port))
+    else:
+      raise SchemeNotSupported("Unsupported scheme: '"+str(uri.scheme)+"'")
+
+    return _CountingEndpoint(endpoint, self)
+
+@implementer(IStreamClientEndpoint)
+class _CountingEndpoint(object):
+  """ A client endpoint that counts the connections that it opens.
+  """
+
+  def __init__(self, endpoint, endpoint_factory):
+    """ Sets up the endpoint.
+
+    @param endpoint          The endpoint to wrap.
+    @param endpoint_factory  The _CountingEndpointFactory that created the endpoint.
+    """
+
+    self.endpoint = endpoint
+    self.endpoint_factory = endpoint_factory
+
+  def connect(self, protocol_factory):
+    """ Connects the wrapped endpoint.
+
+    @param protocol_factory  The protocol factory for the connection.
+    @return Returns the wrapped endpoint's connection deferred.
+    """
+
+    self.endpoint_factory.connections_opened += 1
+
+    return self.endpoint.connect(protocol_factory)
+
+# Define the HTTP client exceptions
+class HTTPRequestError(Exception):
+  pass
+class HTTPRequestTimeout(HTTPRequestError):
+  pass
+class HTTPStatusError(HTTPRequestError):
+  def __init__(self, code, message):
+    HTTPRequestError.__init__(self, message)
+    self.code = code
@@ -4,7 +4,9 @@ This module contains the Twisted Protocol (and related classes) used to broadcas
 
 # Import required modules
 import base64, json, logging
+from twisted.internet import defer, interfaces
 from twisted.internet.protocol import Protocol, Factory
+from zope.interface import implements
 from hwm.network.protocols import utilities
 from hwm.sessions import session
 
@@ -22,6 +24,8 @@ class PipelineTelemetry(Protocol):
   @see https://en.wikipedia.org/wiki/WebSocket
   """
 
+  implements(interfaces.IHandshakeListener)
+
   def __init__(self, session_coordinator):
     """ Sets up the PipelineTelemetry protocol instance.
 
@@ -31,6 +35,8 @@ class PipelineTelemetry(Protocol):
     # Set protocol attributes
     self.session_coordinator = session_coordinator
     self.session = None
+    self.tls_handshake_deferred = None
+    self._session_setup_deferred = None
 
   def write_telemetry(self, source_id, stream, timestamp, telemetry_datum, binary=False, **extra_headers):
     """ Sends a telemetry data point to the user.
@@ -73,9 +79,10 @@ class PipelineTelemetry(Protocol):
     function that will wait and load the user's certificate after the TLS handshake has been performed.
 
     @note Because this method may be (and probably will be) called before the connection's TLS handshake is complete,
-          it calls an additional function that periodically checks if the client's certificate is available and, once it
-          is, returns it via a deferred. Any data that the user tries to pass to the connection before the TLS handshake
-          has completed will be dropped.
+          it calls an additional function that waits for the handshake to complete (see handshakeCompleted()) and then
+          loads the requested session. If the session isn't active yet, the connection will wait for it in the session
+          coordinator's waiting room. Any data that the user tries to pass to the connection before its session has
+          been loaded will be dropped.
     @return Returns a deferred that will be fired with the requested Session.
     """
 
@@ -83,14 +90,24 @@ class PipelineTelemetry(Protocol):
     tls_handshake_deferred = utilities.load_session_after_tls_handshake(self)
     tls_handshake_deferred.addCallback(self.perform_registrations)
     tls_handshake_deferred.addErrback(self._connection_setup_error)
+    self._session_setup_deferred = tls_handshake_deferred
 
     return tls_handshake_deferred
 
-  def connectionLost(self):
+  def handshakeCompleted(self):
+    """ Called by the TLS transport as soon as the connection's TLS handshake is complete.
+    """
+
+    utilities.tls_handshake_completed(self)
+
+  def connectionLost(self, reason = None):
     """ Called when the connection to the user is lost.
+
+    If the connection is lost while it's still waiting for its TLS handshake or its session, it will stop waiting.
     """
 
-    return
+    if self._session_setup_deferred is not None:
+      self._session_setup_deferred.cancel()
 
   def perform_registrations(self, requested_session):
     """ Performs the necessary registrations between the protocol and its associated session.
@@ -107,6 +124,7 @@ class PipelineTelemetry(Protocol):
     """
 
     # Store the session
+    self._session_setup_deferred = None
     self.session = requested_session
 
     # Perform the registrations between the data protocol and its associated session
@@ -169,6 +187,12 @@ class PipelineTelemetry(Protocol):
     @return Returns None after handling the error.
     """
 
+    self._session_setup_deferred = None
+
+    # Nothing needs to be cleaned up if the connection was lost before its session could be loaded
+    if failure.check(defer.CancelledError):
+      return None
+
     # Close the connection and log the error
     self.transport.abortConnection()
     logging.error("An error occured setting up a pipeline telemetry connection: '"+str(failure.value)+"'")
@@ -1,6 +1,7 @@
 # Import required modules
 import logging
 from mock import MagicMock
+from twisted.internet import defer
 from pkg_resources import Requirement, resource_filename
 from twisted.trial import unittest
 from twisted.test import proto_helpers
@@ -78,7 +79,7 @@ class TestPipelineDataProtocol(unittest.TestCase):
     self.protocol.connectionMade = self.old_connectionMade # Restore the actual connectionMade method for this test
     self.protocol.transport.getPeerCertificate = lambda : None
     self.protocol.transport.abortConnection = MagicMock()
-    self.protocol.session_coordinator.load_reservation_session = self._mock_session_lookup_failed
+    self.protocol.session_coordinator.wait_for_reservation_session = self._mock_session_lookup_failed
 
     def validate_session(loaded_session):
       """ A callback that will be called after the protocol has handled the session lookup error.
@@ -92,12 +93,13 @@ class TestPipelineDataProtocol(unittest.TestCase):
     setup_deferred = self.protocol.connectionMade()
     setup_deferred.addCallback(validate_session)
 
-    # Update the getPeerCertificate method to return a valid mock certificate before the reactor.callLater call goes out
+    # Update the getPeerCertificate method to return a valid mock certificate and simulate the handshake completing
     test_cert = MagicMock()
     test_subject = MagicMock()
     test_subject.commonName = test_res_id
     test_cert.get_subject = lambda : test_subject
     self.protocol.transport.getPeerCertificate = lambda : test_cert
+    self.protocol.handshakeCompleted()
 
     return setup_deferred
 
@@ -111,7 +113,7 @@ class TestPipelineDataProtocol(unittest.TestCase):
     test_session = MagicMock()
     self.protocol.connectionMade = self.old_connectionMade # Restore the actual connectionMade method for this test
     self.protocol.transport.getPeerCertificate = lambda : None
-    self.protocol.session_coordinator.load_reservation_session = lambda res_id: test_session
+    self.protocol.session_coordinator.wait_for_reservation_session = lambda res_id: defer.succeed(test_session)
 
     def validate_session(loaded_session):
       """ A callback that will receive the session once the simulated TLS handshake finishes.
@@ -125,19 +127,40 @@ class TestPipelineDataProtocol(unittest.TestCase):
     setup_deferred = self.protocol.connectionMade()
     setup_deferred.addCallback(validate_session)
 
-    # Update the getPeerCertificate method to return a valid mock certificate before the reactor.callLater call goes out
+    # Update the getPeerCertificate method to return a valid mock certificate and simulate the handshake completing
     test_cert = MagicMock()
     test_subject = MagicMock()
     test_subject.commonName = test_res_id
     test_cert.get_subject = lambda : test_subject
     self.protocol.transport.getPeerCertificate = lambda : test_cert
+    self.protocol.handshakeCompleted()
+
+    return setup_deferred
+
+  def test_connection_lost_while_waiting(self):
+    """ Checks that the data protocol stops waiting for its session (without logging an error or aborting the 
+    connection) if its connection is lost before the session becomes active.
+    """
+
+    # Simulate a connection that is waiting for its session in the waiting room
+    waiting_deferred = defer.Deferred()
+    self.protocol.connectionMade = self.old_connectionMade # Restore the actual connectionMade method for this test
+    self.protocol.transport.getPeerCertificate = lambda : MagicMock()
+    self.protocol.transport.abortConnection = MagicMock()
+    self.protocol.session_coordinator.wait_for_reservation_session = lambda res_id: waiting_deferred
+    setup_deferred = self.protocol.connectionMade()
+
+    # Drop the connection
+    self.protocol.connectionLost()
+    self.assertTrue(waiting_deferred.called)
+    self.assertEqual(self.protocol.session, None)
+    self.assertEqual(self.protocol.transport.abortConnection.call_count, 0)
 
     return setup_deferred
 
   def _mock_connectionMade(self):
-    """ A mock version of the PipelineData Protocol that does not call the AuthUtilities._wait_for_session mixin. This
-    is required because the proto_helpers.StringTransport() transport we're testing with doesn't support SSL. In
-    addition, the callLater() call in _wait_for_session() would make test cleanup more difficult.
+    """ A mock version of the PipelineData Protocol that does not call utilities.load_session_after_tls_handshake(). This 
+    is required because the proto_helpers.StringTransport() transport we're testing with doesn't support SSL.
     """
 
     return
@@ -152,8 +175,9 @@ class TestPipelineDataProtocol(unittest.TestCase):
     raise session.ProtocolAlreadyRegistered("Testing session-data protocol registration.")
 
   def _mock_session_lookup_failed(self, res_id):
-    """ This function raises a coordinator.SessionNotFound exception and is used to test error handling.
+    """ This function returns a deferred failed with a coordinator.SessionNotFound exception and is used to test error
+    handling.
     """
 
-    raise coordinator.SessionNotFound("Test SessionNotFound exception.")
+    return defer.fail(coordinator.SessionNotFound("Test SessionNotFound exception."))
 
@@ -3,6 +3,7 @@ import logging
 from mock import MagicMock
 from pkg_resources import Requirement, resource_filename
 from twisted.trial import unittest
+from twisted.internet import defer
 from hwm.network.protocols import utilities
 from hwm.sessions import session, coordinator
 
@@ -25,9 +26,10 @@ class TestProtocolUtilities(unittest.TestCase):
     # Create a mock protocol and session to test with
     test_res_id = "res_id"
     test_protocol = MagicMock()
+    test_protocol.tls_handshake_deferred = None
     test_session = MagicMock()
     test_protocol.transport.getPeerCertificate = lambda : None
-    test_protocol.session_coordinator.load_reservation_session = lambda res_id: test_session
+    test_protocol.session_coordinator.wait_for_reservation_session = lambda res_id: defer.succeed(test_session)
 
     def validate_session(loaded_session):
       """ A callback that will receive the session once the simulated TLS handshake finishes.
@@ -35,16 +37,20 @@ class TestProtocolUtilities(unittest.TestCase):
 
       self.assertEqual(loaded_session, test_session)
 
-    # Try to load the session (should trigger a reactor.callLater call because no certificate was returned)
+    # Try to load the session (should wait because the handshake hasn't finished yet)
     session_deferred = utilities.load_session_after_tls_handshake(test_protocol)
     session_deferred.addCallback(validate_session)
+    self.assertFalse(session_deferred.called)
 
-    # Update the getPeerCertificate method to return a mock certificate before the reactor.callLater call goes out
+    # Update the getPeerCertificate method to return a mock certificate and simulate the handshake completing
     test_cert = MagicMock()
     test_subject = MagicMock()
     test_subject.commonName = test_res_id
     test_cert.get_subject = lambda : test_subject
     test_protocol.transport.getPeerCertificate = lambda : test_cert
+    utilities.tls_handshake_completed(test_protocol)
+    self.assertTrue(session_deferred.called)
+    self.assertEqual(test_protocol.tls_handshake_deferred, None)
 
     return session_deferred
 
@@ -53,17 +59,11 @@ class TestProtocolUtilities(unittest.TestCase):
     for a session that doesn't exist.
     """
 
-    def raise_session_load_exception(res_id):
-      """ This function raises a coordinator.SessionNotFound exception and is used to test error handling.
-      """
-
-      raise coordinator.SessionNotFound()
-
-    # Create a mock protocol and session to test with
+    # Create a mock protocol to test with
     test_res_id = "res_id"
     test_protocol = MagicMock()
-    test_session = MagicMock()
-    test_protocol.session_coordinator.load_reservation_session = raise_session_load_exception
+    test_protocol.session_coordinator.wait_for_reservation_session = lambda res_id: defer.fail(
+      coordinator.SessionNotFound())
 
     # Update the getPeerCertificate method to return a mock certificate
     test_cert = MagicMock()
@@ -76,3 +76,19 @@ class TestProtocolUtilities(unittest.TestCase):
     session_deferred = utilities.load_session_after_tls_handshake(test_protocol)
 
     return self.assertFailure(session_deferred, coordinator.SessionNotFound)
+
+  def test_load_session_after_tls_handshake_no_certificate(self):
+    """ Verifies that utilities.load_session_after_tls_handshake() fails if the client didn't provide a certificate 
+    during its TLS handshake.
+    """
+
+    # Create a mock protocol without a client certificate
+    test_protocol = MagicMock()
+    test_protocol.tls_handshake_deferred = None
+    test_protocol.transport.getPeerCertificate = lambda : None
+
+    # Complete the handshake without a certificate
+    session_deferred = utilities.load_session_after_tls_handshake(test_protocol)
+    utilities.tls_handshake_completed(test_protocol)
+
+    return self.assertFailure(session_deferred, utilities.ClientCertificateMissing)
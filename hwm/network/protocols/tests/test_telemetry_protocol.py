@@ -1,11 +1,12 @@
 # Import required modules
 import logging, json, base64, exceptions
 from mock import MagicMock
+from twisted.internet import defer
 from pkg_resources import Requirement, resource_filename
 from twisted.trial import unittest
 from twisted.test import proto_helpers
 from hwm.network.protocols import telemetry
-from hwm.sessions import session
+from hwm.sessions import session, coordinator
 
 class TestPipelineTelemetryProtocol(unittest.TestCase):
   """ This test suite is designed to test the functionality of the PipelineTelemetry protocol, which is responsible for 
@@ -125,7 +126,18 @@ class TestPipelineTelemetryProtocol(unittest.TestCase):
     self.protocol.connectionMade = self.old_connectionMade # Restore the actual connectionMade method for this test
     self.protocol.transport.getPeerCertificate = lambda : None
     self.protocol.transport.abortConnection = MagicMock()
-    self.protocol.session_coordinator.load_reservation_session = self._mock_session_lookup_failed
+    self.protocol.session_coordinator.wait_for_reservation_session = self._mock_session_lookup_failed
+    handled_failures = []
+    connection_setup_error = self.protocol._connection_setup_error
+
+    def record_setup_error(failure):
+      """ Records the error handled by the protocol.
+      """
+
+      handled_failures.append(failure)
+      return connection_setup_error(failure)
+
+    self.protocol._connection_setup_error = record_setup_error
 
     def validate_session(loaded_session):
       """ A callback that will be called after the protocol has handled the session lookup error.
@@ -134,17 +146,20 @@ class TestPipelineTelemetryProtocol(unittest.TestCase):
       self.assertEqual(loaded_session, None)
       self.assertEqual(self.protocol.session, None)
       self.protocol.transport.abortConnection.assert_called_once_with()
+      self.assertEqual(len(handled_failures), 1)
+      self.assertTrue(handled_failures[0].check(coordinator.SessionNotFound))
 
     # Simulate a newly initialized connection
     setup_deferred = self.protocol.connectionMade()
     setup_deferred.addCallback(validate_session)
 
-    # Update the getPeerCertificate method to return a valid mock certificate before the reactor.callLater call goes out
+    # Update the getPeerCertificate method to return a valid mock certificate and simulate the handshake completing
     test_cert = MagicMock()
     test_subject = MagicMock()
     test_subject.commonName = test_res_id
     test_cert.get_subject = lambda : test_subject
     self.protocol.transport.getPeerCertificate = lambda : test_cert
+    self.protocol.handshakeCompleted()
 
     return setup_deferred
 
@@ -159,7 +174,7 @@ class TestPipelineTelemetryProtocol(unittest.TestCase):
     self.protocol.connectionMade = self.old_connectionMade # Restore the actual connectionMade method for this test
     self.protocol.transport.registerProducer = MagicMock()
     self.protocol.transport.getPeerCertificate = lambda : None
-    self.protocol.session_coordinator.load_reservation_session = lambda res_id: test_session
+    self.protocol.session_coordinator.wait_for_reservation_session = lambda res_id: defer.succeed(test_session)
 
     def validate_session(loaded_session):
       """ A callback that will receive the session once the simulated TLS handshake finishes.
@@ -175,20 +190,20 @@ class TestPipelineTelemetryProtocol(unittest.TestCase):
     setup_deferred = self.protocol.connectionMade()
     setup_deferred.addCallback(validate_session)
 
-    # Update the getPeerCertificate method to return a valid mock certificate before the reactor.callLater call goes out
+    # Update the getPeerCertificate method to return a valid mock certificate and simulate the handshake completing
     test_cert = MagicMock()
     test_subject = MagicMock()
     test_subject.commonName = test_res_id
     test_cert.get_subject = lambda : test_subject
     self.protocol.transport.getPeerCertificate = lambda : test_cert
+    self.protocol.handshakeCompleted()
 
     return setup_deferred
 
 
   def _mock_connectionMade(self):
-    """ A mock version of the PipelineData Protocol that does not call the AuthUtilities._wait_for_session mixin. This
-    is required because the proto_helpers.StringTransport() transport we're testing with doesn't support SSL. In
-    addition, the callLater() call in _wait_for_session() would make test cleanup more difficult.
+    """ A mock version of the PipelineData Protocol that does not call utilities.load_session_after_tls_handshake(). This 
+    is required because the proto_helpers.StringTransport() transport we're testing with doesn't support SSL.
     """
 
     return
@@ -203,7 +218,8 @@ class TestPipelineTelemetryProtocol(unittest.TestCase):
     raise session.ProtocolAlreadyRegistered("Testing session-telemetry protocol registration.")
 
   def _mock_session_lookup_failed(self, res_id):
-    """ This function raises a coordinator.SessionNotFound exception and is used to test error handling.
+    """ This function returns a deferred failed with a coordinator.SessionNotFound exception and is used to test error
+    handling.
     """
 
-    raise coordinator.SessionNotFound("Test SessionNotFound exception.")
+    return defer.fail(coordinator.SessionNotFound("Test SessionNotFound exception."))
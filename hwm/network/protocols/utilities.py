@@ -3,50 +3,82 @@ Contains methods commonly used by the HWM network protocols.
 """
 
 # Import required modules
-from twisted.internet import reactor
-from twisted.internet.defer import Deferred
-from hwm.sessions import coordinator
+from twisted.internet import defer
 
 def load_session_after_tls_handshake(protocol):
   """ Loads the requested session once the provided Protocol's TLS handshake is complete.
 
-  This function periodically checks if the specified protocol's transport has completed its TLS handshake using the 
-  reactor.callLater() utility. This is required because connectionMade() method is typically called before the TLS 
-  handshake has been completed. Once the handshake is complete, this function will load the requested session and return
-  it via a deferred.
+  This function waits for the specified protocol's TLS handshake to complete (see wait_for_tls_handshake()). This is
+  required because connectionMade() method is typically called before the TLS handshake has been completed. Once the
+  handshake is complete, this function will load the requested session and return it via a deferred.
 
   @note This function uses the clients's TLS certificate's common name field to determine what session it should load.
-        If the requested session is not yet active, the connection will be terminated.
-
-  @todo This method should probably wait if a user connects a few minutes before their session begins instead of 
-        immediately disconnecting.
+        If the requested session is not yet active but its reservation is about to start, the connection will wait in
+        the session coordinator's waiting room until it is (see SessionCoordinator.wait_for_reservation_session()).
+        Otherwise, the deferred will errback and the connection should be terminated.
 
   @param protocol  The Protocol that wants to wait for its TLS handshake to complete.
-  @return This function returns a deferred that will eventually be fired with the loaded session. If the session can't 
+  @return This function returns a deferred that will eventually be fired with the loaded session. If the session can't
           be located, the deferred will errback.
   """
-  
-  # Try to load the client's TLS certificate
+
+  handshake_deferred = wait_for_tls_handshake(protocol)
+  handshake_deferred.addCallback(_load_requested_session)
+
+  return handshake_deferred
+
+def wait_for_tls_handshake(protocol):
+  """ Returns a deferred that will be fired as soon as the provided Protocol's TLS handshake is complete.
+
+  @note Protocols that use this function must implement twisted.internet.interfaces.IHandshakeListener and call
+        tls_handshake_completed() from their handshakeCompleted() method. They must also initialize their
+        'tls_handshake_deferred' attribute to None. Protocols that are wrapped by another protocol (e.g. a WebSocket
+        protocol) won't be notified by the TLS transport, but they are typically only connected after the wrapping
+        protocol has received data (by which point the handshake has already completed).
+
+  @param protocol  The Protocol that wants to wait for its TLS handshake to complete.
+  @return Returns a deferred that will be fired with the protocol once its handshake is complete (immediately, if it
+          already is).
+  """
+
+  if protocol.transport.getPeerCertificate() is not None:
+    return defer.succeed(protocol)
+
+  protocol.tls_handshake_deferred = defer.Deferred()
+
+  return protocol.tls_handshake_deferred
+
+def tls_handshake_completed(protocol):
+  """ Notifies anything waiting for the provided Protocol's TLS handshake that it has completed.
+
+  @param protocol  The Protocol whose TLS handshake just completed.
+  """
+
+  handshake_deferred, protocol.tls_handshake_deferred = protocol.tls_handshake_deferred, None
+  if handshake_deferred is not None:
+    handshake_deferred.callback(protocol)
+
+def _load_requested_session(protocol):
+  """ Loads the session specified by the common name of the protocol's client certificate.
+
+  @throw Throws ClientCertificateMissing if the client didn't provide a certificate.
+
+  @param protocol  The Protocol whose TLS handshake just completed.
+  @return Returns a deferred that will be fired with the requested session once it's active.
+  """
+
+  # Load the client's TLS certificate
   user_cert = protocol.transport.getPeerCertificate()
   if user_cert is None:
-    # Create a deferred and schedule it to fire in a bit so we can check for the certificate again
-    recheck_deferred = Deferred()
-    recheck_deferred.addCallback(load_session_after_tls_handshake)
-    reactor.callLater(0.25, recheck_deferred.callback, protocol)
-    return recheck_deferred
-
-  # Locate the requested session
-  cert_subject = user_cert.get_subject()
-  cert_reservation_id = cert_subject.commonName
-  try:
-    requested_session = protocol.session_coordinator.load_reservation_session(cert_reservation_id)
-  except coordinator.SessionNotFound as lookup_error:
-    # The session couldn't be found or isn't ready yet, return a failed deferred
-    failed_deferred = Deferred()
-    failed_deferred.errback(lookup_error)
-    return failed_deferred
-
-  # Return a deferred fired with the loaded session
-  session_deferred = Deferred()
-  session_deferred.callback(requested_session)
-  return session_deferred
+    raise ClientCertificateMissing("The client didn't provide a TLS certificate.")
+
+  # Locate the requested session (waiting for it if it's about to start)
+  cert_reservation_id = user_cert.get_subject().commonName
+
+  return protocol.session_coordinator.wait_for_reservation_session(cert_reservation_id)
+
+# Define the protocol utility exceptions
+class ProtocolUtilityError(Exception):
+  pass
+class ClientCertificateMissing(ProtocolUtilityError):
+  pass
@@ -3,9 +3,81 @@ This module contains a class used to manage and cache user command permissions.
 """
 
 # Include required modules
-import time, json, jsonschema, urllib2, urllib
+import os, time, json, logging, threading, jsonschema, urllib, collections
 from twisted.internet import threads, defer
+from twisted.python import failure
 from hwm.core import configuration
+from hwm.network import http_client
+
+# The schema of a single user's permission settings
+USER_PERMISSIONS_SCHEMA = {
+  "type": "object",
+  "additionalProperties": False,
+  "properties": {
+    "generated_at": {
+      "type": "number",
+      "id": "generated_at",
+      "required": True
+    },
+    "user_id": {
+      "type": "string",
+      "id": "user_id",
+      "required": True
+    },
+    "username": {
+      "type": "string",
+      "id": "username",
+      "required": True
+    },
+    "ignore_session_protections": {
+      "type": "boolean",
+      "id": "ignore_session_protections",
+      "required": False
+    },
+    "permitted_commands": {
+      "type": "array",
+      "id": "permitted_commands",
+      "required": True,
+      "items": {
+        "type": "object",
+        "additionalProperties": True,
+        "properties": {
+          "command": {
+            "type": "string",
+            "id": "command",
+            "required": True
+          },
+          "destination": {
+            "type": "string",
+            "id": "destination",
+            "required": True
+          },
+          "pipelines": {
+            "type": "array",
+            "id": "pipelines",
+            "required": False,
+            "minitems": 1,
+            "items": {
+              "type": "string"
+            }
+          }
+        }
+      }
+    }
+  }
+}
+
+# The schema of a permissions resource (a list of user permission settings)
+PERMISSION_LIST_SCHEMA = {
+  "type": "array",
+  "$schema": "http://json-schema.org/draft-03/schema",
+  "required": True,
+  "items": USER_PERMISSIONS_SCHEMA
+}
+
+# The schema validators are compiled once, when the module is loaded
+USER_PERMISSIONS_VALIDATOR = jsonschema.Draft3Validator(USER_PERMISSIONS_SCHEMA)
+PERMISSION_LIST_VALIDATOR = jsonschema.Draft3Validator(PERMISSION_LIST_SCHEMA)
 
 class PermissionManager:
   """ Stores and provides access to user permission settings.
@@ -13,9 +85,15 @@ class PermissionManager:
   This class stores user command permission settings for use by the command parser and related classes. All permission
   settings are stored with an associated timestamp. This is used to invalidate permissions after a set amount of time,
   forcing a redownload.
+
+  The permission cache is bounded by both the number of users and the (approximate) size of their permission settings.
+  When either limit is exceeded, the permissions of the least recently used users are evicted. The permissions of users
+  that are actively being used are reloaded in the background shortly before they expire (refresh-ahead), while those 
+  that haven't been used since they were loaded are purged once they expire (see maintain_cache()).
   """
   
-  def __init__(self, permissions_endpoint, update_frequency):
+  def __init__(self, permissions_endpoint, update_frequency, max_cached_users = 1000, max_cache_size = 4194304,
+               refresh_ahead = 10):
     """ Sets up the permission manager.
     
     @param permissions_endpoint  The location that can be queried to find user command permissions. This can either be
@@ -24,24 +102,52 @@ class PermissionManager:
     @param update_frequency      How often the user's permissions should be updated (i.e. if a user's permissions are 
                                  requested and the cached version is older than this value, update them). Specified in 
                                  seconds.
+    @param max_cached_users      The maximum number of users whose permissions will be cached.
+    @param max_cache_size        The maximum total size (in bytes) of the cached permission settings. The size of each
+                                 user's permissions is estimated using the length of their serialized settings.
+    @param refresh_ahead         How long (in seconds) before their permissions expire the permissions of users that are
+                                 being used will be reloaded in the background. Set to 0 to disable refresh-ahead.
     """
     
     # Set up the manager attributes
-    self.permissions = {}
+    self.permissions = collections.OrderedDict() # Ordered from least to most recently used
     self.use_remote_permissions = permissions_endpoint.startswith('http')
     self.permissions_location = permissions_endpoint
     self.config = configuration.Configuration
     self.update_frequency = update_frequency
+    self.max_cached_users = max_cached_users
+    self.max_cache_size = max_cache_size
+    self.refresh_ahead = refresh_ahead
+    self._cache_size = 0
+    self._local_store = None
+    self._pending_updates = {}
+
+    # Permission fetch statistics
+    self.fetches_started = 0
+    self.fetches_coalesced = 0
+    self.refreshes_coalesced = 0
+    self.prefetches_started = 0
+    self.users_prefetched = 0
+    self.cache_hits = 0
+    self.cache_misses = 0
+    self.cache_evictions = 0
+    self.cache_purges = 0
+    self.refreshes_started = 0
+    self.refresh_ahead_started = 0
   
   def get_user_permissions(self, user_id):
     """ Returns the permissions structure for the indicated user.
     
     If the user does not have any permissions loaded, they will be downloaded/loaded in a thread and returned via a 
     deferred. If the user does have cached permissions, they will be fired immediately into the returned deferred (and 
-    will get updated in the background if they are too old).
+    will get updated in the background if they are too old, or are about to be, see 'refresh_ahead').
+
+    Only one fetch is performed for each user at a time. Callers that request the permissions of a user whose 
+    permissions are already being fetched (including by a background update) will share the results of that fetch.
     
-    @note The permissions returned from this function are a copy. That is, they don't reference the permission manager's
-          main permission dictionary.
+    @note The permissions returned from this function are the permission manager's compiled UserPermissions object for
+          the user, which is shared with the permission manager. It should be treated as read-only. Updated permissions
+          are stored in a new UserPermissions object so references to the old permissions won't change.
     
     @throws Throws PermissionsUserNotFound if the specified user doesn't have any permission settings saved.
     
@@ -57,19 +163,88 @@ class PermissionManager:
     # Check if the user has cached permissions
     if user_id not in self.permissions:
       # Update the user's permissions and return the results in a deferred
+      self.cache_misses += 1
       permissions_deferred = self._update_user_permissions(user_id)
     else:
-      # Update the permissions in the background, if needed
-      if (current_time - self.permissions[user_id]['loaded_at']) >= self.update_frequency:
-        background_deferred = self._update_user_permissions(user_id)
-        background_deferred.addErrback(self._background_update_error)
-      
-      # Create a deferred and fire the user's cached permissions into it
-      permissions_deferred = defer.succeed(self.permissions[user_id].copy())
+      # Mark the user's permissions as the most recently used
+      self.cache_hits += 1
+      user_permissions = self.permissions.pop(user_id)
+      self.permissions[user_id] = user_permissions
+      user_permissions.hits += 1
+
+      # Create a deferred and fire the user's cached permissions into it (before any update can replace them)
+      permissions_deferred = defer.succeed(user_permissions)
+
+      # Update the permissions in the background, if needed (and not already being updated)
+      permissions_age = current_time - user_permissions['loaded_at']
+      if permissions_age >= self.update_frequency - self.refresh_ahead:
+        if user_id in self._pending_updates:
+          self.refreshes_coalesced += 1
+        else:
+          self._refresh_user_permissions(user_id, permissions_age < self.update_frequency)
     
     # Return the user's permissions via a deferred
     return permissions_deferred
   
+  def prefetch_user_permissions(self, user_ids):
+    """ Loads the permissions of several users before they're needed (e.g. users with upcoming reservations).
+
+    The permissions of every listed user that doesn't have cached permissions (and isn't already having them fetched)
+    are loaded with a single request to the permissions resource, so that the first command sent by each user doesn't
+    have to wait for their permissions to be downloaded. Requests for these users' permissions made while the prefetch
+    is in progress will share its results.
+
+    @param user_ids  A list containing the IDs of the users to load permissions for.
+    @return Returns a deferred that will be fired with the number of users whose permissions were loaded, or with an 
+            error if the permissions resource couldn't be loaded.
+    """
+
+    # Skip users that already have (or are getting) permissions
+    prefetch_user_ids = []
+    for user_id in user_ids:
+      if user_id not in self.permissions and user_id not in self._pending_updates and user_id not in prefetch_user_ids:
+        prefetch_user_ids.append(user_id)
+    if not prefetch_user_ids:
+      return defer.succeed(0)
+
+    # Fetch the permissions of all of the users at once
+    self.prefetches_started += 1
+    for user_id in prefetch_user_ids:
+      self._pending_updates[user_id] = []
+    prefetch_deferred = self._fetch_bulk_permissions(prefetch_user_ids)
+    prefetch_deferred.addBoth(self._prefetch_finished, prefetch_user_ids)
+
+    return prefetch_deferred
+
+  def get_stats(self):
+    """ Returns statistics about the permission manager.
+
+    @return Returns a dictionary containing the number of users with cached permissions and their approximate size, the 
+            number of cache hits and misses, the number of users evicted (because the cache was full) and purged 
+            (because their permissions expired without being used), the number of background refreshes started (and how
+            many of them were refresh-ahead refreshes), the number of fetches that are in progress, the number of 
+            fetches started, the number of requests and background updates that shared a fetch that was already in 
+            progress, the number of bulk prefetches started, and the number of users whose permissions were loaded by 
+            them.
+    """
+
+    return {
+      'cached_users': len(self.permissions),
+      'cache_size': self._cache_size,
+      'hits': self.cache_hits,
+      'misses': self.cache_misses,
+      'evictions': self.cache_evictions,
+      'purged': self.cache_purges,
+      'refreshes': self.refreshes_started,
+      'refresh_ahead': self.refresh_ahead_started,
+      'in_flight': len(self._pending_updates),
+      'fetches': self.fetches_started,
+      'coalesced_fetches': self.fetches_coalesced,
+      'coalesced_refreshes': self.refreshes_coalesced,
+      'prefetches': self.prefetches_started,
+      'prefetched_users': self.users_prefetched
+    }
+
   def purge_user_permissions(self, age):
     """ Removes all old permission settings.
     
@@ -91,7 +266,106 @@ class PermissionManager:
     for temp_user_id in self.permissions.keys():
       if (current_time - self.permissions[temp_user_id]['loaded_at']) >= age:
         # Delete the permission entry
-        del self.permissions[temp_user_id]
+        self._remove_user_permissions(temp_user_id)
+        self.cache_purges += 1
+
+  def maintain_cache(self):
+    """ Refreshes and purges the cached permissions.
+
+    This method is called by the session coordinator (see get_next_maintenance_time()). It reloads (in the background) the permissions of 
+    users that have been used since they were loaded and that will expire within 'refresh_ahead' seconds, so that their
+    permissions are never stale when they're used. The permissions of users that haven't been used since they were 
+    loaded are purged once they expire, instead of being kept until they're evicted.
+
+    @return Returns the number of users whose permissions were purged.
+    """
+
+    current_time = int(time.time())
+    users_purged = 0
+    for temp_user_id in self.permissions.keys():
+      user_permissions = self.permissions[temp_user_id]
+      permissions_age = current_time - user_permissions['loaded_at']
+      if permissions_age < self.update_frequency - self.refresh_ahead or temp_user_id in self._pending_updates:
+        continue
+
+      if user_permissions.hits > 0:
+        self._refresh_user_permissions(temp_user_id, permissions_age < self.update_frequency)
+      elif permissions_age >= self.update_frequency:
+        self._remove_user_permissions(temp_user_id)
+        users_purged += 1
+    self.cache_purges += users_purged
+
+    return users_purged
+
+  def get_next_maintenance_time(self):
+    """ Returns the next time that maintain_cache() will have something to do.
+
+    This is the earliest time that a cached user's permissions enter the refresh-ahead window or, for users that are in
+    the window but haven't been used, expire. Permissions that are being fetched (or that are loaded later) can't need
+    maintenance until 'update_frequency - refresh_ahead' seconds from now, so that's the latest time returned.
+
+    @return Returns the UNIX timestamp at which the cache should next be maintained.
+    """
+
+    current_time = int(time.time())
+    refresh_period = max(self.update_frequency - self.refresh_ahead, 1)
+    next_maintenance = current_time + refresh_period
+    for temp_user_id, user_permissions in self.permissions.iteritems():
+      if temp_user_id in self._pending_updates:
+        continue
+
+      refresh_at = user_permissions['loaded_at'] + refresh_period
+      if refresh_at > current_time:
+        next_maintenance = min(next_maintenance, refresh_at)
+      elif user_permissions.hits == 0:
+        next_maintenance = min(next_maintenance, max(user_permissions['loaded_at'] + self.update_frequency,
+                                                     current_time))
+
+    return next_maintenance
+
+  def _refresh_user_permissions(self, user_id, refresh_ahead):
+    """ Updates a user's cached permissions in the background.
+
+    @param user_id        The ID of the user whose permissions should be updated.
+    @param refresh_ahead  Whether or not the user's permissions are being updated before they have expired.
+    """
+
+    self.refreshes_started += 1
+    if refresh_ahead:
+      self.refresh_ahead_started += 1
+
+    background_deferred = self._update_user_permissions(user_id)
+    background_deferred.addErrback(self._background_update_error)
+
+  def _cache_user_permissions(self, user_id, user_permissions):
+    """ Saves a user's compiled permissions in the cache as the most recently used entry.
+
+    If the cache exceeds its size limits, the permissions of the least recently used users will be evicted (though the
+    new entry is always kept).
+
+    @param user_id           The ID of the user.
+    @param user_permissions  The user's UserPermissions.
+    """
+
+    if user_id in self.permissions:
+      self._remove_user_permissions(user_id)
+    self.permissions[user_id] = user_permissions
+    self._cache_size += user_permissions.size
+
+    # Evict the least recently used entries
+    while len(self.permissions) > 1 and (len(self.permissions) > self.max_cached_users or 
+                                         self._cache_size > self.max_cache_size):
+      self._remove_user_permissions(next(iter(self.permissions)))
+      self.cache_evictions += 1
+
+  def _remove_user_permissions(self, user_id):
+    """ Removes a user's permissions from the cache.
+
+    @param user_id  The ID of the user.
+    """
+
+    removed_permissions = self.permissions.pop(user_id)
+    self._cache_size = max(self._cache_size - getattr(removed_permissions, 'size', 0), 0)
   
   def _update_user_permissions(self, user_id):
     """ Updates the permissions for the indicated user.
@@ -100,6 +374,8 @@ class PermissionManager:
     
     @note If a non-remote permissions endpoint is specified, the permissions will be loaded from the offline local file.
     @note If the indicated user already has permission settings recorded, they will be overridden with the new settings.
+    @note If the user's permissions are already being fetched, the returned deferred will be fired with the results of
+          that fetch instead of starting a new one.
     
     @throws Throws PermissionsInvalidSchema if the dictionary defined in permission_settings does not conform to the 
             permission settings schema, as checked by _validate_permissions().
@@ -109,81 +385,242 @@ class PermissionManager:
     @return Returns a deferred that will be fired with the results of the permission settings load/download. That is,
             an error or the permissions object for the indicated user.
     """
+
+    update_deferred = defer.Deferred()
+
+    # Wait for the fetch that's already in progress, if there is one
+    waiting_deferreds = self._pending_updates.get(user_id, None)
+    if waiting_deferreds is not None:
+      self.fetches_coalesced += 1
+      waiting_deferreds.append(update_deferred)
+      return update_deferred
+
+    # Fetch the user's permissions
+    self.fetches_started += 1
+    self._pending_updates[user_id] = [update_deferred]
+    fetch_deferred = self._fetch_user_permissions(user_id)
+    fetch_deferred.addBoth(self._fetch_finished, user_id)
+
+    return update_deferred
+
+  def _fetch_finished(self, fetch_results, user_id):
+    """ Passes the results of a permission fetch to every caller waiting for it.
+
+    @param fetch_results  The user's UserPermissions or a Failure describing why they couldn't be fetched.
+    @param user_id        The ID of the user whose permissions were fetched.
+    """
+
+    for waiting_deferred in self._pending_updates.pop(user_id):
+      if isinstance(fetch_results, failure.Failure):
+        waiting_deferred.errback(fetch_results)
+      else:
+        waiting_deferred.callback(fetch_results)
+
+  def _fetch_user_permissions(self, user_id):
+    """ Downloads or loads the permissions of the indicated user (see _update_user_permissions()).
+
+    @param user_id  The ID of the user that the command permissions are for.
+    @return Returns a deferred that will be fired with the UserPermissions for the user (or an error).
+    """
     
-    # Attempt to load the user's permissions
-    if self.use_remote_permissions:
-      defer_download = threads.deferToThread(self._download_remote_permissions, user_id)
-    else:
-      defer_download = threads.deferToThread(self._load_local_permissions, user_id)
+    # Load the user's permissions from the local permissions store
+    if not self.use_remote_permissions:
+      return self._load_local_permissions(user_id)
+
+    # Attempt to download the user's permissions
+    defer_download = self._download_remote_permissions(user_id)
     
     # Validate & save
     defer_download.addCallback(self._validate_permissions, user_id)
     defer_download.addCallback(self._save_permissions, user_id)
     
     return defer_download
+
+  def _fetch_bulk_permissions(self, user_ids):
+    """ Downloads or loads the permission settings of several users (see prefetch_user_permissions()).
+
+    @param user_ids  A list containing the IDs of the users to load permissions for.
+    @return Returns a deferred that will be fired with a list containing the permission settings dictionaries that were
+            loaded (which may not include every requested user).
+    """
+
+    # Load the users' permissions from the local permissions store
+    if not self.use_remote_permissions:
+      load_deferred = self._refresh_local_store()
+      load_deferred.addCallback(self._load_local_user_settings, user_ids)
+
+      return load_deferred
+
+    # Download the permissions of all of the users with one request
+    defer_download = self._download_remote_permissions(user_ids)
+    defer_download.addCallback(self._validate_permissions, ", ".join(user_ids))
+
+    return defer_download
+
+  def _prefetch_finished(self, prefetch_results, user_ids):
+    """ Saves the permissions loaded by a prefetch and passes them to any callers waiting for them.
+
+    @param prefetch_results  A list of the permission settings that were loaded or a Failure describing why they 
+                             couldn't be.
+    @param user_ids          A list containing the IDs of the users that were prefetched.
+    @return Returns the number of users whose permissions were loaded, or passes on the Failure.
+    """
+
+    if isinstance(prefetch_results, failure.Failure):
+      for user_id in user_ids:
+        self._fetch_finished(prefetch_results, user_id)
+
+      return prefetch_results
+
+    saved_permissions = self._save_permission_list(prefetch_results)
+    users_prefetched = 0
+    for user_id in user_ids:
+      if user_id in saved_permissions:
+        users_prefetched += 1
+        self._fetch_finished(saved_permissions[user_id], user_id)
+      else:
+        self._fetch_finished(failure.Failure(PermissionsUserNotFound("The permissions for user '"+user_id+"' could "+
+                                                                     "not be found in the permissions resource.")),
+                             user_id)
+    self.users_prefetched += users_prefetched
+
+    return users_prefetched
   
   def _download_remote_permissions(self, user_id):
     """ Loads the user's permissions from a remote location.
     
-    This method loads the specified user's command execution permissions from a remote location (e.g. the mercury2 
-    user interface) and returns them.
-    
-    @throws PermissionsError if an error occurs while downloading or parsing the schedule.
-    @throws May throw PermissionsInvalidSchema if the permission settings do not conform to the defined schema.
+    This method downloads the specified user's command execution permissions from a remote location (e.g. the mercury2 
+    user interface) using the shared HTTP client. The permissions of several users can be requested at once by 
+    providing a list of user IDs, which will be sent as a comma separated 'user_id' parameter. The request is 
+    conditional, so unchanged permissions don't have to be resent by the server.
     
-    @note This method is intended to be called with threads.deferToThread. The returned permissions will be passed to 
-          the resulting deferred's callback chain.
-    
-    @param user_id  The ID of the user we want to download permissions for.
-    @return Returns an array of JSON objects representing the permissions for each queried user. Note that in this case
-            the array will only have a single element.
+    @param user_id  The ID of the user we want to download permissions for, or a list of user IDs.
+    @return Returns a deferred that will be fired with the raw (unparsed) permissions resource, which contains an array
+            of JSON objects representing the permissions for each queried user. If the download fails, it will be fired
+            with a PermissionsError.
     """
     
-    # Setup local variables
-    permissions_file = None
-    
-    # Attempt to download the JSON resource
+    if isinstance(user_id, list):
+      user_id = ",".join(user_id)
+
+    # Encode the request parameters
+    encoded_params = urllib.urlencode({'user_id': user_id})
+
     try:
-      # Encode the request parameters
-      encoded_params = urllib.urlencode({'user_id': user_id})
-      
-      permissions_request = urllib2.Request(self.permissions_location+'?'+encoded_params)
-      permissions_opener = urllib2.build_opener()
-      permissions_file = permissions_opener.open(permissions_request, None, self.config.get('permissions-update-timeout'))
+      download_deferred = http_client.get_client().get(self.permissions_location+'?'+encoded_params,
+                                                       timeout = self.config.get('permissions-update-timeout'),
+                                                       conditional = True)
     except:
-      # Error downloading the file
-      raise PermissionsError('There was an error downloading the permissions for user: '+user_id)
+      download_deferred = defer.fail()
+    download_deferred.addCallbacks(lambda permissions_response: permissions_response.body,
+                                   self._download_failed, errbackArgs = (user_id,))
     
-    return permissions_file
+    return download_deferred
+
+  def _download_failed(self, failure, user_id):
+    """ Translates permission download errors into PermissionsError exceptions.
+
+    @throw Throws PermissionsError.
+
+    @param failure  The Failure wrapping the HTTPRequestError.
+    @param user_id  The ID of the user (or the comma separated IDs of the users) whose permissions were requested.
+    """
+
+    # Error downloading the file
+    raise PermissionsError('There was an error downloading the permissions for user: '+user_id)
   
   def _load_local_permissions(self, user_id):
-    """ Load the user's permissions from a local file.
+    """ Loads the user's permissions from the local permissions store.
     
-    This method loads the specified user's command execution permissions from a local master permissions file (generated
-    by the mercury2 user interface). 
+    The local permissions file is only parsed when it has changed since it was last loaded (in a thread, because it may
+    be large). Otherwise, the user's permissions are looked up directly in the store's index.
     
-    @throws PermissionsError if the file can't be loaded for some reason.
+    @throws PermissionsError if the permissions file can't be loaded for some reason.
     @throws May throw PermissionsInvalidSchema if the permission settings file does not conform to the defined schema.
-    
-    @note This method is intended to be called with threads.deferToThread. The returned permissions will be passed to the 
-          resulting deferred's callback chain.
+    @throws May throw PermissionsUserNotFound if the user isn't defined in the permissions file.
     
     @param user_id  The ID of the user to load permissions for.
-    @return Returns an array of JSON objects representing the permissions for each queried user. Note that in this case
-            the array will only have a single element.
+    @return Returns a deferred that will be fired with the UserPermissions for the user.
     """
-    
-    # Setup local variables
-    permissions_file = None
-    
-    # Attempt to open the permissions file
+
+    load_deferred = self._refresh_local_store()
+    load_deferred.addCallback(lambda local_store: local_store.get_user_settings(user_id))
+    load_deferred.addCallback(self._save_user_permissions, user_id)
+
+    return load_deferred
+
+  def _refresh_local_store(self):
+    """ Makes sure that the local permissions store reflects the current version of the local permissions file.
+
+    @return Returns a deferred that will be fired with the up to date LocalPermissionStore (or a PermissionsError).
+    """
+
+    # Use a new store if the permissions file has moved
+    if self._local_store is None or self._local_store.permissions_file != self.permissions_location:
+      self._local_store = LocalPermissionStore(self.permissions_location)
+    local_store = self._local_store
+
     try:
-      permissions_file = open(self.permissions_location, 'r')
-    except IOError:
-      # Error loading the file
-      raise PermissionsError('There was an error loading the user permissions file.')
-    
-    return permissions_file
+      reload_needed = local_store.is_stale()
+    except PermissionsError:
+      return defer.fail()
+
+    if not reload_needed:
+      return defer.succeed(local_store)
+
+    reload_deferred = threads.deferToThread(local_store.reload)
+    reload_deferred.addCallback(self._local_permissions_reloaded)
+    reload_deferred.addCallback(lambda ignored: local_store)
+
+    return reload_deferred
+
+  def _load_local_user_settings(self, local_store, user_ids):
+    """ Looks up the permission settings of several users in the local permissions store.
+
+    @param local_store  The LocalPermissionStore to use.
+    @param user_ids     A list containing the IDs of the users to look up.
+    @return Returns a list containing the permission settings of the users that are defined in the permissions file.
+    """
+
+    user_settings = []
+    for user_id in user_ids:
+      try:
+        user_settings.append(local_store.get_user_settings(user_id))
+      except PermissionsUserNotFound:
+        continue
+
+    return user_settings
+
+  def _local_permissions_reloaded(self, changed_user_ids):
+    """ Replaces the cached permissions of the users whose settings changed when the local permissions file was reloaded.
+
+    @param changed_user_ids  A set containing the IDs of the users whose permission settings were added, changed, or
+                             removed.
+    """
+
+    current_time = int(time.time())
+    for changed_user_id in changed_user_ids:
+      if changed_user_id not in self.permissions:
+        continue
+
+      try:
+        self._cache_user_permissions(changed_user_id, 
+                                     UserPermissions(self._local_store.get_user_settings(changed_user_id), current_time))
+      except PermissionsUserNotFound:
+        self._remove_user_permissions(changed_user_id)
+
+  def _save_user_permissions(self, permission_settings, user_id):
+    """ Compiles and saves the permission settings of a single user.
+
+    @param permission_settings  The user's permission settings dictionary.
+    @param user_id              The ID of the user.
+    @return Returns the UserPermissions for the user.
+    """
+
+    user_permissions = UserPermissions(permission_settings, int(time.time()))
+    self._cache_user_permissions(user_id, user_permissions)
+
+    return user_permissions
   
   def _background_update_error(self, update_error):
     """ This callback responds to errors when updating the permissions in the background.
@@ -199,10 +636,9 @@ class PermissionManager:
     
     This callback saves the permissions for every user with permissions defined in permission settings.
     
-    @note Depending on how the permissions are loaded (i.e. either from a remote API location or a local offline file),
-          permission_settings can contain the permissions for multiple users. Regardless of how many users are
-          represented in permission_settings, the permissions will be saved for all of them. This prevents frequent file
-          loads when operating in offline mode.
+    @note The downloaded permission_settings can contain the permissions for multiple users. Regardless of how many 
+          users are represented in permission_settings, the permissions will be saved for all of them. (Permissions 
+          loaded from a local file are saved by _save_user_permissions() instead.)
     @note If a user already has non-expired permissions in the manager, they will be overwritten by the new values.
     
     @throws PermissionsUserNotFound if the user originally indicated couldn't be located in the loaded permissions
@@ -210,29 +646,34 @@ class PermissionManager:
     
     @param permission_settings  An array containing the JSON permission objects for users it includes.
     @param user_id              The ID of the user that was initially queried for.
-    @return Returns the permission settings for the user that was originally queried for.
+    @return Returns the UserPermissions for the user that was originally queried for.
     """
     
-    target_user_permissions = None
-    current_time = int(time.time())
-    
-    # Loop through and save every permission object
-    for user_permissions in permission_settings:
-      self.permissions[user_permissions['user_id']] = user_permissions
-      
-      # Set the load time
-      self.permissions[user_permissions['user_id']]['loaded_at'] = current_time
-      
-      if user_permissions['user_id'] == user_id:
-        target_user_permissions = user_permissions
+    # Compile and save every permission object
+    target_user_permissions = self._save_permission_list(permission_settings).get(user_id, None)
     
     # Make sure the original user's permissions were downloaded
     if target_user_permissions is None:
       raise PermissionsUserNotFound("The permissions for user '"+user_id+"' could not be found upon loading the latest "
                                     "version of the permissions resource.")
     
-    # Return a copy of the user's permission
-    return target_user_permissions.copy()
+    return target_user_permissions
+
+  def _save_permission_list(self, permission_settings):
+    """ Compiles and saves every user permission object in a list of permission settings.
+
+    @param permission_settings  An array containing the JSON permission objects to save.
+    @return Returns a dictionary containing the new UserPermissions, keyed by user ID.
+    """
+
+    saved_permissions = {}
+    current_time = int(time.time())
+    for user_permissions in permission_settings:
+      compiled_permissions = UserPermissions(user_permissions, current_time)
+      self._cache_user_permissions(compiled_permissions['user_id'], compiled_permissions)
+      saved_permissions[compiled_permissions['user_id']] = compiled_permissions
+
+    return saved_permissions
   
   def _validate_permissions(self, raw_permissions, user_id):
     """ Validates the provided permission settings.
@@ -243,91 +684,215 @@ class PermissionManager:
             permission settings schema.
     @throws Throws PermissionsError if the raw permissions resource can't be parsed.
     
-    @param raw_permissions  A raw, unparsed, permissions resource file (either from net or local machine).
+    @param raw_permissions  A string containing the raw, unparsed, permissions resource.
     @param user_id          The ID of the user who's permissions are being queried for.
     @return Returns a dictionary containing the parsed permissions.
     """
     
     # Parse the schedule JSON
     try:
-      permission_settings = json.load(raw_permissions)
+      permission_settings = json.loads(raw_permissions)
     except ValueError:
       # Error parsing the permissions JSON
       raise PermissionsError('The permissions resource for user \''+user_id+'\' did not contain a parsable JSON object.')
     
-    # Define the schema
-    permission_list_schema = {
-      "type": "array",
-      "$schema": "http://json-schema.org/draft-03/schema",
-      "required": True,
-      "items": {
-        "type": "object",
-        "additionalProperties": False,
-        "properties": {
-          "generated_at": {
-            "type": "number",
-            "id": "generated_at",
-            "required": True
-          },
-          "user_id": {
-            "type": "string",
-            "id": "user_id",
-            "required": True
-          },
-          "username": {
-            "type": "string",
-            "id": "username",
-            "required": True
-          },
-          "ignore_session_protections": {
-            "type": "boolean",
-            "id": "ignore_session_protections",
-            "required": False
-          },
-          "permitted_commands": {
-            "type": "array",
-            "id": "permitted_commands",
-            "required": True,
-            "items": {
-              "type": "object",
-              "additionalProperties": True,
-              "properties": {
-                "command": {
-                  "type": "string",
-                  "id": "command",
-                  "required": True
-                },
-                "destination": {
-                  "type": "string",
-                  "id": "destination",
-                  "required": True
-                },
-                "pipelines": {
-                  "type": "array",
-                  "id": "pipelines",
-                  "required": False,
-                  "minitems": 1,
-                  "items": {
-                    "type": "string"
-                  }
-                }
-              }
-            }
-          }
-        }
-      }
-    }
-  
     # Validate the JSON schema
-    schema_validator = jsonschema.Draft3Validator(permission_list_schema)
     try:
-      schema_validator.validate(permission_settings)
+      PERMISSION_LIST_VALIDATOR.validate(permission_settings)
     except jsonschema.ValidationError:
       # Invalid permission list JSON
       raise PermissionsInvalidSchema("The provided permission list did not conform to the defined schema.")
     
     return permission_settings
 
+class LocalPermissionStore:
+  """ Stores the permission settings loaded from a local (offline) permissions file, indexed by user ID.
+
+  The permissions file is parsed once and its entries are indexed by user ID, so loading a user's permission settings
+  (or finding out that the user doesn't exist) only requires a dictionary lookup. The file is only reloaded when its 
+  modification time, inode, or size changes (e.g. because it was replaced by a newly generated file). When it is 
+  reloaded, only the entries that changed are re-validated and replaced.
+  """
+
+  def __init__(self, permissions_file, check_interval = 1.0):
+    """ Sets up the local permission store.
+
+    @note The permissions file isn't loaded until reload() is called.
+
+    @param permissions_file  The path to the local permissions file.
+    @param check_interval    How often (in seconds) to check if the permissions file has changed.
+    """
+
+    self.permissions_file = permissions_file
+    self.check_interval = check_interval
+    self._user_settings = {}
+    self._file_signature = None
+    self._last_checked = None
+    self._reload_lock = threading.Lock()
+
+    # Store statistics
+    self.reloads = 0
+    self.entries_validated = 0
+
+  def is_stale(self):
+    """ Checks if the permissions file needs to be (re)loaded.
+
+    @throw Throws PermissionsError if the permissions file can't be accessed.
+
+    @return Returns True if the permissions file hasn't been loaded or has changed since it was last loaded.
+    """
+
+    current_time = time.time()
+    if (self._file_signature is not None and self._last_checked is not None and
+        0 <= current_time - self._last_checked < self.check_interval):
+      return False
+
+    file_signature = self._load_file_signature()
+    self._last_checked = current_time
+
+    return file_signature != self._file_signature
+
+  def reload(self):
+    """ Reloads the permissions file if it has changed.
+
+    @note This method may be called from a thread. The user index is replaced in a single assignment, so lookups made
+          while the file is being reloaded will use the previous version of the file.
+
+    @throw Throws PermissionsError if the permissions file can't be loaded or parsed.
+    @throw Throws PermissionsInvalidSchema if any of the changed entries don't conform to the permissions schema. In 
+           this case, the previously loaded entries will continue to be used.
+
+    @return Returns a set containing the IDs of the users whose permission settings were added, changed, or removed.
+    """
+
+    with self._reload_lock:
+      file_signature = self._load_file_signature()
+      if file_signature == self._file_signature:
+        return set()
+
+      # Parse the file
+      try:
+        with open(self.permissions_file, 'r') as permissions_file:
+          permission_settings = json.load(permissions_file)
+      except IOError:
+        raise PermissionsError('There was an error loading the user permissions file.')
+      except ValueError:
+        raise PermissionsError('The user permissions file did not contain a parsable JSON object.')
+      if not isinstance(permission_settings, list):
+        raise PermissionsInvalidSchema("The provided permission list did not conform to the defined schema.")
+
+      # Index the entries, only validating the ones that changed
+      new_user_settings = {}
+      for user_settings in permission_settings:
+        user_id = user_settings.get('user_id', None) if isinstance(user_settings, dict) else None
+        if user_id is not None and self._user_settings.get(user_id, None) == user_settings:
+          new_user_settings[user_id] = self._user_settings[user_id]
+          continue
+
+        try:
+          USER_PERMISSIONS_VALIDATOR.validate(user_settings)
+        except jsonschema.ValidationError:
+          raise PermissionsInvalidSchema("The provided permission list did not conform to the defined schema.")
+        self.entries_validated += 1
+        new_user_settings[user_id] = user_settings
+
+      # Find the entries that changed and swap in the new index
+      changed_user_ids = set()
+      for user_id in set(new_user_settings.keys()) | set(self._user_settings.keys()):
+        if new_user_settings.get(user_id, None) is not self._user_settings.get(user_id, None):
+          changed_user_ids.add(user_id)
+      self._user_settings = new_user_settings
+      self._file_signature = file_signature
+      self.reloads += 1
+
+      logging.info("Loaded the local permissions file ("+str(len(new_user_settings))+" users, "+
+                   str(len(changed_user_ids))+" changed).")
+
+      return changed_user_ids
+
+  def get_user_settings(self, user_id):
+    """ Loads the permission settings of the specified user.
+
+    @throw Throws PermissionsUserNotFound if the user isn't defined in the permissions file.
+
+    @param user_id  The ID of the user.
+    @return Returns the user's permission settings dictionary.
+    """
+
+    user_settings = self._user_settings.get(user_id, None)
+    if user_settings is None:
+      raise PermissionsUserNotFound("The permissions for user '"+str(user_id)+"' could not be found in the local "+
+                                    "permissions file.")
+
+    return user_settings
+
+  def _load_file_signature(self):
+    """ Returns the modification time, inode, and size of the permissions file, which are used to detect changes.
+
+    @throw Throws PermissionsError if the permissions file can't be accessed.
+    """
+
+    try:
+      file_status = os.stat(self.permissions_file)
+    except OSError:
+      raise PermissionsError('There was an error loading the user permissions file.')
+
+    return (file_status.st_mtime, file_status.st_ino, file_status.st_size)
+
+class UserPermissions(dict):
+  """ Represents the compiled command execution permissions of a single user.
+
+  This class stores a user's permission settings (as loaded from the permissions resource) and compiles the user's 
+  permitted commands into a hashed structure so that permission checks take constant time, regardless of how many 
+  commands the user has been granted. It can be accessed just like the original permission settings dictionary.
+
+  @note Permission objects are never updated in place. When a user's permissions are reloaded, a new UserPermissions
+        object is created, which replaces the old permission decisions.
+  """
+
+  def __init__(self, permission_settings, loaded_at):
+    """ Compiles the user's permissions.
+
+    @param permission_settings  A dictionary containing the user's permission settings (conforming to the permission
+                                schema defined in PermissionManager._validate_permissions()).
+    @param loaded_at            A UNIX timestamp indicating when the permissions were loaded.
+    """
+
+    dict.__init__(self, permission_settings)
+    self['loaded_at'] = loaded_at
+    self['ignore_session_protections'] = self.get('ignore_session_protections', False)
+    self.hits = 0 # How many times the permissions have been requested from the cache
+    self.size = len(json.dumps(permission_settings)) # The approximate size of the permissions, used to limit the cache
+
+    # Compile the permitted commands into a dictionary of the form: {command: {destination: pipelines}}. The pipeline
+    # set will be None if the command can be executed on the destination in any pipeline.
+    self._permitted_commands = {}
+    for command_permission in self['permitted_commands']:
+      command_destinations = self._permitted_commands.setdefault(command_permission['command'], {})
+      destination = command_permission['destination']
+      if 'pipelines' not in command_permission:
+        command_destinations[destination] = None
+      elif destination not in command_destinations:
+        command_destinations[destination] = frozenset(command_permission['pipelines'])
+      elif command_destinations[destination] is not None:
+        command_destinations[destination] |= frozenset(command_permission['pipelines'])
+
+  def is_permitted(self, command, destination, pipeline = None):
+    """ Checks if the user is allowed to execute the specified command.
+
+    @param command      The name of the command being executed.
+    @param destination  The destination of the command (a system command handler or device ID).
+    @param pipeline     The ID of the pipeline that contains the destination device, or None for system commands.
+    @return Returns True if the user may execute the command and False otherwise.
+    """
+
+    command_destinations = self._permitted_commands.get(command)
+    if command_destinations is None or destination not in command_destinations:
+      return False
+
+    permitted_pipelines = command_destinations[destination]
+    return permitted_pipelines is None or (pipeline is not None and pipeline in permitted_pipelines)
+
 # Define permission related exceptions
 class PermissionsInvalidSchema(Exception):
   pass
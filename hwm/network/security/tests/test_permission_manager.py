@@ -1,10 +1,13 @@
 # Import required modules
-import logging, time, json
+import logging, time, json, os, shutil
+from twisted.internet.defer import inlineCallbacks, Deferred, DeferredList
+from mock import MagicMock
 from pkg_resources import Requirement, resource_filename
 from twisted.trial import unittest
 from twisted.test import proto_helpers
 from hwm.core.configuration import *
 from hwm.network.security import permissions
+from hwm.network.tests.utilities import StandInHTTPServer
 
 class TestPermissionManager(unittest.TestCase):
   """ This test suite tests the permission manager class, which is used to manage and cache downloaded user command
@@ -78,6 +81,49 @@ class TestPermissionManager(unittest.TestCase):
     
     return update_deferred
   
+  def test_permission_decisions(self):
+    """ Verifies that the compiled user permissions correctly allow and deny commands, and that reloading a user's 
+    permissions replaces their compiled permissions.
+    """
+    
+    # Initialize the permission manager
+    permission_manager = permissions.PermissionManager(self.source_data_directory+'/network/security/tests/data/test_permissions_valid.json', 3600)
+    
+    def check_reloaded_permissions(permission_settings, old_permission_settings):
+      self.assertTrue(permission_settings is not old_permission_settings)
+      self.assertTrue(permission_manager.permissions['1'] is permission_settings)
+      self.assertTrue(permission_settings.is_permitted('station_time', 'system'))
+    
+    def user_permissions_callback(permission_settings):
+      self.assertTrue(isinstance(permission_settings, permissions.UserPermissions))
+      self.assertTrue(permission_settings['ignore_session_protections'])
+      
+      # System commands
+      self.assertTrue(permission_settings.is_permitted('station_time', 'system'))
+      self.assertTrue(permission_settings.is_permitted('requires_session', 'test'))
+      self.assertFalse(permission_settings.is_permitted('station_time', 'test'))
+      self.assertFalse(permission_settings.is_permitted('fake_command', 'system'))
+      
+      # Device commands restricted to certain pipelines
+      self.assertTrue(permission_settings.is_permitted('test_command', 'test_device', 'test_pipeline'))
+      self.assertTrue(permission_settings.is_permitted('test_command', 'test_device', 'test_pipeline3'))
+      self.assertFalse(permission_settings.is_permitted('test_command', 'test_device', 'test_pipeline2'))
+      self.assertFalse(permission_settings.is_permitted('test_command', 'test_device'))
+      
+      # Make sure the cached permissions are returned without being copied, then force a reload
+      self.assertTrue(permission_manager.permissions['1'] is permission_settings)
+      permission_manager.purge_user_permissions(0)
+      reload_deferred = permission_manager.get_user_permissions('1')
+      reload_deferred.addCallback(check_reloaded_permissions, permission_settings)
+      
+      return reload_deferred
+    
+    # Force a file load
+    update_deferred = permission_manager.get_user_permissions('1')
+    update_deferred.addCallback(user_permissions_callback)
+    
+    return update_deferred
+  
   def test_get_valid_old_user(self):
     """ Verifies that the permissions manager correctly returns the cached permissions in the event that they need to be
     updated (instead of waiting for the new ones).
@@ -88,7 +134,7 @@ class TestPermissionManager(unittest.TestCase):
     
     def check_permission_update(permission_settings):
       # Check that the old version of the user's permissions were returned while they're being updated
-      self.assertTrue(permission_manager.permissions['2']['loaded_at'] == 42, "A user's cached permissions weren't returned as expected.")
+      self.assertTrue(permission_settings['loaded_at'] == 42, "A user's cached permissions weren't returned as expected.")
     
     def user_permissions_callback(permission_settings):
       # Reset the loaded_at time for the user to be older than the update interval for the permission manager
@@ -99,7 +145,7 @@ class TestPermissionManager(unittest.TestCase):
       reload_deferred.addCallback(check_permission_update)
     
     # Force a file load
-    update_deferred = permission_manager.get_user_permissions('1')
+    update_deferred = permission_manager.get_user_permissions('2')
     update_deferred.addCallback(user_permissions_callback)
     
     return update_deferred
@@ -127,7 +173,7 @@ class TestPermissionManager(unittest.TestCase):
       reload_deferred.addCallback(check_permission_update)
       
     # Force a file load
-    update_deferred = permission_manager.get_user_permissions('1')
+    update_deferred = permission_manager.get_user_permissions('2')
     update_deferred.addCallback(user_permissions_callback)
     
     return update_deferred
@@ -169,5 +215,259 @@ class TestPermissionManager(unittest.TestCase):
     update_deferred.addCallback(user_permissions_callback)
     
     return update_deferred
-    
-    
+
+  def _write_permissions(self, permissions_path, permission_settings, modified_at):
+    with open(permissions_path, 'w') as permissions_file:
+      json.dump(permission_settings, permissions_file)
+    os.utime(permissions_path, (modified_at, modified_at))
+
+  def test_local_permission_store(self):
+    """ Verifies that the local permission store indexes the permissions file and only reloads and re-validates the
+    entries that changed when the file changes.
+    """
+
+    permissions_path = self.mktemp()
+    shutil.copy(self.source_data_directory+'/network/security/tests/data/test_permissions_valid.json', permissions_path)
+    os.utime(permissions_path, (1000, 1000))
+    local_store = permissions.LocalPermissionStore(permissions_path, check_interval = 0)
+
+    # Load the file
+    self.assertTrue(local_store.is_stale())
+    self.assertEqual(local_store.reload(), set(['1', '2', '3', '4', '5']))
+    self.assertEqual(local_store.get_user_settings('1')['username'], 'test_admin')
+    self.assertFalse(local_store.is_stale())
+    self.assertEqual(local_store.reload(), set())
+
+    # Unknown users shouldn't cause the file to be reloaded
+    self.assertRaises(permissions.PermissionsUserNotFound, local_store.get_user_settings, '99')
+    self.assertEqual(local_store.reloads, 1)
+    self.assertEqual(local_store.entries_validated, 5)
+
+    # Change a single user's permissions
+    with open(permissions_path, 'r') as permissions_file:
+      permission_settings = json.load(permissions_file)
+    permission_settings[1]['username'] = 'renamed_user'
+    old_admin_settings = local_store.get_user_settings('1')
+    self._write_permissions(permissions_path, permission_settings, 2000)
+    self.assertTrue(local_store.is_stale())
+    self.assertEqual(local_store.reload(), set(['2']))
+    self.assertEqual(local_store.get_user_settings('2')['username'], 'renamed_user')
+    self.assertTrue(local_store.get_user_settings('1') is old_admin_settings)
+    self.assertEqual(local_store.entries_validated, 6)
+
+    # Invalid entries should be rejected without replacing the loaded entries
+    permission_settings[1]['permitted_commands'] = "invalid"
+    self._write_permissions(permissions_path, permission_settings, 3000)
+    self.assertRaises(permissions.PermissionsInvalidSchema, local_store.reload)
+    self.assertEqual(local_store.get_user_settings('2')['username'], 'renamed_user')
+
+    # Removed users should be reported as changed
+    self._write_permissions(permissions_path, permission_settings[:1], 4000)
+    self.assertEqual(local_store.reload(), set(['2', '3', '4', '5']))
+    self.assertRaises(permissions.PermissionsUserNotFound, local_store.get_user_settings, '2')
+
+  @inlineCallbacks
+  def test_local_permissions_reload(self):
+    """ Checks that the permission manager swaps in the new permissions of cached users when the local permissions file
+    changes.
+    """
+
+    permissions_path = self.mktemp()
+    shutil.copy(self.source_data_directory+'/network/security/tests/data/test_permissions_valid.json', permissions_path)
+    os.utime(permissions_path, (1000, 1000))
+    permission_manager = permissions.PermissionManager(permissions_path, 3600)
+
+    # Load some users
+    admin_permissions = yield permission_manager.get_user_permissions('1')
+    user_permissions = yield permission_manager.get_user_permissions('4')
+    self.assertEqual(permission_manager._local_store.reloads, 1)
+
+    # Revoke one of the admin's commands and force the file to be checked
+    with open(permissions_path, 'r') as permissions_file:
+      permission_settings = json.load(permissions_file)
+    permission_settings[0]['permitted_commands'] = permission_settings[0]['permitted_commands'][1:]
+    self._write_permissions(permissions_path, permission_settings, 2000)
+    permission_manager._local_store.check_interval = 0
+    permission_manager.purge_user_permissions(0)
+    permission_manager.permissions['1'] = admin_permissions
+    yield permission_manager.get_user_permissions('4')
+    self.assertEqual(permission_manager._local_store.reloads, 2)
+    self.assertFalse(permission_manager.permissions['1'].is_permitted('station_time', 'system'))
+    self.assertTrue(permission_manager.permissions['1'] is not admin_permissions)
+    self.assertTrue(user_permissions.is_permitted('station_time', 'system'))
+
+  @inlineCallbacks
+  def test_coalesced_permission_fetches(self):
+    """ Verifies that concurrent requests for a user's permissions, and background updates of stale permissions, share
+    a single fetch.
+    """
+
+    permission_manager = permissions.PermissionManager(self.source_data_directory+'/network/security/tests/data/test_permissions_valid.json', 3600)
+    fetch_deferred = Deferred()
+    permission_manager._fetch_user_permissions = MagicMock(return_value = fetch_deferred)
+
+    # Request a user's permissions several times while they're being fetched
+    request_deferreds = [permission_manager.get_user_permissions('1') for request_index in range(3)]
+    self.assertEqual(permission_manager._fetch_user_permissions.call_count, 1)
+    test_permissions = permissions.UserPermissions({'user_id': '1', 'username': 'test', 'generated_at': 1,
+                                                    'permitted_commands': []}, 42)
+    permission_manager.permissions['1'] = test_permissions
+    fetch_deferred.callback(test_permissions)
+    request_results = yield DeferredList(request_deferreds)
+    for request_succeeded, user_permissions in request_results:
+      self.assertTrue(request_succeeded)
+      self.assertTrue(user_permissions is test_permissions)
+
+    # Background updates of the stale permissions should also be shared
+    fetch_deferred = Deferred()
+    permission_manager._fetch_user_permissions = MagicMock(return_value = fetch_deferred)
+    for request_index in range(3):
+      cached_permissions = yield permission_manager.get_user_permissions('1')
+      self.assertTrue(cached_permissions is test_permissions)
+    self.assertEqual(permission_manager._fetch_user_permissions.call_count, 1)
+    fetch_deferred.callback(test_permissions)
+
+    permission_stats = permission_manager.get_stats()
+    self.assertEqual(permission_stats['fetches'], 2)
+    self.assertEqual(permission_stats['coalesced_fetches'], 2)
+    self.assertEqual(permission_stats['coalesced_refreshes'], 2)
+    self.assertEqual(permission_stats['in_flight'], 0)
+
+  @inlineCallbacks
+  def test_coalesced_permission_fetch_errors(self):
+    """ Checks that every caller waiting on a failed permission fetch receives the error.
+    """
+
+    permission_manager = permissions.PermissionManager(self.source_data_directory+'/network/security/tests/data/test_permissions_valid.json', 3600)
+    fetch_deferred = Deferred()
+    permission_manager._fetch_user_permissions = MagicMock(return_value = fetch_deferred)
+
+    request_deferreds = [permission_manager.get_user_permissions('99') for request_index in range(2)]
+    fetch_deferred.errback(permissions.PermissionsUserNotFound("Test error."))
+    for request_deferred in request_deferreds:
+      yield self.assertFailure(request_deferred, permissions.PermissionsUserNotFound)
+    self.assertEqual(permission_manager.get_stats()['in_flight'], 0)
+
+  @inlineCallbacks
+  def test_local_permission_prefetch(self):
+    """ Verifies that the permissions of several users can be prefetched from the local permissions file, and that 
+    requests made while the prefetch is in progress share its results.
+    """
+
+    permission_manager = permissions.PermissionManager(self.source_data_directory+'/network/security/tests/data/test_permissions_valid.json', 3600)
+
+    # Request a user's permissions while a prefetch that includes them is in progress
+    prefetch_deferred = permission_manager.prefetch_user_permissions(['1', '2', '1', '99'])
+    request_deferred = permission_manager.get_user_permissions('2')
+    missing_deferred = permission_manager.get_user_permissions('99')
+    users_prefetched = yield prefetch_deferred
+    self.assertEqual(users_prefetched, 2)
+    user_permissions = yield request_deferred
+    self.assertTrue(user_permissions is permission_manager.permissions['2'])
+    yield self.assertFailure(missing_deferred, permissions.PermissionsUserNotFound)
+    self.assertTrue('1' in permission_manager.permissions)
+
+    # Users that already have cached permissions shouldn't be prefetched again
+    users_prefetched = yield permission_manager.prefetch_user_permissions(['1', '2'])
+    self.assertEqual(users_prefetched, 0)
+
+    permission_stats = permission_manager.get_stats()
+    self.assertEqual(permission_stats['prefetches'], 1)
+    self.assertEqual(permission_stats['prefetched_users'], 2)
+    self.assertEqual(permission_stats['fetches'], 0)
+    self.assertEqual(permission_stats['coalesced_fetches'], 2)
+    self.assertEqual(permission_stats['in_flight'], 0)
+
+  @inlineCallbacks
+  def test_remote_permission_prefetch(self):
+    """ Checks that the permissions of several users are downloaded with a single request when they're prefetched from
+    a remote permissions resource, and that download errors are passed to the callers waiting for the prefetch.
+    """
+
+    # Serve the test permissions from a local stand-in for the user interface
+    self.config.options['permissions-update-timeout'] = 5
+    permissions_server = StandInHTTPServer()
+    permissions_server.start()
+    self.addCleanup(permissions_server.stop)
+    with open(self.source_data_directory+'/network/security/tests/data/test_permissions_valid.json', 'r') as permissions_file:
+      permission_list = permissions_file.read()
+    permissions_server.respond_with(permission_list)
+    permission_manager = permissions.PermissionManager(permissions_server.url+'permissions', 3600)
+
+    users_prefetched = yield permission_manager.prefetch_user_permissions(['1', '3'])
+    self.assertEqual(users_prefetched, 2)
+    self.assertEqual(len(permissions_server.requests), 1)
+    self.assertEqual(permissions_server.requests[0].args['user_id'], ['1,3'])
+
+    # The other users included in the response should be cached too
+    self.assertEqual(len(permission_manager.permissions), len(json.loads(permission_list)))
+
+    # Make sure errors get passed on
+    permission_manager.permissions = {}
+    permissions_server.respond_with("Server error.", code = 500)
+    prefetch_deferred = permission_manager.prefetch_user_permissions(['1'])
+    request_deferred = permission_manager.get_user_permissions('1')
+    yield self.assertFailure(prefetch_deferred, permissions.PermissionsError)
+    yield self.assertFailure(request_deferred, permissions.PermissionsError)
+    self.assertEqual(permission_manager.get_stats()['in_flight'], 0)
+
+  @inlineCallbacks
+  def test_permission_cache_limits(self):
+    """ Verifies that the permission cache evicts the least recently used users when it exceeds its user or size limit.
+    """
+
+    permission_manager = permissions.PermissionManager(self.source_data_directory+'/network/security/tests/data/test_permissions_valid.json', 3600,
+                                                       max_cached_users = 2)
+
+    # Load two users, use the first one again, then load a third (should evict the second)
+    yield permission_manager.get_user_permissions('1')
+    yield permission_manager.get_user_permissions('2')
+    yield permission_manager.get_user_permissions('1')
+    yield permission_manager.get_user_permissions('3')
+    self.assertEqual(list(permission_manager.permissions.keys()), ['1', '3'])
+    cache_stats = permission_manager.get_stats()
+    self.assertEqual((cache_stats['hits'], cache_stats['misses'], cache_stats['evictions']), (1, 3, 1))
+    self.assertEqual(cache_stats['cache_size'], permission_manager.permissions['1'].size+
+                                                permission_manager.permissions['3'].size)
+
+    # Limit the cache to the size of a single user's permissions
+    permission_manager.max_cache_size = permission_manager.permissions['3'].size
+    yield permission_manager.get_user_permissions('3')
+    yield permission_manager.get_user_permissions('2')
+    self.assertEqual(list(permission_manager.permissions.keys()), ['2'])
+    self.assertEqual(permission_manager.get_stats()['evictions'], 3)
+
+  @inlineCallbacks
+  def test_permission_cache_maintenance(self):
+    """ Checks that the permissions of users that are being used are refreshed shortly before they expire, and that the
+    permissions of unused users are purged once they expire.
+    """
+
+    permission_manager = permissions.PermissionManager(self.source_data_directory+'/network/security/tests/data/test_permissions_valid.json', 3600,
+                                                       refresh_ahead = 60)
+    yield permission_manager.get_user_permissions('1')
+    yield permission_manager.get_user_permissions('2')
+    yield permission_manager.get_user_permissions('3')
+    yield permission_manager.get_user_permissions('1')
+    old_permissions = permission_manager.permissions['1']
+
+    # Refresh the user that has been used and leave the others until they expire
+    for user_id in ['1', '2']:
+      permission_manager.permissions[user_id]['loaded_at'] = int(time.time())-3590
+    permission_manager.permissions['3']['loaded_at'] = int(time.time())-3600
+    self.assertEqual(permission_manager.maintain_cache(), 1)
+    self.assertTrue(permission_manager.permissions['1'] is not old_permissions)
+    self.assertEqual(sorted(permission_manager.permissions.keys()), ['1', '2'])
+    cache_stats = permission_manager.get_stats()
+    self.assertEqual((cache_stats['refreshes'], cache_stats['refresh_ahead'], cache_stats['purged']), (1, 1, 1))
+
+    # The cache should next need maintenance when the unused user's permissions expire
+    self.assertEqual(permission_manager.get_next_maintenance_time(),
+                     permission_manager.permissions['2']['loaded_at']+3600)
+
+    # Requests for permissions that are about to expire should refresh them too
+    permission_manager.permissions['2']['loaded_at'] = int(time.time())-3590
+    old_permissions = permission_manager.permissions['2']
+    user_permissions = yield permission_manager.get_user_permissions('2')
+    self.assertTrue(user_permissions is old_permissions)
+    self.assertEqual(permission_manager.get_stats()['refresh_ahead'], 2)
@@ -0,0 +1,109 @@
+# Import required modules
+import logging, tempfile, shutil
+from twisted.trial import unittest
+from twisted.internet import reactor, threads
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.protocol import Protocol, Factory
+from hwm.core.configuration import *
+from hwm.network.security import verification
+from hwm.network.tests.utilities import generate_tls_certificates, tls_client_request
+
+class TestTLSContextFactory(unittest.TestCase):
+  """ This test suite tests the TLS context factory used by the hardware manager's TLS listeners.
+  """
+
+  def setUp(self):
+    # Set a local reference to Configuration (how other modules should typically access Config)
+    self.config = Configuration
+    self.config.verbose_startup = False
+
+    # Generate some test certificates
+    self.certificate_directory = tempfile.mkdtemp()
+    self.certificate_files = generate_tls_certificates(self.certificate_directory)
+    self.config.options['tls-ca-cert-location'] = self.certificate_files['ca_cert']
+    self.config.options['tls-private-key-location'] = self.certificate_files['server_key']
+    self.config.options['tls-public-cert-location'] = self.certificate_files['server_cert']
+    self.listening_ports = []
+
+    # Disable logging for most events
+    logging.disable(logging.CRITICAL)
+
+  def tearDown(self):
+    # Reset the recorded configuration values
+    self.config.options = {}
+    self.config.user_options = {}
+    self.config = None
+
+    shutil.rmtree(self.certificate_directory)
+    for listening_port in self.listening_ports:
+      listening_port.stopListening()
+
+  @inlineCallbacks
+  def test_session_resumption(self):
+    """ Verifies that clients can resume their TLS sessions on any of the listeners that share the context factory, and
+    that the handshake statistics distinguish between full and resumed handshakes.
+    """
+
+    self.config.options['tls-session-cache-enabled'] = True
+    self.config.options['tls-session-cache-size'] = 16
+    self.config.options['tls-session-lifetime'] = 60
+    self.config.options['tls-session-tickets'] = False
+    context_factory = verification.create_tls_context_factory()
+    self.assertEqual(context_factory.get_stats(), None)
+    first_port = self._listen(context_factory)
+    second_port = self._listen(context_factory)
+
+    # Connect, then resume the session on both listeners
+    response, session, session_resumed = yield threads.deferToThread(tls_client_request, first_port,
+                                                                     self.certificate_files)
+    self.assertEqual(response, "okay")
+    self.assertFalse(session_resumed)
+    for listener_port in [first_port, second_port]:
+      response, session, session_resumed = yield threads.deferToThread(tls_client_request, listener_port,
+                                                                       self.certificate_files, session = session)
+      self.assertEqual(response, "okay")
+      self.assertTrue(session_resumed)
+
+    handshake_stats = context_factory.get_stats()
+    self.assertEqual(handshake_stats['handshakes_completed'], 3)
+    self.assertEqual(handshake_stats['full_handshakes'], 1)
+    self.assertEqual(handshake_stats['resumed_handshakes'], 2)
+
+  @inlineCallbacks
+  def test_session_resumption_disabled(self):
+    """ Checks that sessions aren't resumed when the session cache and session tickets are disabled.
+    """
+
+    self.config.options['tls-session-cache-enabled'] = False
+    self.config.options['tls-session-cache-size'] = 16
+    self.config.options['tls-session-lifetime'] = 60
+    self.config.options['tls-session-tickets'] = False
+    context_factory = verification.create_tls_context_factory()
+    listener_port = self._listen(context_factory)
+
+    session = None
+    for connection_index in range(2):
+      response, session, session_resumed = yield threads.deferToThread(tls_client_request, listener_port,
+                                                                       self.certificate_files, session = session)
+      self.assertEqual(response, "okay")
+      self.assertFalse(session_resumed)
+
+    handshake_stats = context_factory.get_stats()
+    self.assertEqual(handshake_stats['full_handshakes'], 2)
+    self.assertEqual(handshake_stats['resumed_handshakes'], 0)
+
+  def _listen(self, context_factory):
+    """ Starts a TLS listener that responds to every connection with 'okay' and then closes it.
+
+    @return Returns the listener's port number.
+    """
+
+    listener_factory = Factory.forProtocol(OkayProtocol)
+    self.listening_ports.append(reactor.listenSSL(0, listener_factory, context_factory, interface = "127.0.0.1"))
+
+    return self.listening_ports[-1].getHost().port
+
+class OkayProtocol(Protocol):
+  def connectionMade(self):
+    self.transport.write("okay")
+    self.transport.loseConnection()
@@ -1,7 +1,10 @@
 """ @package hwm.network.security.verification
 Contains functions for verifying user authorization credentials.
 
-This module functions for authenticating users based on their provided SSL certificate.
+This module functions for authenticating users based on their provided SSL certificate. It also contains the TLS context
+factory shared by the hardware manager's TLS listeners, which can resume TLS sessions so that clients that reconnect 
+frequently (e.g. clients sending short-lived command requests) don't have to perform a full handshake (and client
+certificate verification) for every connection.
 """
 
 # Import required modules
@@ -10,6 +13,12 @@ from hwm.core.configuration import Configuration
 from OpenSSL import SSL
 from twisted.internet import ssl
 
+# OpenSSL functions that pyOpenSSL doesn't expose (may not be available in every version of pyOpenSSL)
+try:
+  from OpenSSL._util import lib as _openssl_lib
+except ImportError:
+  _openssl_lib = None
+
 def create_tls_context_factory():
   """ Creates and returns a new ssl.ContextFactory used to create TLS contexts for various ground station connections.
   
@@ -19,7 +28,10 @@ def create_tls_context_factory():
   TLS context factory with the ground station's public CA certificate which is used to verify the integrity of user 
   certificates. 
 
-  @return Returns an ssl.ContextFactory for use by SSL listeners.
+  TLS session resumption is configured using the 'tls-session-cache-enabled', 'tls-session-cache-size', 
+  'tls-session-lifetime', and 'tls-session-tickets' configuration options.
+
+  @return Returns a TLSContextFactory for use by SSL listeners.
   """
 
   # Load the server's private key, public X509 certificate, and the certificate authority's X509 certificate
@@ -29,6 +41,85 @@ def create_tls_context_factory():
     with open(Configuration.get('tls-public-cert-location')) as public_certificate_file:
       server_certificate = ssl.PrivateCertificate.loadPEM(private_key_file.read() + public_certificate_file.read())
 
-  server_context_factory = server_certificate.options(ca_certificate)
+  server_context_factory = TLSContextFactory(server_certificate, ca_certificate,
+                                             session_cache = Configuration.get('tls-session-cache-enabled'),
+                                             session_cache_size = Configuration.get('tls-session-cache-size'),
+                                             session_lifetime = Configuration.get('tls-session-lifetime'),
+                                             session_tickets = Configuration.get('tls-session-tickets'))
 
   return server_context_factory
+
+class TLSContextFactory(ssl.CertificateOptions):
+  """ A TLS context factory that requires client certificates and supports TLS session resumption.
+
+  The factory creates a single TLS context, which is shared by every listener that uses the factory. As a result, a
+  session established on one listener can be resumed on any of the others.
+  """
+
+  def __init__(self, server_certificate, ca_certificate, session_cache = True, session_cache_size = 1024,
+               session_lifetime = 3600, session_tickets = False):
+    """ Sets up the context factory.
+
+    @param server_certificate  The server's ssl.PrivateCertificate.
+    @param ca_certificate      The ssl.Certificate of the CA that signs user certificates.
+    @param session_cache       Whether or not to cache sessions on the server so that clients can resume them using 
+                               their session ID.
+    @param session_cache_size  The maximum number of sessions to cache.
+    @param session_lifetime    How long (in seconds) sessions (including those resumed using tickets) can be resumed.
+    @param session_tickets     Whether or not to issue session tickets, which allow clients to resume sessions without
+                               them being cached by the server.
+    """
+
+    ssl.CertificateOptions.__init__(self, privateKey = server_certificate.privateKey.original,
+                                    certificate = server_certificate.original,
+                                    trustRoot = ssl.trustRootFromCertificates([ca_certificate]),
+                                    enableSessions = session_cache or session_tickets,
+                                    enableSessionTickets = session_tickets)
+    self.session_cache = session_cache
+    self.session_cache_size = session_cache_size
+    self.session_lifetime = session_lifetime
+    self.session_tickets = session_tickets
+
+  def get_stats(self):
+    """ Returns statistics about the TLS handshakes performed using the factory's context.
+
+    @return Returns a dictionary containing the number of handshakes started and completed, how many of the completed
+            handshakes were full handshakes or resumed sessions, how many resumption attempts missed (e.g. because the
+            session expired), and the number of sessions in the session cache. Returns None if the statistics aren't 
+            available.
+    """
+
+    if self._context is None or _openssl_lib is None or not hasattr(_openssl_lib, 'SSL_CTX_sess_hits'):
+      return None
+
+    context_pointer = self._context._context
+    handshakes_completed = _openssl_lib.SSL_CTX_sess_accept_good(context_pointer)
+    handshakes_resumed = _openssl_lib.SSL_CTX_sess_hits(context_pointer)
+
+    return {
+      'handshakes_started': _openssl_lib.SSL_CTX_sess_accept(context_pointer),
+      'handshakes_completed': handshakes_completed,
+      'full_handshakes': max(handshakes_completed-handshakes_resumed, 0),
+      'resumed_handshakes': handshakes_resumed,
+      'resumption_misses': _openssl_lib.SSL_CTX_sess_misses(context_pointer),
+      'cached_sessions': _openssl_lib.SSL_CTX_sess_number(context_pointer)
+    }
+
+  def _makeContext(self):
+    """ Creates the TLS context and configures its session cache.
+    """
+
+    tls_context = ssl.CertificateOptions._makeContext(self)
+
+    if self.session_cache:
+      tls_context.set_session_cache_mode(SSL.SESS_CACHE_SERVER)
+      if _openssl_lib is not None and hasattr(_openssl_lib, 'SSL_CTX_sess_set_cache_size'):
+        _openssl_lib.SSL_CTX_sess_set_cache_size(tls_context._context, self.session_cache_size)
+      else:
+        logging.info("The TLS session cache size can't be set with this version of pyOpenSSL, the OpenSSL default "+
+                     "will be used instead.")
+    else:
+      tls_context.set_session_cache_mode(SSL.SESS_CACHE_OFF)
+    tls_context.set_timeout(self.session_lifetime)
+
+    return tls_context
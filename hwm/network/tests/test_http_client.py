@@ -0,0 +1,103 @@
+# Import required modules
+import logging
+from twisted.trial import unittest
+from twisted.internet.defer import inlineCallbacks
+from twisted.web import server
+from hwm.network import http_client
+from hwm.network.tests.utilities import StandInHTTPServer
+
+class TestHTTPClient(unittest.TestCase):
+  """ This test suite tests the shared HTTP client against a local stand-in HTTP server.
+  """
+
+  def setUp(self):
+    # Start the stand-in server
+    self.server = StandInHTTPServer()
+    self.server.start()
+    self.client = http_client.get_client()
+
+    # Disable logging for most events
+    logging.disable(logging.CRITICAL)
+
+  def tearDown(self):
+    return self.server.stop()
+
+  @inlineCallbacks
+  def test_persistent_connections(self):
+    """ Verifies that sequential requests to the same host reuse a single pooled connection and that POST bodies are 
+    sent correctly.
+    """
+
+    self.server.response_handler = lambda request: request.content.read() or "empty"
+    connections_opened = self.client.get_stats()['connections_opened']
+    requests_started = self.client.get_stats()['requests']
+
+    for request_index in range(5):
+      response = yield self.client.get(self.server.url)
+      self.assertEqual(response.code, 200)
+      self.assertEqual(response.body, "empty")
+    response = yield self.client.post(self.server.url, "request=test")
+    self.assertEqual(response.body, "request=test")
+    self.assertEqual(self.server.requests[-1].getHeader('Content-Type'), "application/x-www-form-urlencoded")
+
+    client_stats = self.client.get_stats()
+    self.assertEqual(client_stats['connections_opened'], connections_opened+1)
+    self.assertEqual(client_stats['requests'], requests_started+6)
+    self.assertEqual(client_stats['in_flight'], 0)
+
+  @inlineCallbacks
+  def test_conditional_requests(self):
+    """ Checks that conditional requests send the validators of the previous response and reuse its body if the server
+    responds with '304 Not Modified'.
+    """
+
+    def response_handler(request):
+      if request.getHeader('If-None-Match') == '"v1"':
+        request.setResponseCode(304)
+        return ""
+
+      request.setHeader('ETag', '"v1"')
+      return "resource body"
+    self.server.response_handler = response_handler
+    not_modified = self.client.get_stats()['not_modified']
+
+    response = yield self.client.get(self.server.url+"resource", conditional = True)
+    self.assertEqual(response.body, "resource body")
+    self.assertFalse(response.not_modified)
+    response = yield self.client.get(self.server.url+"resource", conditional = True)
+    self.assertEqual(response.code, 304)
+    self.assertTrue(response.not_modified)
+    self.assertEqual(response.body, "resource body")
+    self.assertEqual(self.client.get_stats()['not_modified'], not_modified+1)
+
+    # Unconditional requests shouldn't send validators
+    response = yield self.client.get(self.server.url+"resource")
+    self.assertEqual(self.server.requests[-1].getHeader('If-None-Match'), None)
+    self.assertEqual(response.code, 200)
+
+  @inlineCallbacks
+  def test_request_errors(self):
+    """ Verifies that error responses, dropped connections, timeouts, and invalid URLs are reported as HTTPRequestError
+    exceptions.
+    """
+
+    failed_requests = self.client.get_stats()['failed']
+    timed_out_requests = self.client.get_stats()['timed_out']
+
+    self.server.respond_with("Not found.", code = 404)
+    status_error = yield self.assertFailure(self.client.get(self.server.url), http_client.HTTPStatusError)
+    self.assertEqual(status_error.code, 404)
+
+    self.server.response_handler = lambda request: None
+    yield self.assertFailure(self.client.get(self.server.url), http_client.HTTPRequestError)
+
+    # Never respond to the request (its connection will be closed when the server stops)
+    self.server.response_handler = lambda request: server.NOT_DONE_YET
+    yield self.assertFailure(self.client.get(self.server.url, timeout = 0.1), http_client.HTTPRequestTimeout)
+
+    yield self.assertFailure(self.client.get("invalid.url"), http_client.HTTPRequestError)
+
+    client_stats = self.client.get_stats()
+    self.assertEqual(client_stats['failed'], failed_requests+4)
+    self.assertEqual(client_stats['timed_out'], timed_out_requests+1)
+    self.assertEqual(client_stats['in_flight'], 0)
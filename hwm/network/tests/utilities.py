@@ -0,0 +1,204 @@
+""" This module contains various utility classes and functions for testing the hardware manager's network clients.
+"""
+
+# Import required modules
+import os, socket
+from OpenSSL import SSL, crypto
+from twisted.internet import reactor, defer
+from twisted.protocols import policies
+from twisted.web import resource, server
+from hwm.network import http_client
+
+class StandInHTTPServer:
+  """ A local HTTP server that stands in for remote web APIs (e.g. the mercury2 user interface, antenna controller APIs,
+  or APRS.fi) during tests.
+
+  Every request is recorded in 'requests' and answered by 'response_handler', which is called with the twisted.web
+  Request and returns the response body. Handlers can set the response code and headers using the request. If the
+  handler returns None, the connection will be dropped without a response.
+  """
+
+  def __init__(self):
+    self.requests = []
+    self.response_handler = lambda request: ""
+    self.url = None
+    self._port = None
+    self._factory = ConnectionTrackingFactory(server.Site(StandInResource(self), timeout = None))
+
+  def start(self):
+    """ Starts listening on a local port and sets 'url' to the server's address.
+    """
+
+    self._port = reactor.listenTCP(0, self._factory, interface = "127.0.0.1")
+    self.url = "http://127.0.0.1:"+str(self._port.getHost().port)+"/"
+
+  def respond_with(self, body, code = 200, headers = None):
+    """ Sets up the server to answer every request with the provided response.
+    """
+
+    def response_handler(request):
+      request.setResponseCode(code)
+      for header_name, header_value in (headers or {}).items():
+        request.setHeader(header_name, header_value)
+
+      return body
+
+    self.response_handler = response_handler
+
+  def stop(self):
+    """ Stops the server, closes its connections and the idle connections of the shared HTTP client.
+
+    @return Returns a deferred that will be fired once the server's connections have been closed.
+    """
+
+    return defer.DeferredList([defer.maybeDeferred(self._port.stopListening), self._factory.close_connections(),
+                               http_client.get_client().close()])
+
+class StandInResource(resource.Resource):
+  isLeaf = True
+
+  def __init__(self, stand_in_server):
+    resource.Resource.__init__(self)
+    self.stand_in_server = stand_in_server
+
+  def render(self, request):
+    self.stand_in_server.requests.append(request)
+    response_body = self.stand_in_server.response_handler(request)
+
+    if response_body is None:
+      request.channel.transport.abortConnection()
+      return server.NOT_DONE_YET
+
+    return response_body
+
+class ConnectionTrackingFactory(policies.WrappingFactory):
+  """ A wrapping factory that can close its open connections and wait for them to close.
+  """
+
+  def __init__(self, wrapped_factory):
+    policies.WrappingFactory.__init__(self, wrapped_factory)
+    self._close_deferreds = []
+
+  def close_connections(self):
+    self._close_deferreds.append(defer.Deferred())
+    close_deferred = self._close_deferreds[-1]
+
+    if not self.protocols:
+      self._fire_close_deferreds()
+    for open_protocol in list(self.protocols.keys()):
+      open_protocol.transport.loseConnection()
+
+    return close_deferred
+
+  def unregisterProtocol(self, closed_protocol):
+    policies.WrappingFactory.unregisterProtocol(self, closed_protocol)
+
+    if not self.protocols:
+      self._fire_close_deferreds()
+
+  def _fire_close_deferreds(self):
+    close_deferreds, self._close_deferreds = self._close_deferreds, []
+    for close_deferred in close_deferreds:
+      close_deferred.callback(None)
+
+def generate_tls_certificates(certificate_directory):
+  """ Generates a test CA certificate along with server and client certificates signed by it.
+
+  @param certificate_directory  The directory to write the PEM files to.
+  @return Returns a dictionary containing the paths of the CA certificate ('ca_cert') and the server and client 
+          certificates and private keys ('server_cert', 'server_key', 'client_cert', 'client_key').
+  """
+
+  certificate_files = {}
+  ca_key = _generate_key()
+  ca_certificate = _generate_certificate("Mercury2 Test CA", ca_key, 1)
+  ca_certificate.sign(ca_key, 'sha256')
+  certificate_files['ca_cert'] = _write_pem(certificate_directory, 'ca-cert.pem',
+                                            crypto.dump_certificate(crypto.FILETYPE_PEM, ca_certificate))
+
+  for certificate_name, serial_number in [('server', 2), ('client', 3)]:
+    certificate_key = _generate_key()
+    certificate = _generate_certificate("Mercury2 Test "+certificate_name, certificate_key, serial_number)
+    certificate.set_issuer(ca_certificate.get_subject())
+    certificate.sign(ca_key, 'sha256')
+    certificate_files[certificate_name+'_cert'] = _write_pem(certificate_directory, certificate_name+'-cert.pem',
+                                                             crypto.dump_certificate(crypto.FILETYPE_PEM, certificate))
+    certificate_files[certificate_name+'_key'] = _write_pem(certificate_directory, certificate_name+'-key.pem',
+                                                            crypto.dump_privatekey(crypto.FILETYPE_PEM, 
+                                                                                   certificate_key))
+
+  return certificate_files
+
+def tls_client_request(port, certificate_files, request = "", session = None):
+  """ Connects to a local TLS listener using the test client certificate, sends a request, and reads the response.
+
+  @note This function blocks, so tests should call it using threads.deferToThread().
+
+  @param port               The port of the TLS listener.
+  @param certificate_files  The certificate paths returned by generate_tls_certificates().
+  @param request            The data to send once connected.
+  @param session            A TLS session returned by a previous call to resume, or None to perform a full handshake.
+  @return Returns a tuple containing the response (everything received until the connection was closed), the TLS
+          session (which can be used to resume the session), and whether or not the session was resumed.
+  """
+
+  client_context = SSL.Context(SSL.SSLv23_METHOD)
+  client_context.use_certificate_file(certificate_files['client_cert'])
+  client_context.use_privatekey_file(certificate_files['client_key'])
+  client_context.load_verify_locations(certificate_files['ca_cert'])
+
+  client_socket = socket.create_connection(("127.0.0.1", port))
+  client_connection = SSL.Connection(client_context, client_socket)
+  client_connection.set_connect_state()
+  if session is not None:
+    client_connection.set_session(session)
+
+  try:
+    client_connection.do_handshake()
+    if request:
+      client_connection.sendall(request)
+    response = ""
+    while True:
+      try:
+        response_data = client_connection.recv(65536)
+      except (SSL.ZeroReturnError, SSL.SysCallError):
+        break
+      if not response_data:
+        break
+      response += response_data
+    new_session = client_connection.get_session()
+    session_resumed = session is not None and SSL._lib.SSL_session_reused(client_connection._ssl) == 1
+
+    # Close the connection cleanly, otherwise OpenSSL won't let the session be resumed
+    try:
+      client_connection.shutdown()
+    except SSL.Error:
+      pass
+  finally:
+    client_connection.close()
+
+  return (response, new_session, session_resumed)
+
+def _generate_key():
+  certificate_key = crypto.PKey()
+  certificate_key.generate_key(crypto.TYPE_RSA, 2048)
+
+  return certificate_key
+
+def _generate_certificate(common_name, certificate_key, serial_number):
+  certificate = crypto.X509()
+  certificate.get_subject().CN = common_name
+  certificate.set_issuer(certificate.get_subject())
+  certificate.set_serial_number(serial_number)
+  certificate.gmtime_adj_notBefore(-3600)
+  certificate.gmtime_adj_notAfter(24*3600)
+  certificate.set_pubkey(certificate_key)
+
+  return certificate
+
+def _write_pem(certificate_directory, file_name, pem_data):
+  file_path = os.path.join(certificate_directory, file_name)
+  with open(file_path, 'w') as pem_file:
+    pem_file.write(pem_data)
+
+  return file_path
@@ -5,8 +5,9 @@ This module contains a class that is used to coordinate the various sessions.
 """
 
 # Import required modules
-import logging, time
-from hwm.core import configuration
+import logging, time, heapq
+from twisted.internet import reactor, defer
+from hwm.core import configuration, stats
 from hwm.hardware.pipelines import pipeline, manager as pipeline_manager
 from hwm.sessions import session, schedule
 
@@ -17,6 +18,11 @@ class SessionCoordinator:
   references to the active schedule instance and all active session instances. In addition, it contains the main 
   "program loop" that is responsible for periodically trigging schedule updates, checking for reservations, and 
   creating new sessions as needed.
+
+  Once started, the coordinator doesn't poll the schedule. Instead, it sets a single reactor timer for the next event 
+  that requires its attention (the next reservation start, session end, schedule update, or permission prefetch) and 
+  resets the timer every time it runs or the schedule changes. The timer is never set further ahead than the 
+  'session-coordinator-sweep-period' configuration option, which acts as a safety sweep.
   """
   
   def __init__(self, reservation_schedule, device_manager, pipeline_manager, command_parser):
@@ -35,22 +41,64 @@ class SessionCoordinator:
     self.command_parser = command_parser
     self.config = configuration.Configuration
 
-    # Register the session coordinator with the command parser so it can check command session requirements
+    # Register the session coordinator with the command parser so it can check command session requirements, and with
+    # the schedule so it's notified of schedule changes
     command_parser.session_coordinator = self
+    reservation_schedule.session_coordinator = self
     
     # Initialize coordinator attributes
     self.active_sessions = {} # Sessions that are currently running or being prepared to run
-    self.closed_sessions = [] # Sessions that have been completed or experienced a fatal error during initialization,
-                              # this is just an array of reservation IDs so that their session objects can get garbage
-                              # collected
+    self.closed_sessions = set() # Sessions that have been completed or experienced a fatal error during 
+                                 # initialization, this is just a set of reservation IDs so that their session objects
+                                 # can get garbage collected
+    self._closed_session_expiry = [] # (time_end, reservation_id) tuples used to forget closed sessions once their 
+                                     # reservations end
+    self.prefetched_reservations = set() # Upcoming reservations whose users' permissions have been prefetched
+    self.waiting_connections = {} # Deferreds for connections that are waiting for their session to become active, 
+                                  # indexed by reservation ID
+    self._coordination_timer = None # The DelayedCall that will run coordinate() next (None if it isn't running)
+    self._permission_maintenance_timer = None # The DelayedCall that will next maintain the permission cache
+    self._schedule_update_deferred = None # The deferred of the schedule update in progress, if any
+    self._schedule_update_attempted = 0 # When the last schedule update was started
+    self._started_at = None
+
+    # Coordinator statistics
+    self.coordination_runs = 0
+    self.session_start_lateness = stats.LatencyHistogram() # How late sessions were created after their reservation began
+    self.session_end_lateness = stats.LatencyHistogram() # How late sessions were stopped after their reservation ended
+
+  def start(self):
+    """ Starts coordinating the hardware manager.
+
+    This method runs coordinate() for the first time, which sets the coordinator's timer, and sets a timer for the 
+    next time that the permission cache needs to be maintained (see PermissionManager.get_next_maintenance_time()).
+    """
+
+    self._started_at = time.time()
+    self.coordinate()
+    self._reset_permission_maintenance_timer()
+
+  def stop(self):
+    """ Stops the coordinator's timer and the permission cache maintenance timer.
+    """
+
+    self._started_at = None
+
+    if self._coordination_timer is not None and self._coordination_timer.active():
+      self._coordination_timer.cancel()
+    self._coordination_timer = None
+
+    if self._permission_maintenance_timer is not None and self._permission_maintenance_timer.active():
+      self._permission_maintenance_timer.cancel()
+    self._permission_maintenance_timer = None
   
   def coordinate(self):
     """ Coordinates the operation of the hardware manager.
     
     This method coordinates the hardware manager by performing periodic maintenance functions such as instructing the 
     schedule manager to update its schedule, checking for newly active reservations, and creating sessions as the 
-    schedule dictates. This method is called periodically using a LoopingCall which is started during the main
-    initialization process.
+    schedule dictates. Once the coordinator has been started (see start()), this method resets the coordinator's timer
+    for the next time it needs to run.
 
     @note This method checks for completed sessions before it checks for new ones. Because this method is run 
           asynchronously in a single thread, this allows back to back session scheduling of the same pipeline.
@@ -61,11 +109,65 @@ class SessionCoordinator:
     
     # Check for completed sessions
     self._check_for_finished_sessions()
+    self._prune_closed_sessions()
     
     # Check the schedule for newly active reservations
     self._check_for_new_reservations()
-    
-    print 'COORDINATE'
+
+    # Load the permissions of users with upcoming reservations
+    self._prefetch_user_permissions()
+
+    self.coordination_runs += 1
+    if self._started_at is not None:
+      self._reset_coordination_timer()
+
+  def schedule_changed(self, schedule_changes):
+    """ Handles changes to the reservation schedule.
+
+    This method is called by the schedule manager after it applies a new version of the schedule. Reservations that 
+    were removed from the schedule before their session started are cancelled: connections waiting for them are 
+    rejected and the coordinator forgets about them. The sessions of reservations that have already started keep
+    running until they end, and the end times of running sessions are updated if their reservations' end times changed.
+    Finally, the coordinator's timer is reset for the new schedule.
+
+    @param schedule_changes  A dictionary containing lists of the IDs of the reservations that were 'added', 'changed',
+                             and 'removed'.
+    """
+
+    for reservation_id in schedule_changes['removed']:
+      if reservation_id in self.active_sessions:
+        continue
+
+      self.prefetched_reservations.discard(reservation_id)
+      self.closed_sessions.discard(reservation_id)
+      if reservation_id in self.waiting_connections:
+        self._release_waiting_connections(reservation_id)
+      logging.info("The reservation '"+reservation_id+"' was removed from the schedule before its session started.")
+
+    for reservation_id in schedule_changes['changed']:
+      if reservation_id in self.active_sessions:
+        changed_reservation = self.schedule.get_reservation(reservation_id)
+        if changed_reservation is not None:
+          self.active_sessions[reservation_id].configuration['time_end'] = changed_reservation['time_end']
+
+    if self._started_at is not None:
+      self._reset_coordination_timer()
+
+  def get_stats(self):
+    """ Returns statistics about the session coordinator.
+
+    @return Returns a dictionary containing the number of active and closed sessions, the number of times the 
+            coordinator has run, and statistics about how late (in milliseconds) sessions were started and stopped 
+            relative to their reservation's start and end times (see LatencyHistogram.get_stats()).
+    """
+
+    return {
+      'active_sessions': len(self.active_sessions),
+      'closed_sessions': len(self.closed_sessions),
+      'coordination_runs': self.coordination_runs,
+      'start_lateness': self.session_start_lateness.get_stats(),
+      'end_lateness': self.session_end_lateness.get_stats()
+    }
 
   def load_reservation_session(self, reservation_id):
     """ Returns the Session instance for the requested reservation.
@@ -94,6 +196,43 @@ class SessionCoordinator:
 
     return requested_session
 
+  def wait_for_reservation_session(self, reservation_id):
+    """ Returns the Session instance for the requested reservation once it's active.
+
+    This method is similar to load_reservation_session(), except that connections for reservations that are about to 
+    start can wait for their session to become active instead of being rejected. If the reservation starts within the 
+    'session-waiting-room-period' configuration option (or its session is still executing its setup commands), the
+    returned deferred will be parked in the waiting room and fired once the session becomes active.
+
+    @param reservation_id  The ID of the requested session.
+    @return Returns a deferred that will be fired with the Session that represents the specified reservation. If the
+            reservation doesn't exist, doesn't start soon enough, fails to start, or doesn't become active within the
+            waiting period after it was supposed to start, the deferred will errback with SessionNotFound.
+    """
+
+    try:
+      return defer.succeed(self.load_reservation_session(reservation_id))
+    except SessionNotFound as lookup_error:
+      # Check if the connection can wait for the session
+      waiting_period = self.config.get('session-waiting-room-period')
+      requested_reservation = self.schedule.get_reservation(reservation_id)
+      if waiting_period <= 0 or reservation_id in self.closed_sessions:
+        return defer.fail(lookup_error)
+      if reservation_id not in self.active_sessions and (requested_reservation is None or 
+                                                         requested_reservation['time_start'] > 
+                                                         time.time()+waiting_period):
+        return defer.fail(lookup_error)
+
+    # Park the connection until the session is active
+    waiting_deferred = defer.Deferred(lambda cancelled_deferred: self._stop_waiting(reservation_id, cancelled_deferred))
+    self.waiting_connections.setdefault(reservation_id, []).append(waiting_deferred)
+    time_until_start = max(requested_reservation['time_start']-time.time(), 0) if requested_reservation else 0
+    waiting_deferred.addTimeout(time_until_start+waiting_period, reactor, 
+                                onTimeoutCancel = lambda cancelled_results, timeout: self._waiting_timed_out(
+                                  reservation_id))
+
+    return waiting_deferred
+
   def load_user_sessions(self, user_id):
     """ Returns any active user sessions that the specified user may have.
 
@@ -123,16 +262,48 @@ class SessionCoordinator:
     """
 
     # Loop through the active sessions and check for ones that have finished
+    current_time = time.time()
     for active_session_id, active_session in self.active_sessions.items():
       if self._session_expired(active_session):
         # Call the session's clean up method and mark it as closed
-        self.closed_sessions.append(active_session_id)
+        self.session_end_lateness.record(max(current_time-active_session.configuration['time_end'], 0.0))
         del self.active_sessions[active_session_id]
+        self._close_session(active_session_id)
         active_session.kill_session()
+        self.command_parser.command_scheduler.cancel_session_commands(active_session_id)
 
         # Session finished
         logging.info("The session for the '"+active_session.id+"' reservation has been stopped after expiring.")
 
+  def _close_session(self, reservation_id):
+    """ Marks a reservation's session as closed so that it won't be started (again).
+
+    The reservation will be remembered until it ends, after which it can't be returned as an active reservation by the 
+    schedule manager anymore.
+
+    @param reservation_id  The ID of the reservation whose session was closed.
+    """
+
+    closed_reservation = self.schedule.get_reservation(reservation_id)
+    self.closed_sessions.add(reservation_id)
+    heapq.heappush(self._closed_session_expiry, (closed_reservation['time_end'] if closed_reservation is not None else 
+                                                 time.time(), reservation_id))
+
+  def _prune_closed_sessions(self):
+    """ Forgets about closed sessions whose reservations have ended.
+
+    @note If a closed reservation's end time has been extended, it will be remembered until its new end time.
+    """
+
+    current_time = time.time()
+    while self._closed_session_expiry and self._closed_session_expiry[0][0] <= current_time:
+      time_end, reservation_id = heapq.heappop(self._closed_session_expiry)
+      closed_reservation = self.schedule.get_reservation(reservation_id)
+      if closed_reservation is not None and closed_reservation['time_end'] > current_time:
+        heapq.heappush(self._closed_session_expiry, (closed_reservation['time_end'], reservation_id))
+      else:
+        self.closed_sessions.discard(reservation_id)
+
   def _session_expired(self, session):
     """ Determines if the specified session should be dead.
 
@@ -140,7 +311,7 @@ class SessionCoordinator:
     @return Returns True if the session has expired and False otherwise. 
     """
 
-    current_time = int(time.time())
+    current_time = time.time()
 
     if current_time >= session.configuration["time_end"]:
       return True
@@ -159,6 +330,7 @@ class SessionCoordinator:
     
     # Get the list of active reservations
     active_reservations = self.schedule.get_active_reservations()
+    current_time = time.time()
     
     # Check for new active reservations
     for active_reservation in active_reservations:
@@ -170,9 +342,14 @@ class SessionCoordinator:
         except pipeline_manager.PipelineNotFound:
           logging.error("The pipeline requested for reservation '"+active_reservation['reservation_id']+"' could not "+
                         "be found. Requested pipeline: "+active_reservation['pipeline_id'])
-          self.closed_sessions.append(active_reservation['reservation_id'])
+          self._close_session(active_reservation['reservation_id'])
+          self._release_waiting_connections(active_reservation['reservation_id'])
           continue
         
+        # Record how late the session is being created (unless the reservation began before the coordinator started)
+        if self._started_at is not None and active_reservation['time_start'] >= self._started_at:
+          self.session_start_lateness.record(max(current_time-active_reservation['time_start'], 0.0))
+
         # Create a session object for the newly active reservation
         self.active_sessions[active_reservation['reservation_id']] = session.Session(active_reservation, 
                                                                                      requested_pipeline,
@@ -197,6 +374,7 @@ class SessionCoordinator:
 
     # Session started
     logging.info("A new session has successfully been started for the reservation: '"+reservation_id+"'.")
+    self._release_waiting_connections(reservation_id)
 
     # Check for any failed session setup commands
     if session_command_results is not None:
@@ -222,8 +400,9 @@ class SessionCoordinator:
     """
 
     # Mark the session as closed and remove it from active_sessions so it won't be immediately re-run
-    self.closed_sessions.append(reservation_id)
     self.active_sessions.pop(reservation_id, None)
+    self._close_session(reservation_id)
+    self._release_waiting_connections(reservation_id)
 
     # Log the session failure
     logging.error("A fatal error occured while starting the session '"+reservation_id+"'.")
@@ -231,21 +410,197 @@ class SessionCoordinator:
 
     return True
   
+  def _release_waiting_connections(self, reservation_id):
+    """ Releases the connections waiting for the specified reservation's session.
+
+    Waiting connections will be attached to the session if it's active. Otherwise (e.g. if the session failed to start),
+    their deferreds will errback with SessionNotFound.
+
+    @param reservation_id  The ID of the reservation whose waiting connections should be released.
+    """
+
+    waiting_deferreds = self.waiting_connections.pop(reservation_id, [])
+
+    try:
+      requested_session = self.load_reservation_session(reservation_id)
+    except SessionNotFound as lookup_error:
+      for waiting_deferred in waiting_deferreds:
+        waiting_deferred.errback(lookup_error)
+      return
+
+    for waiting_deferred in waiting_deferreds:
+      waiting_deferred.callback(requested_session)
+
+  def _stop_waiting(self, reservation_id, waiting_deferred):
+    """ Removes a cancelled (e.g. because its connection was lost) deferred from the waiting room.
+
+    @param reservation_id    The ID of the reservation that the deferred was waiting for.
+    @param waiting_deferred  The cancelled deferred.
+    """
+
+    if waiting_deferred in self.waiting_connections.get(reservation_id, []):
+      self.waiting_connections[reservation_id].remove(waiting_deferred)
+      if not self.waiting_connections[reservation_id]:
+        del self.waiting_connections[reservation_id]
+
+  def _waiting_timed_out(self, reservation_id):
+    """ Called when a connection has waited too long for its session to become active.
+
+    @throw Always throws SessionNotFound, which will be passed to the waiting connection.
+
+    @param reservation_id  The ID of the reservation that the connection was waiting for.
+    """
+
+    raise SessionNotFound("The session for the reservation '"+reservation_id+"' didn't become active in time.")
+
+  def _prefetch_user_permissions(self):
+    """ Prefetches the permissions of users whose reservations are about to start.
+
+    This method instructs the permission manager to load, in bulk, the permissions of every user with a reservation 
+    that starts within the 'permissions-prefetch-horizon' configuration option so that the first command sent during
+    their session doesn't have to wait for their permissions to be downloaded. The users of each reservation are only
+    prefetched once (unless the prefetch fails).
+
+    @return Returns the deferred returned by PermissionManager.prefetch_user_permissions(), or None if there weren't
+            any new upcoming reservations.
+    """
+
+    prefetch_horizon = self.config.get('permissions-prefetch-horizon')
+    if prefetch_horizon <= 0:
+      return None
+
+    # Find the upcoming reservations that haven't been prefetched yet
+    upcoming_reservations = self.schedule.get_upcoming_reservations(prefetch_horizon)
+    new_reservation_ids = set()
+    prefetch_user_ids = []
+    for upcoming_reservation in upcoming_reservations:
+      if upcoming_reservation['reservation_id'] not in self.prefetched_reservations:
+        new_reservation_ids.add(upcoming_reservation['reservation_id'])
+        if upcoming_reservation['user_id'] not in prefetch_user_ids:
+          prefetch_user_ids.append(upcoming_reservation['user_id'])
+
+    # Forget about reservations that have ended or been removed from the schedule
+    self.prefetched_reservations = set([upcoming_reservation['reservation_id'] 
+                                        for upcoming_reservation in upcoming_reservations])
+    if not prefetch_user_ids:
+      return None
+
+    prefetch_deferred = self.command_parser.permission_manager.prefetch_user_permissions(prefetch_user_ids)
+    prefetch_deferred.addErrback(self._error_prefetching_permissions, new_reservation_ids)
+
+    return prefetch_deferred
+
+  def _error_prefetching_permissions(self, failure, reservation_ids):
+    """ Handles failed permission prefetches.
+
+    @param failure          The Failure object wrapping the generated exception.
+    @param reservation_ids  A set containing the IDs of the reservations whose users were being prefetched. They will be
+                            prefetched again the next time the coordinator runs.
+    """
+
+    self.prefetched_reservations -= reservation_ids
+    logging.error("The session coordinator could not prefetch the permissions of users with upcoming reservations. "+
+                  "Received error: "+failure.getErrorMessage())
+
+  def _reset_coordination_timer(self):
+    """ Sets the coordinator's timer for the next event that requires the coordinator to run.
+
+    The timer is set for the earliest of: the start of the next reservation, the end of the earliest ending active 
+    session, the next schedule update, the time the next reservation enters the permission prefetch horizon, and the 
+    next safety sweep (defined by the 'session-coordinator-sweep-period' configuration option).
+    """
+
+    current_time = time.time()
+    next_run_time = current_time+self.config.get('session-coordinator-sweep-period')
+
+    # Check for the next reservation to start and the next session to end
+    next_reservation = self.schedule.get_next_reservation()
+    if next_reservation is not None:
+      next_run_time = min(next_run_time, next_reservation['time_start'])
+    for active_session in self.active_sessions.itervalues():
+      next_run_time = min(next_run_time, active_session.configuration['time_end'])
+
+    # Check for the next schedule update (updates that are in progress will reset the timer when they finish)
+    if self._schedule_update_deferred is None:
+      next_run_time = min(next_run_time, self._schedule_update_attempted+self.config.get('schedule-update-period'))
+
+    # Check for the next reservation to enter the prefetch horizon
+    prefetch_horizon = self.config.get('permissions-prefetch-horizon')
+    if prefetch_horizon > 0:
+      next_prefetch_reservation = self.schedule.get_next_reservation(prefetch_horizon)
+      if next_prefetch_reservation is not None:
+        next_run_time = min(next_run_time, next_prefetch_reservation['time_start']-prefetch_horizon)
+
+    timer_delay = max(next_run_time-current_time, 0)
+    if self._coordination_timer is not None and self._coordination_timer.active():
+      self._coordination_timer.reset(timer_delay)
+    else:
+      self._coordination_timer = reactor.callLater(timer_delay, self.coordinate)
+
+  def _maintain_permission_cache(self):
+    """ Refreshes and purges the cached user permissions and sets the timer for the next time the cache needs it.
+    """
+
+    self.command_parser.permission_manager.maintain_cache()
+    self._reset_permission_maintenance_timer()
+
+  def _reset_permission_maintenance_timer(self):
+    """ Sets the permission cache maintenance timer for the next time that a cached user's permissions need to be
+    refreshed or purged.
+
+    @note Permissions that are loaded after the timer is set can't need maintenance before the time returned by
+          PermissionManager.get_next_maintenance_time(), so the timer doesn't have to be reset when they're loaded.
+    """
+
+    next_maintenance_time = self.command_parser.permission_manager.get_next_maintenance_time()
+    timer_delay = max(next_maintenance_time-time.time(), 0)
+    if self._permission_maintenance_timer is not None and self._permission_maintenance_timer.active():
+      self._permission_maintenance_timer.reset(timer_delay)
+    else:
+      self._permission_maintenance_timer = reactor.callLater(timer_delay, self._maintain_permission_cache)
+
   def _update_schedule(self):
     """ Updates the schedule if appropriate.
     
     This method instructs the schedule manager to update its schedule if it hasn't been updated recently ('recently' is
-    defined by the 'schedule-update-period' configuration option).
+    defined by the 'schedule-update-period' configuration option) and an update isn't already in progress. Failed 
+    updates are retried after the same period.
     
-    @return Returns the schedule update deferred from the schedule manager.
+    @return Returns the schedule update deferred from the schedule manager, or None if the schedule doesn't need to be
+            updated.
     """
     
     # Check if the schedule needs to be updated
-    if (time.time()-self.schedule.last_updated) > self.config.get('schedule-update-period'):
-      schedule_update_deferred = self.schedule.update_schedule()
-      schedule_update_deferred.addErrback(self._error_updating_schedule)
+    current_time = time.time()
+    if (self._schedule_update_deferred is not None or 
+        (current_time-self._schedule_update_attempted) < self.config.get('schedule-update-period')):
+      return None
+
+    self._schedule_update_attempted = current_time
+    schedule_update_deferred = self.schedule.update_schedule()
+    schedule_update_deferred.addErrback(self._error_updating_schedule)
+    schedule_update_deferred.addBoth(self._schedule_update_finished)
+    if not schedule_update_deferred.called:
+      self._schedule_update_deferred = schedule_update_deferred
     
     return schedule_update_deferred
+
+  def _schedule_update_finished(self, update_result):
+    """ Called when a schedule update finishes (whether or not it was successful).
+
+    If the coordinator has been started, this callback runs coordinate() immediately so that reservations that were 
+    added or moved by the update are handled right away, and so that the coordinator's timer is reset for the new 
+    schedule.
+
+    @param update_result  The result of the schedule update.
+    @return Passes on the result of the schedule update.
+    """
+
+    self._schedule_update_deferred = None
+    if self._started_at is not None:
+      self.coordinate()
+
+    return update_result
   
   def _error_updating_schedule(self, failure):
     """ Handles failed schedule updates. 
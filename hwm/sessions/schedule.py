@@ -1,14 +1,108 @@
 """ @package hwm.sessions.schedule
 Stores and maintains the reservation access schedule.
 
-This module contains a class that is used to fetch, maintain, and provide access to the reservation schedule.
+This module contains a class that is used to fetch, maintain, and provide access to the reservation schedule, as well
+as a time index that is used to quickly find the active and upcoming reservations in large schedules.
+
+Remote schedules are synchronized incrementally when the user interface supports it. After the first download, the 
+schedule manager sends the 'generated_at' timestamp of its copy of the schedule in the SCHEDULE_SINCE_HEADER request 
+header (along with the ETag of the last response). The server can then respond with '304 Not Modified' if the schedule
+hasn't changed, or with a delta schedule containing only the reservations that were added or changed since that time:
+
+  {"generated_at": 1360096600, "since": 1360096490, "reservations": [...], "deleted_reservations": ["RES.1"]}
+
+Servers that don't support delta schedules just ignore the header and respond with the full schedule.
 """
 
 # Import required modules
-import logging, json, jsonschema, threading, urllib2, time
+import logging, json, jsonschema, threading, time, bisect, heapq
 from hwm.core.configuration import Configuration
-from twisted.internet import threads
+from twisted.internet import threads, defer
 from hwm.command import command
+from hwm.network import http_client
+
+# The request header used to send the 'generated_at' timestamp of the local schedule to the user interface
+SCHEDULE_SINCE_HEADER = "X-Schedule-Since"
+
+# Define the schema that determines what a valid reservation looks like
+reservation_schema = {
+  "type": "object",
+  "additionalProperties": True,
+  "properties": {
+    "setup_commands": {
+      "type": "array",
+      "required": False,
+      "items": command.schema
+    },
+    "active_services": {
+      "type": "object",
+      "required": False,
+      "additionalProperties": {
+        "type": "string"
+      }
+    },
+    "pipeline_id": {
+      "type": "string",
+      "required": True
+    },
+    "time_end": {
+      "type": "number",
+      "required": True
+    },
+    "time_start": {
+      "type": "number",
+      "required": True
+    },
+    "reservation_id": {
+      "type": "string",
+      "required": True
+    },
+    "user_id": {
+      "type": "string",
+      "required": True
+    },
+    "username": {
+      "type": "string",
+      "required": True
+    }
+  }
+}
+
+# Define the schema that determines what a valid schedule (or delta schedule) looks like (the reservations are validated 
+# separately)
+schedule_schema = {
+  "type": "object",
+  "$schema": "http://json-schema.org/draft-03/schema",
+  "required": True,
+  "properties": {
+    "generated_at": {
+      "type": "number",
+      "required": True
+    },
+    "since": {
+      "type": "number",
+      "required": False
+    },
+    "deleted_reservations": {
+      "type": "array",
+      "required": False,
+      "items": {
+        "type": "string"
+      }
+    },
+    "reservations": {
+      "type": "array",
+      "required": True,
+      "items": {
+        "type": "object"
+      }
+    }
+  }
+}
+
+# Compile the schedule validators once (they are shared by every ScheduleManager instance)
+schedule_validator = jsonschema.Draft3Validator(schedule_schema)
+reservation_validator = jsonschema.Draft3Validator(reservation_schema)
 
 class ScheduleManager:
   """ Represents a reservation access schedule.
@@ -17,6 +111,17 @@ class ScheduleManager:
   * Download new copies of the reservation schedule from the user interface
   * Query for specific reservations
   * Access newly active reservations
+
+  The reservations are indexed by time (see ReservationIndex), so finding the active and upcoming reservations doesn't 
+  require scanning the whole schedule. Reservations are pruned from the schedule once they end.
+
+  Each downloaded schedule is compared against the current schedule, and only the reservations that were added, 
+  changed, or removed are applied. If a session coordinator is registered with the schedule manager (see 
+  'session_coordinator'), it will be notified of the changes.
+
+  @note The schedule dictionary ('schedule') can be replaced, in which case it will be re-indexed the next time it's
+        queried. Reservations in the dictionary shouldn't be modified in place, new versions of a reservation should be 
+        saved with _save_schedule() instead.
   """
   
   def __init__(self, schedule_endpoint):
@@ -35,8 +140,15 @@ class ScheduleManager:
     
     # Set the schedule parameters
     self.schedule_location = schedule_endpoint
-    self.schedule = {}
+    self._reservation_index = ReservationIndex()
+    self.schedule = self._reservation_index.reservations
     self.last_updated = 0
+    self.generated_at = None # The 'generated_at' timestamp of the last schedule (or delta schedule) that was saved
+    self.session_coordinator = None # Notified of schedule changes, set by the SessionCoordinator
+
+    # Schedule update statistics
+    self.full_updates = 0
+    self.delta_updates = 0
   
   def update_schedule(self):
     """ Downloads the most recent version of the schedule from the active source.
@@ -54,13 +166,15 @@ class ScheduleManager:
     
     # Attempt to download the schedule
     if self.use_network_schedule:
-      defer_download = threads.deferToThread(self._download_remote_schedule)
+      defer_download = self._download_remote_schedule()
     else:
       defer_download = threads.deferToThread(self._download_local_schedule)
     
     # Add a callback to store the schedule
     defer_download.addCallback(self._validate_schedule)
     defer_download.addCallback(self._save_schedule)
+    if self.use_network_schedule:
+      defer_download.addErrback(self._resynchronize_schedule)
     
     return defer_download
   
@@ -74,25 +188,72 @@ class ScheduleManager:
             will be returned.
     """
     
-    # Setup local variables
-    temp_active_reservations = []
-    current_time = time.time()
-    
-    # Loop through the schedule and find active reservations
-    if len(self.schedule) > 0:
-      for reservation_id in self.schedule:
-        # Test the reservation
-        temp_reservation = self.schedule[reservation_id]
-        
-        if temp_reservation['time_start'] < current_time and temp_reservation['time_end'] > current_time:
-          temp_active_reservations.append(temp_reservation)
-    
-    return temp_active_reservations
+    return self._get_reservation_index().get_active_reservations(time.time())
+  
+  def get_upcoming_reservations(self, horizon):
+    """ Returns a list of the reservations that will be active at some point within the specified horizon.
+
+    @param horizon  How far ahead to look (in seconds).
+    @return Returns a list containing every reservation that hasn't ended yet and starts within the next 'horizon' 
+            seconds (including reservations that are already active).
+    """
+
+    return self._get_reservation_index().get_upcoming_reservations(time.time(), horizon)
+
+  def get_next_reservation(self, horizon = 0):
+    """ Returns the next reservation to start.
+
+    @param horizon  If specified, only reservations that start at least this many seconds from now will be considered.
+    @return Returns the reservation that hasn't started yet with the earliest start time, or None if there aren't any.
+    """
+
+    return self._get_reservation_index().get_next_reservation(time.time(), horizon)
   
+  def get_reservation(self, reservation_id):
+    """ Returns the specified reservation.
+
+    @param reservation_id  The ID of the reservation to return.
+    @return Returns the reservation dictionary, or None if the schedule doesn't contain the reservation.
+    """
+
+    return self.schedule.get(reservation_id, None)
+
+  def _resynchronize_schedule(self, failure):
+    """ Downloads the full schedule if a delta schedule couldn't be applied to the local schedule.
+
+    @param failure  The Failure from the schedule update. Failures other than ScheduleOutOfSync will be passed on.
+    @return Returns a deferred that will be fired with the result of the full schedule update.
+    """
+
+    failure.trap(ScheduleOutOfSync)
+    logging.warning("The delta schedule from '"+self.schedule_location+"' didn't match the local schedule, downloading "+
+                    "the full schedule.")
+
+    self.generated_at = None
+    defer_download = self._download_remote_schedule(full_schedule = True)
+    defer_download.addCallback(self._validate_schedule)
+    defer_download.addCallback(self._save_schedule)
+
+    return defer_download
+
+  def _get_reservation_index(self):
+    """ Returns the time index of the schedule, re-indexing the schedule first if it has been replaced.
+
+    @return Returns the schedule's ReservationIndex.
+    """
+
+    if self._reservation_index.reservations is not self.schedule:
+      self._reservation_index = ReservationIndex(self.schedule.values())
+      self.schedule = self._reservation_index.reservations
+
+    return self._reservation_index
+
   def _validate_schedule(self, schedule_load_result):
     """ Validates the newly loaded schedule JSON.
     
-    This callback validates the format of the new schedule against the JSON schedule schema.
+    This callback validates the format of the new schedule against the JSON schedule schema. Reservations that are 
+    identical to the reservations already in the schedule have already been validated, so only new and changed 
+    reservations are validated against the reservation schema.
     
     @throw Throws ScheduleError if the schedule represented by schedule_load_result isn't valid.
     
@@ -100,69 +261,12 @@ class ScheduleManager:
     @retun Returns a python object representing the new schedule.
     """
     
-    # Define the schema that determines what a valid schedule looks like
-    schedule_schema = {
-      "type": "object",
-      "$schema": "http://json-schema.org/draft-03/schema",
-      "required": True,
-      "properties": {
-        "generated_at": {
-          "type": "number",
-          "required": True
-        },
-        "reservations": {
-          "type": "array",
-          "required": True,
-          "items": {
-            "type": "object",
-            "additionalProperties": True,
-            "properties": {
-              "setup_commands": {
-                "type": "array",
-                "required": False,
-                "items": command.schema
-              },
-              "active_services": {
-                "type": "object",
-                "required": False,
-                "additionalProperties": {
-                  "type": "string"
-                }
-              },
-              "pipeline_id": {
-                "type": "string",
-                "required": True
-              },
-              "time_end": {
-                "type": "number",
-                "required": True
-              },
-              "time_start": {
-                "type": "number",
-                "required": True
-              },
-              "reservation_id": {
-                "type": "string",
-                "required": True
-              },
-              "user_id": {
-                "type": "string",
-                "required": True
-              },
-              "username": {
-                "type": "string",
-                "required": True
-              }
-            }
-          }
-        }
-      }
-    }
-    
     # Validate the JSON schema
-    schema_validator = jsonschema.Draft3Validator(schedule_schema)
     try:
-      schema_validator.validate(schedule_load_result)
+      schedule_validator.validate(schedule_load_result)
+      for schedule_reservation in schedule_load_result['reservations']:
+        if self.schedule.get(schedule_reservation.get('reservation_id', None), None) != schedule_reservation:
+          reservation_validator.validate(schedule_reservation)
     except jsonschema.ValidationError:
       # Invalid schedule JSON
       logging.error("The provided schedule did not meet JSON schema requirements: "+self.schedule_location)
@@ -172,54 +276,133 @@ class ScheduleManager:
   
   def _save_schedule(self, schedule_load_result):
     """ Saves the provided schedule to this schedule instance.
+
+    This method compares the provided schedule with the current schedule and only applies the differences: new and 
+    changed reservations are (re-)indexed and reservations that are no longer in the schedule (or, for delta schedules,
+    that are listed in 'deleted_reservations') are removed. Reservations that have already ended are ignored (they are
+    pruned from the schedule as time passes).
     
     @note This method is intended to be used as a callback for the deferred returned by the various schedule download 
           methods.
+
+    @throw Throws ScheduleOutOfSync if the provided schedule is a delta schedule that wasn't generated relative to the 
+           current schedule.
     
     @param schedule_load_result  The result of the attempted schedule download.
     @return Returns a python object representing the new schedule. Note this returned schedule represents the raw JSON 
             object before any filters or modifications have been applied.
     """
+
+    # Make sure that delta schedules are relative to the current schedule
+    delta_schedule = 'since' in schedule_load_result
+    if delta_schedule and schedule_load_result['since'] != self.generated_at:
+      raise ScheduleOutOfSync('The delta schedule was not generated relative to the current schedule.')
     
     # Set the update time
-    self.last_updated = int(time.time())
+    current_time = time.time()
+    self.last_updated = int(current_time)
     
-    # Loop through the schedule and build the dictionary
+    # Apply the new and changed reservations
+    reservation_index = self._get_reservation_index()
+    schedule_changes = {'added': [], 'changed': [], 'removed': []}
+    schedule_reservation_ids = set()
     for schedule_reservation in schedule_load_result['reservations']:
-      self.schedule[schedule_reservation['reservation_id']] = schedule_reservation
+      reservation_id = schedule_reservation['reservation_id']
+      schedule_reservation_ids.add(reservation_id)
+      current_reservation = self.schedule.get(reservation_id, None)
+      if current_reservation is None:
+        if schedule_reservation['time_end'] <= current_time:
+          continue
+        schedule_changes['added'].append(reservation_id)
+      elif current_reservation != schedule_reservation:
+        schedule_changes['changed'].append(reservation_id)
+      else:
+        continue
+
+      reservation_index.add_reservation(schedule_reservation)
+
+    # Remove the reservations that are no longer in the schedule
+    if delta_schedule:
+      removed_reservation_ids = [reservation_id for reservation_id in schedule_load_result.get('deleted_reservations', [])
+                                 if reservation_id in self.schedule]
+    else:
+      removed_reservation_ids = [reservation_id for reservation_id in self.schedule.keys() 
+                                 if reservation_id not in schedule_reservation_ids]
+    for reservation_id in removed_reservation_ids:
+      reservation_index.remove_reservation(reservation_id)
+      schedule_changes['removed'].append(reservation_id)
+
+    # Record the version of the schedule
+    self.generated_at = schedule_load_result['generated_at']
+    if delta_schedule:
+      self.delta_updates += 1
+    else:
+      self.full_updates += 1
+
+    # Notify the session coordinator
+    if self.session_coordinator is not None and (schedule_changes['added'] or schedule_changes['changed'] or 
+                                                 schedule_changes['removed']):
+      self.session_coordinator.schedule_changed(schedule_changes)
     
     return schedule_load_result
   
-  def _download_remote_schedule(self):
+  def _download_remote_schedule(self, full_schedule = False):
     """ Loads the schedule from the schedule's URL.
     
-    This method loads the the schedule from a URL (e.g. the mercury2 user interface) and returns it.
-    
-    @throw Throws ScheduleError if an error occurs while downloading or parsing the schedule.
-    
-    @note This method is intended to be called with threads.deferToThread. The returned schedule will be passed to the 
-          resulting deferred's callback chain.
-    
-    @return Returns a python object representing the downloaded schedule.
+    This method downloads the schedule from a URL (e.g. the mercury2 user interface) using the shared HTTP client. 
+    Unless a full schedule is requested, the request is conditional and includes the 'generated_at' timestamp of the 
+    current schedule, so the server can respond with '304 Not Modified' or a delta schedule instead of resending the
+    whole schedule.
+
+    @param full_schedule  Whether or not to request the full schedule.
+    @return Returns a deferred that will be fired with a python object representing the downloaded schedule, or with a
+            ScheduleError if an error occurs while downloading or parsing the schedule.
     """
-    
-    # Setup local variables
-    temp_schedule = None
-    schedule_file = None
-    
-    # Attempt to download the JSON file
+
+    request_headers = None
+    if not full_schedule and self.generated_at is not None:
+      request_headers = {SCHEDULE_SINCE_HEADER: repr(self.generated_at)}
+
     try:
-      schedule_request = urllib2.Request(self.schedule_location)
-      schedule_opener = urllib2.build_opener()
-      schedule_file = schedule_opener.open(schedule_request, None, self.config.get('schedule-update-timeout'))
+      download_deferred = http_client.get_client().get(self.schedule_location,
+                                                       timeout = self.config.get('schedule-update-timeout'),
+                                                       conditional = not full_schedule,
+                                                       headers = request_headers)
     except:
-      # Error downloading the file
-      logging.error("There was an error downloading the schedule: "+self.schedule_location)
-      raise ScheduleError('Could not download schedule from remote URL.')
+      download_deferred = defer.fail()
+    download_deferred.addCallbacks(self._parse_remote_schedule, self._remote_schedule_error)
+
+    return download_deferred
+
+  def _remote_schedule_error(self, failure):
+    """ Handles errors that occur while downloading the schedule.
+
+    @throw Throws ScheduleError after logging the error.
+
+    @param failure  The Failure wrapping the HTTPRequestError.
+    """
+
+    logging.error("There was an error downloading the schedule: "+self.schedule_location+" ("+
+                  failure.getErrorMessage()+")")
+    raise ScheduleError('Could not download schedule from remote URL.')
+
+  def _parse_remote_schedule(self, schedule_response):
+    """ Parses a downloaded schedule.
+
+    @throw Throws ScheduleError if the schedule isn't valid JSON.
+
+    @param schedule_response  The HTTPResponse containing the schedule.
+    @return Returns a python object representing the downloaded schedule. If the schedule hasn't changed since the 
+            current schedule was saved, an empty delta schedule will be returned.
+    """
+
+    # Skip parsing the previous response again if it has already been saved
+    if schedule_response.not_modified and self.generated_at is not None:
+      return {'generated_at': self.generated_at, 'since': self.generated_at, 'reservations': []}
     
     # Parse the schedule JSON
     try:
-      temp_schedule = json.load(schedule_file)
+      temp_schedule = json.loads(schedule_response.body)
     except ValueError:
       # Error parsing the schedule JSON
       logging.error("Schedule manager could not parse remote schedule file: "+self.schedule_location)
@@ -263,6 +446,161 @@ class ScheduleManager:
     
     return temp_schedule
 
+class ReservationIndex:
+  """ Indexes reservations by time.
+
+  Reservations that haven't started yet are kept in a list sorted by their start times. As time passes, reservations 
+  that have started are moved into a dictionary of started reservations and their end times are pushed onto a min-heap,
+  which is used to prune them from the index once they end. As a result, finding the active reservations takes 
+  O(k + log n) amortized time (where k is the number of reservations returned) instead of requiring a scan of the whole
+  schedule, and the index only ever contains reservations that haven't ended yet.
+
+  @note Queries must be made with a non-decreasing current time. Reservations that have been pruned won't be returned
+        again, even if an earlier time is used for a later query.
+  """
+
+  def __init__(self, reservations = None):
+    """ Sets up the reservation index.
+
+    @param reservations  An optional list of reservations to add to the index.
+    """
+
+    self.reservations = {} # All indexed reservations, keyed by reservation ID
+    self._pending_starts = [] # (time_start, reservation_id) tuples sorted by start time
+    self._next_start = 0 # The index of the first entry in _pending_starts that hasn't started yet
+    self._started_reservations = {} # Reservations that have started and hadn't ended when the index was last advanced
+    self._end_heap = [] # (time_end, reservation_id) tuples of the started reservations
+
+    for reservation in reservations or []:
+      self.add_reservation(reservation)
+
+  def add_reservation(self, reservation):
+    """ Adds a reservation to the index.
+
+    If the index already contains a reservation with the same ID, it will be replaced.
+
+    @param reservation  The reservation dictionary to add.
+    """
+
+    reservation_id = reservation['reservation_id']
+    self.remove_reservation(reservation_id)
+    self.reservations[reservation_id] = reservation
+    bisect.insort(self._pending_starts, (reservation['time_start'], reservation_id), self._next_start)
+
+  def remove_reservation(self, reservation_id):
+    """ Removes a reservation from the index.
+
+    @note The reservation's entries in the start list and end heap are removed lazily (they're skipped when they're
+          reached).
+
+    @param reservation_id  The ID of the reservation to remove.
+    """
+
+    self.reservations.pop(reservation_id, None)
+    self._started_reservations.pop(reservation_id, None)
+
+  def get_active_reservations(self, current_time):
+    """ Returns the reservations that are active at the specified time.
+
+    @param current_time  The current UNIX timestamp.
+    @return Returns a list of the reservations that have started and haven't ended yet.
+    """
+
+    self._advance(current_time)
+
+    return self._started_reservations.values()
+
+  def get_upcoming_reservations(self, current_time, horizon):
+    """ Returns the reservations that will be active at some point within the specified horizon.
+
+    @param current_time  The current UNIX timestamp.
+    @param horizon       How far ahead to look (in seconds).
+    @return Returns a list containing every reservation that hasn't ended yet and starts within the next 'horizon' 
+            seconds (including reservations that are already active).
+    """
+
+    self._advance(current_time)
+
+    upcoming_reservations = self._started_reservations.values()
+    upcoming_ids = set()
+    for time_start, reservation_id in self._iterate_pending_starts():
+      if time_start >= current_time+horizon:
+        break
+      if reservation_id not in upcoming_ids and self.reservations[reservation_id]['time_end'] > current_time:
+        upcoming_ids.add(reservation_id)
+        upcoming_reservations.append(self.reservations[reservation_id])
+
+    return upcoming_reservations
+
+  def get_next_reservation(self, current_time, horizon = 0):
+    """ Returns the next reservation to start.
+
+    @param current_time  The current UNIX timestamp.
+    @param horizon       If specified, only reservations that start at least this many seconds after current_time will
+                         be considered.
+    @return Returns the reservation that hasn't started yet with the earliest start time, or None if there aren't any.
+    """
+
+    self._advance(current_time)
+
+    for time_start, reservation_id in self._iterate_pending_starts(current_time+horizon if horizon > 0 else None):
+      return self.reservations[reservation_id]
+
+    return None
+
+  def _iterate_pending_starts(self, time_start = None):
+    """ Iterates over the valid (not removed or replaced) entries of the start list that haven't started yet.
+
+    @param time_start  If specified, iteration will begin with the first entry that starts at or after this time.
+    """
+
+    first_index = self._next_start
+    if time_start is not None:
+      first_index = bisect.bisect_left(self._pending_starts, (time_start,), self._next_start)
+
+    for start_index in xrange(first_index, len(self._pending_starts)):
+      time_start, reservation_id = self._pending_starts[start_index]
+      if self._is_current_start(time_start, reservation_id):
+        yield time_start, reservation_id
+
+  def _is_current_start(self, time_start, reservation_id):
+    """ Checks if a start list entry belongs to an indexed reservation that hasn't started yet.
+    """
+
+    reservation = self.reservations.get(reservation_id, None)
+
+    return (reservation is not None and reservation['time_start'] == time_start and 
+            reservation_id not in self._started_reservations)
+
+  def _advance(self, current_time):
+    """ Moves the reservations that have started into the started reservations and prunes the ones that have ended.
+
+    @param current_time  The current UNIX timestamp.
+    """
+
+    # Start the reservations whose start time has passed
+    while (self._next_start < len(self._pending_starts) and 
+           self._pending_starts[self._next_start][0] < current_time):
+      time_start, reservation_id = self._pending_starts[self._next_start]
+      self._next_start += 1
+      if self._is_current_start(time_start, reservation_id):
+        self._started_reservations[reservation_id] = self.reservations[reservation_id]
+        heapq.heappush(self._end_heap, (self.reservations[reservation_id]['time_end'], reservation_id))
+
+    # Discard the part of the start list that has been passed once it makes up most of the list
+    if self._next_start > 64 and self._next_start*2 > len(self._pending_starts):
+      del self._pending_starts[:self._next_start]
+      self._next_start = 0
+
+    # Prune the reservations that have ended
+    while self._end_heap and self._end_heap[0][0] <= current_time:
+      time_end, reservation_id = heapq.heappop(self._end_heap)
+      started_reservation = self._started_reservations.get(reservation_id, None)
+      if started_reservation is not None and started_reservation['time_end'] == time_end:
+        self.remove_reservation(reservation_id)
+
 # Define schedule related exceptions
 class ScheduleError(Exception):
   pass
+class ScheduleOutOfSync(ScheduleError):
+  pass
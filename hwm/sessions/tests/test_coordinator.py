@@ -1,5 +1,7 @@
 # Import required modules
+import time
 from twisted.trial import unittest
+from twisted.internet import defer, task
 from hwm.core.configuration import *
 from mock import MagicMock
 from hwm.sessions import schedule, coordinator
@@ -214,3 +216,191 @@ class TestCoordinator(unittest.TestCase):
     return schedule_update_deferred
   
 
+
+  def test_permission_prefetching(self):
+    """ Verifies that the session coordinator prefetches the permissions of users whose reservations start within the 
+    configured horizon, and that each reservation is only prefetched once (unless the prefetch fails).
+    """
+
+    # Load in some valid configuration and set the defaults using validate_configuration()
+    self.config.read_configuration(self.source_data_directory+'/core/tests/data/test_config_basic.yml')
+    self.config.validate_configuration()
+    self.config.options['permissions-prefetch-horizon'] = 300
+
+    # Setup the schedule manager with some upcoming reservations
+    test_schedule = schedule.ScheduleManager(self.source_data_directory+'/sessions/tests/data/test_schedule_valid.json')
+    current_time = time.time()
+    test_schedule.schedule = {
+      'RES.A': {'reservation_id': 'RES.A', 'user_id': '1', 'time_start': current_time+60, 'time_end': current_time+600},
+      'RES.B': {'reservation_id': 'RES.B', 'user_id': '1', 'time_start': current_time+120, 'time_end': current_time+600},
+      'RES.C': {'reservation_id': 'RES.C', 'user_id': '2', 'time_start': current_time+200, 'time_end': current_time+600},
+      'RES.D': {'reservation_id': 'RES.D', 'user_id': '3', 'time_start': current_time+900, 'time_end': current_time+999}
+    }
+    session_coordinator = coordinator.SessionCoordinator(test_schedule, self.device_manager, MagicMock(),
+                                                         self.command_parser)
+    permission_manager = self.command_parser.permission_manager
+    permission_manager.prefetch_user_permissions = MagicMock(return_value = defer.fail(permissions.PermissionsError()))
+
+    # The first prefetch fails, so it should be retried
+    session_coordinator._prefetch_user_permissions()
+    self.assertEqual(sorted(permission_manager.prefetch_user_permissions.call_args[0][0]), ['1', '2'])
+    self.assertEqual(session_coordinator.prefetched_reservations, set())
+    permission_manager.prefetch_user_permissions = MagicMock(return_value = defer.succeed(2))
+    session_coordinator._prefetch_user_permissions()
+    self.assertEqual(sorted(permission_manager.prefetch_user_permissions.call_args[0][0]), ['1', '2'])
+    self.assertEqual(session_coordinator.prefetched_reservations, set(['RES.A', 'RES.B', 'RES.C']))
+
+    # Only new upcoming reservations should be prefetched
+    test_schedule._save_schedule({'generated_at': current_time,
+                                  'reservations': [dict(test_schedule.schedule['RES.D'], time_start = current_time+100)]})
+    session_coordinator._prefetch_user_permissions()
+    permission_manager.prefetch_user_permissions.assert_called_with(['3'])
+    self.assertEqual(permission_manager.prefetch_user_permissions.call_count, 2)
+    session_coordinator._prefetch_user_permissions()
+    self.assertEqual(permission_manager.prefetch_user_permissions.call_count, 2)
+
+  def test_coordination_timer(self):
+    """ Verifies that the session coordinator sets its timer for the next event that requires its attention (instead of
+    polling the schedule), and that it records how late sessions are started and stopped.
+    """
+
+    # Load in some valid configuration and set the defaults using validate_configuration()
+    self.config.read_configuration(self.source_data_directory+'/core/tests/data/test_config_basic.yml')
+    self.config.validate_configuration()
+    self.config.options['permissions-prefetch-horizon'] = 300
+    self.config.options['schedule-update-period'] = 30
+    self.config.options['session-coordinator-sweep-period'] = 60
+    test_clock = task.Clock()
+    current_time = int(time.time())
+    self.patch(coordinator, 'reactor', test_clock)
+    self.patch(time, 'time', lambda: current_time+test_clock.seconds())
+    self.patch(coordinator.session, 'Session', lambda reservation, pipeline, command_parser: MagicMock(
+      id = reservation['reservation_id'], configuration = reservation))
+
+    # Setup the schedule manager with some reservations and a schedule update that won't finish right away
+    test_schedule = schedule.ScheduleManager(self.source_data_directory+'/sessions/tests/data/test_schedule_valid.json')
+    update_deferred = defer.Deferred()
+    test_schedule.update_schedule = MagicMock(return_value = update_deferred)
+    test_schedule.schedule = {
+      'RES.A': {'reservation_id': 'RES.A', 'user_id': '1', 'pipeline_id': 'test_pipeline', 'time_start': current_time+40,
+                'time_end': current_time+600},
+      'RES.B': {'reservation_id': 'RES.B', 'user_id': '2', 'pipeline_id': 'test_pipeline', 
+                'time_start': current_time+400, 'time_end': current_time+900},
+      'RES.C': {'reservation_id': 'RES.C', 'user_id': '3', 'pipeline_id': 'test_pipeline', 'time_start': current_time-5,
+                'time_end': current_time+25}
+    }
+    session_coordinator = coordinator.SessionCoordinator(test_schedule, self.device_manager, MagicMock(),
+                                                         self.command_parser)
+    self.command_parser.permission_manager.prefetch_user_permissions = MagicMock(return_value = defer.succeed(2))
+
+    # The timer should be set for the end of RES.C, which began before the coordinator started
+    session_coordinator.start()
+    self.assertTrue('RES.C' in session_coordinator.active_sessions)
+    self.assertEqual(session_coordinator._coordination_timer.getTime(), 25)
+    self.assertEqual(session_coordinator.session_start_lateness.count, 0)
+
+    # The permission cache is empty, so it shouldn't need maintenance until permissions loaded now enter the 
+    # refresh-ahead window
+    permission_manager = self.command_parser.permission_manager
+    self.assertEqual(session_coordinator._permission_maintenance_timer.getTime(), 3590)
+    permission_manager.get_next_maintenance_time = MagicMock(return_value = current_time+100)
+    permission_manager.maintain_cache = MagicMock()
+    session_coordinator._permission_maintenance_timer.func()
+    permission_manager.maintain_cache.assert_called_once_with()
+    self.assertEqual(session_coordinator._permission_maintenance_timer.getTime(), 100)
+    self.assertEqual(len(test_clock.getDelayedCalls()), 2)
+
+    # Changing the end time of RES.C should update its session and reset the timer
+    test_schedule._save_schedule({'generated_at': current_time,
+                                  'reservations': [test_schedule.schedule['RES.A'], test_schedule.schedule['RES.B'],
+                                                   dict(test_schedule.schedule['RES.C'], time_end = current_time-1)]})
+    self.assertEqual(session_coordinator.active_sessions['RES.C'].configuration['time_end'], current_time-1)
+    self.assertEqual(session_coordinator._coordination_timer.getTime(), 0)
+
+    # Once the schedule update finishes, the coordinator should run and set the timer for the next update. RES.C has
+    # ended, so it shouldn't be kept in the closed sessions
+    update_deferred.callback({'reservations': []})
+    self.assertEqual(session_coordinator.active_sessions.keys(), [])
+    self.assertEqual(session_coordinator.closed_sessions, set())
+    self.assertEqual(session_coordinator.session_end_lateness.count, 1)
+    self.assertEqual(session_coordinator._coordination_timer.getTime(), 30)
+
+    # Connections waiting for reservations that are removed from the schedule should be rejected, and reservations that
+    # start after the coordinator started should have their start lateness recorded
+    res_a_deferred = session_coordinator.wait_for_reservation_session('RES.A')
+    session_coordinator._started_at = current_time-10
+    test_schedule._save_schedule({'generated_at': current_time+1,
+                                  'reservations': [{'reservation_id': 'RES.D', 'user_id': '1', 
+                                                    'pipeline_id': 'test_pipeline', 'time_start': current_time-1, 
+                                                    'time_end': current_time+20}]})
+    self.failureResultOf(res_a_deferred, coordinator.SessionNotFound)
+    self.assertEqual(session_coordinator.prefetched_reservations, set())
+    session_coordinator.coordinate()
+    self.assertTrue('RES.D' in session_coordinator.active_sessions)
+    self.assertEqual(session_coordinator.get_stats()['start_lateness']['count'], 1)
+    self.assertEqual(session_coordinator._coordination_timer.getTime(), 20)
+    self.assertEqual(test_schedule.update_schedule.call_count, 1)
+
+    # Stopping the coordinator should cancel its timers
+    session_coordinator.stop()
+    self.assertEqual(test_clock.getDelayedCalls(), [])
+
+  def test_session_waiting_room(self):
+    """ Verifies that connections for reservations that are about to start (or whose sessions are still being set up)
+    wait for their session to become active, and that connections for other reservations are rejected immediately.
+    """
+
+    # Load in some valid configuration and set the defaults using validate_configuration()
+    self.config.read_configuration(self.source_data_directory+'/core/tests/data/test_config_basic.yml')
+    self.config.validate_configuration()
+    self.config.options['session-waiting-room-period'] = 120
+    test_clock = task.Clock()
+    self.patch(coordinator, 'reactor', test_clock)
+
+    # Setup the schedule manager with some upcoming reservations
+    test_schedule = schedule.ScheduleManager(self.source_data_directory+'/sessions/tests/data/test_schedule_valid.json')
+    current_time = time.time()
+    test_schedule.schedule = {
+      'RES.A': {'reservation_id': 'RES.A', 'user_id': '1', 'time_start': current_time+60, 'time_end': current_time+600},
+      'RES.B': {'reservation_id': 'RES.B', 'user_id': '1', 'time_start': current_time+900, 'time_end': current_time+999},
+      'RES.C': {'reservation_id': 'RES.C', 'user_id': '2', 'time_start': current_time-10, 'time_end': current_time+600}
+    }
+    session_coordinator = coordinator.SessionCoordinator(test_schedule, self.device_manager, MagicMock(),
+                                                         self.command_parser)
+    session_coordinator.active_sessions['RES.C'] = MagicMock(is_active = False)
+
+    # Reservations that don't exist or don't start soon enough should be rejected
+    self.failureResultOf(session_coordinator.wait_for_reservation_session('RES.B'), coordinator.SessionNotFound)
+    self.failureResultOf(session_coordinator.wait_for_reservation_session('RES.X'), coordinator.SessionNotFound)
+
+    # Connections for upcoming reservations should be attached once their session is active
+    res_a_deferred = session_coordinator.wait_for_reservation_session('RES.A')
+    self.assertNoResult(res_a_deferred)
+    res_a_session = MagicMock(is_active = True)
+    session_coordinator.active_sessions['RES.A'] = res_a_session
+    session_coordinator._session_init_complete(None, 'RES.A')
+    self.assertEqual(self.successResultOf(res_a_deferred), res_a_session)
+    self.assertEqual(self.successResultOf(session_coordinator.wait_for_reservation_session('RES.A')), res_a_session)
+
+    # Connections that are lost should leave the waiting room, the others should fail if the session can't start
+    res_c_deferreds = [session_coordinator.wait_for_reservation_session('RES.C') for index in range(2)]
+    res_c_deferreds[0].cancel()
+    self.failureResultOf(res_c_deferreds[0], defer.CancelledError)
+    self.assertEqual(session_coordinator.waiting_connections['RES.C'], [res_c_deferreds[1]])
+    session_coordinator._session_init_failed(None, 'RES.C')
+    self.failureResultOf(res_c_deferreds[1], coordinator.SessionNotFound)
+    self.failureResultOf(session_coordinator.wait_for_reservation_session('RES.C'), coordinator.SessionNotFound)
+    self.assertEqual(session_coordinator.waiting_connections, {})
+
+    # Connections should give up if the session doesn't become active in time
+    del session_coordinator.active_sessions['RES.A']
+    res_a_deferred = session_coordinator.wait_for_reservation_session('RES.A')
+    test_clock.advance(179)
+    self.assertNoResult(res_a_deferred)
+    test_clock.advance(2)
+    self.failureResultOf(res_a_deferred, coordinator.SessionNotFound)
+    self.assertEqual(session_coordinator.waiting_connections, {})
+
+    # Disable the waiting room
+    self.config.options['session-waiting-room-period'] = 0
+    self.failureResultOf(session_coordinator.wait_for_reservation_session('RES.A'), coordinator.SessionNotFound)
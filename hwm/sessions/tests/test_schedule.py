@@ -1,8 +1,12 @@
 # Import required modules
 from twisted.trial import unittest
+from twisted.internet.defer import inlineCallbacks
+from mock import MagicMock
+from hwm.core.configuration import Configuration
 from hwm.sessions import schedule
+from hwm.sessions.tests.utilities import StandInScheduleServer
 from pkg_resources import Requirement, resource_filename
-import logging
+import logging, time, json
 
 class TestSchedule(unittest.TestCase):
   """
@@ -104,3 +108,152 @@ class TestSchedule(unittest.TestCase):
     update_deferred.addCallback(check_schedule_update)
     
     return update_deferred
+
+  def test_get_upcoming_reservations(self):
+    """ Tests that the schedule manager returns the reservations that haven't ended yet and start within the requested
+    horizon.
+    """
+
+    schedule_manager = schedule.ScheduleManager(self.source_data_directory+'/sessions/tests/data/test_schedule_valid.json')
+    current_time = time.time()
+    schedule_manager.schedule = {
+      'RES.ACTIVE': {'reservation_id': 'RES.ACTIVE', 'time_start': current_time-100, 'time_end': current_time+100},
+      'RES.SOON': {'reservation_id': 'RES.SOON', 'time_start': current_time+50, 'time_end': current_time+200},
+      'RES.LATER': {'reservation_id': 'RES.LATER', 'time_start': current_time+500, 'time_end': current_time+600},
+      'RES.ENDED': {'reservation_id': 'RES.ENDED', 'time_start': current_time-200, 'time_end': current_time-100}
+    }
+
+    upcoming_reservations = schedule_manager.get_upcoming_reservations(100)
+    self.assertEqual(sorted([reservation['reservation_id'] for reservation in upcoming_reservations]),
+                     ['RES.ACTIVE', 'RES.SOON'])
+    self.assertEqual(len(schedule_manager.get_upcoming_reservations(1000)), 3)
+
+  def test_schedule_changes(self):
+    """ Tests that the schedule manager only applies the reservations that were added, changed, or removed when it saves
+    a new schedule, and that it notifies the session coordinator of the changes.
+    """
+
+    schedule_manager = schedule.ScheduleManager(self.source_data_directory+'/sessions/tests/data/test_schedule_valid.json')
+    schedule_manager.session_coordinator = MagicMock()
+    current_time = time.time()
+    reservation_a = {'reservation_id': 'RES.A', 'time_start': current_time+100, 'time_end': current_time+200}
+    reservation_b = {'reservation_id': 'RES.B', 'time_start': current_time+300, 'time_end': current_time+400}
+    reservation_c = {'reservation_id': 'RES.C', 'time_start': current_time+500, 'time_end': current_time+600}
+    reservation_ended = {'reservation_id': 'RES.ENDED', 'time_start': current_time-200, 'time_end': current_time-100}
+
+    # Save the initial schedule
+    schedule_manager._save_schedule({'generated_at': current_time, 'reservations': [reservation_a, reservation_b,
+                                                                                    reservation_ended]})
+    schedule_manager.session_coordinator.schedule_changed.assert_called_once_with(
+      {'added': ['RES.A', 'RES.B'], 'changed': [], 'removed': []})
+    self.assertEqual(sorted(schedule_manager.schedule.keys()), ['RES.A', 'RES.B'])
+
+    # Saving an identical schedule shouldn't change anything
+    schedule_manager._save_schedule({'generated_at': current_time+1,
+                                     'reservations': [dict(reservation_a), dict(reservation_b), reservation_ended]})
+    self.assertEqual(schedule_manager.session_coordinator.schedule_changed.call_count, 1)
+
+    # Apply some changes
+    schedule_manager._save_schedule({'generated_at': current_time+2,
+                                     'reservations': [dict(reservation_a, time_start = current_time+50), reservation_c,
+                                                      reservation_ended]})
+    schedule_manager.session_coordinator.schedule_changed.assert_called_with(
+      {'added': ['RES.C'], 'changed': ['RES.A'], 'removed': ['RES.B']})
+    self.assertEqual(sorted(schedule_manager.schedule.keys()), ['RES.A', 'RES.C'])
+    self.assertEqual(schedule_manager.get_next_reservation()['time_start'], current_time+50)
+
+  @inlineCallbacks
+  def test_delta_schedule_sync(self):
+    """ Tests that the schedule manager synchronizes its schedule using delta schedules when the server supports them,
+    and that it falls back to the full schedule when it doesn't or when a delta schedule doesn't match its schedule.
+    """
+
+    self.patch(Configuration, 'options', {'schedule-update-timeout': 10})
+    schedule_server = StandInScheduleServer()
+    schedule_server.start()
+    self.addCleanup(schedule_server.stop)
+    current_time = time.time()
+    test_reservation = lambda reservation_id, time_start: {'reservation_id': reservation_id, 'user_id': '1', 
+                                                           'username': 'test_admin', 'pipeline_id': 'test_pipeline',
+                                                           'time_start': time_start, 'time_end': time_start+100}
+    for reservation_index in range(3):
+      schedule_server.set_reservation(test_reservation('RES.'+str(reservation_index), current_time+reservation_index*100))
+    schedule_manager = schedule.ScheduleManager(schedule_server.url)
+
+    # The first update should download the full schedule
+    yield schedule_manager.update_schedule()
+    self.assertEqual(schedule_server.http_server.requests[-1].getHeader(schedule.SCHEDULE_SINCE_HEADER), None)
+    self.assertEqual(sorted(schedule_manager.schedule.keys()), ['RES.0', 'RES.1', 'RES.2'])
+    self.assertEqual(schedule_manager.generated_at, schedule_server.generated_at)
+
+    # The server should respond with '304 Not Modified' if the schedule hasn't changed
+    yield schedule_manager.update_schedule()
+    self.assertEqual(schedule_server.http_server.requests[-1].code, 304)
+    self.assertEqual(len(schedule_manager.schedule), 3)
+
+    # Only the changes should be sent once the schedule changes
+    schedule_server.set_reservation(test_reservation('RES.1', current_time+500))
+    schedule_server.delete_reservation('RES.2')
+    update_results = yield schedule_manager.update_schedule()
+    self.assertEqual(schedule_server.http_server.requests[-1].getHeader(schedule.SCHEDULE_SINCE_HEADER), '4')
+    self.assertEqual([reservation['reservation_id'] for reservation in update_results['reservations']], ['RES.1'])
+    self.assertEqual(update_results['deleted_reservations'], ['RES.2'])
+    self.assertEqual(sorted(schedule_manager.schedule.keys()), ['RES.0', 'RES.1'])
+    self.assertEqual(schedule_manager.get_reservation('RES.1')['time_start'], current_time+500)
+    self.assertEqual((schedule_manager.full_updates, schedule_manager.delta_updates), (1, 2))
+
+    # Delta schedules that aren't relative to the local schedule should be replaced by the full schedule
+    render_schedule = schedule_server.http_server.response_handler
+    schedule_server.http_server.response_handler = lambda request: (
+      json.dumps({'generated_at': 99, 'since': 42, 'reservations': []}) 
+      if request.getHeader(schedule.SCHEDULE_SINCE_HEADER) is not None else render_schedule(request))
+    schedule_server.set_reservation(test_reservation('RES.3', current_time+600))
+    yield schedule_manager.update_schedule()
+    self.assertEqual(sorted(schedule_manager.schedule.keys()), ['RES.0', 'RES.1', 'RES.3'])
+    self.assertEqual(schedule_manager.generated_at, schedule_server.generated_at)
+    self.assertEqual(schedule_manager.full_updates, 2)
+
+    # Servers that don't support delta schedules should always send the full schedule
+    schedule_server.http_server.response_handler = render_schedule
+    schedule_server.supports_deltas = False
+    schedule_server.delete_reservation('RES.0')
+    update_results = yield schedule_manager.update_schedule()
+    self.assertFalse('since' in update_results)
+    self.assertEqual(sorted(schedule_manager.schedule.keys()), ['RES.1', 'RES.3'])
+    self.assertEqual((schedule_manager.full_updates, schedule_manager.delta_updates), (3, 2))
+
+  def test_reservation_index(self):
+    """ Tests that the reservation index tracks the active and next reservations as time passes, handles reservations
+    that are replaced or removed, and prunes the reservations that have ended.
+    """
+
+    reservation_index = schedule.ReservationIndex([
+      {'reservation_id': 'RES.A', 'time_start': 100, 'time_end': 200},
+      {'reservation_id': 'RES.B', 'time_start': 150, 'time_end': 400},
+      {'reservation_id': 'RES.C', 'time_start': 300, 'time_end': 500},
+      {'reservation_id': 'RES.D', 'time_start': 600, 'time_end': 700}
+    ])
+    active_ids = lambda current_time: sorted([reservation['reservation_id'] for reservation in 
+                                              reservation_index.get_active_reservations(current_time)])
+
+    # Check the index before and as reservations start
+    self.assertEqual(active_ids(50), [])
+    self.assertEqual(reservation_index.get_next_reservation(50)['reservation_id'], 'RES.A')
+    self.assertEqual(reservation_index.get_next_reservation(50, 200)['reservation_id'], 'RES.C')
+    self.assertEqual(active_ids(160), ['RES.A', 'RES.B'])
+    self.assertEqual(reservation_index.get_next_reservation(160)['reservation_id'], 'RES.C')
+    self.assertEqual(len(reservation_index.get_upcoming_reservations(160, 200)), 3)
+
+    # Replaced and removed reservations should only be returned with their current times
+    reservation_index.add_reservation({'reservation_id': 'RES.C', 'time_start': 650, 'time_end': 800})
+    reservation_index.add_reservation({'reservation_id': 'RES.A', 'time_start': 100, 'time_end': 170})
+    reservation_index.remove_reservation('RES.D')
+    self.assertEqual(reservation_index.get_next_reservation(160)['reservation_id'], 'RES.C')
+    self.assertEqual(active_ids(180), ['RES.B'])
+
+    # Reservations should be pruned once they end
+    self.assertEqual(active_ids(660), ['RES.C'])
+    self.assertEqual(sorted(reservation_index.reservations.keys()), ['RES.C'])
+    self.assertEqual(reservation_index.get_next_reservation(660), None)
+    self.assertEqual(active_ids(800), [])
+    self.assertEqual(reservation_index.reservations, {})
@@ -2,7 +2,11 @@
 """
 
 # Import required modules
+import json, time
 from mock import MagicMock
+from hwm.core import stats
+from hwm.sessions import schedule
+from hwm.network.tests.utilities import StandInHTTPServer
 
 class MockSessionCoordinator(object):
   """ A mock session coordinator that provides enough functionality to test the command parser.
@@ -23,4 +27,99 @@ class MockSessionCoordinator(object):
 
     sessions = [MagicMock()]
 
-    return sessions
\ No newline at end of file
+    return sessions
+
+  def get_stats(self):
+    """ A mock of the SessionCoordinator.get_stats() method.
+
+    @return Returns a dictionary containing the same fields as SessionCoordinator.get_stats(), with no recorded sessions.
+    """
+
+    return {
+      'active_sessions': 0,
+      'closed_sessions': 0,
+      'coordination_runs': 0,
+      'start_lateness': stats.LatencyHistogram().get_stats(),
+      'end_lateness': stats.LatencyHistogram().get_stats()
+    }
+
+class StandInScheduleServer(object):
+  """ A local server that stands in for the mercury2 user interface's schedule resource.
+
+  The server's schedule is modified using set_reservation() and delete_reservation(), each of which creates a new version
+  of the schedule. Every response includes the schedule's version as its ETag. If 'supports_deltas' is set, requests
+  that include the schedule manager's SCHEDULE_SINCE_HEADER are answered with a delta schedule containing the 
+  reservations that were added, changed, or deleted since that version.
+
+  @note The schedule's versions are used as its 'generated_at' timestamps.
+  """
+
+  def __init__(self, supports_deltas = True):
+    """ Sets up the stand-in schedule server.
+
+    @param supports_deltas  Whether or not the server should respond with delta schedules.
+    """
+
+    self.supports_deltas = supports_deltas
+    self.generated_at = 1
+    self.render_time = 0.0 # The processor time spent rendering responses
+    self.http_server = StandInHTTPServer()
+    self.http_server.response_handler = self._render_schedule
+    self._reservations = {}
+    self._modified_at = {} # The version in which each reservation was last added or changed
+    self._deleted_at = {} # The version in which each deleted reservation was deleted
+
+  @property
+  def url(self):
+    return self.http_server.url
+
+  def start(self):
+    self.http_server.start()
+
+  def stop(self):
+    return self.http_server.stop()
+
+  def set_reservation(self, reservation):
+    """ Adds or replaces a reservation, creating a new version of the schedule.
+    """
+
+    self.generated_at += 1
+    self._reservations[reservation['reservation_id']] = reservation
+    self._modified_at[reservation['reservation_id']] = self.generated_at
+    self._deleted_at.pop(reservation['reservation_id'], None)
+
+  def delete_reservation(self, reservation_id):
+    """ Deletes a reservation, creating a new version of the schedule.
+    """
+
+    self.generated_at += 1
+    del self._reservations[reservation_id]
+    del self._modified_at[reservation_id]
+    self._deleted_at[reservation_id] = self.generated_at
+
+  def _render_schedule(self, request):
+    render_start = time.clock()
+    schedule_version = '"'+str(self.generated_at)+'"'
+
+    if request.getHeader('If-None-Match') == schedule_version:
+      request.setResponseCode(304)
+      response_body = ""
+    else:
+      request.setHeader('ETag', schedule_version)
+      since = request.getHeader(schedule.SCHEDULE_SINCE_HEADER)
+      if self.supports_deltas and since is not None:
+        since = float(since)
+        response_body = json.dumps({
+          'generated_at': self.generated_at,
+          'since': since,
+          'reservations': [self._reservations[reservation_id] 
+                           for reservation_id, modified_at in self._modified_at.iteritems() if modified_at > since],
+          'deleted_reservations': [reservation_id 
+                                   for reservation_id, deleted_at in self._deleted_at.iteritems() if deleted_at > since]
+        })
+      else:
+        response_body = json.dumps({'generated_at': self.generated_at, 'reservations': self._reservations.values()})
+
+    self.render_time += time.clock()-render_start
+
+    return response_body
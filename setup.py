@@ -27,15 +27,16 @@ setup(
   entry_points = {
     'console_scripts': [
       'mercury2_setup = hwm.core.initialization:initial_setup',
-      'mercury2 = hwm.core.initialization:initialize'
+      'mercury2 = hwm.core.initialization:initialize',
+      'mercury2_audit = hwm.command.audit:query_tool'
     ]
   },
 
   # Declare dependencies
   install_requires = ['distribute',
-                      'Twisted>=12.3.0',
+                      'Twisted>=16.5.0',
                       'PyYAML>=3.10',
-                      'pyOpenSSL>=0.13',
+                      'pyOpenSSL>=16.0.0',
                       'doxypy>=0.4.2',
                       'jsonschema',
                       'mock',